@@ -932,28 +932,27 @@ class Triangulation(unstructured_grid.UnstructuredGrid):
     # Make a check for the delaunay criterion:
     def check_global_delaunay(self):
         bad_checks=[] # [ (cell,node),...]
+        all_nodes=np.nonzero(~self.nodes['deleted'])[0]
         for c in self.valid_cell_iter():
             nodes=self.cells['nodes'][c]
             pnts=self.nodes['x'][nodes]
 
             # brute force - check them all.
-            for n in self.valid_node_iter():
-                if n in nodes:
-                    continue
-                t=self.nodes['x'][n]
-                check=robust_predicates.incircle(pnts[0],pnts[1],pnts[2],t)
-                if check>0:
-                    # how do we check for constraints here?
-                    # maybe more edge-centric?
-                    # tests of a cell on one side of an edge against a node on the
-                    # other is reflexive.
-                    # 
-                    
-                    # could go through the edges of c, 
-                    msg="Node %d is inside the circumcircle of cell %d (%d,%d,%d)"%(n,c,
-                                                                                    nodes[0],nodes[1],nodes[2])
-                    self.log.error(msg)
-                    bad_checks.append( (c,n) )
+            others=all_nodes[ ~np.isin(all_nodes,nodes) ]
+            checks=robust_predicates.incircle_many(pnts[0],pnts[1],pnts[2],
+                                                   self.nodes['x'][others])
+            for n in others[checks>0]:
+                # how do we check for constraints here?
+                # maybe more edge-centric?
+                # tests of a cell on one side of an edge against a node on the
+                # other is reflexive.
+                # 
+                
+                # could go through the edges of c, 
+                msg="Node %d is inside the circumcircle of cell %d (%d,%d,%d)"%(n,c,
+                                                                                nodes[0],nodes[1],nodes[2])
+                self.log.error(msg)
+                bad_checks.append( (c,n) )
         return bad_checks
     
     def check_local_delaunay(self):
@@ -993,12 +992,10 @@ class Triangulation(unstructured_grid.UnstructuredGrid):
         Checks all cells for proper CCW orientation,
         return a list of cell indexes of failures.
         """
-        bad_cells=[]
-        for c in self.valid_cell_iter():
-            node_xy=self.nodes['x'][self.cells['nodes'][c]]
-            if robust_predicates.orientation(*node_xy) <= 0:
-                bad_cells.append(c)
-        return bad_cells
+        cells=np.nonzero(~self.cells['deleted'])[0]
+        node_xy=self.nodes['x'][self.cells['nodes'][cells]]
+        ori=robust_predicates.orientation_many(node_xy[:,0],node_xy[:,1],node_xy[:,2])
+        return list(cells[ori<=0])
     def check_convex_hull(self):
         # find an edge on the convex hull, walk the hull and check
         # all consecutive orientations
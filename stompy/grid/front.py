@@ -162,6 +162,58 @@ def one_point_cost(pnt,edges,target_length=5.0):
     return penalty
 
 
+def one_point_cost_many(pnts,edges,owner,target_length):
+    """
+    Vectorized one_point_cost() for many points at once.
+    pnts: [N,2] candidate point locations
+    edges: [M,2,2] edges, each completing a triangle with pnts[owner[m]],
+      as in one_point_cost()
+    owner: [M] index into pnts, sorted, and every point must own at least
+      one edge.
+    target_length: [N] target edge length for each point.
+    returns [N] array of costs.
+    """
+    max_angle = 85.0*np.pi/180.
+
+    P=pnts[owner]
+    all_edges = np.zeros( (edges.shape[0], 3 ,2), np.float64 )
+    all_edges[:,0,:] = edges[:,0] - P  # ab
+    all_edges[:,1,:] = edges[:,1] - edges[:,0] # bc
+    all_edges[:,2,:] = P - edges[:,1] # ca
+
+    i = np.arange(3)
+    im1 = (i-1)%3
+
+    abs_angles = np.arctan2( all_edges[:,:,1], all_edges[:,:,0] )
+    all_angles = (np.pi - (abs_angles[:,i] - abs_angles[:,im1]) % (2*np.pi)) % (2*np.pi)
+
+    # per-point reductions over the triangles of each point
+    starts=np.concatenate( ([0],1+np.nonzero(np.diff(owner))[0]) )
+
+    worst_angle = np.maximum.reduceat(np.abs(all_angles - 60*np.pi/180.).max(axis=1),starts)
+    alpha = worst_angle /(max_angle - 60*np.pi/180.0)
+    angle_penalty = 10*alpha**5
+
+    scale_rad = 3.0*np.pi/180.
+    thresh = max_angle - 1.0*scale_rad
+    big_angle_penalty = np.exp( (np.maximum.reduceat(all_angles.max(axis=1),starts) - thresh) / scale_rad)
+
+    min_ab=np.minimum.reduceat( (all_edges[:,0,:]**2).sum(axis=1), starts)
+    min_ca=np.minimum.reduceat( (all_edges[:,2,:]**2).sum(axis=1), starts)
+    min_len = np.minimum( min_ab,min_ca )
+    max_len = np.maximum( min_ab,min_ca )
+
+    with np.errstate(divide='ignore'):
+        undershoot = target_length**2 / min_len
+    overshoot  = max_len / target_length**2
+
+    length_factor = 2
+    length_penalty = ( length_factor*(np.maximum(undershoot,1) - 1)
+                       + length_factor*(np.maximum(overshoot,1) - 1) )
+
+    return angle_penalty + big_angle_penalty + length_penalty
+
+
 class Curve(object):
     """
     Boundaries which can be open or closed, indexable
@@ -1836,6 +1888,13 @@ class AdvancingFront(object):
             return 0.0
 
     cost_thresh_default=0.22
+
+    # 'fmin': relax one node at a time with Nelder-Mead (relax_node)
+    # 'batched': relax sets of independent nodes together (relax_nodes)
+    relax_method='fmin'
+    # number of gradient steps for batched relaxation
+    relax_batch_iterations=10
+
     def optimize_nodes(self,nodes,max_levels=4,cost_thresh=None):
         """
         iterate over the given set of nodes, optimizing each location,
@@ -1855,16 +1914,21 @@ class AdvancingFront(object):
             nodes.sort(reverse=True)
             
             max_cost=0
-            for n in nodes:
-                # relax_node can return 0 if there was no cost
-                # function to optimize
+            if self.relax_method=='batched':
+                todo=[n for n in nodes if self.eval_cost(n)>=cost_thresh]
+                for new_cost in self.relax_nodes(todo).values():
+                    max_cost=max(max_cost,new_cost or 0.0)
+            else:
+                for n in nodes:
+                    # relax_node can return 0 if there was no cost
+                    # function to optimize
 
-                # this node may already be good enough
-                initial_cost=self.eval_cost(n)
-                if initial_cost<cost_thresh: continue
-                new_cost=self.relax_node(n) or 0.0
+                    # this node may already be good enough
+                    initial_cost=self.eval_cost(n)
+                    if initial_cost<cost_thresh: continue
+                    new_cost=self.relax_node(n) or 0.0
 
-                max_cost=max(max_cost,new_cost)
+                    max_cost=max(max_cost,new_cost)
             if max_cost <= cost_thresh:
                 break
             # as in paver -- if everybody is valid, good enough
@@ -2016,6 +2080,178 @@ class AdvancingFront(object):
                 self.log.info("Relaxation caused intersection, reverting")
         return base_cost
 
+    def batch_cost_function(self,nodes):
+        """
+        Return a function which takes a [...,len(nodes),2] array of locations
+        and evaluates the cost function for all of nodes at once, returning
+        a [...,len(nodes)] array of costs.  Returns None
+        if there is no vectorized cost function, in which case relax_nodes()
+        falls back to relax_node().  nodes must not share cells, so that each
+        cost is independent of the location of the other nodes.
+        """
+        return None
+
+    def independent_node_sets(self,nodes):
+        """
+        Greedy coloring of nodes into sets in which no two nodes share a
+        cell, so that relaxing one node of a set does not change the cost
+        function of the others.  Returns a list of lists of nodes.
+        """
+        node_sets=[]
+        blocked=[] # for each set, nodes which share a cell with a member
+        for n in nodes:
+            nbrs=set([n])
+            for c in self.grid.node_to_cells(n):
+                nbrs.update(self.grid.cell_to_nodes(c))
+            for node_set,block in zip(node_sets,blocked):
+                if n not in block:
+                    node_set.append(n)
+                    block.update(nbrs)
+                    break
+            else:
+                node_sets.append([n])
+                blocked.append(nbrs)
+        return node_sets
+
+    def relax_nodes(self,nodes):
+        """
+        Batched counterpart to relax_node(): move each of nodes, subject to
+        its constraints, to reduce the cost function.  Nodes are split into
+        sets which do not share cells, and each set is relaxed together.
+        Returns a dict of node => final cost.
+        """
+        costs={}
+        for node_set in self.independent_node_sets(nodes):
+            costs.update(self.relax_node_set(node_set))
+        return costs
+
+    def relax_node_set(self,nodes):
+        """
+        Relax a set of nodes which share no cells, taking a few gradient
+        steps on batch_cost_function().  Gradients come from central
+        differences, evaluated for the whole set at once, and each node
+        adapts its own step length.  FREE nodes move in x,y, SLIDE nodes move
+        along their curve within find_slide_limits(), other nodes are left
+        alone.  Returns a dict of node => final cost.
+        """
+        fixed=self.grid.nodes['fixed'][nodes]
+        costs={}
+        for n,fx in zip(nodes,fixed):
+            if fx not in (self.FREE,self.SLIDE):
+                costs[n]=0.0
+        nodes=np.array([n for n,fx in zip(nodes,fixed) if fx in (self.FREE,self.SLIDE)],
+                       np.int32)
+        if len(nodes)==0:
+            return costs
+
+        cost_many=self.batch_cost_function(nodes)
+        if cost_many is None:
+            for n in nodes:
+                costs[n]=self.relax_node(n)
+            return costs
+
+        x0=self.grid.nodes['x'][nodes].copy()
+        slide=self.grid.nodes['fixed'][nodes]==self.SLIDE
+        rings=self.grid.nodes['oring'][nodes]-1
+        f0=self.grid.nodes['ring_f'][nodes].copy()
+        local_length=np.array([self.scale(x) for x in x0])
+
+        # parameters are x,y for free nodes, and f,0 for sliding nodes
+        params=x0.copy()
+        params[slide,0]=f0[slide]
+        params[slide,1]=0.0
+        p_lo=np.full(params.shape,-np.inf)
+        p_hi=np.full(params.shape,np.inf)
+        for i in np.nonzero(slide)[0]:
+            lo,hi=self.find_slide_limits(nodes[i],3*local_length[i])
+            # stay a bit inside the limits, as in relax_slide_node
+            p_lo[i,0]=min(0.95*lo+0.05*hi,f0[i])
+            p_hi[i,0]=max(0.05*lo+0.95*hi,f0[i])
+            p_lo[i,1]=p_hi[i,1]=0.0
+
+        def locations(p):
+            # p: [...,N,2] parameters => [...,N,2] locations
+            X=p.copy()
+            for ring in np.unique(rings[slide]):
+                sel=slide&(rings==ring)
+                f=p[...,sel,0]
+                X[...,sel,:]=self.curves[ring](f.ravel()).reshape(f.shape+(2,))
+            return X
+
+        def cost(p):
+            # clip sliding nodes to their limits
+            p=np.minimum(np.maximum(p,p_lo),p_hi)
+            return cost_many(locations(p))
+
+        init_cost=cost(params[None])[0]
+        cur_cost=init_cost.copy()
+        h=local_length*1e-4 # same as xtol for relax_node
+        step=0.1*local_length
+        # central difference stencil for the gradient
+        stencil=np.zeros( (4,len(nodes),2) )
+        stencil[0,:,0]=h
+        stencil[1,:,0]=-h
+        stencil[2,:,1]=h
+        stencil[3,:,1]=-h
+        # step lengths, relative to step, tried along the gradient
+        factors=np.array([2.0,1.0,0.5,0.25,0.1])
+        idx=np.arange(len(nodes))
+
+        for it in range(self.relax_batch_iterations):
+            c=cost(params[None]+stencil)
+            grad=np.zeros_like(params)
+            with np.errstate(invalid='ignore'):
+                grad[:,0]=(c[0]-c[1])/(2*h)
+                grad[:,1]=(c[2]-c[3])/(2*h)
+            grad[slide,1]=0.0
+            gmag=utils.mag(grad)
+            moving=np.isfinite(gmag) & (gmag>0) & (step>h)
+            if not np.any(moving):
+                break
+            direction=np.zeros_like(grad)
+            direction[moving]=-grad[moving]/gmag[moving,None]
+            trials=params[None] + (factors[:,None]*step[None,:])[...,None]*direction[None]
+            trials=np.minimum(np.maximum(trials,p_lo),p_hi)
+            trial_costs=cost(trials)
+            trial_costs[~np.isfinite(trial_costs)]=np.inf
+            best=np.argmin(trial_costs,axis=0)
+            better=moving & (trial_costs[best,idx]<cur_cost)
+            params[better]=trials[best,idx][better]
+            cur_cost[better]=trial_costs[best,idx][better]
+            step[better]*=factors[best][better]
+            step[moving&~better]*=0.5*factors[-1]
+
+        new_x=locations(params)
+
+        for i,n in enumerate(nodes):
+            costs[n]=init_cost[i]
+            if not (cur_cost[i]<init_cost[i]):
+                continue
+            if self.grid.nodes['deleted'][n]:
+                continue
+            # sliding an earlier node in the set can merge edges, so
+            # confirm the improvement with the node's own cost function
+            # before moving it.
+            cost_fn=self.cost_function(n)
+            if cost_fn is None:
+                continue
+            base_cost=cost_fn(self.grid.nodes['x'][n])
+            new_cost=cost_fn(new_x[i])
+            costs[n]=base_cost
+            if not (new_cost<base_cost):
+                continue
+            cp=self.grid.checkpoint()
+            try:
+                if slide[i]:
+                    self.slide_node(n,params[i,0]-f0[i])
+                else:
+                    self.grid.modify_node(n,x=new_x[i])
+                costs[n]=new_cost
+            except self.cdt.IntersectingConstraints as exc:
+                self.grid.revert(cp)
+                self.log.info("Relaxation caused intersection, reverting")
+        return costs
+
     def node_ring_f(self,n,ring0):
         """
         return effective ring_f for node n in terms of ring0.
@@ -2363,20 +2599,15 @@ class AdvancingTriangles(AdvancingFront):
     # cc_py is more elegant and crappier
     cost_method='base'
     cost_thresh_default=0.22
-    def cost_function(self,n):
+
+    def node_cost_edges(self,n):
         """
-        Return a function which takes an x,y pair, and evaluates
-        a geometric cost function for node n based on the shape and
-        scale of triangle cells containing n
+        For each cell of node n, the pair of other nodes forming a triangle
+        with n, ordered such that n is to the left of the pair, as expected
+        by one_point_cost.  Returns [Ncells,2] array of node indices.
         """
-        local_length = self.scale( self.grid.nodes['x'][n] )
-        my_cells = self.grid.node_to_cells(n)
-
-        if len(my_cells) == 0:
-            return None
-
         cell_nodes = [self.grid.cell_to_nodes(c)
-                      for c in my_cells ]
+                      for c in self.grid.node_to_cells(n) ]
 
         # for the moment, can only deal with triangles
         cell_nodes=np.array(cell_nodes)
@@ -2391,7 +2622,62 @@ class AdvancingTriangles(AdvancingFront):
                 cell_nodes[j,1] = cell_nodes[j,0]
                 cell_nodes[j,0] = cell_nodes[j,2] # otherwise, already set
 
-        edges = cell_nodes[:,:2]
+        return cell_nodes[:,:2]
+
+    def batch_cost_function(self,nodes):
+        """
+        Vectorized version of the 'base' cost function for a set of nodes
+        which share no cells.  See AdvancingFront.batch_cost_function.
+        """
+        if self.cost_method!='base':
+            return None
+
+        edges=[]
+        owner=[]
+        has_cells=np.zeros(len(nodes),np.bool8)
+        for i,n in enumerate(nodes):
+            if len(self.grid.node_to_cells(n))==0:
+                continue
+            node_edges=self.node_cost_edges(n)
+            owner.append( np.full(len(node_edges),has_cells.sum()) )
+            edges.append(node_edges)
+            has_cells[i]=True
+
+        if len(edges)==0:
+            return lambda X: np.zeros(X.shape[:-1])
+
+        edge_points=self.grid.nodes['x'][np.concatenate(edges)]
+        owner=np.concatenate(owner)
+        local_length=np.array( [self.scale(x)
+                                for x in self.grid.nodes['x'][np.asarray(nodes)[has_cells]]] )
+        n_cost=len(local_length)
+
+        def cost(X):
+            # flatten any leading dimensions into one larger batch
+            lead=X.shape[:-2]
+            K=int(np.prod(lead))
+            pnts=X[...,has_cells,:].reshape(-1,2)
+            K_owner=(owner[None,:] + n_cost*np.arange(K)[:,None]).ravel()
+            K_edges=np.tile(edge_points,(K,1,1))
+            K_length=np.tile(local_length,K)
+            result=np.zeros(X.shape[:-1])
+            result[...,has_cells]=one_point_cost_many(pnts,K_edges,K_owner,K_length).reshape(lead+(n_cost,))
+            return result
+        return cost
+
+    def cost_function(self,n):
+        """
+        Return a function which takes an x,y pair, and evaluates
+        a geometric cost function for node n based on the shape and
+        scale of triangle cells containing n
+        """
+        local_length = self.scale( self.grid.nodes['x'][n] )
+        my_cells = self.grid.node_to_cells(n)
+
+        if len(my_cells) == 0:
+            return None
+
+        edges = self.node_cost_edges(n)
         edge_points = self.grid.nodes['x'][edges]
 
         def cost(x,edge_points=edge_points,local_length=local_length):
@@ -19,6 +19,7 @@ from ..io import qnc
 import xarray as xr
 from .. import utils
 import time
+from collections import OrderedDict
 
 def ncslice(ncvar,**kwargs):
     """
@@ -60,6 +61,136 @@ def cf_to_datenums(nc_t_var):
                days=1)[units]
     return tzero + nc_t_var[:] / div
 
+def layer_bounds(eta,bed,z_interfaces=None,sigma_interfaces=None,z_sigma=None,
+                 surface_dzmin=0.0):
+    """
+    Elevations of the bottom and top of every layer in every water column,
+    clipped to the wet part of the column.
+
+    eta, bed: [cell] elevations of the free surface and the bed.
+    z_interfaces: [Nk+1] elevations of fixed z-layer interfaces.  The top
+      layer extends up to eta and the bottom layer down to the bed, even
+      when they pass the outermost interfaces.
+    sigma_interfaces: [Nk+1] sigma coordinates of layer interfaces, CF style
+      with 0 at the surface and -1 at the bed.
+    With only z_interfaces, layers are z-layers.  A top layer thinner than
+    surface_dzmin is lumped into the layer below it, as in suntans.
+    With only sigma_interfaces, layers are sigma-layers.
+    With both, sigma-layers span from max(z_sigma,bed) to eta, and z-layers
+    fill in below z_sigma. Layer order follows sigma_interfaces, then
+    z_interfaces if sigma_interfaces starts at the surface, otherwise
+    z_interfaces and then sigma_interfaces.
+
+    returns bot,top, each [cell,Nk]
+    """
+    eta=np.asarray(eta,np.float64)
+    bed=np.asarray(bed,np.float64)
+    # dry cells, and eta which has gone below the bed, are treated as empty
+    eta=np.maximum(eta,bed)
+
+    def z_bounds(interfaces,top_limit):
+        interfaces=np.asarray(interfaces,np.float64)
+        bot=np.minimum(interfaces[:-1],interfaces[1:])
+        top=np.maximum(interfaces[:-1],interfaces[1:])
+        # the outermost layers extend to the surface and the bed
+        bot[np.argmin(bot)]=-np.inf
+        top[np.argmax(top)]=np.inf
+        bot=bot[None,:] ; top=top[None,:]
+        bot=np.clip(bot,bed[:,None],top_limit[:,None])
+        top=np.clip(top,bed[:,None],top_limit[:,None])
+        return bot,top
+
+    def sigma_bounds(sigmas,bottom):
+        sigmas=np.asarray(sigmas,np.float64)
+        thick=eta-bottom
+        z=eta[:,None] + sigmas[None,:]*thick[:,None]
+        return np.minimum(z[:,:-1],z[:,1:]),np.maximum(z[:,:-1],z[:,1:])
+
+    if sigma_interfaces is None:
+        bot,top=z_bounds(z_interfaces,eta)
+        if surface_dzmin>0:
+            # lump a thin top layer into the one below.  process with the
+            # surface layer first, then flip back if needed.
+            flip=z_interfaces[0]<z_interfaces[-1]
+            if flip:
+                bot=bot[:,::-1] ; top=top[:,::-1]
+            bot=bot.copy() ; top=top.copy()
+            thick=top-bot
+            wet=thick>0
+            ktop=np.argmax(wet,axis=1)
+            cells=np.nonzero( wet.any(axis=1)
+                              & (thick[np.arange(len(thick)),ktop]<surface_dzmin)
+                              & (ktop+1<thick.shape[1]) )[0]
+            kt=ktop[cells]
+            cells=cells[ wet[cells,kt+1] ]
+            kt=ktop[cells]
+            top[cells,kt+1]=top[cells,kt]
+            bot[cells,kt]=top[cells,kt]
+            if flip:
+                bot=bot[:,::-1] ; top=top[:,::-1]
+        return bot,top
+    elif z_interfaces is None:
+        return sigma_bounds(sigma_interfaces,bed)
+    else:
+        z_top=np.maximum(np.minimum(z_sigma,eta),bed)
+        zbot,ztop=z_bounds(z_interfaces,z_top)
+        sbot,stop=sigma_bounds(sigma_interfaces,z_top)
+        if sigma_interfaces[0]>sigma_interfaces[-1]:
+            return (np.concatenate([sbot,zbot],axis=1),
+                    np.concatenate([stop,ztop],axis=1))
+        else:
+            return (np.concatenate([zbot,sbot],axis=1),
+                    np.concatenate([ztop,stop],axis=1))
+
+def averaging_window(eta,bed,ztop=None,zbottom=None,dz=None):
+    """
+    Elevations bounding a vertical averaging window, as in
+    vertical_averaging_weights.  ztop is a distance below eta, zbottom a
+    distance above the bed, and dz a thickness.  Give 2 of the 3, or none
+    for the full water column.
+
+    returns zlow,zhigh, each [cell]
+    """
+    zhigh=np.asarray(eta,np.float64)
+    zlow=np.asarray(bed,np.float64)
+    if ztop is not None:
+        # don't allow the top to go below the bed
+        zhigh=np.maximum(zhigh-ztop,zlow)
+        if dz is not None:
+            zlow=np.maximum(zhigh-dz,zlow)
+    if zbottom is not None:
+        zlow=zlow+zbottom
+        if dz is not None:
+            zhigh=zlow+dz
+    return zlow,zhigh
+
+def averaging_weight_matrix(bot,top,zlow,zhigh):
+    """
+    Sparse matrix of averaging weights, from layer bounds [cell,Nk] as
+    returned by layer_bounds() and an averaging window as returned by
+    averaging_window().
+
+    returns a csr matrix W [cell, cell*Nk], such that W.dot(data.ravel())
+    averages cell-layer data [cell,Nk] over the window.  Cells with an
+    empty window get nan.
+    """
+    from scipy import sparse
+    n_cell,Nk=bot.shape
+    w=np.minimum(top,zhigh[:,None]) - np.maximum(bot,zlow[:,None])
+    np.maximum(w,0,out=w)
+    total=w.sum(axis=1)
+    empty=total<=0
+    w[empty,0]=np.nan
+    total[empty]=1.0
+    w/=total[:,None]
+
+    nonzero=(w!=0).ravel()
+    indices=np.nonzero(nonzero)[0]
+    indptr=np.zeros(n_cell+1,np.int64)
+    indptr[1:]=np.cumsum(nonzero.reshape(n_cell,Nk).sum(axis=1))
+    return sparse.csr_matrix( (w.ravel()[indices],indices,indptr),
+                              shape=(n_cell,n_cell*Nk) )
+
 class Ugrid(object):
     surface_dzmin = 2*0.001 # common value, but no guarantee that this matches suntans code.
     
@@ -767,6 +898,95 @@ class UgridXr(object):
             all_dz = all_dz.transpose([0,2,1])
         return all_dz
 
+    # number of time steps for which vertical_averaging_matrix() keeps
+    # weights around
+    averaging_cache_size=10
+    _vertical_geometry=None
+    def vertical_geometry(self):
+        """
+        Static vertical geometry of the mesh, as a dict with bed elevation
+        per face and either z_interfaces or sigma_interfaces, suitable
+        for layer_bounds().  Cached.
+        """
+        if self._vertical_geometry is not None:
+            return self._vertical_geometry
+
+        if self.face_depth_vname is None:
+            self.face_depth_vname=self.find_var(standard_name=["sea_floor_depth_below_geoid",
+                                                               "sea_floor_depth"],
+                                                location='face')
+        assert self.face_depth_vname is not None,"Failed to find depth variable"
+        bed=self.nc[self.face_depth_vname].values
+        if self.nc[self.face_depth_vname].attrs.get('positive')=='down':
+            bed=-bed
+
+        layers=self.nc[self.layer_var_name()]
+        if 'bounds' in layers.attrs:
+            layer_bounds=self.nc[ layers.attrs['bounds'] ].values
+            if not (layer_bounds.ndim==2 and layer_bounds.shape[1]==2):
+                raise Exception("Not smart enough about layer_bounds to do this")
+            interfaces=np.concatenate( (layer_bounds[:,0],layer_bounds[-1:,1]) )
+        else:
+            interfaces=utils.center_to_edge(layers.values,dx_single=0-bed.min())
+
+        geom=dict(bed=bed)
+        if layers.attrs.get('standard_name')=='ocean_sigma_coordinate':
+            geom['sigma_interfaces']=interfaces
+        else:
+            if layers.attrs.get('positive')=='down':
+                interfaces=-interfaces
+            geom['z_interfaces']=interfaces
+        self._vertical_geometry=geom
+        return geom
+
+    _averaging_cache=None
+    def vertical_averaging_matrix(self,time_step,ztop=None,zbottom=None,dz=None):
+        """
+        Sparse equivalent of vertical_averaging_weights() for a single time
+        step, for z-layer or sigma-layer output.  Returns a csr matrix
+        [face, face*Nk], see averaging_weight_matrix().  Matrices are
+        cached for the last averaging_cache_size combinations of time step
+        and window.
+
+        Unlike vertical_averaging_weights(), the window is limited to the
+        wet part of the water column, and thin surface layers are lumped
+        based on eta rather than the top of the window.
+        """
+        key=(time_step,ztop,zbottom,dz)
+        if self._averaging_cache is None:
+            self._averaging_cache=OrderedDict()
+        if key in self._averaging_cache:
+            self._averaging_cache.move_to_end(key)
+            return self._averaging_cache[key]
+
+        if self.face_eta_vname is None:
+            self.face_eta_vname=self.find_var(standard_name='sea_surface_height_above_geoid')
+            assert self.face_eta_vname is not None,"Failed to discern eta variable"
+        eta=self.nc[self.face_eta_vname].isel({self.time_dim:time_step}).values
+
+        geom=self.vertical_geometry()
+        bot,top=layer_bounds(eta,geom['bed'],
+                             z_interfaces=geom.get('z_interfaces'),
+                             sigma_interfaces=geom.get('sigma_interfaces'),
+                             surface_dzmin=self.surface_dzmin)
+        zlow,zhigh=averaging_window(eta,geom['bed'],ztop=ztop,zbottom=zbottom,dz=dz)
+        W=averaging_weight_matrix(bot,top,zlow,zhigh)
+
+        self._averaging_cache[key]=W
+        while len(self._averaging_cache)>self.averaging_cache_size:
+            self._averaging_cache.popitem(last=False)
+        return W
+
+    def vertical_average(self,label,time_step,ztop=None,zbottom=None,dz=None):
+        """
+        Vertically average the face/layer variable label at the given time
+        step, with a single sparse product.  returns [face] array.
+        """
+        var=self.nc[label].isel({self.time_dim:time_step})
+        values=var.transpose(self.face_dim,self.layer_dim).values
+        W=self.vertical_averaging_matrix(time_step,ztop=ztop,zbottom=zbottom,dz=dz)
+        return W.dot(values.ravel())
+
     def datenums(self):
         """ return datenums, referenced to UTC
         """
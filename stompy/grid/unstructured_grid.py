@@ -5,7 +5,7 @@ from __future__ import print_function
 #  common methods for manipulating unstructured grids, specifically mixed quad/tri
 #  grids from FISH-PTM and UnTRIM
 
-import sys,os,types
+import sys,os,types,shutil,json,time,heapq
 import logging
 
 try:
@@ -236,6 +236,119 @@ def rec_to_dict(r):
         d[name]=r[name]
     return d
 
+class OpProfiler(object):
+    """
+    Lightweight instrumentation of listenable grid methods.  When enabled,
+    accumulates call counts and wall time for each listenable method and
+    each subscribed listener, and the change in undo stack depth caused by
+    each method.  Times and undo ops are inclusive of nested listenable calls,
+    so add_cell_and_edges includes the add_edge calls it makes.
+
+    When disabled, the cost is a single attribute check per call.
+
+    usage:
+      from stompy.grid.unstructured_grid import op_profiler
+      with op_profiler.profiling():
+          ... edit grids ...
+      print(op_profiler.table())
+    """
+    enabled=False
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        # name => [calls,seconds,net undo ops]
+        self.methods=defaultdict(lambda: [0,0.0,0])
+        # (method name,listener name) => [calls,seconds]
+        self.listeners=defaultdict(lambda: [0,0.0])
+        self.max_undo_depth=0
+
+    def enable(self):
+        self.enabled=True
+    def disable(self):
+        self.enabled=False
+
+    class Profiling(object):
+        def __init__(self,profiler,reset):
+            self.profiler=profiler
+            self.reset=reset
+        def __enter__(self):
+            self.was_enabled=self.profiler.enabled
+            if self.reset:
+                self.profiler.reset()
+            self.profiler.enable()
+            return self.profiler
+        def __exit__(self,*a):
+            self.profiler.enabled=self.was_enabled
+
+    def profiling(self,reset=True):
+        """
+        Context manager enabling the profiler, and restoring the previous
+        state on exit.  reset: clear previously accumulated stats first.
+        """
+        return self.Profiling(self,reset)
+
+    @staticmethod
+    def undo_depth(grid):
+        stack=getattr(grid,'op_stack',None)
+        if stack is None:
+            return 0
+        return len(stack)
+
+    def start(self,grid):
+        return (time.perf_counter(),self.undo_depth(grid))
+
+    def stop(self,grid,func_name,token):
+        t0,depth0=token
+        elapsed=time.perf_counter()-t0
+        depth=self.undo_depth(grid)
+        rec=self.methods[func_name]
+        rec[0]+=1
+        rec[1]+=elapsed
+        rec[2]+=depth-depth0
+        self.max_undo_depth=max(self.max_undo_depth,depth)
+
+    def call_listener(self,func,grid,func_name,*a,**k):
+        t0=time.perf_counter()
+        try:
+            func(grid,func_name,*a,**k)
+        finally:
+            rec=self.listeners[ (func_name,getattr(func,'__qualname__',repr(func))) ]
+            rec[0]+=1
+            rec[1]+=time.perf_counter()-t0
+
+    def report(self):
+        """
+        Return the accumulated stats as a dict:
+          methods: name => dict(calls,time,undo_ops)
+          listeners: (method name,listener name) => dict(calls,time)
+          max_undo_depth: largest undo stack seen after a profiled call
+        """
+        return dict(methods={k:dict(calls=v[0],time=v[1],undo_ops=v[2])
+                             for k,v in self.methods.items()},
+                    listeners={k:dict(calls=v[0],time=v[1])
+                               for k,v in self.listeners.items()},
+                    max_undo_depth=self.max_undo_depth)
+
+    def table(self):
+        """
+        Return a text table of the accumulated stats, sorted by total time.
+        """
+        lines=["%-40s %10s %10s %12s %10s"%("method","calls","time [s]","us/call","undo ops")]
+        for name,(calls,elapsed,ops) in sorted(self.methods.items(),key=lambda kv: -kv[1][1]):
+            lines.append("%-40s %10d %10.4f %12.2f %10d"%(name,calls,elapsed,1e6*elapsed/max(calls,1),ops))
+        if self.listeners:
+            lines.append("")
+            lines.append("%-40s %10s %10s %12s"%("listener","calls","time [s]","us/call"))
+            for (name,listener),(calls,elapsed) in sorted(self.listeners.items(),key=lambda kv: -kv[1][1]):
+                lines.append("%-40s %10d %10.4f %12.2f"%(name+":"+listener,calls,elapsed,1e6*elapsed/max(calls,1)))
+        lines.append("")
+        lines.append("max undo stack depth: %d"%self.max_undo_depth)
+        return "\n".join(lines)
+
+op_profiler=OpProfiler()
+
 # two parts - a baseclass which handles the real work
 # of registering listeners for a particular method,
 # and a decorator to streamline setting which methods
@@ -262,10 +375,16 @@ class Listenable(object):
 
     def fire_after(self,func_name,*a,**k):
         for func in self.__post_listeners[func_name]:
-            func(self,func_name,*a,**k)
+            if op_profiler.enabled:
+                op_profiler.call_listener(func,self,func_name,*a,**k)
+            else:
+                func(self,func_name,*a,**k)
     def fire_before(self,func_name,*a,**k):
         for func in self.__pre_listeners[func_name]:
-            func(self,func_name,*a,**k)
+            if op_profiler.enabled:
+                op_profiler.call_listener(func,self,func_name,*a,**k)
+            else:
+                func(self,func_name,*a,**k)
 
     def __getstate__(self):
         # awkward, verbose code to get around the 'hiding' when attributes
@@ -288,14 +407,64 @@ class Listenable(object):
     #def __setstate__(self,state):
     #    self.__dict__.update(state)
 
+class CSRAdjacency(object):
+    """
+    Stand-in for the defaultdict(list) used for _node_to_edges and
+    _node_to_cells, backed by CSR arrays (as stored in the native grid
+    format).  Lists are only materialized when a node is accessed, so
+    loading a large grid does not require a python loop over all nodes.
+    Supports the subset of the dict interface used in this module:
+    item access (which creates the entry, like defaultdict), and del.
+    """
+    def __init__(self,ptr,idx):
+        self.ptr=ptr
+        self.idx=idx
+        self.lists={}
+    def __getitem__(self,n):
+        try:
+            return self.lists[n]
+        except KeyError:
+            pass
+        if 0<=n<len(self.ptr)-1:
+            lst=self.idx[self.ptr[n]:self.ptr[n+1]].tolist()
+        else:
+            lst=[]
+        self.lists[n]=lst
+        return lst
+    def __delitem__(self,n):
+        # like defaultdict, subsequent access gets an empty list
+        self.lists[n]=[]
+    def __len__(self):
+        return len(self.ptr)-1
+
+def adjacency_to_csr(parents,children,N):
+    """
+    parents,children: parallel arrays, child i belongs to parent parents[i].
+    N: number of parents.
+    Returns ptr,idx such that children of parent p are idx[ptr[p]:ptr[p+1]],
+    preserving the original order of children within each parent.
+    """
+    order=np.argsort(parents,kind='stable')
+    idx=np.asarray(children)[order].astype(np.int32)
+    counts=np.bincount(parents,minlength=N)
+    ptr=np.zeros(N+1,np.int64)
+    ptr[1:]=np.cumsum(counts)
+    return ptr,idx
+
 from functools import wraps
 def listenable(f):
     @wraps(f)
     def wrapper(self,*args,**kwargs):
         func_name=f.__name__ # used to be f.func_name, but that disappeared in py3k
-        self.fire_before(func_name,*args,**kwargs)
-        val=f(self,*args,**kwargs)
-        self.fire_after(func_name,*args,return_value=val,**kwargs)
+        token=op_profiler.enabled and op_profiler.start(self)
+        try:
+            self.fire_before(func_name,*args,**kwargs)
+            val=f(self,*args,**kwargs)
+            self.fire_after(func_name,*args,return_value=val,**kwargs)
+        finally:
+            # failed calls are recorded too
+            if token:
+                op_profiler.stop(self,func_name,token)
         return val
 
     return wrapper
@@ -1877,6 +2046,7 @@ class UnstructuredGrid(Listenable,undoer.OpHistory):
         self._node_to_edges = None
         self._node_to_cells = None
         self._node_index = None
+        self._graph_cache = None
         return node_map
 
     def delete_orphan_edges(self):
@@ -1967,6 +2137,7 @@ class UnstructuredGrid(Listenable,undoer.OpHistory):
 
         self.edges['cells'] = cell_map[self.edges['cells']]
         self._cell_center_index=None
+        self._graph_cache=None
         return cell_map
 
     def renumber_edges_ordering(self):
@@ -2001,6 +2172,7 @@ class UnstructuredGrid(Listenable,undoer.OpHistory):
         edge_map[-Nneg:] = np.arange(-Nneg,0)
 
         self.cells['edges'] = edge_map[self.cells['edges']]
+        self._graph_cache=None
         return edge_map
 
     def add_grid(self,ugB,merge_nodes=None,log=None,tol=0.0):
@@ -2302,33 +2474,44 @@ class UnstructuredGrid(Listenable,undoer.OpHistory):
             self.cells['nodes'][c,len(nodes):]=self.UNDEFINED
 
     def make_edges_from_cells(self):
-        edge_map = {} # keys are tuples of node indices, mapping to index into new_edges
-        new_edges = [] # each entry is [n1,n2,c1,c2].  assume for now that c1 is on the left of the edge n1->n2
-
-        for c in range(self.Ncells()):
-            for i,(a,b) in enumerate(circular_pairs(self.cell_to_nodes(c))):
-                if a<b:
-                    k = (a,b)
-                else:
-                    k = (b,a)
-                if k not in edge_map:
-                    j = len(new_edges)
-                    edge_map[k] = j
-                    # we know everything but the opposite cell
-                    new_edges.append([a,b,c,-1])
-                else:
-                    # if it's already in there, then we must be the right-hand side cell
-                    j = edge_map[k]
-                    new_edges[j][3] = c
-                # not 100% sure that this will put the edges in with the expected order
-                # this should have edge i immediately CCW from node i.
-                self.cells['edges'][c,i] = j
-
-        new_edges = np.array(new_edges)
-        self.edges = np.zeros( len(new_edges),self.edge_dtype )
-        self.edges['nodes'] = new_edges[:,:2]
-        self.edges['cells'] = new_edges[:,2:4]
+        """
+        Create edges from cells['nodes'], replacing any existing edges.
+        Edges are numbered in order of first appearance scanning cells and
+        then sides, oriented with the first cell on the left, and
+        cells['edges'] is set with edge i immediately CCW from node i.
+        """
+        cn=self.cells['nodes']
+        Nc,max_sides=cn.shape
+        nsides=(cn>=0).sum(axis=1)
+        side=np.arange(max_sides)[None,:]
+        valid=side<nsides[:,None]
+        # next node around the cell, wrapping at the last valid node
+        nxt=np.where(side+1<nsides[:,None], np.roll(cn,-1,axis=1), cn[:,:1])
+
+        a=cn[valid]
+        b=nxt[valid]
+        c=np.broadcast_to(np.arange(Nc)[:,None],cn.shape)[valid]
+        i=np.broadcast_to(side,cn.shape)[valid]
+
+        N=np.int64(max(self.Nnodes(),1))
+        keys=np.minimum(a,b).astype(np.int64)*N + np.maximum(a,b)
+        ukeys,first,inverse=np.unique(keys,return_index=True,return_inverse=True)
+        # number edges by first appearance
+        rank=np.zeros(len(ukeys),np.int64)
+        rank[np.argsort(first)]=np.arange(len(ukeys))
+        j=rank[inverse]
+
+        self.edges = np.zeros( len(ukeys),self.edge_dtype )
+        self.edges['nodes'][rank,0] = a[first]
+        self.edges['nodes'][rank,1] = b[first]
+        self.edges['cells'][rank,0] = c[first]
+        self.edges['cells'][:,1] = -1
+        # later appearances are the right-hand side cell
+        later=np.arange(len(keys))!=first[inverse]
+        self.edges['cells'][j[later],1] = c[later]
+        self.cells['edges'][c,i] = j
         self._node_to_edges=None
+        self._graph_cache=None
 
     def make_edges_from_cells_fast(self):
         """
@@ -2389,6 +2572,7 @@ class UnstructuredGrid(Listenable,undoer.OpHistory):
         self.edges['cells'][j[has_left],0]=new_edges['c1'][has_left]
         self.edges['cells'][j[has_right],0]=new_edges['c2'][has_right]
         self._node_to_edges=None
+        self._graph_cache=None
 
     def refresh_metadata(self):
         """ Call this when the cells, edges and nodes may be out of sync with indices
@@ -2401,6 +2585,7 @@ class UnstructuredGrid(Listenable,undoer.OpHistory):
         #self._calc_vcenters = False
         self._node_to_edges = None
         self._node_to_cells = None
+        self._graph_cache = None
 
     def Nnodes(self):
         """
@@ -2717,6 +2902,30 @@ class UnstructuredGrid(Listenable,undoer.OpHistory):
         #     if n2 in self.edges['nodes'][e]:
         #         return e
 
+    def nodes_to_edge_many(self,n1,n2):
+        """
+        Vectorized nodes_to_edge.
+        n1,n2: arrays of node indices, same shape
+        returns array of edge indices, -1 where there is no edge
+        """
+        n1=np.asarray(n1)
+        n2=np.asarray(n2)
+        result=np.full(n1.shape,-1,np.int32)
+        valid=np.nonzero(~self.edges['deleted'])[0]
+        if len(valid)==0:
+            return result
+        N=np.int64(max(self.Nnodes(),1))
+        en=self.edges['nodes'][valid].astype(np.int64)
+        keys=en.min(axis=1)*N + en.max(axis=1)
+        order=np.argsort(keys,kind='stable')
+        keys=keys[order]
+
+        query=np.minimum(n1,n2).astype(np.int64)*N + np.maximum(n1,n2)
+        pos=np.searchsorted(keys,query).clip(0,len(keys)-1)
+        found=(keys[pos]==query) & (n1>=0) & (n2>=0)
+        result[found]=valid[order[pos[found]]]
+        return result
+
     def nodes_to_cell(self,ns,fail_hard=True):
         cells=self.node_to_cells(ns[0])
         for n in ns[1:]:
@@ -2881,6 +3090,7 @@ class UnstructuredGrid(Listenable,undoer.OpHistory):
 
     @listenable
     def add_node(self,**kwargs):
+        self.invalidate_graph_cache()
         i=None
         if '_index' in kwargs:
             i=kwargs.pop('_index')
@@ -2920,6 +3130,7 @@ class UnstructuredGrid(Listenable,undoer.OpHistory):
         """
         Does *not* check topology / planarity
         """
+        self.invalidate_graph_cache()
         j=None
         if '_index' in kwargs:
             j=kwargs.pop('_index')
@@ -2967,6 +3178,7 @@ class UnstructuredGrid(Listenable,undoer.OpHistory):
     # and remove dependent entitites
     @listenable
     def delete_edge(self,j,check_cells=True):
+        self.invalidate_graph_cache()
         if check_cells and np.any(self.edges['cells'][j]>=0):
             raise GridException("Edge %d has cell neighbors"%j)
         self.edges['deleted'][j] = True
@@ -3523,6 +3735,7 @@ class UnstructuredGrid(Listenable,undoer.OpHistory):
         but don't build them just to check. The "contract" here does *not*
         promise to check!
         """
+        self.invalidate_graph_cache()
         if self._node_to_edges is not None:
             if len(self._node_to_edges[n])>0:
                 print( "Node %d has edges: %s"%(n,self._node_to_edges[n]) )
@@ -3560,6 +3773,7 @@ class UnstructuredGrid(Listenable,undoer.OpHistory):
 
     @listenable
     def delete_cell(self,i,check_active=True):
+        self.invalidate_graph_cache()
         if check_active and self.cells['deleted'][i]!=False:
             raise Exception("delete_cell(%d) - appears already deleted"%(i))
 
@@ -3646,6 +3860,7 @@ class UnstructuredGrid(Listenable,undoer.OpHistory):
         """
         Does *not* check topology / planarity.  Assumes that edges already exist
         """
+        self.invalidate_graph_cache()
         i=None
         if '_index' in kwargs:
             i=kwargs.pop('_index')
@@ -3745,6 +3960,7 @@ class UnstructuredGrid(Listenable,undoer.OpHistory):
         """ largely incomplete.  This will need to
         update any geometry and topology details
         """
+        self.invalidate_graph_cache()
         if 'nodes' in kws and self._node_to_cells is not None:
             for n in self.cell_to_nodes(c):
                 self._node_to_cells[n].remove(c)
@@ -3764,6 +3980,7 @@ class UnstructuredGrid(Listenable,undoer.OpHistory):
     def modify_edge(self,j,**kws):
         # likewise, this will have to get smarter about patching up derived
         # geometry and topology
+        self.invalidate_graph_cache()
 
         if 'nodes' in kws and self._node_to_edges is not None:
             for n in self.edges['nodes'][j]:
@@ -3778,6 +3995,7 @@ class UnstructuredGrid(Listenable,undoer.OpHistory):
 
     @listenable
     def modify_node(self,n,**kws):
+        self.invalidate_graph_cache()
         if self._cell_center_index:
             my_cells=self.node_to_cells(n)
 
@@ -5399,9 +5617,243 @@ class UnstructuredGrid(Listenable,undoer.OpHistory):
         else:
             return hits
 
+    # Cached graph connectivity and weighted graphs, see graph_pairs() and
+    # graph_adjacency().  The add/modify/delete methods bump _graph_version
+    # via invalidate_graph_cache().  Code which edits the node, edge or cell
+    # arrays directly, or edits weight/selector arrays in place, should
+    # call invalidate_graph_cache().
+    _graph_cache=None
+    _graph_version=0
+    # number of weighted graphs kept in the cache
+    graph_cache_size=8
+
+    def invalidate_graph_cache(self):
+        self._graph_version+=1
+
+    def graph_cache(self):
+        """
+        The cache dict, reset if the grid has been modified or the number
+        of nodes, edges or cells has changed since it was filled.
+        """
+        key=(self._graph_version,self.Nnodes(),self.Nedges(),self.Ncells())
+        if (self._graph_cache is None) or (self._graph_cache['key']!=key):
+            self._graph_cache=dict(key=key,pairs={},weighted=[])
+        return self._graph_cache
+
+    def graph_pairs(self,traverse='nodes'):
+        """
+        Directed connections for graph searches over nodes, cells or edges.
+        Cached until the grid is modified.
+
+        traverse:
+          'nodes': nodes connected by edges
+          'cells': cells connected by shared edges
+          'edges': edges connected by shared nodes
+
+        Returns src,dst,j,direc: parallel arrays, one entry for each direction
+        of each connection.  j is the edge crossed (for traverse='edges', the
+        destination edge), and direc is +1 for traversing edge j
+        forward (nodes[0] to nodes[1], or cells[0] to cells[1]), -1 for backward.
+        """
+        if traverse not in ['nodes','cells','edges']:
+            raise Exception("Bad value for traverse: %s"%traverse)
+
+        cache=self.graph_cache()
+        if traverse in cache['pairs']:
+            return cache['pairs'][traverse]
+
+        if traverse=='nodes':
+            js=np.nonzero(~self.edges['deleted'])[0]
+            a,b=self.edges['nodes'][js].T
+        elif traverse=='cells':
+            e2c=self.edge_to_cells()
+            js=np.nonzero( (~self.edges['deleted']) & np.all(e2c>=0,axis=1) )[0]
+            a,b=e2c[js].T
+            live=(~self.cells['deleted'][a]) & (~self.cells['deleted'][b])
+            js,a,b=js[live],a[live],b[live]
+
+        if traverse in ['nodes','cells']:
+            src=np.concatenate([a,b])
+            dst=np.concatenate([b,a])
+            j=np.concatenate([js,js])
+            direc=np.concatenate([np.ones(len(js),np.int32),-np.ones(len(js),np.int32)])
+        else:
+            # all ordered pairs of distinct edges sharing a node, grouped
+            # by node degree so each group is a dense block
+            ptr,idx=self.node_to_edges_csr()
+            degree=np.diff(ptr)
+            src=[] ; dst=[]
+            for d in np.unique(degree[degree>1]):
+                ns=np.nonzero(degree==d)[0]
+                block=idx[ptr[ns][:,None] + np.arange(d)[None,:]]
+                p,q=np.nonzero(~np.eye(d,dtype=np.bool8))
+                src.append(block[:,p].ravel())
+                dst.append(block[:,q].ravel())
+            src=np.concatenate(src) if src else np.zeros(0,np.int32)
+            dst=np.concatenate(dst) if dst else np.zeros(0,np.int32)
+            j=dst
+            direc=np.ones(len(src),np.int32)
+
+        pairs=(src,dst,j,direc)
+        cache['pairs'][traverse]=pairs
+        return pairs
+
+    def _graph(self,traverse='nodes',edge_weight=None,edge_selector=None):
+        """
+        Assemble a weighted csr graph.  See graph_adjacency for arguments.
+        Returns csr_matrix, sorted src*N+dst keys and the edge index,
+        both parallel to the matrix data, and (initial limit,total weight)
+        for limited searches in shortest_path.
+        Cached, keyed on traverse and the identity of the weight and
+        selector arrays.
+        """
+        from scipy import sparse
+        if edge_weight is None:
+            edge_weight='length'
+        if not isinstance(edge_weight,six.string_types) and not callable(edge_weight):
+            edge_weight=np.asarray(edge_weight,np.float64)
+        if edge_selector is not None and not callable(edge_selector):
+            edge_selector=np.asarray(edge_selector,np.bool8)
+
+        def same(a,b):
+            if isinstance(a,six.string_types) and isinstance(b,six.string_types):
+                return a==b
+            return a is b
+
+        cache=self.graph_cache()
+        cacheable=not (callable(edge_weight) or callable(edge_selector))
+        if cacheable:
+            for key,result in cache['weighted']:
+                if ( key[0]==traverse and same(key[1],edge_weight)
+                     and same(key[2],edge_selector) ):
+                    return result
+
+        src,dst,j,direc=self.graph_pairs(traverse)
+        N={'nodes':self.Nnodes(),'cells':self.Ncells(),'edges':self.Nedges()}[traverse]
+
+        if isinstance(edge_weight,six.string_types) and edge_weight=='length':
+            if traverse=='nodes':
+                x=self.nodes['x']
+            elif traverse=='cells':
+                # safer than using circumcenters
+                x=self.cells_centroid()
+            else:
+                x=self.edges_center()
+            w=mag(x[dst]-x[src])
+        elif isinstance(edge_weight,six.string_types) and edge_weight=='unit':
+            w=np.ones(len(src))
+        elif isinstance(edge_weight,six.string_types):
+            raise Exception("Bad value for edge_weight: %s"%edge_weight)
+        elif callable(edge_weight):
+            w=np.array([edge_weight(jj,dd) for jj,dd in zip(j,direc)],np.float64)
+        elif edge_weight.ndim==2:
+            # forward, backward weights
+            w=edge_weight[j,(direc<0).astype(np.int32)]
+        else:
+            w=edge_weight[j]
+
+        sel=np.isfinite(w)
+        if edge_selector is not None:
+            if callable(edge_selector):
+                sel&=np.array([bool(edge_selector(jj,dd)) for jj,dd in zip(j,direc)],np.bool8)
+            else:
+                sel&=edge_selector[j]
+
+        keys=src[sel].astype(np.int64)*N + dst[sel]
+        w=w[sel]
+        j=j[sel]
+        # parallel connections (e.g. cells sharing two edges): keep the
+        # cheapest
+        order=np.lexsort( (w,keys) )
+        keys=keys[order]
+        first=np.r_[True,keys[1:]!=keys[:-1]]
+        keys=keys[first]
+        w=w[order][first]
+        j=j[order][first]
+
+        ptr=np.zeros(N+1,np.int64)
+        ptr[1:]=np.cumsum(np.bincount(keys//N,minlength=N))
+        graph=sparse.csr_matrix( (w,keys%N,ptr),shape=(N,N) )
+        positive=w[w>0]
+        limits=(8*np.median(positive) if len(positive) else np.inf, w.sum())
+        result=(graph,keys,j,limits)
+
+        if cacheable:
+            # the key holds references to the arrays, so ids are not reused
+            # while the entry is alive
+            key=(traverse,edge_weight,edge_selector)
+            cache['weighted'].append( (key,result) )
+            del cache['weighted'][:-self.graph_cache_size]
+        return result
+
+    def graph_adjacency(self,traverse='nodes',edge_weight=None,edge_selector=None):
+        """
+        Sparse adjacency matrix for graph searches, suitable for
+        scipy.sparse.csgraph.  The matrix is cached for string and array
+        weights and selectors, until the grid is modified.  Array arguments
+        are matched by identity, so call invalidate_graph_cache() after
+        changing one in place.
+
+        traverse: 'nodes','cells' or 'edges', as in graph_pairs.
+        edge_weight:
+          None or 'length': euclidean distance between nodes, cell centroids,
+            or edge centers.
+          'unit': all connections have weight 1.
+          array [Nedges]: weight of crossing each edge (for traverse='edges', weight
+            of arriving at each edge), e.g. edge depths.  [Nedges,2] gives separate
+            forward and backward weights.
+          callable: edge_weight(j,direc), as for shortest_path.  Evaluated
+            for every connection on each call, so prefer arrays.
+          Connections with a non-finite weight are omitted.
+        edge_selector: None, boolean array [Nedges] or callable edge_selector(j,direc)
+          returning True for edges to include.
+
+        Returns a csr_matrix [N,N], which is directed when weights or selection
+        depend on direction.
+        """
+        return self._graph(traverse,edge_weight,edge_selector)[0]
+
+    def graph_distances(self,sources,traverse='nodes',edge_weight=None,edge_selector=None,
+                        limit=np.inf,return_predecessors=False,return_sources=False):
+        """
+        Multi-source Dijkstra via scipy.sparse.csgraph.
+        sources: index or collection of indices (nodes, cells or edges according
+          to traverse)
+        traverse, edge_weight, edge_selector: see graph_adjacency.
+        limit: stop searching beyond this cost.
+
+        Returns dist, array of cost from the nearest source, inf where unreachable.
+        If return_predecessors, also an array of the preceding element on
+        each shortest path (-9999 at sources and unreachable elements).  If return_sources,
+        also an array giving the nearest source (-9999 if unreachable).
+        """
+        from scipy.sparse import csgraph
+        graph=self.graph_adjacency(traverse,edge_weight,edge_selector)
+        indices=np.atleast_1d(np.asarray(sources,np.int32))
+        dist,pred,srcs=csgraph.dijkstra(graph,directed=True,indices=indices,limit=limit,
+                                        return_predecessors=True,min_only=True)
+        result=[dist]
+        if return_predecessors:
+            result.append(pred)
+        if return_sources:
+            result.append(srcs)
+        if len(result)==1:
+            return dist
+        return tuple(result)
+
+    def graph_connected_components(self,traverse='nodes',edge_selector=None):
+        """
+        Label connected components via scipy.sparse.csgraph.
+        traverse, edge_selector: see graph_adjacency.
+        Returns n_components,labels
+        """
+        from scipy.sparse import csgraph
+        graph=self.graph_adjacency(traverse,edge_weight='unit',edge_selector=edge_selector)
+        return csgraph.connected_components(graph,directed=False)
+
     def shortest_path(self,n1,n2,return_type='nodes',
                       edge_weight=None,max_return=None,
-                      edge_selector=lambda j,direc: True,
+                      edge_selector=None,
                       directed=False,
                       traverse='nodes'):
         """ dijkstra on the edge graph from n1 to n2
@@ -5411,8 +5863,13 @@ class UnstructuredGrid(Listenable,undoer.OpHistory):
           'edges' or 'sides': array of edge indices
           'cost': just the total cost
         selector: given an edge index and direction, return True if the edge should be considered.
+          Can also be a boolean array over edges.
         edge_weight: None: use euclidean distance, otherwise function taking an
-          edge index and returning its weight.
+          edge index and returning its weight, or an array of edge weights. See
+          graph_adjacency.
+
+        n1 is typically a single node index, but can also be a collection, in which
+        case paths start from whichever of n1 is closest.
 
         n2 is typically a single node index, but can also be a collection.
         in that case, return values will be a list of (n,value) tuples, in order
@@ -5431,119 +5888,165 @@ class UnstructuredGrid(Listenable,undoer.OpHistory):
           'cells' path is cells connected by edges
             this changes the interpretation of n1,n2 and return_type, such that these
             are all cell indexes instead of node indexes.
+
+        For string or array weights and selectors the search is a compiled
+        Dijkstra (scipy.sparse.csgraph) over the cached graph from
+        graph_adjacency(), with a limit on the search cost which is
+        expanded until enough targets are reached.  Callable weights and
+        selectors are evaluated lazily, only for edges reached by a
+        priority queue search which stops at the last needed target.
         """
-        if pq is None:
-            raise GridException("shortest_path requires the  priority_queue module.")
-        queue = pq.priorityDictionary()
-        queue[n1] = [0,None] # distance, predecessor
-        done = {} # likewise
+        from scipy.sparse import csgraph
+        if traverse not in ['nodes','cells']:
+            raise Exception("Bad value for traverse: %s"%traverse)
+
+        return_scalar=(np.ndim(n2)==0)
+        dests=np.unique(np.atleast_1d(n2)).astype(np.int64)
+        sources=np.atleast_1d(np.asarray(n1,np.int32))
+        n_wanted=len(dests)
+        if max_return is not None:
+            n_wanted=min(n_wanted,max_return)
+
+        if callable(edge_weight) or callable(edge_selector):
+            costs,preds=self._shortest_path_lazy(sources,dests,n_wanted,traverse,
+                                                 edge_weight,edge_selector)
+            # the lazy search settles targets in order of cost
+            dest_set=set(dests.tolist())
+            dests=np.array([n for n in costs if n in dest_set],np.int64)
+            def path_to(n):
+                path=[n] ; js=[]
+                while preds[path[-1]][0]>=0:
+                    pred,j=preds[path[-1]]
+                    path.append(pred)
+                    js.append(j)
+                return np.array(path[::-1]),np.array(js[::-1],np.int32)
+        else:
+            graph,keys,js,(limit,total)=self._graph(traverse,edge_weight,edge_selector)
+            N=graph.shape[0]
+
+            # search out to a cost limit, growing it until enough of the targets
+            # are reached.  Beyond the sum of all weights no limit is needed.
+            while 1:
+                if limit>=total:
+                    limit=np.inf
+                dist,pred,_=csgraph.dijkstra(graph,directed=True,indices=sources,
+                                             limit=limit,return_predecessors=True,
+                                             min_only=True)
+                reached=dests[np.isfinite(dist[dests])]
+                if len(reached)>=n_wanted or np.isinf(limit):
+                    break
+                limit*=4
+            dests=reached[np.argsort(dist[reached],kind='stable')]
+            costs=dist
+            def path_to(n):
+                # reconstruct the path (of cells if traverse=='cells')
+                path=[n]
+                while pred[path[-1]]>=0:
+                    path.append(pred[path[-1]])
+                path=np.array(path[::-1]) # reverse it so it goes from n1 to n2
+                steps=path[:-1].astype(np.int64)*N + path[1:]
+                return path,js[np.searchsorted(keys,steps)]
 
-        try:
-            dests=set(n2) # exception if n2 is a scalar index
-            return_scalar=False
-        except TypeError:
-            dests=set([n2])
-            return_scalar=True
+        dests=dests[:n_wanted]
 
-        if max_return is None:
-            max_return=len(dests)
+        # update/replace the return values in results based on return_type
+        return_values=[] #  (node/cell, <return value>)
+        for n in dests:
+            if return_type in ['nodes','cells']:
+                return_value=path_to(n)[0]
+            elif return_type in ('edges','sides'):
+                return_value=path_to(n)[1]
+            elif return_type=='cost':
+                return_value=costs[n]
+            return_values.append( (int(n),return_value) )
+        if return_scalar:
+            # the old behavior for an unreachable target
+            if len(return_values)==0:
+                raise IndexError("Target %s is not reachable"%n2)
+            return return_values[0][1]
+        else:
+            return return_values
 
-        results=[] # list of dicts, return values per target node in dests
+    def _shortest_path_lazy(self,sources,dests,n_wanted,traverse,edge_weight,edge_selector):
+        """
+        Priority queue Dijkstra for shortest_path() with callable weights or
+        selectors, stopping once n_wanted of dests are reached.
+        Returns costs,preds: dicts over settled nodes (cells), in the order
+        they were settled, of cost and (predecessor,edge).  The predecessor
+        is -1 for sources.
+        """
+        if edge_weight is None or (isinstance(edge_weight,six.string_types) and edge_weight=='length'):
+            if traverse=='nodes':
+                x=self.nodes['x']
+            else:
+                # safer than using circumcenters
+                x=self.cells_centroid()
+            weight=None
+        elif isinstance(edge_weight,six.string_types) and edge_weight=='unit':
+            weight=lambda j,direc: 1.0
+        elif callable(edge_weight):
+            weight=edge_weight
+        else:
+            edge_weight=np.asarray(edge_weight,np.float64)
+            if edge_weight.ndim==2:
+                weight=lambda j,direc: edge_weight[j,int(direc<0)]
+            else:
+                weight=lambda j,direc: edge_weight[j]
+
+        if edge_selector is None:
+            select=lambda j,direc: True
+        elif callable(edge_selector):
+            select=edge_selector
+        else:
+            edge_selector=np.asarray(edge_selector,np.bool8)
+            select=lambda j,direc: edge_selector[j]
 
         if traverse=='cells':
             e2c=self.edge_to_cells()
-            # safer than using circumcenters
-            x=self.cells_centroid()
-        elif traverse=='nodes':
-            x=self.nodes['x']
-            
-        while 1:
-            # find the queue-member with the lowest cost:
-            if len(queue)==0:
-                break
-            best = queue.smallest()
-            best_cost,pred = queue[best]
-            del queue[best]
-
-            done[best] = [best_cost,pred]
 
+        dests=set(dests)
+        queue=[ (0.0,n,-1,-1) for n in sources ] # cost, node, predecessor, edge
+        heapq.heapify(queue)
+        costs={}
+        preds={}
+        found=0
+        while queue and found<n_wanted:
+            best_cost,best,pred,pred_j = heapq.heappop(queue)
+            if best in costs:
+                continue
+            costs[best]=best_cost
+            preds[best]=(pred,pred_j)
             if best in dests:
-                # use the key 'n', but if traverse=='cells', that is actually
-                # a cell index
-                results.append( dict(n=best,cost=best_cost) )
-                if len(results)>=max_return:
-                    break # done!
+                found+=1
 
             # figure out its neighbors
             nbrs=[] # tuples of nbr node, edge, +1/-1 direction
-
             if traverse=='nodes':
                 for j in self.node_to_edges(n=best):
                     ne1,ne2=self.edges['nodes'][j]
-                    if ne1==best and edge_selector(j,1):
+                    if ne1==best:
                         nbrs.append( (ne2,j,1) )
-                    elif edge_selector(j,-1):
+                    else:
                         nbrs.append( (ne1,j,-1) )
-            elif traverse=='cells':
+            else:
                 for j in self.cell_to_edges(best):
                     c1,c2=e2c[j]
-                    if c1==best and c2>=0 and edge_selector(j,1):
+                    if c1==best and c2>=0:
                         nbrs.append( (c2,j,1) )
-                    elif c2==best and c1>=0 and edge_selector(j,-1):
+                    elif c2==best and c1>=0:
                         nbrs.append( (c1,j,-1) )
-                        
+
             for nbr,j,direc in nbrs:
-                if nbr in done:
+                if nbr in costs or not select(j,direc):
                     continue
-
-                if edge_weight is None:
-                    dist = mag( x[nbr] - x[best] )
+                if weight is None:
+                    dist=mag( x[nbr] - x[best] )
                 else:
-                    dist = edge_weight(j,direc)
+                    dist=weight(j,direc)
                 if not np.isfinite(dist):
                     continue # second way of ignoring edges
-
-                new_cost = best_cost + dist
-
-                if nbr not in queue:
-                    queue[nbr] = [np.inf,None]
-
-                if queue[nbr][0] > new_cost:
-                    queue[nbr] = [new_cost,best]
-
-        # update/replace the return values in results based on return_type
-        return_values=[] #  (node/cell, <return value>)
-        for i,result in enumerate(results):
-            if return_type in ['nodes','edges','sides','cells']:
-                # reconstruct the path:
-                path = [result['n']] # will be a cell if traverse=='cells'
-                while 1:
-                    pred=done[path[-1]][1]
-                    if pred is None:
-                        break
-                    else:
-                        path.append(pred)
-                path=np.array(path[::-1]) # reverse it so it goes from n1 to n2
-                result['path']=path
-
-            if return_type in ['nodes','cells']:
-                return_value=path
-            elif return_type in ('edges','sides'):
-                if traverse=='nodes':
-                    return_value=np.array( [self.nodes_to_edge(path[i],path[i+1])
-                                            for i in range(len(path)-1)] )
-                elif traverse=='cells':
-                    return_value=np.array( [self.cells_to_edge(path[i],path[i+1])
-                                            for i in range(len(path)-1)] )
-                else:
-                    raise Exception("Bad value for traverse: %s"%traverse)
-            elif return_type=='cost':
-                return_value=done[result['n']][0]
-            return_values.append( (result['n'],return_value) )
-        if return_scalar:
-            return return_values[0][1]
-        else:
-            return return_values
+                heapq.heappush(queue, (best_cost+dist,nbr,best,j) )
+        return costs,preds
 
     def remove_disconnected_components(self,renumber=True):
         """
@@ -5588,18 +6091,14 @@ class UnstructuredGrid(Listenable,undoer.OpHistory):
             # anecdotal, but remove_disconnected calls boundary_linestrings,
             # which in turn needs cells.
             raise Exception("Creating the dual without cells is not compatible with removing disconnected")
-        gd=UnstructuredGrid()
-
         if center=='centroid':
             cc=self.cells_centroid()
         else:
             cc=self.cells_center()
 
-        gd.add_node_field('dual_cell',np.zeros(0,'i4'))
-        gd.add_edge_field('dual_edge',np.zeros(0,'i4'))
+        e2c=self.edge_to_cells()
 
         if remove_1d:
-            e2c=self.edge_to_cells()
             boundary_edge_mask=e2c.min(axis=1)<0
             boundary_nodes=np.unique(self.edges['nodes'][boundary_edge_mask])
             boundary_node_mask=np.zeros(self.Nnodes(),np.bool8)
@@ -5607,60 +6106,91 @@ class UnstructuredGrid(Listenable,undoer.OpHistory):
             # now if a cells nodes are all True in boundary_node_mask,
             # it will be skipped
 
-        cell_to_dual_node={}
-        for c in self.valid_cell_iter():
-            # dual_cell is redundant if remove_1d is False.
-            if remove_1d:
-                nodes=self.cell_to_nodes(c)
-                if np.all(boundary_node_mask[nodes]):
-                    continue
-            node_idx=gd.add_node(x=cc[c],dual_cell=c)
-            cell_to_dual_node[c]=node_idx
-
-        e2c=self.edge_to_cells()
-
-        for j in self.valid_edge_iter():
-            if e2c[j].min() < 0:
-                continue # boundary
-            if remove_1d and np.all(boundary_node_mask[self.edges['nodes'][j]]):
-                continue # would create a 1D link
-
-            dn1=cell_to_dual_node[e2c[j,0]]
-            dn2=cell_to_dual_node[e2c[j,1]]
-
-            dj_exist=gd.nodes_to_edge([dn1,dn2]) 
-            if dj_exist is None:
-                dj=gd.add_edge(nodes=[dn1,dn2],dual_edge=j)
+        # dual nodes, one per cell
+        dual_cells=np.nonzero(~self.cells['deleted'])[0]
+        if remove_1d:
+            cell_nodes=self.cells['nodes'][dual_cells]
+            all_boundary=np.all( boundary_node_mask[cell_nodes] | (cell_nodes<0), axis=1)
+            dual_cells=dual_cells[~all_boundary]
+        cell_to_dual_node=np.zeros(self.Ncells(),np.int32)-1
+        cell_to_dual_node[dual_cells]=np.arange(len(dual_cells))
+
+        # dual edges, one per internal edge
+        js=np.nonzero( (~self.edges['deleted']) & (e2c.min(axis=1)>=0) )[0]
+        if remove_1d:
+            # would create a 1D link
+            js=js[ ~np.all(boundary_node_mask[self.edges['nodes'][js]],axis=1) ]
+        dual_edges=cell_to_dual_node[e2c[js]]
+        # two cells sharing more than one edge only get one dual edge
+        _,first=np.unique(np.sort(dual_edges,axis=1),axis=0,return_index=True)
+        first=np.sort(first)
+        js=js[first]
+        dual_edges=dual_edges[first]
 
         if create_cells:
             # to create cells in the dual -- these map to interior nodes
             # of self.
-            max_degree=10 # could calculate this.
-            e2c=self.edge_to_cells()
-            gd.modify_max_sides(max_degree)
-
-            gd.add_cell_field('source_node',np.zeros(gd.Ncells(),np.int32)-1,
-                              on_exists='overwrite')
+            node_ptr,node_cells=self.node_to_cells_csr()
+            node_edge_ptr,node_edges=self.node_to_edges_csr()
+            degree=np.diff(node_ptr)
+            n_of_edge=np.repeat(np.arange(self.Nnodes()),np.diff(node_edge_ptr))
+            boundary=np.zeros(self.Nnodes(),np.bool8)
+            boundary[n_of_edge[ np.any(e2c[node_edges]<0,axis=1) ]]=True
+            source_nodes=np.nonzero( (~self.nodes['deleted']) & (~boundary) & (degree>0) )[0]
+
+            # cells around each source node, sorted by angle of the dual
+            # node relative to the source node
+            n_of_cell=np.repeat(np.arange(self.Nnodes()),degree)
+            sel=np.isin(n_of_cell,source_nodes)
+            n_of_cell=n_of_cell[sel]
+            dual_nodes=cell_to_dual_node[node_cells[sel]]
+            diffs=cc[node_cells[sel]] - self.nodes['x'][n_of_cell]
+            angles=np.arctan2(diffs[:,1],diffs[:,0])
+            order=np.lexsort( (angles,n_of_cell) )
+            n_of_cell=n_of_cell[order]
+            dual_nodes=dual_nodes[order]
+
+            counts=degree[source_nodes]
+            max_degree=max(10,counts.max() if len(counts) else 0)
+            col=np.arange(len(n_of_cell)) - np.repeat(np.cumsum(counts)-counts,counts)
+            row=np.repeat(np.arange(len(source_nodes)),counts)
+            dual_cell_nodes=np.zeros( (len(source_nodes),max_degree),np.int32)-1
+            dual_cell_nodes[row,col]=dual_nodes
+            gd=UnstructuredGrid(max_sides=max_degree)
+        else:
+            gd=UnstructuredGrid()
+            dual_cell_nodes=np.zeros((0,gd.max_sides),np.int32)
 
-            for n in self.valid_node_iter():
-                if n%1000==0:
-                    print("%d/%d dual cells"%(n,self.Nnodes())) # not exact
-                js=self.node_to_edges(n)
-                if np.any(e2c[js,:]<0): # boundary
-                    continue
-                tri_cells=self.node_to_cells(n) # i.e. same as dual nodes
-                dual_nodes=np.array([cell_to_dual_node[c] for c in tri_cells])
+        gd.from_simple_data(points=cc[dual_cells],edges=dual_edges,cells=dual_cell_nodes)
+        # same defaults as add_edge
+        gd.edges['mark']=0
+        gd.edges['cells']=-1
+        gd.add_node_field('dual_cell',dual_cells.astype('i4'))
+        gd.add_edge_field('dual_edge',js.astype('i4'))
 
-                # but those have to be sorted.  sort the tri cell centers, same
-                # as dual nodes, relative to tri node
-                diffs=gd.nodes['x'][dual_nodes] - self.nodes['x'][n]
-                angles=np.arctan2(diffs[:,1],diffs[:,0])
-                dual_nodes=dual_nodes[np.argsort(angles)]
-                gd.add_cell(nodes=dual_nodes,source_node=n)
+        if create_cells:
+            gd.add_cell_field('source_node',source_nodes.astype(np.int32),
+                              on_exists='overwrite')
+            # connect cells and edges
+            cn=gd.cells['nodes']
+            side=np.arange(max_degree)[None,:]
+            valid=side<counts[:,None]
+            nxt=np.where(side+1<counts[:,None], np.roll(cn,-1,axis=1), cn[:,:1])
+            a=cn[valid]
+            b=nxt[valid]
+            c=np.broadcast_to(np.arange(len(cn))[:,None],cn.shape)[valid]
+            j=gd.nodes_to_edge_many(a,b)
+            if np.any(j<0):
+                raise GridException("Dual cell edges are missing")
+            gd.cells['edges'][:]=-1
+            gd.cells['edges'][valid]=j
+            left=gd.edges['nodes'][j,0]==a
+            gd.edges['cells'][j[left],0]=c[left]
+            gd.edges['cells'][j[~left],1]=c[~left]
 
             # flip edges to keep invariant that external cells are always
             # second.
-            e2c=gd.edge_to_cells()
+            e2c=gd.edges['cells']
             to_flip=e2c[:,0]<0
             for fld in ['nodes','cells']:
                 gd.edges[fld][to_flip] = gd.edges[fld][to_flip][:,::-1]
@@ -5690,21 +6220,8 @@ class UnstructuredGrid(Listenable,undoer.OpHistory):
           masked out, other cells labeled with the component to which they belong.
 
         """
-        # further constrain to edges which are not on the boundary
-        self.edge_to_cells()
-        edge_mask=edge_mask & np.all( self.edges['cells']>=0,axis=1)
-
-        cell_pairs = self.edges['cells'][edge_mask]
-
-        # use scipy graph algorithms to find the connections
-        from scipy import sparse
-        from scipy.sparse import csgraph
-
-        graph=sparse.csr_matrix( (np.ones(len(cell_pairs)),
-                                  (cell_pairs[:,0],cell_pairs[:,1])),
-                                 shape=(self.Ncells(),self.Ncells()) )
-
-        n_comps,labels=csgraph.connected_components(graph,directed=False)
+        # boundary edges are already excluded from the cell graph
+        n_comps,labels=self.graph_connected_components('cells',edge_selector=edge_mask)
 
         if cell_mask is None:
             cell_mask=np.ones(self.Ncells(), np.bool8)
@@ -5945,6 +6462,131 @@ class UnstructuredGrid(Listenable,undoer.OpHistory):
         with open(fn,'wb') as fp:
             pickle.dump(self,fp,-1)
 
+    # Native format: a versioned directory of .npy files, one per structured
+    # array, which can be memory mapped on load.
+    native_format_name='stompy-native-grid'
+    native_format_version=1
+
+    def node_to_edges_csr(self):
+        """
+        Node to edge adjacency as CSR arrays ptr,idx: edges of node n
+        are idx[ptr[n]:ptr[n+1]].  Same ordering as build_node_to_edges().
+        """
+        valid=np.nonzero(~self.edges['deleted'])[0]
+        nodes=self.edges['nodes'][valid].ravel()
+        js=np.repeat(valid,2)
+        return adjacency_to_csr(nodes,js,self.Nnodes())
+
+    def node_to_cells_csr(self):
+        """
+        Node to cell adjacency as CSR arrays ptr,idx: cells of node n
+        are idx[ptr[n]:ptr[n+1]].  Same ordering as build_node_to_cells().
+        """
+        valid=np.nonzero(~self.cells['deleted'])[0]
+        cell_nodes=self.cells['nodes'][valid]
+        sel=cell_nodes>=0
+        cs=np.repeat(valid,self.max_sides).reshape(cell_nodes.shape)
+        return adjacency_to_csr(cell_nodes[sel],cs[sel],self.Nnodes())
+
+    def write_native(self,path,overwrite=False,precompute=True):
+        """
+        Write the grid in the native format: a directory (or, if path ends
+        in .zip, an uncompressed zip) holding nodes, edges, cells and their
+        default values as .npy files plus a small json header.  All fields,
+        including extra fields, are stored exactly.
+
+        precompute: also store cell centers and the node to edge/cell
+         adjacency so that they need not be recomputed on load.
+
+        Unlike write_pickle, listeners, undo history and spatial indices are
+        not saved.
+        """
+        if os.path.exists(path):
+            if not overwrite:
+                raise Exception("File %s exists, and overwrite is False"%path)
+            if os.path.isdir(path):
+                if not os.path.exists(os.path.join(path,'header.json')):
+                    raise Exception("%s exists but is not a native grid, will not overwrite"%path)
+                shutil.rmtree(path)
+            else:
+                os.unlink(path)
+
+        if precompute:
+            self.cells_center()
+
+        arrays=dict(nodes=self.nodes,edges=self.edges,cells=self.cells,
+                    node_defaults=self.node_defaults,
+                    edge_defaults=self.edge_defaults,
+                    cell_defaults=self.cell_defaults)
+        if precompute:
+            arrays['node_edges_ptr'],arrays['node_edges_idx']=self.node_to_edges_csr()
+            arrays['node_cells_ptr'],arrays['node_cells_idx']=self.node_to_cells_csr()
+
+        header=dict(format=self.native_format_name,
+                    version=self.native_format_version,
+                    max_sides=int(self.max_sides),
+                    arrays=sorted(arrays.keys()),
+                    has_object=[k for k in arrays if arrays[k].dtype.hasobject])
+
+        if path.endswith('.zip'):
+            arrays['header']=np.array(json.dumps(header))
+            with open(path,'wb') as fp:
+                np.savez(fp,**arrays)
+        else:
+            os.makedirs(path)
+            for k in arrays:
+                np.save(os.path.join(path,k+'.npy'),np.asarray(arrays[k]))
+            # header written last, so a partial write is not a valid grid
+            with open(os.path.join(path,'header.json'),'wt') as fp:
+                json.dump(header,fp)
+
+    @staticmethod
+    def read_native(path,mmap_mode='c'):
+        """
+        Load a grid written by write_native().
+
+        mmap_mode: for the directory format, passed to np.load.  The default
+         'c' maps the arrays copy-on-write, so opening even a very large grid
+         is fast, edits in place only touch the pages modified, and the
+         file on disk is never changed.  Operations which grow the arrays
+         promote them to regular in-memory arrays.  None reads everything
+         into memory.  The zip format is always read into memory.
+        """
+        if os.path.isdir(path):
+            with open(os.path.join(path,'header.json'),'rt') as fp:
+                header=json.load(fp)
+            def load(k):
+                if k in header['has_object']:
+                    return np.load(os.path.join(path,k+'.npy'),allow_pickle=True)
+                return np.load(os.path.join(path,k+'.npy'),mmap_mode=mmap_mode)
+        else:
+            npz=np.load(path,allow_pickle=True)
+            header=json.loads(str(npz['header']))
+            load=lambda k: npz[k]
+
+        if header.get('format')!=UnstructuredGrid.native_format_name:
+            raise GridException("%s is not a native grid"%path)
+        if header['version']>UnstructuredGrid.native_format_version:
+            raise GridException("%s is native grid version %s, newer than supported (%s)"%(
+                path,header['version'],UnstructuredGrid.native_format_version))
+
+        g=UnstructuredGrid(max_sides=header['max_sides'])
+        g.nodes=load('nodes')
+        g.edges=load('edges')
+        g.cells=load('cells')
+        # dtype lists are used when extending fields, so keep them in sync
+        for elt in ['node','edge','cell']:
+            A=getattr(g,elt+'s')
+            setattr(g,elt+'_dtype',[(name,A.dtype.fields[name][0])
+                                    for name in A.dtype.names])
+            setattr(g,elt+'_defaults',np.array(load(elt+'_defaults')))
+        g.refresh_metadata()
+        if 'node_edges_ptr' in header['arrays']:
+            g._node_to_edges=CSRAdjacency(load('node_edges_ptr'),load('node_edges_idx'))
+            g._node_to_cells=CSRAdjacency(load('node_cells_ptr'),load('node_cells_idx'))
+        g.filename=path
+        return g
+
     def __getstate__(self):
         # Mostly just clear out elements which can be easily recreated,
         # or objects which don't pickle well.
@@ -5954,6 +6596,7 @@ class UnstructuredGrid(Listenable,undoer.OpHistory):
         d['_node_to_cells']=None
         d['_node_index'] = None
         d['_cell_center_index'] = None
+        d['_graph_cache'] = None
         d['log']=None
 
         return d
@@ -6083,35 +6726,27 @@ class UnstructuredGrid(Listenable,undoer.OpHistory):
             Also copies are shallow - array data will be copied, but if there are
             objects in the arrays, these will not be copied, just referenced.
             """
-            def copy_attributes(j_orig,j_new):
-                for field,type_ in g_new.edge_dtype:
-                    if field not in ['nodes','cells'] and not field.startswith('_'):
-                        g_new.edges[field][j_new] = g_orig.edges[field][j_orig]
-
-            # loop through setting edge marks
-            #  edges between a midpoint and one of the
+            # edges between a midpoint and one of the
             #  endpoints
-            for j in range(g_new.Nedges()):
-                a,b = g_new.edges['nodes'][j]
-                if a>b:
-                    a,b = b,a
-                # only care about edges where one node is original,
-                # the other is a midpoint.
-                # there are no edges where both are original, and
-                # edges with both as midpoints or with one as a center
-                # always internal.
-                if a < g_orig.Nnodes() and b>=g_orig.Nnodes() and b<g_orig.Nnodes()+g_orig.Nedges():
-                    j_orig = b - g_orig.Nnodes()
-                    copy_attributes(j_orig,j)
+            a=g_new.edges['nodes'].min(axis=1)
+            b=g_new.edges['nodes'].max(axis=1)
+            # only care about edges where one node is original,
+            # the other is a midpoint.
+            # there are no edges where both are original, and
+            # edges with both as midpoints or with one as a center
+            # always internal.
+            j_new=np.nonzero( (a < g_orig.Nnodes()) & (b>=g_orig.Nnodes())
+                              & (b<g_orig.Nnodes()+g_orig.Nedges()) )[0]
+            j_orig=b[j_new] - g_orig.Nnodes()
+            for field,type_ in g_new.edge_dtype:
+                if field not in ['nodes','cells'] and not field.startswith('_'):
+                    g_new.edges[field][j_new] = g_orig.edges[field][j_orig]
 
         def copy_cell_attributes_to_refined(g_orig,g_new):
-            def copy_attributes(c_orig,c_new):
-                for field,type_ in g_new.cell_dtype:
-                    if field not in ['nodes','edges'] and not field.startswith('_'):
-                        g_new.cells[field][c_new] = g_orig.cells[field][c_orig]
-
-            for c_new in range(g_new.Ncells()):
-                copy_attributes(c_new//4,c_new)
+            c_orig=np.arange(g_new.Ncells())//4
+            for field,type_ in g_new.cell_dtype:
+                if field not in ['nodes','edges'] and not field.startswith('_'):
+                    g_new.cells[field][:] = g_orig.cells[field][c_orig]
 
         # Refining:
         # 1. add the new points, first the edge-midpoint, second the cell centers
@@ -6123,26 +6758,30 @@ class UnstructuredGrid(Listenable,undoer.OpHistory):
         # 2. build up cells, just using the nodes
         new_cells = np.zeros( (4*self.Ncells(),self.max_sides), np.int32) - 1
 
-        for c in range(self.Ncells()):
-            cn = self.cell_to_nodes(c)
-
-            midpoints = []
-            for i,(a,b) in enumerate(circular_pairs(cn)):
-                j = self.nodes_to_edge(a,b)
-                mab = self.Nnodes() + j
-                midpoints.append(mab)
-
-            if len(cn)==3: # tri
-                for i in range(3):
-                    new_cells[4*c+i,:3] = [ midpoints[(i-1)%3], cn[i], midpoints[i]]
-                # plus the one in the center:
-                new_cells[4*c+3,:3] = midpoints
-            elif len(cn)==4: # quad
-                n_ctr = self.Nnodes() + self.Nedges() + c
-                for i in range(4):
-                    new_cells[4*c+i,:4] =  [ midpoints[(i-1)%4], cn[i], midpoints[i], n_ctr]
-            else:
-                raise Exception("global_refine() can only handle triangles and quads")
+        cell_nodes=self.cells['nodes']
+        nsides=(cell_nodes>=0).sum(axis=1)
+        if np.any( (nsides!=3) & (nsides!=4) ):
+            raise Exception("global_refine() can only handle triangles and quads")
+
+        for n_side in [3,4]:
+            if n_side>self.max_sides:
+                continue
+            cs=np.nonzero(nsides==n_side)[0]
+            cn=cell_nodes[cs,:n_side]
+            js=self.nodes_to_edge_many(cn,np.roll(cn,-1,axis=1))
+            if np.any(js<0):
+                raise GridException("global_refine(): cell without a matching edge")
+            midpoints=self.Nnodes() + js
+
+            for i in range(n_side):
+                rows=4*cs+i
+                new_cells[rows,0]=midpoints[:,(i-1)%n_side]
+                new_cells[rows,1]=cn[:,i]
+                new_cells[rows,2]=midpoints[:,i]
+                if n_side==4: # quad
+                    new_cells[rows,3]=self.Nnodes() + self.Nedges() + cs
+            if n_side==3: # tri, plus the one in the center:
+                new_cells[4*cs+3,:3] = midpoints
 
         # 3. generic construction of edges from cells
         # try to use the same subclass as the original grid, so we'll have the same
@@ -6215,19 +6854,16 @@ class UnstructuredGrid(Listenable,undoer.OpHistory):
 
         self.update_cell_edges()
 
-        cell_geoms = [None]*self.Ncells()
-
         cell_data['depth_mean'] = self.cell_depths()
         cell_data['area']=self.cells_area()
         cell_data['volume']=cell_data['depth_mean']*cell_data['area']
         cell_data['poly_id1'] = 1+np.arange(self.Ncells())
 
-        for poly_id in range(self.Ncells()):
-            if poly_id % 500 == 0:
-                print( "%0.2g%%"%(100.*poly_id/self.Ncells()) )
-
-            # older code put this together manually.
-            cell_geoms[poly_id]=self.cell_polygon(poly_id)
+        # build all of the polygons at once from the node coordinates
+        cell_nodes=self.cells['nodes']
+        valid=cell_nodes>=0
+        ptr=np.r_[0,np.cumsum(valid.sum(axis=1))]
+        cell_geoms=wkb2shp.geoms_from_coords('Polygon',self.nodes['x'][cell_nodes[valid]],ptr)
 
         print( cell_data.dtype )
         result=wkb2shp.wkb2shp(shpname,input_wkbs=cell_geoms,fields=cell_data,
@@ -6288,21 +6924,14 @@ class UnstructuredGrid(Listenable,undoer.OpHistory):
         vertices = self.nodes['x']
 
         edge_data = np.zeros(len(edges), dtype=base_dtype)
-        edge_geoms = [None]*len(edges)
-
-        for edge_id in range(edges.shape[0]):
-            if edge_id % 5000 == 0:
-                print("%0.3g%%"%(100.*edge_id/edges.shape[0]))
+        edge_geoms = wkb2shp.geoms_from_coords('LineString',vertices[edges[:,:2]])
 
-            nodes = vertices[edges[edge_id,:2]]
-            g = geometry.LineString(nodes)
-            edge_geoms[edge_id] = g
-            edge_data[edge_id]['length'] = g.length
-            edge_data[edge_id]['edge_id1'] = edge_id + 1
-            edge_data[edge_id]['depth_mean'] = side_depths_mean[edge_id]
+        edge_data['length'] = mag( vertices[edges[:,1]] - vertices[edges[:,0]] )
+        edge_data['edge_id1'] = 1+np.arange(len(edges))
+        edge_data['depth_mean'] = side_depths_mean
 
-            for fname,ftype,ffunc in extra_fields:
-                edge_data[edge_id][fname] = ffunc(edge_id)
+        for fname,ftype,ffunc in extra_fields:
+            edge_data[fname] = [ffunc(edge_id) for edge_id in range(len(edges))]
 
         wkb2shp.wkb2shp(shpname,input_wkbs=edge_geoms,fields=edge_data,
                         overwrite=overwrite)
@@ -6325,8 +6954,7 @@ class UnstructuredGrid(Listenable,undoer.OpHistory):
         # zero-based index of node (why does write_edge_shp create 1-based ids?)
         base_dtype = [('node_id',np.int32)]
 
-        node_geoms=[geometry.Point( self.nodes['x'][i] )
-                    for i in self.valid_node_iter() ]
+        node_geoms=wkb2shp.geoms_from_coords('Point',self.nodes['x'][~self.nodes['deleted']])
 
         node_data=self.nodes[~self.nodes['deleted']].copy()
 
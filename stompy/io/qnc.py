@@ -588,57 +588,135 @@ def empty(fn=None,overwrite=False,**kwargs):
                 raise QncException('File %s already exists'%fn)
         return QDataset(fn,'w',**kwargs)
 
-def concatenate(ncs,cat_dim,skip=[],new_dim=None):
+# upper limit on the number of elements read at once when streaming
+# variables between datasets
+chunk_elements=2**24
+
+def _axis_blocks(shape,axis,max_elements=None):
+    """
+    Generate (start,stop) ranges along axis of an array with the given shape,
+    such that each block has no more than max_elements elements (but at least
+    one index along axis).
+    """
+    max_elements=max_elements or chunk_elements
+    n=shape[axis]
+    row_size=int(np.prod(shape))//max(1,n)
+    step=max(1,max_elements//max(1,row_size))
+    for start in range(0,n,step):
+        yield start,min(n,start+step)
+
+def _axis_slice(ndim,axis,start,stop):
+    slcs=[slice(None)]*ndim
+    slcs[axis]=slice(start,stop)
+    return tuple(slcs)
+
+def _create_like(result,varname,src,dims,shape):
+    """
+    Create variable varname in result, matching dtype and attributes of
+    the netCDF variable src, but with the given dimensions and shape.
+    Attributes are set before any data is written, so that
+    scaling/masking round-trip.
+    """
+    for dim_name,length in zip(dims,shape):
+        result.add_dimension(dim_name,length)
+    kwargs={}
+    if '_FillValue' in src.ncattrs():
+        kwargs['fill_value']=src.getncattr('_FillValue')
+    newvar=result.createVariable(varname,src.dtype,dims,**kwargs)
+    for attr in src.ncattrs():
+        if attr != '_FillValue':
+            newvar.setncattr(attr,src.getncattr(attr))
+    return newvar
+
+def _copy_var(src,dst,chunk_size=None,dst_prefix=()):
+    """
+    Copy all of netCDF variable src into dst[dst_prefix], in blocks along
+    the first dimension.
+    """
+    if len(src.shape)==0:
+        dst[dst_prefix or ()]=src[...]
+        return
+    for start,stop in _axis_blocks(src.shape,0,chunk_size):
+        dst[dst_prefix + (slice(start,stop),)]=src[start:stop]
+
+def concatenate(ncs,cat_dim,skip=[],new_dim=None,fn=None,chunk_size=None,**create_args):
     """ ncs is an ordered list of QDataset objects
     If a single QDataset is given, it will be copied at the metadata
     level
     new_dim: if given, then fields not having cat_dim, but differing
      between datasets, will be concatenated along new_dim.
 
+    fn: if given, write the result to this netCDF file, otherwise the result
+     is an in-memory dataset.
+    chunk_size: maximum number of elements to read at once, defaults to
+     chunk_elements.  Variables are allocated up front, and data is streamed
+     from the inputs in blocks, so the inputs need not fit in memory.
+
     for convenience, elements of gdms which are None are silently dropped
     """
-    ncs=filter(None,ncs)
+    ncs=[nc for nc in ncs if nc is not None]
     N=len(ncs)
     if N==1:
-        return ncs[0].copy()
+        return ncs[0].copy(fn=fn,**create_args)
     if N==0:
-        return empty()
-    
-    result=empty()
-    
+        return empty(fn,**create_args)
+
+    result=empty(fn,**create_args)
+
     for varname in ncs[0].variables.keys():
         if varname in skip:
             continue
 
-        dim_names=ncs[0].variables[varname].dimensions
-    
+        src0=ncs[0].variables[varname]
+        dim_names=src0.dimensions
+
         if cat_dim in dim_names:
             cat_idx=dim_names.index(cat_dim)
-        else:
-            cat_idx=None
-            
-        parts=[nc.variables[varname][:] for nc in ncs]
-        if cat_idx is not None:
-            result[varname][dim_names]=np.concatenate(parts,axis=cat_idx)
+            shape=list(src0.shape)
+            shape[cat_idx]=sum( [nc.variables[varname].shape[cat_idx] for nc in ncs] )
+            newvar=_create_like(result,varname,src0,dim_names,shape)
+
+            offset=0
+            for nc in ncs:
+                src=nc.variables[varname]
+                for start,stop in _axis_blocks(src.shape,cat_idx,chunk_size):
+                    src_slc=_axis_slice(src.ndim,cat_idx,start,stop)
+                    dst_slc=_axis_slice(src.ndim,cat_idx,offset+start,offset+stop)
+                    newvar[dst_slc]=src[src_slc]
+                offset+=src.shape[cat_idx]
         else:
             constant=True
             for n in range(1,N):
-                if np.any(parts[0]!=parts[n]):
+                srcn=ncs[n].variables[varname]
+                if srcn.shape!=src0.shape:
                     constant=False
+                elif len(src0.shape)==0:
+                    constant=not np.any(src0[...]!=srcn[...])
+                else:
+                    for start,stop in _axis_blocks(src0.shape,0,chunk_size):
+                        if np.any(src0[start:stop]!=srcn[start:stop]):
+                            constant=False
+                            break
+                if not constant:
                     break
 
             if not constant:
                 if new_dim is None:
                     raise QncException("Non-concatenated variable %s "\
                                     "does not match %s != %s"%(varname,
-                                                               parts[0],
-                                                               parts[n]))
+                                                               src0[...],
+                                                               ncs[n].variables[varname][...]))
                 else:
                     print( "Variable values of %s will go into new dimension %s"%(varname,
                                                                                   new_dim) )
-                    result[varname][ [new_dim]+list(dim_names) ]=np.array(parts)
+                    newvar=_create_like(result,varname,src0,
+                                        (new_dim,)+tuple(dim_names),
+                                        [N]+list(src0.shape))
+                    for n,nc in enumerate(ncs):
+                        _copy_var(nc.variables[varname],newvar,chunk_size,dst_prefix=(n,))
             else:
-                result[varname][dim_names]=parts[0]
+                newvar=_create_like(result,varname,src0,dim_names,src0.shape)
+                _copy_var(src0,newvar,chunk_size)
 
     # attrs are copied from first element
     ncs[0].copy_ncattrs_to(result)
@@ -648,43 +726,69 @@ def concatenate(ncs,cat_dim,skip=[],new_dim=None):
 
 # Functional manipulations of QDataset:
 
-def downsample(ds,dim,stride,lowpass=True):
+def downsample(ds,dim,stride,lowpass=True,fn=None,chunk_size=None,**create_args):
     """ Lowpass variables along the given dimension, and resample
     at the given stride.
     lowpass=False   => decimate, no lowpass
     lowpass=<float> => lowpass window size is lowpass*stride
+
+    fn: if given, write the result to this netCDF file.
+    chunk_size: maximum number of elements to read at once (plus the
+     overlap needed by the filter), defaults to chunk_elements.
+
+    Variables are filtered blockwise along dim, with each block extended
+    by the filter length on either side, so the result matches filtering
+    the whole variable at once.  Masked values of floating point variables
+    are treated as nan.
     """
+    from .. import filters
+
     lowpass=float(lowpass)
     winsize=int(lowpass*stride)
+    if lowpass:
+        winsize=max(1,winsize)
 
-    new=empty()
+    new=empty(fn,**create_args)
 
     for var_name in ds.variables:
         ncvar=ds.variables[var_name]
-        val=ncvar[:]
-        if dim in ncvar.dimensions:
-            dim_idx=ncvar.dimensions.index(dim)
-            # should be possible to use the faster scipy way,
-            # but it is having issues with setting nan's in the
-            # output - maybe something is getting truncated or 
-            # reshaped??
-            if True: # lowpass!=1: # older, slower way:
-                if lowpass:
-                    import lp_filter
-                    val_lp=lp_filter.lowpass_fir(val,winsize,axis=dim_idx,nan_weight_threshold=0.5)
-                else:
-                    val_lp=val
-                slcs=[slice(None)]*len(ncvar.dimensions)
-                slcs[dim_idx]=slice(None,None,stride)
-                val=val_lp[slcs]
-            else: # scipy.signal way:
-                kws=dict(q=stride,ftype='fir',axis=dim_idx)
-                val_valid=decimate(np.isfinite(val).astype('f4'),**kws)
-                val=decimate(val,**kws)
-                val[val_valid<0.1] = np.nan
-                new[var_name+'_msk'][ncvar.dimensions]=val_valid # DBG
-
-        new[var_name][ncvar.dimensions] = val
+        if dim not in ncvar.dimensions:
+            newvar=_create_like(new,var_name,ncvar,ncvar.dimensions,ncvar.shape)
+            _copy_var(ncvar,newvar,chunk_size)
+            continue
+
+        dim_idx=ncvar.dimensions.index(dim)
+        n=ncvar.shape[dim_idx]
+        shape=list(ncvar.shape)
+        shape[dim_idx]=len(range(0,n,stride))
+
+        if lowpass:
+            # the filtered output is floating point
+            for dim_name,length in zip(ncvar.dimensions,shape):
+                new.add_dimension(dim_name,length)
+            newvar=new.createVariable(var_name,np.float64,ncvar.dimensions)
+            halo=winsize
+        else:
+            newvar=_create_like(new,var_name,ncvar,ncvar.dimensions,shape)
+            halo=0
+
+        # blocks along dim aligned to the stride
+        for start,stop in _axis_blocks(ncvar.shape,dim_idx,chunk_size):
+            start=stride*( (start+stride-1)//stride )
+            stop=stride*( (stop+stride-1)//stride )
+            if start>=min(stop,n):
+                continue
+            read_start=max(0,start-halo)
+            read_stop=min(n,stop+halo)
+            val=ncvar[_axis_slice(ncvar.ndim,dim_idx,read_start,read_stop)]
+            if lowpass:
+                if isinstance(val,np.ma.MaskedArray):
+                    val=val.astype(np.float64).filled(np.nan)
+                val=filters.lowpass_fir(val,winsize,axis=dim_idx,nan_weight_threshold=0.5)
+            slcs=[slice(None)]*ncvar.ndim
+            slcs[dim_idx]=slice(start-read_start,min(stop,n)-read_start,stride)
+            val=val[tuple(slcs)]
+            newvar[_axis_slice(ncvar.ndim,dim_idx,start//stride,start//stride+val.shape[dim_idx])]=val
 
     ds.copy_ncattrs_to(new)
     return new
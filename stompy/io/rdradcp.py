@@ -1494,6 +1494,360 @@ def nmean(x,dim=None):
     return y
 
 
+#--------------------------------------
+# Vectorized reader
+#
+# rdradcp() above parses one ensemble at a time.  For long moored deployments
+# that is slow, so the functions below scan the file for ensemble offsets in
+# one pass, and decode the fixed-layout blocks with numpy structured dtypes
+# directly from a memory map.  Only ensembles with self-contained, fixed
+# layout blocks are handled (i.e. instrument recorded data).  WINRIVER and
+# VMDAS navigation blocks should go through rdradcp().
+
+def scan_ensembles(name,chunk_size=2**26):
+    """
+    Find the byte offsets of all valid ensembles in the raw file name.
+    An ensemble is valid when it starts with 0x7F7F, and the 0x7F7F of the
+    next ensemble follows immediately after its stated length plus checksum,
+    same as checkheader().  The last ensemble is accepted if it fits in the
+    file.  Returns int64 array of offsets.
+    """
+    mm=np.memmap(name,np.uint8,mode='r')
+    N=len(mm)
+    cands=[]
+    for start in range(0,N-1,chunk_size):
+        block=mm[start:min(N,start+chunk_size+1)]
+        hits=np.nonzero( (block[:-1]==0x7F) & (block[1:]==0x7F) )[0]
+        cands.append(start+hits)
+    if len(cands):
+        cands=np.concatenate(cands)
+    else:
+        cands=np.zeros(0,np.int64)
+    # need the length field
+    cands=cands[cands+4<=N]
+    if len(cands)==0:
+        return cands
+    nbyte=mm[cands+2].astype(np.int64) + 256*mm[cands+3].astype(np.int64)
+    nxt=cands+nbyte+2
+    nxt_idx=np.searchsorted(cands,nxt).clip(0,len(cands)-1)
+    linked=(nbyte>0) & (cands[nxt_idx]==nxt)
+    last=(nbyte>0) & (nxt<=N)
+
+    # follow the chain from the first linked candidate, which skips
+    # junk bytes and any 0x7F7F pairs within ensemble data.  When the
+    # chain is broken by junk, resume at the next linked candidate.
+    linked_idx=np.nonzero(linked)[0]
+    linked_l=linked.tolist()
+    last_l=last.tolist()
+    nxt_l=nxt_idx.tolist()
+    chain=[]
+    if len(linked_idx):
+        i=linked_idx[0]
+    elif last.any():
+        i=last.argmax()
+    else:
+        i=None
+    while i is not None:
+        if linked_l[i] or last_l[i]:
+            chain.append(i)
+        if linked_l[i]:
+            i=nxt_l[i]
+            continue
+        end=nxt[i] if last_l[i] else cands[i]+1
+        k=np.searchsorted(cands[linked_idx],end)
+        i=linked_idx[k] if k<len(linked_idx) else None
+    return cands[np.array(chain,np.int64)]
+
+def ensemble_layout_dtype(ids,dat_offsets,nbyte,cfg):
+    """
+    Build a structured dtype for an ensemble with the given block ids
+    (as strings, like rd_buffer) and data offsets, both from the header.
+    nbyte: ensemble length including the header, excluding the checksum.
+    """
+    names=[] ; formats=[] ; offsets=[]
+    def add(name,fmt,off):
+        fmt=np.dtype(fmt)
+        if off+fmt.itemsize<=nbyte:
+            names.append(name) ; formats.append(fmt) ; offsets.append(off)
+    nc=int(cfg.n_cells)
+    ver=cfg.prog_ver
+
+    for id_,o in zip(ids,dat_offsets):
+        o=int(o)
+        if id_=='0080': # Variable leader
+            add('number','<u2',o+2)
+            add('rtc',('u1',7),o+4)
+            add('number_msb','u1',o+11)
+            add('BIT','<u2',o+12)
+            add('ssp','<u2',o+14)
+            add('depth','<u2',o+16)
+            add('heading','<u2',o+18)
+            add('pitch','<i2',o+20)
+            add('roll','<i2',o+22)
+            add('salinity','<i2',o+24)
+            add('temperature','<i2',o+26)
+            add('mpt',('u1',3),o+28)
+            add('heading_std','u1',o+31)
+            add('pitch_std','u1',o+32)
+            add('roll_std','u1',o+33)
+            add('adc',('u1',8),o+34)
+            if cfg.name=='bb-adcp':
+                if ver>=5.55:
+                    add('cent','u1',o+57)
+                    add('rtc2',('u1',7),o+58)
+            elif cfg.name=='wh-adcp':
+                add('error_status_wd','<u4',o+42)
+                if int(ver) in (8,10,16,50,51,52):
+                    if ver>=8.13:
+                        add('pressure','<u4',o+48)
+                        add('pressure_std','<u4',o+52)
+                    if (ver>=10.01 and ver<=10.99) or ver>=16.05:
+                        add('cent','u1',o+57)
+                        add('rtc2',('u1',7),o+58)
+                elif int(ver)==9:
+                    add('pressure','<u4',o+48)
+                    add('pressure_std','<u4',o+52)
+        elif id_=='0100':
+            add('vel',('<i2',(nc,4)),o+2)
+        elif id_=='0200':
+            add('corr',('u1',(nc,4)),o+2)
+        elif id_=='0300':
+            add('intens',('u1',(nc,4)),o+2)
+        elif id_=='0400':
+            add('percent',('u1',(nc,4)),o+2)
+        elif id_=='0500':
+            if cfg.name!='os-adcp':
+                add('status',('u1',(nc,4)),o+2)
+        elif id_=='0600':
+            add('bt_mode','u1',o+9)
+            add('bt_range',('<u2',4),o+16)
+            add('bt_vel',('<i2',4),o+24)
+            add('bt_corr',('u1',4),o+32)
+            add('bt_ampl',('u1',4),o+36)
+            add('bt_perc_good',('u1',4),o+40)
+            if ver>=5.3:
+                add('bt_range_msb',('u1',4),o+77)
+        elif id_[:1]=='2':
+            raise Exception("Navigation block %s not supported by the vectorized reader, use rdradcp()"%id_)
+        # other blocks are not decoded
+    return np.dtype(dict(names=names,formats=formats,offsets=offsets,itemsize=nbyte+2))
+
+def ensemble_records(mm,offsets,dtype,chunk=10000):
+    """
+    Return records of the given structured dtype at the given offsets
+    into the uint8 memmap mm.  When offsets are evenly spaced by the
+    record size, this is a strided view on the memmap, otherwise the
+    bytes are gathered in chunks.
+    """
+    n=len(offsets)
+    if n==0:
+        return np.zeros(0,dtype)
+    if n==1 or np.all(np.diff(offsets)==dtype.itemsize):
+        return np.ndarray(shape=(n,),dtype=dtype,buffer=mm,offset=int(offsets[0]))
+    recs=np.zeros(n,dtype)
+    span=np.arange(dtype.itemsize)
+    for start in range(0,n,chunk):
+        stop=min(n,start+chunk)
+        raw=mm[offsets[start:stop,None]+span]
+        recs[start:stop]=raw.view(dtype)[:,0]
+    return recs
+
+def read_ensembles(name,offsets,cfg,msg=msg_print):
+    """
+    Decode the ensembles at the given offsets.  Returns a dict of per-ping
+    arrays, with the same names, units and scaling as the fields of the
+    ensemble structure in rd_buffer().
+    """
+    mm=np.memmap(name,np.uint8,mode='r')
+    n=len(offsets)
+    nc=int(cfg.n_cells)
+
+    out=dict(number=np.zeros(n),rtc=np.zeros((n,7)),BIT=np.zeros(n),ssp=np.zeros(n),
+             depth=np.zeros(n),pitch=np.zeros(n),roll=np.zeros(n),heading=np.zeros(n),
+             temperature=np.zeros(n),salinity=np.zeros(n),mpt=np.zeros(n),
+             heading_std=np.zeros(n),pitch_std=np.zeros(n),roll_std=np.zeros(n),
+             adc=np.zeros((n,8)),error_status_wd=np.zeros(n),
+             pressure=np.zeros(n),pressure_std=np.zeros(n),
+             vel=np.zeros((n,nc,4)),intens=np.zeros((n,nc,4)),percent=np.zeros((n,nc,4)),
+             corr=np.zeros((n,nc,4)),status=np.zeros((n,nc,4)),
+             bt_mode=np.zeros(n),bt_range=np.zeros((n,4)),bt_vel=np.zeros((n,4)),
+             bt_corr=np.zeros((n,4)),bt_ampl=np.zeros((n,4)),bt_perc_good=np.zeros((n,4)))
+    if n==0:
+        return out
+
+    # Group ensembles by header: length, number of data types, and the
+    # data type offsets and ids.
+    nbyte=mm[offsets+2].astype(np.int64)+256*mm[offsets+3].astype(np.int64)
+    ndat=mm[offsets+5].astype(np.int64)
+    for key in np.unique(nbyte*256+ndat):
+        sel=np.nonzero(nbyte*256+ndat==key)[0]
+        nd=int(key%256)
+        hdr_raw=mm[offsets[sel,None]+6+np.arange(2*nd)]
+        dat_offsets=hdr_raw.view('<u2').astype(np.int64)
+        id_raw=mm[offsets[sel,None,None]+dat_offsets[:,:,None]+np.arange(2)[None,None,:]]
+        ids=id_raw.reshape([len(sel),-1]).view('<u2')
+        layouts,inverse=np.unique(np.concatenate([dat_offsets,ids],axis=1),
+                                  axis=0,return_inverse=True)
+        inverse=inverse.ravel()
+        for li,layout in enumerate(layouts):
+            sub=sel[inverse==li]
+            ids_s=["%04X"%v for v in layout[nd:]]
+            dtype=ensemble_layout_dtype(ids_s,layout[:nd],int(key//256),cfg)
+            recs=ensemble_records(mm,offsets[sub],dtype)
+            names=dtype.names
+            def fld(nm):
+                return recs[nm].astype(np.float64)
+
+            if 'number' in names:
+                out['number'][sub]=fld('number')
+                if 'number_msb' in names:
+                    out['number'][sub]+=65536*fld('number_msb')
+                rtc=fld('rtc')
+                if 'rtc2' in names:
+                    rtc=fld('rtc2')
+                    rtc[:,0]+=100*fld('cent')
+                out['rtc'][sub]=rtc
+                out['depth'][sub]=fld('depth')*.1
+                out['heading'][sub]=fld('heading')*.01
+                out['pitch'][sub]=fld('pitch')*.01
+                out['roll'][sub]=fld('roll')*.01
+                out['temperature'][sub]=fld('temperature')*.01
+                out['mpt'][sub]=(fld('mpt')*np.array([60,1,.01])).sum(axis=1)
+                out['pitch_std'][sub]=fld('pitch_std')*.1
+                out['roll_std'][sub]=fld('roll_std')*.1
+                for nm in ['BIT','ssp','salinity','heading_std','adc','error_status_wd',
+                           'pressure','pressure_std']:
+                    if nm in names:
+                        out[nm][sub]=fld(nm)
+            if 'vel' in names:
+                vel=fld('vel')
+                vel[ recs['vel']==-32768 ]=np.nan
+                out['vel'][sub]=vel*0.001
+            for nm in ['corr','intens','percent','status',
+                       'bt_mode','bt_vel','bt_corr','bt_ampl','bt_perc_good']:
+                if nm in names:
+                    out[nm][sub]=fld(nm)
+            if 'bt_range' in names:
+                bt_range=fld('bt_range')*.01
+                if 'bt_range_msb' in names:
+                    bt_range+=fld('bt_range_msb')*655.36
+                out['bt_range'][sub]=bt_range
+    return out
+
+def rdradcp_fast(name,
+                 num_av=5,
+                 nens=-1, # or [start,stop] as 1-based, inclusive
+                 baseyear=2000,
+                 log_fp=None):
+    """
+    Vectorized equivalent of rdradcp() for instrument recorded data,
+    returning an Adcp with the same fields.  Ensemble offsets are found
+    in a single scan of the file, and only the requested ensembles are
+    decoded, directly from a memory map of the file.
+
+    num_av: average this many ensembles together (simple mean only, no
+      despiking)
+    nens: -1 for all, a count, or [start,stop] 1-based, inclusive, same as
+      rdradcp.
+
+    Unlike rdradcp, the last ensemble in the file is included when it is
+    complete.
+    """
+    if log_fp is None:
+        log_fp = sys.stdout
+    def msg(s):
+        log_fp.write(s)
+        log_fp.flush()
+
+    if not os.path.exists(name):
+        msg("ERROR******* Can't find file %s\n"%name)
+        return None
+
+    offsets=scan_ensembles(name)
+    if len(offsets)==0:
+        msg("No Valid data found\n")
+        return None
+    msg("Found %d ensembles in %s\n"%(len(offsets),name))
+
+    # Configuration from the fixed leader of the first ensemble
+    with open(name,'rb') as fd:
+        fd.seek(offsets[0]+2)
+        hdr,nbyte=rd_hdrseg(fd)
+        for dat_off in hdr.dat_offsets:
+            fd.seek(offsets[0]+dat_off)
+            if fromfile(fd,uint16,1)[0]==0:
+                cfg,nbyte=rd_fixseg(fd)
+                break
+        else:
+            msg("No fixed leader found in first ensemble\n")
+            return None
+
+    century=baseyear
+    if (cfg.prog_ver<16.05 and cfg.prog_ver>5.999) or cfg.prog_ver<5.55:
+        msg("***** Assuming that the century begins year %d (info not in this firmware version)\n"%century)
+    elif cfg.prog_ver>23.18 and cfg.prog_ver<23.20:
+        century=2000
+    else:
+        century=0
+
+    if isinstance(nens,(int,integer)):
+        if nens==-1:
+            nens=len(offsets)
+        offsets=offsets[:nens]
+    else:
+        offsets=offsets[nens[0]-1:nens[1]]
+    n=len(offsets)//num_av
+    offsets=offsets[:n*num_av]
+
+    ens=read_ensembles(name,offsets,cfg,msg)
+
+    # dates, as in rdradcp's ensemble_dates, but vectorized
+    rtc=ens['rtc'].astype(np.int64)
+    days=( (rtc[:,0]+century-1970).astype('M8[Y]')
+           + (rtc[:,1]-1).astype('m8[M]') ).astype('M8[D]') + (rtc[:,2]-1).astype('m8[D]')
+    dats=( date2num(days)
+           + (ens['rtc'][:,3:7]*np.array([1./24, 1./(24*60), 1./86400, 1./8640000])).sum(axis=1) )
+
+    adcp = Adcp()
+    adcp.name = 'adcp'
+    adcp.config=cfg
+
+    ens_dtype = get_ens_dtype(cfg.sourceprog)
+    bin_dtype = get_bin_dtype()
+    adcp.ensemble_data = zeros(n,dtype=ens_dtype)
+    adcp.bin_data = zeros((n,cfg.n_cells), dtype=bin_dtype)
+
+    def grp(x):
+        return x.reshape( (n,num_av)+x.shape[1:] )
+    E=adcp.ensemble_data
+    B=adcp.bin_data
+    E['mtime']=np.median(grp(dats),axis=1)
+    E['number']=grp(ens['number'])[:,0]
+    E['heading']=ssm.circmean(grp(ens['heading'])*pi/180.,axis=1)*180/pi
+    for fld in ['pitch','roll','heading_std','pitch_std','roll_std','depth',
+                'temperature','salinity','pressure','pressure_std']:
+        E[fld]=grp(ens[fld]).mean(axis=1)
+    for i,fld in enumerate(['east_vel','north_vel','vert_vel','error_vel']):
+        B[fld]=nmean(grp(ens['vel'][:,:,i]),1)
+    B['corr']=nmean(grp(ens['corr']),1)
+    B['status']=nmean(grp(ens['status']),1)
+    B['intens']=nmean(grp(ens['intens']),1)
+    B['perc_good']=nmean(grp(ens['percent']),1)
+    for fld in ['bt_range','bt_mode','bt_vel','bt_corr','bt_ampl','bt_perc_good']:
+        E[fld]=nmean(grp(ens[fld]),1)
+
+    bt_invalid = E['bt_vel'][:,0]==-32768
+    E['bt_vel'][bt_invalid]=np.nan
+
+    for name,typ in ens_dtype:
+        setattr(adcp,name,E[name])
+    for name,typ in bin_dtype:
+        setattr(adcp,name,B[name])
+    adcp.latitude = None
+    adcp.longitude = None
+    return adcp
+
+
 # related functions 
 def adcp_merge_nmea(r,gps_fn,adjust_to_utc=False):
     """
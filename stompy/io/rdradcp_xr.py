@@ -41,3 +41,13 @@ def rdradcp_xr(*a,**kw):
     ds.attrs['src']=kw.get('name',None) or a[0]
     return ds
 
+
+def rdradcp_fast_xr(*a,**kw):
+    """
+    Same as rdradcp_xr, but parsing with the vectorized
+    rdradcp.rdradcp_fast()
+    """
+    adcp=rdradcp.rdradcp_fast(*a,**kw)
+    ds=adcp_to_dataset(adcp)
+    ds.attrs['src']=kw.get('name',None) or a[0]
+    return ds
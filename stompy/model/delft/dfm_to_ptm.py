@@ -81,6 +81,15 @@ class DFlowToPTMHydro(object):
     # as the DFM map output cells
     remap_waq_elements=True
 
+    # Output time steps are computed and written in blocks.  If time_block
+    # is None, it is chosen so that a block of one 3D edge variable has
+    # about block_elements values.
+    time_block=None
+    block_elements=2**22
+    # number of threads computing blocks.  Writes to the output stay on
+    # the calling thread, in order.
+    workers=1
+
     def __init__(self,mdu_path,output_fn,**kwargs):
         utils.set_keywords(self,kwargs)
 
@@ -125,14 +134,44 @@ class DFlowToPTMHydro(object):
         # incoming dataset from DFM:
         map_fns=self.model.map_outputs()
         if len(map_fns)>1:
-            map_fns=[map_fn for map_fn in map_fns if '_merged_' in map_fn]
-            if len(map_fns)==1:
+            merged_fns=[map_fn for map_fn in map_fns if '_merged_' in map_fn]
+            if len(merged_fns)==1:
                 log.info("Found multiple map files but only 1 merged map file.  Will use that")
-        assert len(map_fns)==1,"Not ready for multi processor or time-divided output"
-        self.map_ds=xr.open_dataset(map_fns[0])
-        
+                map_fns=merged_fns
+            else:
+                assert self.nprocs==1,"Not ready for multi processor output"
+                log.info("Will read %d time-divided map files"%len(map_fns))
+        # time-divided output, i.e. from a restarted run, is read in order
+        # of start time.  Static fields come from the first file.
+        self.map_dss=[xr.open_dataset(map_fn) for map_fn in map_fns]
+        self.map_dss.sort(key=lambda ds: ds.time.values[0])
+        self.map_ds=self.map_dss[0]
+
+        # [file index, time index in file] for each output time step,
+        # dropping steps repeated at the start of the next file
+        srcs=[]
+        last_time=None
+        for fi,ds in enumerate(self.map_dss):
+            file_times=ds.time.values
+            if last_time is None:
+                tis=np.arange(len(file_times))
+            else:
+                tis=np.nonzero(file_times>last_time)[0]
+            srcs.append( np.c_[ np.full(len(tis),fi), tis ] )
+            if len(file_times):
+                last_time=file_times[-1]
+        self.map_time_src=np.concatenate(srcs)[self.time_slice]
+
         # Additionally trim to subset of times here:
-        subset_ds=self.map_ds.isel(time=self.time_slice)
+        if len(self.map_dss)==1:
+            subset_ds=self.map_ds.isel(time=self.time_slice)
+        else:
+            # only the freesurface is needed up front
+            subset_ds=self.map_ds.drop_dims('time')
+            srcs=self.map_time_src
+            subset_ds['mesh2d_s1']=xr.concat([self.map_dss[fi].mesh2d_s1.isel(time=srcs[srcs[:,0]==fi,1])
+                                              for fi in np.unique(srcs[:,0])],
+                                             dim='time')
 
         if 'mesh2d' in subset_ds:
             face_dim=subset_ds.mesh2d.attrs.get('face_dimension','nmesh2d_face')
@@ -224,11 +263,11 @@ class DFlowToPTMHydro(object):
 
         # Additional grid information:
         # xarray wants the dimension made explicit here -- don't know why.
-        out_ds['Mesh2_face_x']=('nMesh2_face',),self.mod_map_ds['Mesh2_face_x']
-        out_ds['Mesh2_face_y']=('nMesh2_face',),self.mod_map_ds['Mesh2_face_y']
+        out_ds['Mesh2_face_x']=('nMesh2_face',),self.mod_map_ds['Mesh2_face_x'].values
+        out_ds['Mesh2_face_y']=('nMesh2_face',),self.mod_map_ds['Mesh2_face_y'].values
 
-        out_ds['Mesh2_edge_x']=('nMesh2_edge',),self.mod_map_ds['Mesh2_edge_x']
-        out_ds['Mesh2_edge_y']=('nMesh2_edge',),self.mod_map_ds['Mesh2_edge_y']
+        out_ds['Mesh2_edge_x']=('nMesh2_edge',),self.mod_map_ds['Mesh2_edge_x'].values
+        out_ds['Mesh2_edge_y']=('nMesh2_edge',),self.mod_map_ds['Mesh2_edge_y'].values
 
         e2c=self.g.edge_to_cells()
         out_ds['Mesh2_edge_faces']=('nMesh2_edge','Two'),e2c
@@ -269,7 +308,7 @@ class DFlowToPTMHydro(object):
             # also, writing anything time-varying beyond the time stamps themselves
             # should probably be handled in the time loop [TODO]
             s1=np.maximum( self.mod_map_ds.mesh2d_s1, -out_ds['Mesh2_face_depth'])
-            out_ds['Mesh2_sea_surface_elevation']=('nMesh2_face','nMesh2_data_time'),s1.T
+            out_ds['Mesh2_sea_surface_elevation']=('nMesh2_face','nMesh2_data_time'),s1.values.T
 
         if 1: # edge and cell marks
             edge_marks=self.g.edges['mark']
@@ -282,7 +321,7 @@ class DFlowToPTMHydro(object):
             out_ds['Mesh2_face_bc']=('nMesh2_face',),self.g.cells['mark']
 
         if 1: # layers
-            ucx=self.mod_map_ds['mesh2d_ucx']
+            ucx=self.map_ds['mesh2d_ucx']
             if ucx.ndim==2:
                 self.nkmax=1
                 self.map_2d=True
@@ -342,7 +381,7 @@ class DFlowToPTMHydro(object):
         self.edge_2d_data_dims=('nMesh2_edge','nMesh2_data_time')
 
         # Scalar-ish variables
-        if 'mesh2d_sa1' not in self.mod_map_ds:
+        if 'mesh2d_sa1' not in self.map_ds:
             print("Will fabricate salinity=0")
         # seems that PTM wants this to exist regardless, so better
         # to fabricate salinity.
@@ -416,14 +455,16 @@ class DFlowToPTMHydro(object):
            - if self.remap_waq_elements is False, this is just np.arange(g.Ncells()).
              Otherwise it will be decided based on geometry
         """
+        # for n_2d_elements
+        self.hyd.infer_2d_elements()
         if self.remap_waq_elements:
             hg=self.hyd.grid()
             node_map,edge_map,cell_map=hg.match_to_grid(self.g)
             self.element_to_cell=cell_map
         else:
-            self.element_to_cell=np.arange(self.hyd.n_seg)
+            self.element_to_cell=np.arange(self.hyd.n_2d_elements)
 
-        assert self.hyd.n_seg == self.g.Ncells()
+        assert self.hyd.n_2d_elements == self.g.Ncells()
         self.cell_to_element=utils.invert_permutation(self.element_to_cell)
             
         # link_to_edge_sign=[] # an edge index in g.edges, and a +-1 sign for whether the link is aligned the same.
@@ -489,180 +530,239 @@ class DFlowToPTMHydro(object):
 
         self.link_to_edge_sign=link_to_edge_sign
 
+    def map_block(self,var,t0,t1):
+        """
+        Read map output variable var for output time steps [t0,t1),
+        which may span several map files.  Returns an array with time first.
+        """
+        srcs=self.map_time_src[t0:t1]
+        parts=[]
+        for fi in np.unique(srcs[:,0]):
+            tis=srcs[srcs[:,0]==fi,1]
+            if np.all(np.diff(tis)==1):
+                tis=slice(tis[0],tis[-1]+1)
+            parts.append( self.map_dss[fi][var].isel(time=tis).values )
+        return np.concatenate(parts,axis=0)
+
+    def init_exchange_mappings(self):
+        """
+        Precompute index arrays to scatter DWAQ exchanges onto PTM edges,
+        cells and layers.
+        """
+        # just the horizontal exchanges
+        exchs=np.arange(self.hyd.n_exch_x+self.hyd.n_exch_y)
+        # for horizontal exchanges in a sigma grid, this is a safe way
+        # to get layer:
+        ks=self.hyd.seg_k[self.poi0[exchs][:,1]]
+        links=self.hyd.exch_to_2d_link['link'][exchs]
+
+        link_sgns=self.hyd.exch_to_2d_link['sgn'][exchs]
+        js_j_sgns=self.link_to_edge_sign[links,:]
+        js=js_j_sgns[:,0]
+        j_sgns=js_j_sgns[:,1]
+
+        self.hor_exchs=exchs
+        self.hor_js=js
+        self.hor_sgns=np.where(js>=0,link_sgns*j_sgns,0)
+        # so far this is k in the DWAQ world, surface to bed.
+        # but now we assign in the untrim sense, bed to surface.
+        self.hor_ptm_ks=self.nkmax-ks-1
+
+        if self.nkmax>1:
+            # this has not been tested against real 3D output
+            exchs=np.arange(self.hyd.n_exch_x+self.hyd.n_exch_y,self.hyd.n_exch)
+            assert np.all(self.poi0[exchs,0]>=0),"Wasn't expecting BC exchanges in the vertical"
+            seg_up=self.poi0[exchs,0]
+            seg_down=self.poi0[exchs,1]
+            k_upper=self.hyd.seg_k[seg_up]
+            k_lower=self.hyd.seg_k[seg_down]
+            elts=self.hyd.seg_to_2d_element[seg_up]
+            assert np.all(k_upper+1==k_lower),"Thought this was a given"
+            assert np.all(elts==self.hyd.seg_to_2d_element[seg_down]),"Maybe this wasn't a vertical exchange"
+            self.vert_exchs=exchs
+            # no longer assume that dwaq cells are numbered the same as dfm cells.
+            self.vert_cells=self.element_to_cell[elts]
+            # based on looking at the untrim output, this should be recorded to
+            # the k of the lower layer, but also flipped to be bed->surface
+            # ordered
+            self.vert_ptm_ks=self.nkmax-k_lower-1
+            # and the top flux is repeated
+            self.vert_top=(k_upper==0)
+
+    def default_time_block(self):
+        return max(1,self.block_elements//(self.g.Nedges()*self.nkmax))
+
     @profile
     def write_time_steps(self):
         """
         The heavy lifting writing out hydro fields at each time step.
+        Steps are processed in blocks, optionally in parallel, and each
+        block is written with one call per variable.
         """
+        from concurrent.futures import ThreadPoolExecutor, Future
+
         times=self.mod_map_ds.nMesh2_data_time.values
-        e2c=self.g.edge_to_cells()
-        # when possible use the DWAQ areas, but for 2D, will use this
-        # area since there isn't a dwaq cell area.
-        Ac=self.g.cells_area()
 
         # this writes all time strings at once -- maybe that keeps those
         # small data contiguous for fast scanning.  Calling it from this
         # method maybe consolidates time step selection locations.
         self.write_time_strings()
 
-        # "safe" versions of the cells on either side of an edge
-        c1=e2c[:,0].copy() ; c2=e2c[:,1].copy()
-        c2[c2<0]=c1[c2<0]
-        c1[c1<0]=c2[c1<0] # unnecessary, but hey..
-
-        # Make it clear that the step-integrated values are not valid
-        # for i=0
-        self.h_flow_var[:,:,0]=np.nan
-        self.A_edge_var[:,:,0]=np.nan
-        self.edge_k_top_var[:,0]=0
-        self.v_flow_var[:,:,0]=np.nan
-        self.A_face_var[:,:,0]=np.nan
-
         # will need seg_k below
         self.hyd.infer_2d_elements()
+        self.init_exchange_mappings()
 
-        for ti,t in enumerate(times):
-            if True: # ti%24==0:
-                print("%d/%d t=%s"%(ti,len(times),t))
+        time_block=self.time_block or self.default_time_block()
+        blocks=[ (t0,min(t0+time_block,len(times)))
+                 for t0 in range(0,len(times),time_block) ]
 
-            cell_water_depth=self.mod_map_ds.mesh2d_waterdepth.isel(nMesh2_data_time=ti)
-            if 0:
-                # try setting edges to be dry by k_top=0.  this is specific to nk=1
-                # all or nothing for sigma layers
-                self.cell_k_top_var[:,ti] = np.where(cell_water_depth>0,self.nkmax,0)
-            else:
-                # based on looking at untrim output, seems that cells are *not*
-                # dried out by setting cell_top=0, though they do show a zero wet area.
-                self.cell_k_top_var[:,ti] = self.nkmax
-
-            # HERE: this should probably use edge area and length, so that
-            #  fluxes
-            # edge eta is taken from the higher freesurface
-            eta_cell=self.out_nc['Mesh2_sea_surface_elevation'][:,ti]
-            edge_eta=np.maximum( eta_cell[c1], eta_cell[c2] )
-            edge_water_depth=edge_eta + self.out_nc['Mesh2_edge_depth'][:]
-
-            # bed never moves in this code
-            self.cell_k_bot_var[:,ti] = 1
-            self.edge_k_bot_var[:,ti] = 1
-
-            def copy_3d_cell(src,dst):
-                # Copies single time step of cell-centered 3D data.
-                # src: string name of variable in mod_map_ds
-                # dst: netCDF variable to assign to.
-                src_data=self.mod_map_ds[src].isel(nMesh2_data_time=ti).values
-                if self.map_2d:
-                    dst[:,0,ti]=src_data
-                else:
-                    dst[:,:,ti]=src_data
+        if self.workers>1:
+            executor=ThreadPoolExecutor(max_workers=self.workers)
+        else:
+            executor=None
 
-            if 'mesh2d_sa1' in self.mod_map_ds:
-                copy_3d_cell('mesh2d_sa1',self.salt_var)
+        try:
+            pending=[]
+            for t0,t1 in blocks:
+                if executor is not None:
+                    fut=executor.submit(self.compute_block,t0,t1)
+                else:
+                    fut=Future()
+                    fut.set_result(self.compute_block(t0,t1))
+                pending.append(fut)
+                # limit the number of computed blocks held in memory
+                while len(pending)>self.workers:
+                    self.write_block(pending.pop(0).result())
+            for fut in pending:
+                self.write_block(fut.result())
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    def compute_block(self,t0,t1):
+        """
+        Compute the time-varying output for output time steps [t0,t1).
+        Returns a dict mapping output variable names to arrays with time
+        last, or to scalars for constant fields, along with the slice
+        of time steps under 'time'.
+        """
+        times=self.mod_map_ds.nMesh2_data_time.values
+        print("%d/%d t=%s"%(t0,len(times),times[t0]))
+
+        Ncells=self.g.Ncells()
+        Nedges=self.g.Nedges()
+        nkmax=self.nkmax
+        nt=t1-t0
+
+        # dwaq uses seconds from reference time
+        hyd_t_secs=(times[t0:t1]-utils.to_dt64(self.hyd.time0))/np.timedelta64(1,'s')
+        hyd_tidxs=self.hyd.t_sec_to_index(hyd_t_secs)
+
+        blk={'time':slice(t0,t1)}
+
+        # based on looking at untrim output, seems that cells are *not*
+        # dried out by setting cell_top=0, though they do show a zero wet area.
+        blk['Mesh2_face_top_layer']=nkmax
+        # bed never moves in this code
+        blk['Mesh2_face_bottom_layer']=1
+        blk['Mesh2_edge_bottom_layer']=1
+
+        def cell_3d(src):
+            # cell-centered 3D data from map output, [cell,k,time]
+            src_data=self.map_block(src,t0,t1)
+            if self.map_2d:
+                return src_data.T[:,None,:]
             else:
-                self.salt_var[:,:,ti]=0.0
+                return np.moveaxis(src_data,0,-1)
 
-            if self.nkmax>1:
-                copy_3d_cell('mesh2d_viw',self.nut_var)
-            else:
-                # punt - would be nice to calculate something based on
-                # velocity, roughness, etc.
-                self.nut_var[:,:,ti]=0.0
-
-            # h_flow gets interesting as we have to read dwaq output
-            # dwaq uses seconds from reference time
-            hyd_t_sec=(t-utils.to_dt64(self.hyd.time0))/np.timedelta64(1,'s')
-
-            # time-step integrated quantities in PTM reflect the preceding interval
-            # but DWAQ integrated quantities reflect the following interval.
-            if ti+1<len(times):
-                # flows is all horizontal flows, layer by layer, surface to bed,
-                # and then vertical flows.
-                # only flow edges get flows, though.
-                flows=self.hyd.flows(hyd_t_sec)
-                areas=self.hyd.areas(hyd_t_sec)
-
-                # compose exch_to_2d_link,link_to_edge_sign, weed out unmapped
-                # links, and copy into h_flow_avg.  start with naive loops
-                h_flow_avg=np.zeros((self.g.Nedges(),self.nkmax),np.float64)
-                h_area_avg=np.zeros_like(h_flow_avg)
-
-                # vectorized
-                # just the horizontal exchanges
-                exchs=np.arange(self.hyd.n_exch_x+self.hyd.n_exch_y)
-
-                Qs=flows[exchs]
-                # for horizontal exchanges in a sigma grid, this is a safe way
-                # to get layer:
-                ks=self.hyd.seg_k[self.poi0[exchs][:,1]]
-                links=self.hyd.exch_to_2d_link['link'][exchs]
-
-                link_sgns=self.hyd.exch_to_2d_link['sgn'][exchs]
-                js_j_sgns=self.link_to_edge_sign[links,:]
-                js=js_j_sgns[:,0]
-                j_sgns=js_j_sgns[:,1]
-
-                sgns=np.where(js>=0,link_sgns*j_sgns,0)
-
-                # so far this is k in the DWAQ world, surface to bed.
-                # but now we assign in the untrim sense, bed to surface.
-                ptm_ks=self.nkmax-ks-1
-                h_flow_avg[js,ptm_ks]=Qs*sgns
-                h_area_avg[js,ptm_ks]=np.where(js>=0,areas[exchs],0.0)
-
-                self.h_flow_var[:,:,ti+1]=h_flow_avg
-                self.A_edge_var[:,:,ti+1]=h_area_avg
-                
-                # edge ktop is based on presence of flux rather than geometry of freesurface
-                # and bed, since eta is instantaneous.  Could also use areas, but fluxes
-                # are more 'fundamental' 
-                edge_is_wet=np.any( h_flow_avg!=0.0, axis=1)
-                self.edge_k_top_var[:,ti+1] = np.where(edge_is_wet,self.nkmax,0)
-
-                v_flow_avg=np.zeros((self.g.Ncells(),self.nkmax), np.float64)
-                v_area_avg=np.zeros_like(v_flow_avg)
-
-                if self.nkmax>1:
-                    # this is here for future reference, but most of the
-                    # other code is not ready for 3D, and this code has not been
-                    # tested.
-                    for exch in range(self.hyd.n_exch_x+self.hyd.n_exch_y,self.hyd.n_exch):
-                        # negate, because dwaq records this relative to the exchange,
-                        # which is top-segment to next segment down.
-                        Q=-flows[exch]
-                        assert self.poi0[exch][0] >=0,"Wasn't expecting BC exchanges in the vertical"
-                        seg_up,seg_down=self.poi0[exch][0,:2]
-                        k_upper=self.hyd.seg_k[seg_up]
-                        k_lower=self.hyd.seg_k[seg_down]
-                        elt=self.hyd.seg_to_2d_element[seg_up]
-                        assert k_upper+1==k_lower,"Thought this was a given"
-                        assert elt==self.hyd.seg_to_2d_element[seg_down],"Maybe this wasn't a vertical exchange"
-                        # based on looking at the untrim output, this should be recorded to
-                        # the k of the lower layer, but also flipped to be bed->surface
-                        # ordered
-                        # no longer assume that dwaq cells are numbered the same as dfm cells.
-                        cell=self.element_to_cell[elt]
-                        v_flow_avg[cell,nkmax-k_lower-1]=Q
-                        if k_upper==0: # repeat top flux
-                            v_flow_avg[cell,nkmax-k_upper-1]=Q
-                else:
-                    # At least populate the area, though it may not make a difference
-                    v_area_avg[:,0] = np.where(cell_water_depth>0,Ac,0.0)
+        if 'mesh2d_sa1' in self.map_ds:
+            blk['Mesh2_salinity_3d']=cell_3d('mesh2d_sa1')
+        else:
+            blk['Mesh2_salinity_3d']=0.0
 
-                self.v_flow_var[:,:,ti+1]=v_flow_avg
-                self.A_face_var[:,:,ti+1]=v_area_avg
+        if nkmax>1:
+            blk['Mesh2_vertical_diffusivity_3d']=cell_3d('mesh2d_viw')
+        else:
+            # punt - would be nice to calculate something based on
+            # velocity, roughness, etc.
+            blk['Mesh2_vertical_diffusivity_3d']=0.0
+
+        # Instantaneous volumes come to us ordered by first all the top layer,
+        # then the second layer, on down to the bed.  convert to 3D, and
+        # reorder the layers.
+        vols=self.hyd.volumes_block(hyd_tidxs)
+        vols=vols.reshape( (nt,nkmax,self.hyd.n_2d_elements) )[:,::-1,:] # [time,k,element]
+        vols=vols.transpose(2,1,0) # [element,k,time]
+        blk['Mesh2_face_water_volume']=vols[self.cell_to_element,:,:]
+
+        # time-step integrated quantities in PTM reflect the preceding interval
+        # but DWAQ integrated quantities reflect the following interval.
+        # Make it clear that these are not valid for the first step.
+        h_flow_avg=np.zeros((Nedges,nkmax,nt),np.float64)
+        h_area_avg=np.zeros_like(h_flow_avg)
+        v_flow_avg=np.zeros((Ncells,nkmax,nt),np.float64)
+        v_area_avg=np.zeros_like(v_flow_avg)
+        edge_k_top=np.zeros((Nedges,nt),np.int32)
+
+        # block-relative index of the first output step with a preceding interval
+        s0=1 if t0==0 else 0
+        if s0:
+            for a in [h_flow_avg,h_area_avg,v_flow_avg,v_area_avg]:
+                a[:,:,0]=np.nan
+
+        if s0<nt:
+            # DWAQ steps for the intervals preceding output steps [t0+s0,t1)
+            step_t_secs=(times[t0+s0-1:t1-1]-utils.to_dt64(self.hyd.time0))/np.timedelta64(1,'s')
+            step_tidxs=self.hyd.t_sec_to_index(step_t_secs)
+
+            # flows is all horizontal flows, layer by layer, surface to bed,
+            # and then vertical flows.
+            # only flow edges get flows, though.
+            flows=self.hyd.flows_block(step_tidxs)
+            areas=self.hyd.areas_block(step_tidxs)
+
+            js=self.hor_js
+            Qs=flows[:,self.hor_exchs]
+            h_flow_avg[js,self.hor_ptm_ks,s0:]=(Qs*self.hor_sgns).T
+            h_area_avg[js,self.hor_ptm_ks,s0:]=np.where(js>=0,areas[:,self.hor_exchs],0.0).T
+
+            # edge ktop is based on presence of flux rather than geometry of freesurface
+            # and bed, since eta is instantaneous.  Could also use areas, but fluxes
+            # are more 'fundamental'
+            edge_is_wet=np.any( h_flow_avg[:,:,s0:]!=0.0, axis=1)
+            edge_k_top[:,s0:]=np.where(edge_is_wet,nkmax,0)
+
+            if nkmax>1:
+                # negate, because dwaq records this relative to the exchange,
+                # which is top-segment to next segment down.
+                Qv=-flows[:,self.vert_exchs].T
+                v_flow_avg[self.vert_cells,self.vert_ptm_ks,s0:]=Qv
+                top=self.vert_top
+                v_flow_avg[self.vert_cells[top],nkmax-1,s0:]=Qv[top]
+            else:
+                # At least populate the area, though it may not make a difference
+                cell_water_depth=self.map_block('mesh2d_waterdepth',t0+s0-1,t1-1)
+                Ac=self.g.cells_area()
+                v_area_avg[:,0,s0:] = np.where(cell_water_depth>0,Ac,0.0).T
+
+        blk['h_flow_avg']=h_flow_avg
+        blk['Mesh2_edge_wet_area']=h_area_avg
+        blk['Mesh2_edge_top_layer']=edge_k_top
+        blk['v_flow_avg']=v_flow_avg
+        blk['Mesh2_face_wet_area']=v_area_avg
+        return blk
+
+    def write_block(self,blk):
+        """
+        Write the output of compute_block()
+        """
+        tslc=blk['time']
+        for name,data in blk.items():
+            if name=='time':
+                continue
+            var=self.out_nc[name]
+            var[...,tslc]=data
 
-            # Instantaneous values
-            
-            #   Mesh2_face_water_volume
-            vols=self.hyd.volumes(hyd_t_sec)
-            # assume again that cells are numbered the same.
-            # they come to us ordered by first all the top layer, then the second
-            # layer, on down to the bed.  convert to 3D, and reorder the layers
-            # used to reshape by self.g.Ncells().
-            vols=vols.reshape( (self.nkmax,self.hyd.n_2d_elements) )[::-1,:] # [k,element]
-            vols=vols.T # [element,k]
-            vols=vols[self.cell_to_element,:] # [cell,k]
-            self.vol_var[:,:,ti] = vols
     def close(self):
         self.out_nc.close()
         self.out_nc=None
@@ -695,6 +795,8 @@ elif __name__=='__main__':
                         action='store_true')
     parser.add_argument("--skip-nc","-n",help="Do not write netcdf, usu. in conjunction with --subgrid",
                         action='store_true')
+    parser.add_argument("--time-block",type=int,help="Number of time steps to process at once")
+    parser.add_argument("--workers",type=int,default=1,help="Number of threads processing time blocks")
     args=parser.parse_args()
 
     kwargs={}
@@ -708,5 +810,8 @@ elif __name__=='__main__':
         assert kwargs['grd_fn']!=args.output,"Output filename should end in .nc"
     if args.skip_nc:
         kwargs['write_nc']=False
+    if args.time_block is not None:
+        kwargs['time_block']=args.time_block
+    kwargs['workers']=args.workers
 
     converter=DFlowToPTMHydro(args.mdu,args.output,**kwargs)
@@ -19,6 +19,106 @@ log=logging.getLogger('delft.io')
 
 from ... import utils
 
+class DelwaqFrameArray(xr.backends.BackendArray):
+    """
+    Lazy access to binary delwaq output laid out as a sequence of frames,
+    each an 'i4' timestamp followed by 'f4' data [n_rows,n_cols], as in map
+    and history files.  Indexing reads only the requested frames, rows and
+    columns through a memory map.
+
+    The array has shape (nframes,) + row_shape + (n_cols,), dropping the
+    last dimension if col is given to select a single column (substance).
+    row_shape reshapes the rows, e.g. segments to (layer,face).
+    row_index optionally selects a subset of rows, in which case row_shape
+    defaults to (len(row_index),).
+    """
+    def __init__(self,fn,data_start,nframes,n_rows,n_cols,col=None,
+                 row_shape=None,row_index=None):
+        self.fn=fn
+        self.data_start=data_start
+        self.nframes=nframes
+        self.n_rows=n_rows
+        self.n_cols=n_cols
+        self.col=col
+        self.row_index=row_index
+        if row_shape is None:
+            if row_index is not None:
+                row_shape=(len(row_index),)
+            else:
+                row_shape=(n_rows,)
+        self.row_shape=tuple(row_shape)
+        shape=(nframes,)+self.row_shape
+        if col is None:
+            shape=shape+(n_cols,)
+        self.shape=shape
+        self.dtype=np.dtype('f4')
+
+    def frames(self):
+        return np.memmap(self.fn,[ ('tsecs','i4'),
+                                   ('data','f4',(self.n_rows,self.n_cols))],
+                         mode='r',shape=(self.nframes,),offset=self.data_start)
+
+    def __getitem__(self,key):
+        return xr.core.indexing.explicit_indexing_adapter(
+            key,self.shape,xr.core.indexing.IndexingSupport.OUTER,
+            self._raw_indexing_method)
+
+    def _raw_indexing_method(self,key):
+        # key has an int, slice or 1-D integer array for each dimension
+        idxs=[np.arange(n)[k] for n,k in zip(self.shape,key)]
+        squeeze=tuple(i for i,idx in enumerate(idxs) if np.ndim(idx)==0)
+        idxs=[np.atleast_1d(idx) for idx in idxs]
+
+        t_idx=idxs[0]
+        row_idxs=idxs[1:1+len(self.row_shape)]
+        rows=np.ravel_multi_index(np.ix_(*row_idxs),self.row_shape).ravel()
+        if self.row_index is not None:
+            rows=np.asarray(self.row_index)[rows]
+        if self.col is None:
+            cols=idxs[-1]
+        else:
+            cols=np.array([self.col])
+
+        result=np.zeros((len(t_idx),len(rows),len(cols)),self.dtype)
+        if result.size:
+            data=self.frames()['data']
+            for i,t in enumerate(t_idx):
+                result[i]=data[t][rows[:,None],cols[None,:]]
+
+        out_shape=(len(t_idx),)+tuple(len(idx) for idx in row_idxs)
+        if self.col is None:
+            out_shape=out_shape+(len(cols),)
+        result=result.reshape(out_shape)
+        if squeeze:
+            result=result.squeeze(axis=squeeze)
+        return result
+
+def lazy_variable(dims,backend_array,attrs=None):
+    """
+    Wrap a BackendArray as a lazily indexed xarray Variable.
+    """
+    return xr.Variable(dims,xr.core.indexing.LazilyIndexedArray(backend_array),attrs)
+
+def parse_his_header(fp):
+    """
+    Read the header of a delwaq history file from the open file fp, leaving
+    fp at the start of the first frame.
+    returns sim_descs,time0,regions,fields as in parse_his_file()
+    """
+    sim_descs=np.fromfile(fp,'S40',4)
+    time0=sim_descs[3]
+    n_fields,n_regions=np.fromfile(fp,'i4',2)
+
+    fdtype=np.dtype( [ ('sub','S10'),
+                       ('proc','S10') ] )
+
+    fields=np.fromfile( fp, fdtype, n_fields)
+
+    regions=np.fromfile(fp,
+                        [('num','i4'),('name','S20')],
+                        n_regions)
+    return sim_descs,time0,regions,fields
+
 def parse_his_file(fn):
     """
     you probably want mon_his_file_dataframe() or bal_his_file_dataframe()
@@ -35,19 +135,9 @@ def parse_his_file(fn):
     """
     fp=open(fn,'rb')
 
-    sim_descs=np.fromfile(fp,'S40',4)
-    time0=sim_descs[3]
-
-    n_fields,n_regions=np.fromfile(fp,'i4',2)
-
-    fdtype=np.dtype( [ ('sub','S10'),
-                       ('proc','S10') ] )
-
-    fields=np.fromfile( fp, fdtype, n_fields)
-
-    regions=np.fromfile(fp,
-                        [('num','i4'),('name','S20')],
-                        n_regions)
+    sim_descs,time0,regions,fields=parse_his_header(fp)
+    n_regions=len(regions)
+    n_fields=len(fields)
 
     # assume that data is 'f4'
     # following other Delft output, probably each frame is prepended by
@@ -79,15 +169,26 @@ def bal_his_file_dataframe(fn):
     return df
 
 
-def his_file_xarray(fn,region_exclude=None,region_include=None):
+def his_file_xarray(fn,region_exclude=None,region_include=None,lazy=False):
     """
     Read a delwaq balance file, return the result as an xarray.
     region_exclude: regular expression for region names to omit from the result
     region_include: regular expression for region names to include.
+    lazy: if True, 'bal' is read on demand from the file, only touching the
+      requested times, regions and fields.
 
     Defaults to returning all regions.
     """
-    sim_descs,time_meta,regions,fields,frames = parse_his_file(fn)
+    if lazy:
+        with open(fn,'rb') as fp:
+            sim_descs,time_meta,regions,fields=parse_his_header(fp)
+            data_start=fp.tell()
+        frame_dtype=np.dtype( [('tsec','i4'),
+                               ('data','f4',(len(regions),len(fields)))] )
+        nframes=(os.path.getsize(fn)-data_start)//frame_dtype.itemsize
+        frames=np.memmap(fn,frame_dtype,mode='r',shape=(nframes,),offset=data_start)
+    else:
+        sim_descs,time_meta,regions,fields,frames = parse_his_file(fn)
 
     def decstrip(s):
         try:
@@ -103,7 +204,7 @@ def his_file_xarray(fn,region_exclude=None,region_include=None):
     time0,time_unit = parse_time0(time_meta)
     times=time0 + time_unit*frames['tsec']
     ds['time']=( ('time',), times)
-    ds['tsec']=( ('time',), frames['tsec'])
+    ds['tsec']=( ('time',), np.array(frames['tsec']))
 
     region_names=[decstrip(s) for s in regions['name']]
     subs=[decstrip(s) for s in np.unique(fields['sub'])]
@@ -133,8 +234,14 @@ def his_file_xarray(fn,region_exclude=None,region_include=None):
     ds['proc'] =( ('proc',), procs)
     ds['field']=( ('field',), sub_proc)
 
-    ds['bal']=( ('time','region','field'),
-                frames['data'][:,region_mask,:] )
+    if lazy:
+        ds['bal']=lazy_variable( ('time','region','field'),
+                                 DelwaqFrameArray(fn,data_start,len(frames),
+                                                  len(regions),len(fields),
+                                                  row_index=region_idxs) )
+    else:
+        ds['bal']=( ('time','region','field'),
+                    frames['data'][:,region_mask,:] )
     return ds
 
 # older name - xarray version doesn't discriminate between balance
@@ -686,7 +793,8 @@ def create_restart(res_fn, map_fn, hyd, state_vars = None, map_net_cdf = False,
     return 
 
 
-def read_map(fn,hyd=None,use_memmap=True,include_grid=True,return_grid=False):
+def read_map(fn,hyd=None,use_memmap=True,include_grid=True,return_grid=False,
+             lazy=True,chunks=None):
     """
     Read binary D-Water Quality map output, returning an xarray dataset.
 
@@ -696,6 +804,11 @@ def read_map(fn,hyd=None,use_memmap=True,include_grid=True,return_grid=False):
        Hydro object.
     use_memmap: use memory mapping for file access.  Currently
       this must be enabled.
+    lazy: substances are lazily indexed arrays, and slicing reads only the
+      requested frames and segments from the file.  Otherwise each substance
+      is a strided view on a memory map of the whole file.
+    chunks: if given, passed to Dataset.chunk() to return dask arrays
+      (requires dask).
 
     include_grid: the returned dataset also includes grid geometry, suitable
        for unstructured_grid.from_ugrid(ds).
@@ -785,17 +898,25 @@ def read_map(fn,hyd=None,use_memmap=True,include_grid=True,return_grid=False):
     times=utils.to_dt64(hyd.time0) + np.timedelta64(1,'s') * mapped['tsecs']
 
     ds['time']=( ('time',), times)
-    ds['t_sec']=( ('time',), mapped['tsecs'] )
+    ds['t_sec']=( ('time',), np.array(mapped['tsecs']) )
 
     for idx,name in enumerate(ds.sub.values):
-        ds[name]= ( ('time','layer','face'), 
-                    mapped['data'][...,idx] )
+        if lazy:
+            ds[name]=lazy_variable( ('time','layer','face'),
+                                    DelwaqFrameArray(fn,data_start,nframes,n_segs,n_subs,col=idx,
+                                                     row_shape=(n_layers,hyd.n_2d_elements)) )
+        else:
+            ds[name]= ( ('time','layer','face'), 
+                        mapped['data'][...,idx] )
         ds[name].attrs['_FillValue']=-999
 
     if include_grid:
         # not sure why this doesn't work.
         g.write_to_xarray(ds=ds)
 
+    if chunks is not None:
+        ds=ds.chunk(chunks)
+
     if return_grid:
         return ds,g
     else:
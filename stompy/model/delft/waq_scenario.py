@@ -252,6 +252,11 @@ class Hydro(object):
     # true.
     overwrite=True
 
+    # if True, write() finishes by checking volume conservation of the
+    # vol and flo files it just wrote.  The check reads the files back
+    # block by block, at roughly the cost of writing the flo file.
+    check_conservation_on_write=True
+
     @property
     def fn_base(self): # base filename for output. typically com-<scenario name>
         return 'com-{}'.format(self.scenario.name)
@@ -449,6 +454,23 @@ class Hydro(object):
         """
         raise WaqException("Implement in subclass")
 
+    def volumes_block(self, tidxs):
+        """ segment volumes for several time indices, [len(tidxs),n_seg].
+        Subclasses with file-backed data can override this to avoid
+        reading one step at a time.
+        """
+        return np.array( [self.volumes(self.t_secs[ti]) for ti in tidxs] ).reshape(-1,self.n_seg)
+
+    def flows_block(self, tidxs):
+        """ exchange flows for several time indices, [len(tidxs),n_exch]
+        """
+        return np.array( [self.flows(self.t_secs[ti]) for ti in tidxs] ).reshape(-1,self.n_exch)
+
+    def areas_block(self, tidxs):
+        """ exchange areas for several time indices, [len(tidxs),n_exch]
+        """
+        return np.array( [self.areas(self.t_secs[ti]) for ti in tidxs] ).reshape(-1,self.n_exch)
+
     @property
     def vol_filename(self):
         return os.path.join(self.scenario.base_path, self.fn_base+".vol")
@@ -585,6 +607,23 @@ class Hydro(object):
         self.write_poi()
         self.log.debug('Writing volumes')
         self.write_vol()
+        if self.check_conservation_on_write:
+            self.check_conservation_after_write()
+
+    def check_conservation_after_write(self):
+        """
+        Called by write(). Check volume conservation of the written vol and
+        flo files, only warning when the files cannot be read.
+        """
+        self.log.info('Checking volume conservation of written hydro')
+        try:
+            written=self.written_vol_flo()
+        except (OSError,ValueError) as exc:
+            # missing or partial files, e.g. from a subclass which
+            # writes elsewhere. The hydro is written, so just report.
+            self.log.warning("Could not read vol/flo to check volume conservation (%s)"%str(exc))
+            return None
+        return self.check_written_volume_conservation(written=written)
 
     def write_srf(self):
         if 0: # old Hydro behavior:
@@ -627,7 +666,11 @@ class Hydro(object):
     def write_parameters(self):
         # parameters are updated with force=True on Scenario instantiation,
         # don't need to do it here.
-        for param in self.parameters(force=False).values():
+        params=list(self.parameters(force=False).values())
+        written=write_supporting_concurrently(params)
+        for param in params:
+            if param in written:
+                continue
             # don't care about the textual description
             _=param.text(write_supporting=True)
     def planform_areas(self):
@@ -854,20 +897,16 @@ class Hydro(object):
         if self._QtodV is None:
             # build a sparse matrix for mapping exchange flux to segments
             # QtodV.dot(Q): rows of QtodV correspond to segment
-            # columns correspond to exchanges
-            rows=[]
-            cols=[]
-            vals=[]
-
-            for exch_i,(seg_from,seg_to) in enumerate(self.pointers[:,:2]):
-                if seg_from>0:
-                    rows.append(seg_from-1)
-                    cols.append(exch_i)
-                    vals.append(-1.0)
-                if seg_to>0:
-                    rows.append(seg_to-1)
-                    cols.append(exch_i)
-                    vals.append(1.0)
+            # columns correspond to exchanges.  Boundary exchanges have
+            # a non-positive pointer and only touch one segment.
+            seg_from=self.pointers[:,0]
+            seg_to=self.pointers[:,1]
+            exchs=np.arange(len(self.pointers))
+            from_sel=seg_from>0
+            to_sel=seg_to>0
+            rows=np.concatenate( [seg_from[from_sel]-1,seg_to[to_sel]-1] )
+            cols=np.concatenate( [exchs[from_sel],exchs[to_sel]] )
+            vals=np.concatenate( [-np.ones(from_sel.sum()),np.ones(to_sel.sum())] )
 
             QtodV=sparse.coo_matrix( (vals, (rows,cols)),
                                      (self.n_seg,self.n_exch) )
@@ -982,6 +1021,179 @@ class Hydro(object):
             Vlast=Vnow
         return summary
 
+    # time steps per block for check_volume_conservation_blocks().
+    # Small blocks keep the [seg,time] work arrays in cache, and are
+    # faster than large ones.
+    conservation_block_size=32
+    # threads for check_volume_conservation_blocks(). Most of the time
+    # goes to reading data and the sparse products.
+    conservation_workers=1
+
+    def check_volume_conservation_blocks(self,seg_select=slice(None),
+                                         tidx_select=slice(None),
+                                         block_size=None,workers=None,
+                                         n_worst=10,rel_err_tol=1e-4,
+                                         verbose=True,
+                                         volumes=None,flows=None,t_secs=None):
+        """
+        Array-level version of check_volume_conservation_incr(). Volumes
+        and flows are read block_size steps at a time, and the budgets
+        for all segments in a block come from a single product with the
+        exchange-to-segment incidence matrix.  Blocks are optionally
+        processed on `workers` threads.
+
+        seg_select: slice, bitmask or index array of segments to include.
+        tidx_select: slice of time indices, must be consecutive.
+        volumes, flows, t_secs: optional arrays [time,seg], [time,exch] and
+         [time], e.g. fields of a memmap.  Default to volumes_block(),
+         flows_block() and self.t_secs.  flows may be one step shorter
+         than volumes.
+        n_worst: number of segments to report when verbose.
+
+        Errors are defined as in check_volume_conservation_incr.  Returns
+        an xr.Dataset with the worst error per interval (dimension time,
+        labeled by the end of the interval) and per segment.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        assert (tidx_select.step is None) or (tidx_select.step==1),"Times must be consecutive"
+        block_size=block_size or self.conservation_block_size
+        workers=workers or self.conservation_workers
+
+        if t_secs is None:
+            t_secs=self.t_secs
+        t_idxs=np.arange(len(t_secs))[tidx_select]
+        if flows is not None:
+            # need flows at the start of each interval
+            t_idxs=t_idxs[t_idxs<=len(flows)]
+        if volumes is not None:
+            t_idxs=t_idxs[t_idxs<len(volumes)]
+        n_intervals=max(0,len(t_idxs)-1)
+
+        QtodV,QtodVabs=self.mats_QtodV()
+        QtodV=QtodV.tocsr()
+        QtodVabs=QtodVabs.tocsr()
+        segs=np.arange(self.n_seg)[seg_select]
+
+        def read_vol(tidxs):
+            if volumes is None:
+                return self.volumes_block(tidxs)
+            return volumes[tidxs[0]:tidxs[-1]+1]
+        def read_flo(tidxs):
+            if flows is None:
+                return self.flows_block(tidxs)
+            return flows[tidxs[0]:tidxs[-1]+1]
+
+        def process(start):
+            # intervals start..stop-1, which needs volumes at start..stop
+            stop=min(start+block_size,n_intervals)
+            # work segment-major, so the sparse products see contiguous
+            # [exch,time] input.
+            Vt=np.asarray(read_vol(t_idxs[start:stop+1])).T.astype(np.float64,order='C')
+            Qt=np.asarray(read_flo(t_idxs[start:stop])).T.astype(np.float64,order='C')
+            dt=np.diff(t_secs[t_idxs[start:stop+1]]).astype(np.float64)
+
+            Vnow=Vt[:,1:]
+            err=Vnow-Vt[:,:-1]
+            err-=QtodV.dot(Qt)*dt
+            np.abs(Qt,out=Qt)
+            denom=QtodVabs.dot(Qt)
+            denom*=dt
+            denom+=Vnow
+            if not isinstance(seg_select,slice):
+                err=err[segs]
+                denom=denom[segs]
+            else:
+                err=err[seg_select]
+                denom=denom[seg_select]
+            denom[denom==0.0]=1.0
+            rel_err=np.abs(err)
+            rel_err/=denom
+
+            cols=np.arange(len(dt))
+            rows=np.arange(len(segs))
+            worst_seg=np.argmax(rel_err,axis=0)
+            worst_time=np.argmax(rel_err,axis=1)
+            return dict(rel_err_max=rel_err[worst_seg,cols],
+                        rel_err_rms=np.sqrt(np.mean(rel_err**2,axis=0)),
+                        worst_seg=segs[worst_seg],
+                        vol_err=err[worst_seg,cols],
+                        Q_err=err[worst_seg,cols]/dt,
+                        n_bad=(rel_err>rel_err_tol).sum(axis=0),
+                        seg_rel_err_max=rel_err[rows,worst_time],
+                        seg_vol_err=err[rows,worst_time],
+                        seg_worst_tidx=t_idxs[start+1+worst_time])
+
+        starts=range(0,n_intervals,block_size)
+        if workers>1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results=list(executor.map(process,starts))
+        else:
+            results=[process(start) for start in starts]
+
+        time_fields=['rel_err_max','rel_err_rms','worst_seg','vol_err','Q_err','n_bad']
+        ds=xr.Dataset()
+        ds['tidx']=('time',),t_idxs[1:]
+        ds['t_sec']=('time',),np.asarray(t_secs)[t_idxs[1:]]
+        ds['seg']=('seg',),segs
+        for fld in time_fields:
+            if results:
+                ds[fld]=('time',),np.concatenate([r[fld] for r in results])
+            else:
+                ds[fld]=('time',),np.zeros(0)
+        # reduce the per-segment worst case across blocks
+        seg_max=np.zeros(len(segs))
+        seg_vol_err=np.zeros(len(segs))
+        seg_tidx=np.zeros(len(segs),np.int32)
+        for r in results:
+            sel=r['seg_rel_err_max']>seg_max
+            seg_max[sel]=r['seg_rel_err_max'][sel]
+            seg_vol_err[sel]=r['seg_vol_err'][sel]
+            seg_tidx[sel]=r['seg_worst_tidx'][sel]
+        ds['seg_rel_err_max']=('seg',),seg_max
+        ds['seg_vol_err']=('seg',),seg_vol_err
+        ds['seg_worst_tidx']=('seg',),seg_tidx
+        ds.attrs['rel_err_max']=seg_max.max() if len(segs) else 0.0
+
+        if verbose:
+            if ds.attrs['rel_err_max']>rel_err_tol:
+                self.log.warning("****************BAD Volume Conservation*************")
+                self.log.warning("  %d of %d intervals, %d of %d segments above rel err tolerance"%
+                                 ( (ds.n_bad.values>0).sum(),n_intervals,
+                                   (seg_max>rel_err_tol).sum(),len(segs) ))
+                for i in np.argsort(-seg_max)[:n_worst]:
+                    if seg_max[i]<=rel_err_tol:
+                        break
+                    self.log.warning("  seg %6d  t=%10d  rel. err: %e  vol err: %e"%
+                                     (segs[i],t_secs[seg_tidx[i]],seg_max[i],seg_vol_err[i]))
+            else:
+                self.log.info("Volume conservation OK over %d intervals. Max rel. err: %e"%
+                              (n_intervals,ds.attrs['rel_err_max']))
+        return ds
+
+    def written_vol_flo(self):
+        """
+        Memmaps of the vol and flo files written by write(), as a tuple.
+        Raises OSError for missing files and ValueError for files which are
+        not a whole number of records.
+        """
+        vol_mmap=np.memmap(self.vol_filename,self.vol_dtype(),mode='r')
+        flo_mmap=np.memmap(self.flo_filename,self.flo_dtype(),mode='r')
+        return vol_mmap,flo_mmap
+
+    def check_written_volume_conservation(self,written=None,**kw):
+        """
+        Run check_volume_conservation_blocks() on the vol and flo files
+        written by write(), via memmap.  written: output of
+        written_vol_flo(), opened here by default.  Other keyword arguments
+        are passed on.
+        """
+        vol_mmap,flo_mmap=written or self.written_vol_flo()
+        return self.check_volume_conservation_blocks(volumes=vol_mmap['volume'],
+                                                     flows=flo_mmap['flow'],
+                                                     t_secs=vol_mmap['tstamp'],
+                                                     **kw)
+
     # Boundary handling
     # this representation follows the naming in the input file
     boundary_dtype=[('id','S20'),
@@ -2084,6 +2296,51 @@ class HydroFiles(Hydro):
                     return np.zeros(self.n_exch,'f4')
                 return data # all's well.
 
+    _volumes_mmap=None
+    def volumes_block(self,tidxs):
+        """ volumes for several time indices, read via memmap.  Assumes
+        the volume file has a frame for every entry of t_secs.
+        """
+        if self._volumes_mmap is None:
+            self._volumes_mmap=np.memmap(self.get_path('volumes-file'),self.vol_dtype(),
+                                         mode='r')
+        return self._volumes_mmap['volume'][tidxs]
+
+    def flows_block(self,tidxs):
+        """ flows for several time indices, read via memmap.  Steps beyond the
+        end of the file get zero flow, as in flows().
+        """
+        if self._flows_mmap is False:
+            return super(HydroFiles,self).flows_block(tidxs)
+        if self._flows_mmap is None:
+            self._flows_mmap=np.memmap(self.get_path('flows-file'), self.flo_dtype(),
+                                       mode='r')
+        tidxs=np.asarray(tidxs)
+        result=np.zeros((len(tidxs),self.n_exch),'f4')
+        valid=tidxs<len(self._flows_mmap)
+        if not np.all(valid):
+            self.log.info("flows_block: %d steps beyond end of flow data get zero flow"%(~valid).sum())
+        result[valid]=self._flows_mmap['flow'][tidxs[valid]]
+        return result
+
+    _areas_mmap=None
+    def areas_block(self,tidxs):
+        """ areas for several time indices, read via memmap.  Steps beyond
+        the last complete frame get that frame, as in areas().
+        """
+        if self._areas_mmap is None:
+            area_fn=self.get_path('areas-file')
+            n_frames=os.stat(area_fn).st_size // self.are_dtype().itemsize
+            if n_frames==0:
+                raise Exception("No complete frames in areas data")
+            self._areas_mmap=np.memmap(area_fn,self.are_dtype(),mode='r',
+                                       shape=(n_frames,))
+        tidxs=np.asarray(tidxs)
+        n_frames=len(self._areas_mmap)
+        if np.any(tidxs>=n_frames):
+            self.log.warning("Area data ends early by %d steps. Use previous"%(tidxs.max()+1-n_frames))
+        return self._areas_mmap['area'][np.minimum(tidxs,n_frames-1)]
+
     def update_flows(self,t,new_flows):
         """ the 'reverse' of flows(), this will overwrite flow data in the existing
         flo file.
@@ -4235,6 +4492,28 @@ class DwaqAggregator(Hydro):
             flows += Eflow.dot(p_flow)
         return flows
 
+    def volumes_block(self,tidxs):
+        """ aggregated volumes for several time indices, [len(tidxs),n_seg].
+        Same as volumes(), but seg_matrix is applied to the whole block.
+        """
+        vols=np.zeros( (len(tidxs),self.n_seg),'f4')
+        for p in range(self.nprocs):
+            if np.all(self.seg_local['agg'][p,:]<0):
+                continue
+            # same minimum volume as segment_aggregator()
+            p_vols=self.open_hyd(p).volumes_block(tidxs).clip(0.00001,np.inf)
+            vols += self.seg_matrix[p].dot(p_vols.T).T
+        return vols
+
+    def flows_block(self,tidxs):
+        """ aggregated flows for several time indices, [len(tidxs),n_exch]
+        """
+        flows=np.zeros( (len(tidxs),self.n_exch),'f4')
+        for p,Eflow in iteritems(self.flow_matrix):
+            p_flows=self.open_hyd(p).flows_block(tidxs)
+            flows += Eflow.dot(p_flows.T).T
+        return flows
+
     def segment_aggregator(self,t_sec,seg_fn,normalize=True,min_volume=0.00001,
                            nan_method='pass'):
         """ 
@@ -5487,10 +5766,15 @@ class FilterHydroBC(Hydro):
     lp_secs=86400*36./24
     selection='boundary'
 
-    # for large inputs, use memmap.
-    # apply_filter() will create temporary files, and put the names
-    # here.  then write*() can just move these files.
+    # read the original flo, vol and are files via memmap.  Requires the
+    # original to be HydroFiles.  Otherwise the original data are read a
+    # block of time steps at a time.
     use_memmap=True
+    # apply_filter() writes the filtered data to memmaps, and puts the
+    # filenames here.  These are the output files when the scenario's
+    # output directory already exists, otherwise files in tmp_dir which
+    # write*() then moves into place.
+    tmp_dir="."
     tmp_flo_fn=None
     tmp_vol_fn=None
     tmp_are_fn=None
@@ -5498,6 +5782,10 @@ class FilterHydroBC(Hydro):
     new_flo_mmap=None
     new_vol_mmap=None
     new_are_mmap=None
+    # original data, memmapped, or None when use_memmap is False
+    orig_volumes=None
+    orig_flows=None
+    orig_areas=None
     
     def __init__(self,original,**kws):
         """
@@ -5553,6 +5841,16 @@ class FilterHydroBC(Hydro):
     #  when cells dry up, leading to negative volume.
     filter_type='butter' # or 'fir'
 
+    # apply_filter() handles this many exchanges at a time, bounding
+    # memory to a few [time,exchange_block_size] arrays.  None: one exchange
+    # at a time.
+    exchange_block_size=256
+    # data are copied and checked this many time steps at a time
+    time_block_size=100
+    # number of threads filtering exchange blocks in parallel.  Updates to
+    # flows and volumes are still applied in order by the calling thread.
+    filter_workers=1
+
     _pad=None
     @property
     def pad(self):
@@ -5569,30 +5867,33 @@ class FilterHydroBC(Hydro):
         return self._dt
             
     def lowpass(self,data):
+        """
+        data: [time] or [time,...] array, filtered along the first axis.
+        """
         if self.filter_type=='butter':
             # For butterworth pad out the ends
-            pad =self.pad
-            npad=len(pad)
+            npad=len(self.pad)
+            pad=np.zeros( (npad,)+data.shape[1:] )
 
             flow_padded=np.concatenate( ( pad, 
                                           data,
                                           pad) )
             lp_flows=filters.lowpass(flow_padded,
-                                     cutoff=self.lp_secs,dt=self.dt)
+                                     cutoff=self.lp_secs,dt=self.dt,axis=0)
             lp_flows=lp_flows[npad:-npad] # trim the pad
         elif self.filter_type=='fir':
             # try no padding here
-            lp_flows=filters.lowpass_fir(data,winsize=int(self.lp_secs/self.dt))
+            lp_flows=filters.lowpass_fir(data,winsize=int(self.lp_secs/self.dt),axis=0)
         else:
             raise Exception('Bad filter type: %s'%self.filter_type)
         return lp_flows
 
     def apply_filter(self):
         """
-        Filters all of the hydro information.  Note that this is not smart about
-        loading only a small part of the data, and thus won't work when
-        applied to a large dataset.  Better to aggregate some and
-        then apply the lowpass.
+        Filters all of the hydro information.  The filtered data are written
+        to memmaps (see tmp_dir), and the original data are streamed into
+        them time_block_size steps at a time, so memory use is bounded by
+        the block sizes rather than the size of the run.
         """
         if self.use_memmap:
             # for this to work, the source data needs to be sitting on disk where
@@ -5609,52 +5910,145 @@ class FilterHydroBC(Hydro):
             self.orig_volumes=vol_mmap['volume']
             self.orig_flows  =flo_mmap['flow']
             self.orig_areas  =are_mmap['area']
+            src_fns=[flo_fn,vol_fn,are_fn]
+            flo_tstamps=flo_mmap['tstamp']
+            vol_tstamps=vol_mmap['tstamp']
+            are_tstamps=are_mmap['tstamp']
+        else:
+            self.orig_volumes=self.orig_flows=self.orig_areas=None
+            src_fns=[]
+            flo_tstamps=vol_tstamps=are_tstamps=self.t_secs
+
+        self.new_flo_mmap=self.output_mmap("tmp_flo_fn","flo_filename","tmp.flo",
+                                           self.flo_dtype(),flo_tstamps,src_fns)
+        self.filt_flows=self.new_flo_mmap['flow']
+        self.new_vol_mmap=self.output_mmap("tmp_vol_fn","vol_filename","tmp.vol",
+                                           self.vol_dtype(),vol_tstamps,src_fns)
+        self.filt_volumes=self.new_vol_mmap['volume']
+        self.new_are_mmap=self.output_mmap("tmp_are_fn","are_filename","tmp.are",
+                                           self.are_dtype(),are_tstamps,src_fns)
+        self.filt_areas=self.new_are_mmap['area']
+
+        self.copy_unfiltered()
 
-            # To modify these, have to create new file
-            self.tmp_flo_fn="tmp.flo"
-            self.tmp_vol_fn="tmp.vol"
-            self.tmp_are_fn="tmp.are"
+        # 4th order butterworth gives better rejection of tidal
+        # signal than FIR filter.
+        # but there can be some transients at the beginning, so pad the flows
+        # out with 0s:
+        # npad=int(5*self.lp_secs / dt)
 
-            self.log.info("Copying flo file")
-            shutil.copyfile(flo_fn,self.tmp_flo_fn)
-            self.log.info("Copying vol file")
-            shutil.copyfile(vol_fn,self.tmp_vol_fn)
-            self.log.info("Copying are file") # eventually gets modified
-            shutil.copyfile(are_fn,self.tmp_are_fn)
+        if self.exchange_block_size:
+            self.filter_exchange_blocks()
+        else:
+            self.filter_exchanges()
 
-            self.new_flo_mmap=np.memmap(self.tmp_flo_fn, self.flo_dtype(), mode='r+')
-            self.filt_flows=self.new_flo_mmap['flow']
+        self.adjust_negative_volumes()
 
-            self.new_vol_mmap=np.memmap(self.tmp_vol_fn, self.vol_dtype(), mode='r+')
-            self.filt_volumes=self.new_vol_mmap['volume']
+        # it's possible to have some transient negative volumes that work themselves out
+        # when other fluxes are included.  but in the end, can't have any negatives.
+        seg_min=self.volume_minima()
+        assert( np.all(seg_min>=0) )
+
+        if np.any(seg_min<self.min_volume):
+            self.log.warning("All volumes non-negative, but some below threshold of %f"%self.min_volume)
 
-            self.new_are_mmap=np.memmap(self.tmp_are_fn, self.are_dtype(), mode='r+')
-            self.filt_areas =self.new_are_mmap['area']
+        self.adjust_plan_areas()
+
+    def output_mmap(self,fn_attr,out_attr,tmp_fn,dtype,tstamps,src_fns):
+        """
+        Create a memmap for filtered data with a record per entry of tstamps,
+        and record its filename in fn_attr.  The file is the output file
+        (property out_attr) when the scenario's output directory exists and
+        it is not one of the source files src_fns, and otherwise tmp_fn in
+        tmp_dir.
+        """
+        fn=os.path.join(self.tmp_dir,tmp_fn)
+        try:
+            out_fn=getattr(self,out_attr)
+        except AttributeError: # no scenario, or no base_path yet
+            out_fn=None
+        if ( (out_fn is not None)
+             and os.path.isdir(os.path.dirname(os.path.abspath(out_fn)))
+             and not any(os.path.exists(out_fn) and os.path.samefile(out_fn,src)
+                         for src in src_fns) ):
+            fn=out_fn
+        setattr(self,fn_attr,fn)
+        mmap=np.memmap(fn,dtype,mode='w+',shape=(len(tstamps),))
+        mmap['tstamp']=tstamps
+        return mmap
+
+    def copy_unfiltered(self):
+        """
+        Stream the original volumes, areas and flows into the output memmaps,
+        time_block_size steps at a time.  With memmapped input, exchanges
+        which will be filtered are skipped, since the filter reads those from
+        the original flows.
+        """
+        if self.orig_flows is not None:
+            filtered=np.zeros(self.n_exch,np.bool_)
+            filtered[self.exchanges_to_filter()]=True
+            flow_cols=np.nonzero(~filtered)[0]
         else:
-            # old way - uses tons of RAM.  all of the RAM.
-            self.filt_volumes=np.array( [self.orig.volumes(t) for t in self.orig.t_secs] )
-            self.filt_flows  =np.array( [self.orig.flows(t)   for t in self.orig.t_secs] )
-            self.filt_areas  =np.array( [self.orig.areas(t)   for t in self.orig.t_secs] )
-            self.orig_volumes=self.filt_volumes.copy()
-            self.orig_flows  =self.filt_flows.copy()
+            flow_cols=slice(None)
 
-        dt=np.median(np.diff(self.t_secs))
+        copies=[ (self.filt_volumes,self.orig_volumes,self.orig.volumes_block,slice(None)),
+                 (self.filt_areas,self.orig_areas,self.orig.areas_block,slice(None)),
+                 (self.filt_flows,self.orig_flows,self.orig.flows_block,flow_cols) ]
+        for dest,src,read_block,cols in copies:
+            if isinstance(cols,np.ndarray) and len(cols)==0:
+                continue
+            for start in range(0,len(dest),self.time_block_size):
+                stop=min(start+self.time_block_size,len(dest))
+                if src is not None:
+                    data=src[start:stop]
+                else:
+                    data=read_block(np.arange(start,stop))
+                dest[start:stop,cols]=data[:,cols]
+
+    def volume_minima(self):
+        """
+        Minimum over time of each segment's filtered volume, scanned
+        time_block_size steps at a time.
+        """
+        seg_min=np.full(self.n_seg,np.inf)
+        for start in range(0,len(self.filt_volumes),self.time_block_size):
+            block=self.filt_volumes[start:start+self.time_block_size]
+            np.minimum(seg_min,block.min(axis=0),out=seg_min)
+        return seg_min
+
+    def clamp_min_area(self):
+        """
+        Raise filtered areas to at least min_area, time_block_size steps
+        at a time.
+        """
+        for start in range(0,len(self.filt_areas),self.time_block_size):
+            block=self.filt_areas[start:start+self.time_block_size]
+            block[block<self.min_area]=self.min_area
+
+    def unfiltered_flows(self):
+        """ the flows to filter: the original memmap if available, otherwise
+        flows copied into filt_flows.
+        """
+        if self.orig_flows is not None:
+            return self.orig_flows
+        return self.filt_flows
+
+    def filter_exchanges(self):
+        """
+        Lowpass the flows of exchanges_to_filter() one exchange at a time,
+        shifting the tidal part into the volumes of adjacent segments.
+        """
         pointers=self.pointers
 
-        # 4th order butterworth gives better rejection of tidal
-        # signal than FIR filter.
-        # but there can be some transients at the beginning, so pad the flows
-        # out with 0s:
-        # npad=int(5*self.lp_secs / dt)
-        
         for j in utils.progress(self.exchanges_to_filter()):
             # j: index into self.pointers.  
             segA,segB=pointers[j,:2]
 
-            lp_flows=self.lowpass(self.filt_flows[:,j])
+            flows=self.unfiltered_flows()[:,j]
+            lp_flows=self.lowpass(flows)
             
             # separate into tidal and subtidal constituents
-            tidal_flows=self.filt_flows[:,j]-lp_flows
+            tidal_flows=flows-lp_flows
             self.filt_flows[:,j]=lp_flows 
 
             tidal_volumes= np.cumsum(tidal_flows[:-1]*np.diff(self.t_secs))
@@ -5671,16 +6065,53 @@ class FilterHydroBC(Hydro):
                 #if np.any( self.filt_volumes[:,segB-1]<0 ):
                 #    self.log.warning("while filtering fluxes had negative volume (may be temporary)")
 
-        self.adjust_negative_volumes()
+    def filter_exchange_blocks(self):
+        """
+        Blocked version of filter_exchanges(): lowpass
+        the flows for exchange_block_size exchanges at a time, and shift the
+        tidal part into the volumes of the adjacent segments.  Blocks are
+        filtered by filter_workers threads, with no more than filter_workers
+        blocks in memory at once.
+        """
+        from concurrent.futures import ThreadPoolExecutor
 
-        # it's possible to have some transient negative volumes that work themselves out
-        # when other fluxes are included.  but in the end, can't have any negatives.
-        assert( np.all(self.filt_volumes>=0) )
+        exchs=np.asarray(self.exchanges_to_filter()).ravel()
+        block_size=self.exchange_block_size
+        blocks=[exchs[i:i+block_size] for i in range(0,len(exchs),block_size)]
+        dts=np.diff(self.t_secs)
+        src=self.unfiltered_flows()
 
-        if np.any(self.filt_volumes<self.min_volume):
-            self.log.warning("All volumes non-negative, but some below threshold of %f"%self.min_volume)
+        def filter_block(js):
+            # time-contiguous layout is about twice as fast for the filter
+            flows=np.asfortranarray(src[:,js])
+            lp_flows=self.lowpass(flows)
+            tidal_volumes=np.zeros(flows.shape)
+            np.cumsum( (flows-lp_flows)[:-1]*dts[:,None], axis=0, out=tidal_volumes[1:])
+            return lp_flows,tidal_volumes
 
-        self.adjust_plan_areas()
+        def apply_block(js,lp_flows,tidal_volumes):
+            self.filt_flows[:,js]=lp_flows
+            # a positive flow is *out* of segA, and *in* to segB
+            # positive volumes represent water which is now part of the cell
+            segA,segB=self.pointers[js,0],self.pointers[js,1]
+            seg_exch=np.concatenate( [ np.nonzero(segA>0)[0], np.nonzero(segB>0)[0] ] )
+            seg=np.concatenate( [segA[segA>0],segB[segB>0]] ) - 1
+            sign=np.concatenate( [np.ones((segA>0).sum()), -np.ones((segB>0).sum())] )
+            if len(seg)==0:
+                return
+            useg,seg_idx=np.unique(seg,return_inverse=True)
+            # [block exchanges, unique segments]
+            incidence=sparse.coo_matrix( (sign,(seg_exch,seg_idx)),
+                                         shape=(len(js),len(useg)) ).tocsc()
+            dV=(incidence.T.dot(tidal_volumes.T)).T
+            self.filt_volumes[:,useg]+=dV
+
+        workers=max(1,self.filter_workers)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for bi in utils.progress(range(0,len(blocks),workers)):
+                batch=blocks[bi:bi+workers]
+                for js,(lp_flows,tidal_volumes) in zip(batch,executor.map(filter_block,batch)):
+                    apply_block(js,lp_flows,tidal_volumes)
 
     min_volume=0.0 # 
     min_area = 1.0 # this is very important, I thought
@@ -5693,7 +6124,7 @@ class FilterHydroBC(Hydro):
     # non-negative over time.
     force_min_volume=True
     def adjust_negative_volumes(self):
-        has_negative=np.nonzero( np.any(self.filt_volumes<self.min_volume,axis=0 ) )[0]
+        has_negative=np.nonzero( self.volume_minima()<self.min_volume )[0]
         dt=np.median(np.diff(self.t_secs))
 
         for seg in has_negative:
@@ -5705,8 +6136,11 @@ class FilterHydroBC(Hydro):
                 self.log.warning("Segment with negative volume has no boundary exchanges")
                 if self.force_min_volume:
                     V_add=self.min_volume-self.filt_volumes[:,seg].min()
-                    self.log.warning("Forcing minimum volume. Adding %.3e  Original volumes max: %.3e, mean %.3e"%
-                                     (V_add, self.orig_volumes[:,seg].max(),self.orig_volumes[:,seg].mean()))
+                    if self.orig_volumes is not None:
+                        self.log.warning("Forcing minimum volume. Adding %.3e  Original volumes max: %.3e, mean %.3e"%
+                                         (V_add, self.orig_volumes[:,seg].max(),self.orig_volumes[:,seg].mean()))
+                    else:
+                        self.log.warning("Forcing minimum volume. Adding %.3e"%V_add)
                     self.filt_volumes[:,seg]+=V_add
                 
                 continue
@@ -5714,8 +6148,6 @@ class FilterHydroBC(Hydro):
                 self.log.info("Segment with negative volume has multiple BC exchanges.  Choosing the first")
             bc_exch=bc_exchs[0]
 
-            orig_vol=self.orig_volumes[:,seg]# here
-            orig_flow=self.orig_flows[:,bc_exch]
             filt_vol=self.filt_volumes[:,seg]
             filt_flow=self.filt_flows[:,bc_exch]
 
@@ -5726,7 +6158,6 @@ class FilterHydroBC(Hydro):
             # what it should be anyway.
             corr_flow=np.concatenate( ( corr_flow, [0]) )
 
-            orig_rms=utils.rms(orig_flow)
             filt_rms=utils.rms(filt_flow)
 
             self.filt_volumes[:,seg]   -=err_vol
@@ -5735,7 +6166,8 @@ class FilterHydroBC(Hydro):
             # report change in rms flow:
             upd_rms=utils.rms(self.filt_flows[:,bc_exch])
 
-            print("    Original flow rms: ",orig_rms)
+            if self.orig_flows is not None:
+                print("    Original flow rms: ",utils.rms(self.orig_flows[:,bc_exch]))
             print("    Filtered flow rms: ",filt_rms)
             print("    Updated flow rms:  ",upd_rms)
 
@@ -5758,41 +6190,45 @@ class FilterHydroBC(Hydro):
         # group in the sense of SQL group by
         groups=self.orig.seg_to_2d_element
 
-        volumes     =np.array( [self.volumes(t)      for t in self.t_secs] )
-        orig_volumes=np.array( [self.orig.volumes(t) for t in self.t_secs] )
-
         # sum volume in each water column
         # might have dense output of z-levels, for which there segments which don't
-        # belong to a water column - bincount doesn't like those negative values.
-        valid=groups>=0
-        
-        Vratio_filt_to_orig_2d=[ np.bincount(groups[valid],volumes[ti,valid])  / \
-                                 np.bincount(groups[valid],orig_volumes[ti,valid])                                 
-                                 for ti in range(len(self.t_secs)) ]
-        Afactor_per_2d_element=np.array( Vratio_filt_to_orig_2d )
-
-        # loop over vertical exchanges, updating areas
-        exchs=self.pointers
-        for j in range(self.n_exch_x+self.n_exch_y,self.n_exch):
-            segA,segB=exchs[j,:2] - 1 # seg now 0-based
-            if segA<0: # boundary
-                group=groups[segB]
-            elif segB<0: # boundary
-                group=groups[segA]
+        # belong to a water column - those are left out of the sums.
+        valid=np.nonzero(groups>=0)[0]
+        column_sum=sparse.coo_matrix( (np.ones(len(valid)),(groups[valid],np.arange(len(valid)))),
+                                      shape=(groups[valid].max()+1,len(valid)) ).tocsr()
+
+        # water column of each vertical exchange
+        exch_z=np.arange(self.n_exch_x+self.n_exch_y,self.n_exch)
+        segA,segB=(self.pointers[exch_z,:2] - 1).T # seg now 0-based
+        groupA=groups[np.maximum(segA,0)]
+        groupB=groups[np.maximum(segB,0)]
+        assert np.all( (segA<0) | (segB<0) | (groupA==groupB) )
+        exch_group=np.where(segA<0,groupB,groupA) # boundary: use the other side
+
+        # update exchange areas, a block of time steps at a time
+        for start in range(0,len(self.filt_areas),self.time_block_size):
+            stop=min(start+self.time_block_size,len(self.filt_areas))
+            volumes=self.filt_volumes[start:stop]
+            if self.orig_volumes is not None:
+                orig_volumes=self.orig_volumes[start:stop]
             else:
-                assert(groups[segA]==groups[segB])
-                group=groups[segA]
-            # update this exchanges area, for all time steps
-            self.filt_areas[:,j] *= Afactor_per_2d_element[:,group]
+                orig_volumes=self.orig.volumes_block(np.arange(start,stop))
+            # [2d element,time]
+            Afactor_per_2d_element=( column_sum.dot(volumes[:,valid].T)
+                                     / column_sum.dot(orig_volumes[:,valid].T) )
+            self.filt_areas[start:stop,exch_z] *= Afactor_per_2d_element[exch_group,:].T
 
         # clean up a slightly different issue while we're at it.
         # since upper layers can dry out, it's possible that we'll
         # add some lowpass flow, but the area will be zero.
         # there is also the very likely case that unused exchanges
         # have zero flow and zero area, but maybe that's not a big deal.
-        for exch in range(self.n_exch):
-            sel=(self.filt_areas[:,exch]==0) & (self.filt_flows[:,exch]!=0)
-            if np.any(sel):
+        block_size=self.exchange_block_size or 1
+        for start in range(0,self.n_exch,block_size):
+            js=np.arange(start,min(start+block_size,self.n_exch))
+            zero_area=(self.filt_areas[:,js]==0) & (self.filt_flows[:,js]!=0)
+            for exch in js[np.any(zero_area,axis=0)]:
+                sel=(self.filt_areas[:,exch]==0) & (self.filt_flows[:,exch]!=0)
                 self.log.warning("Cleaning up zero area exchange %d"%exch)
                 if np.all( self.filt_areas[:,exch]==0  ):
                     raise Exception("An exchange has some flow, but never has any area")
@@ -5801,9 +6237,7 @@ class FilterHydroBC(Hydro):
                 
         # and finally, delwaq2 doesn't like to have any zero-area exchanges, even if
         # they never have any flow.  so they all get unit area.
-        
-        self.filt_areas[ self.filt_areas<self.min_area ] = self.min_area
-
+        self.clamp_min_area()
 
     def exchanges_to_filter(self):
         """
@@ -5907,7 +6341,12 @@ class FilterHydroBC(Hydro):
 
     def copy_mmap_or_delegate(self,fn_attr,mmap_attr,deleg,new_fn):
         tmp_fn=getattr(self,fn_attr)
-        if self.use_memmap and tmp_fn is not None:
+        if tmp_fn is not None and os.path.abspath(tmp_fn)==os.path.abspath(new_fn):
+            # apply_filter() wrote straight to the output file
+            getattr(self,mmap_attr).flush()
+            setattr(self,mmap_attr,None)
+            return
+        if tmp_fn is not None:
             assert os.path.exists(tmp_fn),"Hmm - should have memory mapped but %s is not there"%tmp_fn
             delattr(self,mmap_attr)
             setattr(self,mmap_attr,None)
@@ -5958,7 +6397,7 @@ class FilterAll(FilterHydroBC):
                 
         # and finally, delwaq2 doesn't like to have any zero-area exchanges, even if
         # they never have any flow.  so they all get unit area.
-        self.filt_areas[ self.filt_areas<self.min_area ] = self.min_area
+        self.clamp_min_area()
 
     def planform_areas(self):
         """ Skip FilterHydroBC's filtering of planform areas, use the original hydro
@@ -7033,6 +7472,13 @@ class ParameterSpatioTemporal(Parameter):
     interpolation='LINEAR' # or 'BLOCK'
     warned_2d_to_3d=False # track one-time warning when data is supplied as 2D
 
+    # write_supporting() writes this many timesteps per block.  None
+    # writes one timestep at a time.
+    write_block_size=100
+    # number of threads used by write_supporting_concurrently().  1 writes
+    # the files one after another; larger values are opt-in.
+    write_workers=1
+
     def __init__(self,times=None,values=None,func_t=None,scenario=None,name=None,
                  seg_func_file=None,enable_write_symlink=None,n_seg=None,
                  hydro=None):
@@ -7144,6 +7590,9 @@ class ParameterSpatioTemporal(Parameter):
             self.write_supporting_loop(tidxs,fp,name=target)
 
     def write_supporting_loop(self,tidxs,fp,name='n/a'):
+        if self.write_block_size:
+            return self.write_supporting_blocks(tidxs,fp,name=name)
+
         t_secs=self.times.astype('i4')
         
         for tidx in utils.progress(tidxs,msg=name+": %s"):
@@ -7160,6 +7609,43 @@ class ParameterSpatioTemporal(Parameter):
                 values=self.func_t(t)
             fp.write(values.astype('f4').tobytes())
 
+    def write_supporting_blocks(self,tidxs,fp,name='n/a'):
+        """
+        Same output as the per-timestep loop in write_supporting_loop(), but
+        each block of write_block_size timesteps is assembled in memory and
+        written in one call.
+        """
+        t_secs=self.times.astype('i4')
+        tidxs=np.asarray(tidxs)
+        block_size=self.write_block_size
+
+        for start in utils.progress(range(0,len(tidxs),block_size),msg=name+": %s"):
+            block_tidxs=tidxs[start:start+block_size]
+            block_t=t_secs[block_tidxs]
+            seg_idx=None
+            if self.values is not None:
+                values=np.asarray(self.values[block_tidxs,:])
+                if (values.shape[1]==self.hydro.n_2d_elements) and (values.shape[1]!=self.hydro.n_seg):
+                    if not self.warned_2d_to_3d:
+                        self.scenario.log.warning("Padding parameter %s from 2D to 3D"%self.safe_name)
+                        self.warned_2d_to_3d=True
+                    seg_idx=self.hydro.seg_to_2d_element
+            else:
+                values=np.array( [self.func_t(t) for t in block_t] )
+            values=values.reshape(len(block_tidxs),-1)
+            # same layout as [('t','i4'),('value','f4',n)], but as a plain 2D
+            # array the copies stay aligned, which is much faster.
+            n_values=values.shape[1] if seg_idx is None else len(seg_idx)
+            block=np.empty( (len(block_tidxs),1+n_values), 'f4')
+            block.view('i4')[:,0]=block_t
+            if seg_idx is None:
+                block[:,1:]=values
+            else:
+                # row at a time is several times faster than a 2D fancy index
+                for row in range(len(values)):
+                    block[row,1:]=values[row][seg_idx]
+            fp.write(block.data)
+
     def load_from_segment_file(self):
         """
         Set self.values and self._times from the segment function file.
@@ -7277,6 +7763,28 @@ def cast_to_parameter(v):
         # Not at this point, though.
         return ParameterConstant(v)
     
+
+def write_supporting_concurrently(params,workers=None):
+    """
+    Call write_supporting() for each ParameterSpatioTemporal in params,
+    with up to workers (default ParameterSpatioTemporal.write_workers)
+    files written at once.  Returns the list of parameters written.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    params=[p for p in params if isinstance(p,ParameterSpatioTemporal)]
+    if workers is None:
+        workers=ParameterSpatioTemporal.write_workers
+    if workers<=1 or len(params)<=1:
+        for p in params:
+            p.write_supporting()
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # list() to propagate any exceptions
+            list(executor.map(lambda p: p.write_supporting(),params))
+    return params
+
+
 # Options for defining parameters and substances:
 # 1. as before - list attributes of the class
 #    this is annoying because you can't alter the lists easily/safely 
@@ -9335,8 +9843,11 @@ INCLUDE '{self.atr_filename}'  ; attributes file
     def text_block07(self):
         lines=['; seventh block of model input (process parameters)']
 
-        for param in self.scenario.parameters.values():
-            lines.append( param.text(write_supporting=True) )
+        params=list(self.scenario.parameters.values())
+        # the larger supporting files can be written in parallel
+        written=write_supporting_concurrently(params)
+        for param in params:
+            lines.append( param.text(write_supporting=(param not in written)) )
         for param in self.scenario.hydro_parameters.values():
             # hydro.write() takes care of writing its own parameters
             lines.append( param.text(write_supporting=False) )
@@ -24,9 +24,8 @@ from __future__ import print_function
 
 import os
 
-from collections import defaultdict
-
 import numpy as np
+from six import iteritems
 
 from . import waq_scenario 
 
@@ -157,83 +156,166 @@ class ZLayerAggregator(waq_scenario.DwaqAggregator):
     dzmin_m=0.0
 
     def init_seg_mapping(self):
+        """ populates seg_local, agg_seg and inactive_segs, following the
+        mapping chosen by self.mode
+        """
+        self.agg_seg=[]
+        self.agg_seg_hash={} # (k,elt) => index into agg_seg
+
+        self.seg_local=np.zeros( (self.nprocs,self.max_segs_per_proc),self.seg_local_dtype)
+        self.seg_local['agg'][...] = -1
+
         if self.mode=='original':
-            return self.init_seg_mapping_original()
+            self.init_seg_mapping_original()
         elif self.mode=='sort':
-            return self.init_seg_mapping_sort()
+            self.init_seg_mapping_sort()
         elif self.mode=='combine_bed':
-            return self.init_seg_mapping_combine_bed()
+            self.init_seg_mapping_combine_bed()
         else:
             assert False
 
-    def init_seg_mapping_sort(self):
-        self.agg_seg=[]
-        self.agg_seg_hash={} # (k,elt) => index into agg_seg
+        # 'sort' allocates every layer of an element, and some may not
+        # receive any local segments
+        agg=self.seg_local['agg']
+        counts=np.bincount(agg[agg>=0],minlength=len(self.agg_seg))
+        self.inactive_segs=list(np.nonzero(counts==0)[0])
+        for agg_segi in self.inactive_segs:
+            self.agg_seg[agg_segi]['active']=False
 
-        seg_local_to_agg=np.zeros( (self.nprocs,self.max_segs_per_proc),'i4') - 1
+    def local_segments(self):
+        """
+        Gather the unaggregated segments which fall within an aggregated
+        element, for all processors at once.
+        Returns a list with a dict per processor which has any such segments:
+          p: processor
+          seg: 0-based local segments, grouped by water column and ordered
+            surface to bed within each column.
+          col: 0-based local 2D element of each segment
+          col_start: True for the first (surface) segment of each column
+          k: index of the segment within its water column, 0 at the surface
+          seg_k: layer of the segment as reported by the hydro
+          agg_elt: aggregated 2D element of each segment
+          ghost: True for segments in elements owned by another processor
+          hyd,nc: the hydro and flowgeom for the processor
+        """
+        tables=[]
+        for p in range(self.nprocs):
+            nc=self.open_flowgeom_ds(p)
+
+            global_ids=nc.FlowElemGlobalNr.values-1 # make 0-based
+            col_agg_elt=self.elt_global_to_agg_2d[global_ids]
+            if not np.any(col_agg_elt>=0):
+                self.log.info("Proc %d has no local elements in an aggregated element"%p)
+                continue
+
+            hyd=self.open_hyd(p)
+            hyd.infer_2d_elements()
+            seg_to_2d=hyd.seg_to_2d_element
+
+            segs=np.nonzero(seg_to_2d>=0)[0]
+            segs=segs[ col_agg_elt[seg_to_2d[segs]]>=0 ]
+            # stable sort keeps segments within a column in increasing order,
+            # which is surface->bed.
+            segs=segs[ np.argsort(seg_to_2d[segs],kind='stable') ]
+            cols=seg_to_2d[segs]
+
+            idx=np.arange(len(segs))
+            col_start=np.r_[True,cols[1:]!=cols[:-1]]
+            k=idx - np.maximum.accumulate(np.where(col_start,idx,0))
+
+            tables.append( dict(p=p,seg=segs,col=cols,col_start=col_start,k=k,
+                                seg_k=np.asarray(hyd.seg_k)[segs],
+                                agg_elt=col_agg_elt[cols],
+                                ghost=(nc.FlowElemDomain.values[cols]!=p),
+                                hyd=hyd,nc=nc) )
+        return tables
+
+    def assign_agg_segments(self,tables,agg_ks):
+        """
+        tables: output of local_segments()
+        agg_ks: matching list of arrays, aggregated layer for each local segment.
+        Allocates the aggregated segments and fills in seg_local.
+        """
+        n_elt=len(self.elements)
+        keys=np.concatenate( [agg_k*n_elt+tbl['agg_elt']
+                              for tbl,agg_k in zip(tables,agg_ks)] ).astype(np.int64)
+        ukeys,inv=np.unique(keys,return_inverse=True)
+        agg_segs=np.array( [self.get_agg_segment(agg_k=ukey//n_elt,agg_elt=ukey%n_elt)
+                            for ukey in ukeys], np.int32 )
+        agg_segs=agg_segs[inv]
+
+        offset=0
+        for tbl in tables:
+            n=len(tbl['seg'])
+            self.seg_local['agg'][tbl['p'],tbl['seg']] = agg_segs[offset:offset+n]
+            self.seg_local['ghost'][tbl['p'],tbl['seg']] = tbl['ghost']
+            offset+=n
 
+    def init_seg_mapping_sort(self):
         n_layers_for_elt=self.n_agg_layers
 
-        for elt_i in range(len(self.elements)):
-            self.log.info("--- Processing aggregate element %d ---"%elt_i)
-
-            # first two entries are for lexsort
-            elt_segs=[] # [ (seg_z,bed_z,proc,local_seg,vol), ...]
-
-            V_agg_elt=0.0 # accumulate total volume (approx by first time step)
-
-            for p in range(self.nprocs):
-                nc=self.open_flowgeom(p)
-
-                global_ids=nc.FlowElemGlobalNr[:]-1 # make 0-based
-
-                sel_elt=(self.elt_global_to_agg_2d[global_ids]==elt_i)
-                if not np.any(sel_elt):
-                    self.log.info("This proc has no local elements in this aggregated element")
-                    continue
-
-                hyd=self.open_hyd(p)
-                hyd.infer_2d_elements()
-                seg_to_2d=hyd.seg_to_2d_element
-
-                local_vols=hyd.volumes(hyd.t_secs[0])
-                # iterate over columns, so we can calculate bed depth at the same time.
-                elt_areas=nc.FlowElem_bac[:]
-
-                for local_elt in np.nonzero(sel_elt)[0]: # Loop over local water columns
-                    segs=np.nonzero( (seg_to_2d==local_elt) )[0]
-                    # print "Found %d segs in this water column"%len(segs)
-                    # segs are already ordered surface->bed
-
-                    Vsegs=local_vols[segs]
-                    local_elt_area=elt_areas[local_elt]
-                    V_agg_elt+=Vsegs.sum() # accumulate
-                    D=Vsegs.sum()/local_elt_area
-
-                    d=0
-                    for seg,Vseg in zip(segs,Vsegs):
-                        d+=Vseg/local_elt_area # depth of bottom of the segment
-                        elt_segs.append( (d,D,p,seg,Vseg) )
-            # /for p in range(self.nprocs)
-
-            elt_segs=np.array(elt_segs)
-            order=np.lexsort(elt_segs[:,1::-1].T)
-
-            cumul_vol=np.cumsum(elt_segs[order,4])
+        tables=self.local_segments()
+
+        # depth of segment bottom, depth of bed and volume for all local segments
+        seg_d=[]
+        seg_D=[]
+        seg_V=[]
+        for tbl in tables:
+            hyd=tbl['hyd']
+            Vsegs=hyd.volumes(hyd.t_secs[0])[tbl['seg']]
+            seg_area=tbl['nc'].FlowElem_bac.values[tbl['col']]
+            dz=Vsegs/seg_area
+
+            # depth of bottom of the segment, accumulated down each column
+            d=np.zeros(len(dz))
+            for k in range(1+tbl['k'].max()):
+                sel=np.nonzero(tbl['k']==k)[0]
+                d[sel]=dz[sel]
+                if k>0:
+                    d[sel]+=d[sel-1]
+            starts=np.nonzero(tbl['col_start'])[0]
+            D=np.add.reduceat(Vsegs,starts)/seg_area[starts]
+            seg_d.append(d)
+            seg_D.append(np.repeat(D,np.diff(np.r_[starts,len(d)])))
+            seg_V.append(Vsegs)
+
+        agg_elt=np.concatenate([tbl['agg_elt'] for tbl in tables])
+        seg_d=np.concatenate(seg_d)
+        seg_D=np.concatenate(seg_D)
+        seg_V=np.concatenate(seg_V).astype(np.float64)
+
+        # order by aggregated element, then the depth of the segment bottom
+        # and the depth of the bed.
+        order=np.lexsort( (seg_D,seg_d,agg_elt) )
+        elt_sorted=agg_elt[order]
+        cumul_vol=np.cumsum(seg_V[order])
+
+        idx=np.arange(len(order))
+        elt_start=np.r_[True,elt_sorted[1:]!=elt_sorted[:-1]]
+        elt_end=np.r_[elt_start[1:],True]
+        first=np.maximum.accumulate(np.where(elt_start,idx,0))
+        # cumulative and total volume within each aggregated element
+        cumul_vol-=cumul_vol[first]-seg_V[order][first]
+        V_agg_elt=np.repeat(cumul_vol[elt_end],np.diff(np.r_[np.nonzero(elt_start)[0],len(order)]))
+
+        # equal volume layers: a segment falls in the last layer whose top
+        # break it reaches.
+        step=V_agg_elt/n_layers_for_elt
+        k_agg=np.zeros(len(order),np.int32)
+        for k in range(1,n_layers_for_elt):
+            k_agg+=(k*step <= cumul_vol)
+        seg_k_agg=np.zeros(len(order),np.int32)
+        seg_k_agg[order]=k_agg
+
+        # allocate all layers, even if some end up empty
+        for elt_i in np.unique(agg_elt):
+            for k in range(n_layers_for_elt):
+                self.get_agg_segment(agg_k=k,agg_elt=elt_i)
+
+        offsets=np.cumsum([0]+[len(tbl['seg']) for tbl in tables])
+        self.assign_agg_segments(tables,[seg_k_agg[a:b]
+                                         for a,b in zip(offsets[:-1],offsets[1:])])
 
-            breaks=np.linspace(0,V_agg_elt,1+n_layers_for_elt)
-            break_idxs=np.searchsorted(cumul_vol,breaks)
-            break_idxs[-1]=len(elt_segs) # avoid 1-off error
-
-            for k_agg in range(n_layers_for_elt):
-                agg_seg = self.get_agg_segment(agg_k=k_agg,agg_elt=elt_i)
-                segs_this_layer=elt_segs[order[break_idxs[k_agg]:break_idxs[k_agg+1]]]
-                for seg in segs_this_layer:
-                    d,D,p,seg,Vseg = seg
-                    seg_local_to_agg[int(p),int(seg)] = agg_seg
-        # and done
-        self.seg_local_to_agg=seg_local_to_agg
-                    
     def planform_areas(self):
         """ 
         Return a Parameter object encapsulating variability of planform 
@@ -251,169 +333,113 @@ class ZLayerAggregator(waq_scenario.DwaqAggregator):
         """
 
         # This is the old code - just maps maximum area from the grid
-        map2d3d=self.agg_seg_to_agg_elt_2d()
+        map2d3d=self.infer_2d_elements()
         data=(self.elements['plan_area'][map2d3d]).astype('f4')
-        return waq_scenario.ParameterSpatial(data)
+        return waq_scenario.ParameterSpatial(data,hydro=self)
+
+    _exch_z_columns=None
+    def exch_z_columns(self):
+        """
+        Vertical exchanges grouped by 2D element, computed once and reused
+        for every time step.  Returns a dict
+          exch: 0-based vertical exchanges, sorted by element
+          starts: index into exch of the first exchange of each element
+          counts: number of exchanges for each element
+        """
+        if self._exch_z_columns is None:
+            poi=self.pointers
+            self.infer_2d_elements()
+
+            # use the to segment, since some from segments are boundary/negative
+            exch_z=np.arange(self.n_exch-self.n_exch_z,self.n_exch)
+            elt_for_exch_z=self.seg_to_2d_element[poi[exch_z,1]-1]
+            exch_z=exch_z[elt_for_exch_z>=0]
+            elt_for_exch_z=elt_for_exch_z[elt_for_exch_z>=0]
+
+            order=np.argsort(elt_for_exch_z,kind='stable')
+            elts=elt_for_exch_z[order]
+            starts=np.nonzero(np.r_[True,elts[1:]!=elts[:-1]])[0]
+            self._exch_z_columns=dict(exch=exch_z[order],
+                                      starts=starts,
+                                      counts=np.diff(np.r_[starts,len(elts)]))
+        return self._exch_z_columns
 
     def areas(self,t):
-        areas=super(ZLayerAggregator,self).areas(t)
+        return self.areas_block([self.t_sec_to_index(t)])[0]
+
+    def areas_block(self,tidxs):
+        """ exchange areas for several time indices, [len(tidxs),n_exch].
+        Local areas are aggregated with area_matrix for the whole block,
+        and vertical exchanges in each water column set to the column max.
+        """
+        areas=np.zeros( (len(tidxs),self.n_exch),'f4')
+        for p,Earea in iteritems(self.area_matrix):
+            hyd=self.open_hyd(p)
+            p_areas=hyd.areas_block(tidxs)
+            areas += Earea.dot(p_areas.T).T
 
         # here we make all the areas equal to the max.
         # it may be that we could deal with wetting and drying here, too.  not sure.
-        
-        # map vertical exchanges to 2d element
-        poi=self.pointers
-        self.infer_2d_elements()
-
-        # use the to segment, since some from segments are boundary/negative
-        elt_for_exch_z=self.seg_to_2d_element[poi[:,1]-1]
-        elt_for_exch_z[:-self.n_exch_z] = -1 # limit to vertical
-
-        for elt in range(self.n_2d_elements):
-            exch_sel=(elt_for_exch_z==elt)
-            areas[exch_sel]=areas[exch_sel].max()
-        
+        cols=self.exch_z_columns()
+        if len(cols['exch']):
+            col_max=np.maximum.reduceat(areas[:,cols['exch']],cols['starts'],axis=1)
+            areas[:,cols['exch']]=np.repeat(col_max,cols['counts'],axis=1)
         return areas
 
     def init_seg_mapping_original(self):
-        """ the end product here is seg_local_to_agg, and entries in agg_seg
+        """ all segments retain their original z level.
         """
-        self.agg_seg=[]
-        self.agg_seg_hash={} # (k,elt) => index into agg_seg
-
-        seg_local_to_agg=np.zeros( (self.nprocs,self.max_segs_per_proc),'i4') - 1
-
-        # this is going to vary by the deepest layer in each region
-        # n_layers_for_elt=self.n_agg_layers
-
-        for elt_i in range(len(self.elements)):
-            print("--- Processing aggregate element %d ---"%elt_i)
-
-            for p in range(self.nprocs):
-                nc=self.open_flowgeom(p)
-
-                global_ids=nc.FlowElemGlobalNr[:]-1 # make 0-based
-
-                sel_elt=(self.elt_global_to_agg_2d[global_ids]==elt_i)
-                if not np.any(sel_elt):
-                    print("This proc has no local elements in this aggregated element")
-                    continue
-
-                hyd=self.open_hyd(p)
-                hyd.infer_2d_elements()
-                seg_to_2d=hyd.seg_to_2d_element
-
-                # local_vols=hyd.volumes(hyd.t_secs[0])
-                # iterate over columns, so we can calculate bed depth at the same time.
-                # elt_areas=nc.FlowElem_bac[:]
-
-                for local_elt in np.nonzero(sel_elt)[0]: # Loop over local water columns
-                    # these are all the segments which fall within this aggregated
-                    # segment, for this processor.
-                    segs=np.nonzero( (seg_to_2d==local_elt) )[0]
-
-                    for seg in segs: 
-                        agg_k=hyd.seg_k[seg]
-                        agg_seg = self.get_agg_segment(agg_k=agg_k,agg_elt=elt_i)
-                        seg_local_to_agg[p,seg] = agg_seg
-
-        # and done
-        self.seg_local_to_agg=seg_local_to_agg
+        tables=self.local_segments()
+        self.assign_agg_segments(tables,[tbl['seg_k'] for tbl in tables])
 
     def init_seg_mapping_combine_bed(self):
-        self.agg_seg=[]
-        self.agg_seg_hash={} # (k,elt) => index into agg_seg
-
-        seg_local_to_agg=np.zeros( (self.nprocs,self.max_segs_per_proc),'i4') - 1
-
-        # n_layers_for_elt=self.n_agg_layers
-
-        for elt_i in range(len(self.elements)):
-            self.log.info("--- Processing aggregate element %d ---"%elt_i)
-
-            elt_segs=[] # [ (seg_k,bed_z,proc,local_seg,vol), ...]
-
-            layer_vols=defaultdict(lambda: 0.0) # accumulate volume per original layer
-            agg_elt_area=0.0 # accumulate surface planform area
-            
-            elt_segs=[] # [(proc,seg,seg_k),...]
-
-            for p in range(self.nprocs):
-                nc=self.open_flowgeom(p)
-
-                global_ids=nc.FlowElemGlobalNr[:]-1 # make 0-based
-
-                sel_elt=(self.elt_global_to_agg_2d[global_ids]==elt_i)
-                if not np.any(sel_elt):
-                    self.log.info("This proc has no local elements in this aggregated element")
-                    continue
-
-                hyd=self.open_hyd(p)
-                hyd.infer_2d_elements()
-                seg_to_2d=hyd.seg_to_2d_element
-
-                local_vols=hyd.volumes(hyd.t_secs[0])
-                elt_areas=nc.FlowElem_bac[:]
-
-                for local_elt in np.nonzero(sel_elt)[0]: # Loop over local water columns
-                    agg_elt_area += elt_areas[local_elt]
-                    segs=np.nonzero( (seg_to_2d==local_elt) )[0]
-                    for seg in segs:
-                        layer_vols[ hyd.seg_k[seg] ] += local_vols[seg]
-                        elt_segs.append( (p,seg,hyd.seg_k[seg]) )
-
-            # get a list of layers and their thicknesses:
-            Nk = 1+np.max(layer_vols.keys())
-            all_dz=[ layer_vols[k] / agg_elt_area
-                     for k in range(Nk) ]
-            
-            # these don't line up precisely with what delwaq reports, but pretty close.
-            # maybe using a slightly different area, or volume taken from a different time
-            # print "Layer thicknesses:"
-            # print all_dz
-
-            k_map=np.arange(Nk) # this is the no-op version - no combining
-
-            # loop from the bottom up:
-            dz_combined=0.0
-            count=0
-            groups=[]
-            this_group=[]
-            dzmin=self.dzmin_m
-            for k in range(Nk)[::-1]:
-                this_group.append(k)
-                dz_combined+=all_dz[k]
-                if dz_combined < dzmin:
-                    continue # keep lumping
-                else:
-                    groups.append(this_group)
-                    this_group=[]
-                    dz_combined=0.0
-                if all_dz[k]>=dzmin:
-                    dzmin=0.0 # no more lumping
-            if this_group:
-                groups.append(this_group)
-                this_group=[]
-                    
-            self.log.info("Lumped layers are (in reverse order):")
-            self.log.info(str(groups))
-
-            groups=groups[::-1]
-            for agg_k,seg_ks in enumerate(groups):
-                for seg_k in seg_ks:
-                    k_map[seg_k]=agg_k
-
-            self.log.info("k_map is then:")
-            self.log.info(str(k_map))
-
-            for p,seg,seg_k in elt_segs:
-                agg_k=k_map[seg_k]
-                agg_seg = self.get_agg_segment(agg_k=agg_k,agg_elt=elt_i)
-                seg_local_to_agg[p,seg] = agg_seg
-
-        # and done
-        self.seg_local_to_agg=seg_local_to_agg
-                    
-
-
-
+        tables=self.local_segments()
+        n_elt=len(self.elements)
+
+        agg_elt=np.concatenate([tbl['agg_elt'] for tbl in tables])
+        seg_k=np.concatenate([tbl['seg_k'] for tbl in tables])
+        Kmax=1+seg_k.max()
+
+        # accumulate volume per original layer and surface planform area
+        layer_vols=np.zeros(n_elt*Kmax)
+        agg_elt_area=np.zeros(n_elt)
+        for tbl in tables:
+            hyd=tbl['hyd']
+            local_vols=hyd.volumes(hyd.t_secs[0])[tbl['seg']]
+            np.add.at(layer_vols,tbl['agg_elt']*Kmax+tbl['seg_k'],local_vols)
+            starts=tbl['col_start']
+            elt_areas=tbl['nc'].FlowElem_bac.values[tbl['col'][starts]]
+            np.add.at(agg_elt_area,tbl['agg_elt'][starts],elt_areas)
+        Nk=np.zeros(n_elt,np.int32)
+        np.maximum.at(Nk,agg_elt,seg_k+1)
+
+        # layer thicknesses:
+        # these don't line up precisely with what delwaq reports, but pretty close.
+        # maybe using a slightly different area, or volume taken from a different time
+        with np.errstate(divide='ignore',invalid='ignore'):
+            all_dz=layer_vols.reshape([n_elt,Kmax]) / agg_elt_area[:,None]
+
+        # loop from the bottom up, all elements at once:
+        dz_combined=np.zeros(n_elt)
+        dzmin=np.full(n_elt,float(self.dzmin_m))
+        group=np.zeros( (n_elt,Kmax),np.int32) # group index, counted from the bed
+        n_closed=np.zeros(n_elt,np.int32)
+        group_open=np.zeros(n_elt,np.bool_)
+        for k in range(Kmax)[::-1]:
+            active=k<Nk
+            group[:,k]=n_closed
+            dz_combined[active]+=all_dz[active,k]
+            # keep lumping while the group is thinner than dzmin
+            close=active & ~(dz_combined<dzmin)
+            n_closed[close]+=1
+            dz_combined[close]=0.0
+            group_open[active]=~close[active]
+            # no more lumping once a layer is thick enough on its own
+            dzmin[close & (all_dz[:,k]>=dzmin)]=0.0
+
+        n_groups=n_closed+group_open
+        k_map=n_groups[:,None]-1-group
+        self.log.info("%d aggregated elements have lumped bed layers"%np.sum(n_groups<Nk))
+
+        self.assign_agg_segments(tables,[k_map[tbl['agg_elt'],tbl['seg_k']]
+                                         for tbl in tables])
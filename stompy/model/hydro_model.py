@@ -8,6 +8,7 @@ import logging
 log=logging.getLogger('HydroModel')
 
 import copy
+from collections import defaultdict
 
 import numpy as np
 import xarray as xr
@@ -909,9 +910,14 @@ class HydroModel(object):
     # this is only used for setting utc_to_native, and native_to_utc
     utc_offset=np.timedelta64(0,'h') # -8 for PST
 
+    # Before writing BCs, batch their data requests by source and cache the
+    # extractions (see BCCompiler).  False fetches each BC's data directly.
+    compile_bcs=True
+
     def __init__(self,**kw):
         self.log=log
         self.bcs=[]
+        self.bc_compiler=BCCompiler(self)
         self.extra_files=[]
         self.gazetteers=[]
 
@@ -1157,6 +1163,8 @@ class HydroModel(object):
         raise Exception("Implement in subclass")
     
     def write_forcing(self):
+        if self.compile_bcs:
+            self.bc_compiler.compile()
         for bc in self.bcs:
             self.write_bc(bc)
 
@@ -1447,6 +1455,11 @@ class OTPSHelper(object):
 
     def __init__(self,otps_model,**kw):
         self.otps_model=otps_model # something like OhS
+
+    @staticmethod
+    def otps_times(data_start,data_stop):
+        return np.arange(data_start,data_stop,15*np.timedelta64(60,'s'))
+
     def dataset(self):
         """
         extract h,u,v from OTPS.
@@ -1460,17 +1473,24 @@ class OTPSHelper(object):
         from stompy.model.otps import read_otps
 
         ds=xr.Dataset()
-        times=np.arange( self.data_start,
-                         self.data_stop,
-                         15*np.timedelta64(60,'s') )
+        times=self.otps_times(self.data_start,self.data_stop)
         log.debug("Will generate tidal prediction for %d time steps"%len(times))
         ds['time']=('time',),times
-        modfile=read_otps.model_path(self.otps_model)
         xy=np.array(self.geom.coords)
-        ll=self.model.native_to_ll(xy)
-        # Note z=1.0 to get transport values in m2/s
-        pred_h,pred_U,pred_V=read_otps.tide_pred(modfile,lon=ll[:,0],lat=ll[:,1],
-                                                 time=times,z=1.0)
+
+        # Use the batched prediction if the model compiled one for this BC
+        pred=None
+        bc_compiler=getattr(self.model,'bc_compiler',None)
+        if bc_compiler is not None:
+            pred=bc_compiler.otps_lookup(self.otps_model,xy,times)
+        if pred is not None:
+            pred_h,pred_U,pred_V=pred
+        else:
+            modfile=read_otps.model_path(self.otps_model)
+            ll=self.model.native_to_ll(xy)
+            # Note z=1.0 to get transport values in m2/s
+            pred_h,pred_U,pred_V=read_otps.tide_pred(modfile,lon=ll[:,0],lat=ll[:,1],
+                                                     time=times,z=1.0)
         pred_h=pred_h.mean(axis=1)
         pred_U=pred_U.mean(axis=1)
         pred_V=pred_V.mean(axis=1)
@@ -1703,9 +1723,19 @@ class HycomMultiBC(MultiBC):
         self.populate_values()
 
     def populate_files(self):
-        self.data_files=hycom.fetch_range(self.ll_box[:2],self.ll_box[2:],
-                                          [self.data_start,self.data_stop],
-                                          cache_dir=self.cache_dir)
+        def fetch():
+            return hycom.fetch_range(self.ll_box[:2],self.ll_box[2:],
+                                     [self.data_start,self.data_stop],
+                                     cache_dir=self.cache_dir)
+        bc_compiler=getattr(self.model,'bc_compiler',None)
+        if bc_compiler is not None:
+            # salinity, temperature and velocity BCs over the same box
+            # share one download
+            key=bc_compiler.cache_key('hycom',self.ll_box,
+                                      (self.data_start,self.data_stop),self.cache_dir)
+            self.data_files=bc_compiler.cached(key,fetch,persist=False)
+        else:
+            self.data_files=fetch()
 
     def init_bathy(self):
         """
@@ -2114,11 +2144,19 @@ class NOAAStageBC(StageBC):
         Download or load from cache, take care of any filtering, unit conversion, etc.
         Returns a dataset with a 'z' variable, and with time as UTC
         """
-        ds=noaa_coops.coops_dataset(station=self.station,
-                                    start_date=period_start,
-                                    end_date=period_stop,
-                                    products=[self.product],
-                                    days_per_request='M',cache_dir=self.cache_dir)
+        def fetch():
+            return noaa_coops.coops_dataset(station=self.station,
+                                            start_date=period_start,
+                                            end_date=period_stop,
+                                            products=[self.product],
+                                            days_per_request='M',cache_dir=self.cache_dir)
+        bc_compiler=getattr(self.model,'bc_compiler',None)
+        if bc_compiler is not None:
+            key=bc_compiler.cache_key('noaa',self.station,(period_start,period_stop),
+                                      self.product,self.cache_dir)
+            ds=bc_compiler.cached(key,fetch,persist=False)
+        else:
+            ds=fetch()
         ds=ds.isel(station=0)
         ds['z']=ds[self.product]
         ds['z'].attrs['units']='m'
@@ -2271,6 +2309,149 @@ class NwisFlowBC(NwisBC,FlowBC):
             ds['flow'].attrs['standard_name']=self.standard_name
         return ds
 
+class BCCompiler(object):
+    """
+    Batch the data requests of a model's BCs.  BCs which draw on the same
+    source are grouped, the source is queried once for the union of their
+    points and period, and each BC then takes its own slice of the result.
+
+    Extracted data are cached by (source,location,period), where location is
+    a lon/lat bounding box or a station id.  The cache is kept in memory by
+    each compiler, holding up to cache_size extractions, and tidal
+    predictions are additionally written to the model's cache_dir when that
+    is set, so that rebuilding a run with the same boundary reuses the
+    earlier extraction.
+    """
+    # number of extractions kept in memory
+    cache_size=20
+
+    def __init__(self,model):
+        self.model=model
+        # (otps_model,data_start,data_stop) => (Dataset,{(x,y):point index})
+        self.otps={}
+        self.clear_cache()
+
+    def clear_cache(self):
+        """ Drop the in-memory extractions. Files in cache_dir are kept.
+        """
+        self.cache=memoize.LRUDict(size_limit=self.cache_size)
+
+    def leaf_bcs(self):
+        """
+        Flattened list of the model's BCs.  MultiBCs over OTPS BCs are
+        enumerated so that their per-edge geometries join the batch.  Other
+        MultiBCs do real work in enumerate_sub_bcs(), and are left alone.
+        """
+        bcs=[]
+        for bc in self.model.bcs:
+            if isinstance(bc,MultiBC) and issubclass(bc.cls,OTPSHelper):
+                bc.enumerate_sub_bcs()
+                bcs.extend(bc.sub_bcs)
+            else:
+                bcs.append(bc)
+        return bcs
+
+    def compile(self):
+        bcs=self.leaf_bcs()
+        self.compile_otps([bc for bc in bcs if isinstance(bc,OTPSHelper)])
+
+    def cache_key(self,source,location,period,*extra):
+        if not isinstance(location,six.string_types+(int,np.integer)):
+            location=tuple(np.round(np.asarray(location,np.float64),6).tolist())
+        period=tuple(str(t) for t in period)
+        return (source,location,period)+tuple(extra)
+
+    def cached(self,key,fetch,persist=True):
+        """
+        Return a copy of the data for key, calling fetch() only when it is
+        not already cached.  With persist, fetch() must return an xr.Dataset,
+        which is also cached to the model's cache_dir, if set.
+        When the model has compile_bcs=False, nothing is cached and fetch()
+        is called directly.
+        """
+        if not getattr(self.model,'compile_bcs',True):
+            return fetch()
+        if key not in self.cache:
+            fn=None
+            if persist and self.model.cache_dir is not None:
+                fn=os.path.join(self.model.cache_dir,
+                                "%s-%s.nc"%(key[0],memoize.memoize_key(*key)))
+            if fn is not None and os.path.exists(fn):
+                log.info("Loading %s data from %s"%(key[0],fn))
+                with xr.open_dataset(fn) as ds:
+                    data=ds.load()
+            else:
+                data=fetch()
+                if fn is not None:
+                    data.to_netcdf(fn)
+            self.cache[key]=data
+        # BC processing may modify its data in place
+        return copy.deepcopy(self.cache[key])
+
+    def compile_otps(self,bcs):
+        """
+        Predict tides once for all OTPS BCs sharing a model and period, over
+        the unique points of their geometries.
+        """
+        groups=defaultdict(list)
+        for bc in bcs:
+            groups[(bc.otps_model,bc.data_start,bc.data_stop)].append(bc)
+
+        for (otps_model,data_start,data_stop),group in groups.items():
+            xy=np.unique(np.concatenate([np.array(bc.geom.coords)[:,:2]
+                                         for bc in group]),axis=0)
+            log.info("Tidal prediction for %d BCs at %d points"%(len(group),len(xy)))
+            ds=self.otps_prediction(otps_model,xy,data_start,data_stop)
+            index={pnt:i for i,pnt in enumerate(zip(ds.x.values,ds.y.values))}
+            self.otps[(otps_model,data_start,data_stop)]=(ds,index)
+
+    def otps_prediction(self,otps_model,xy,data_start,data_stop):
+        """
+        Dataset of h, U, V (as from read_otps.tide_pred with z=1.0) at native
+        coordinates xy [N,2] over the given period.
+        """
+        times=OTPSHelper.otps_times(data_start,data_stop)
+        ll=self.model.native_to_ll(xy)
+        bbox=[ll[:,0].min(),ll[:,0].max(),ll[:,1].min(),ll[:,1].max()]
+        # points are part of the key, since bbox alone does not pin down
+        # the boundary
+        key=self.cache_key('otps',bbox,(data_start,data_stop),
+                           otps_model,memoize.memoize_key(xy))
+
+        def fetch():
+            from stompy.model.otps import read_otps
+            modfile=read_otps.model_path(otps_model)
+            pred_h,pred_U,pred_V=read_otps.tide_pred(modfile,lon=ll[:,0],lat=ll[:,1],
+                                                     time=times,z=1.0)
+            ds=xr.Dataset()
+            ds['time']=('time',),times
+            ds['x']=('point',),xy[:,0]
+            ds['y']=('point',),xy[:,1]
+            ds['h']=('time','point'),pred_h
+            ds['U']=('time','point'),pred_U
+            ds['V']=('time','point'),pred_V
+            return ds
+        return self.cached(key,fetch)
+
+    def otps_lookup(self,otps_model,xy,times):
+        """
+        Slice a compiled prediction for points xy [N,2] at times.
+        Returns h,U,V each [len(times),N], or None if this request was not
+        compiled.
+        """
+        for (model,data_start,data_stop),(ds,index) in self.otps.items():
+            if model!=otps_model or len(times)!=ds.dims['time']:
+                continue
+            if not np.all(ds.time.values==times):
+                continue
+            try:
+                idxs=[index[tuple(pnt)] for pnt in xy[:,:2]]
+            except KeyError:
+                continue
+            return [ds[v].values[:,idxs] for v in ['h','U','V']]
+        return None
+
+
 class DFlowModel(HydroModel):
     # If these are the empty string, then assumes that the executables are
     # found in existing $PATH
@@ -121,17 +121,16 @@ def tide_pred(modfile,lon,lat,time,z=None,conlist=None):
     # Calculate the time series
     # othertime.SecondsSince(time,basetime=datetime(1992,1,1)) # Needs to be referenced to 1992
     tsec = (time-base_time)/np.timedelta64(1,'s')
-    h=np.zeros((nt,nx))
-    u=np.zeros((nt,nx))
-    v=np.zeros((nt,nx))
-    for nn,om in enumerate(omega):
-        for ii in range(0,nx):
-            h[:,ii] += pf[nn]*h_re[nn,ii] * np.cos(om*tsec + v0u[nn] + pu[nn]) - \
-                pf[nn]*h_im[nn,ii] * np.sin(om*tsec + v0u[nn] + pu[nn])
-            u[:,ii] += pf[nn]*u_re[nn,ii] * np.cos(om*tsec + v0u[nn] + pu[nn]) - \
-                pf[nn]*u_im[nn,ii] * np.sin(om*tsec + v0u[nn] + pu[nn])
-            v[:,ii] += pf[nn]*v_re[nn,ii] * np.cos(om*tsec + v0u[nn] + pu[nn]) - \
-                pf[nn]*v_im[nn,ii] * np.sin(om*tsec + v0u[nn] + pu[nn])
+
+    # The phase of each constituent only depends on time, so evaluate the
+    # [nt,ncon] basis once and reduce over constituents for all points
+    # with a matrix product, rather than looping over points.
+    phase = omega[None,:]*tsec[:,None] + v0u[:,0] + pu[:,0]
+    fcos = pf[:,0][None,:]*np.cos(phase)
+    fsin = pf[:,0][None,:]*np.sin(phase)
+    h = fcos.dot(h_re) - fsin.dot(h_im)
+    u = fcos.dot(u_re) - fsin.dot(u_im)
+    v = fcos.dot(v_re) - fsin.dot(v_im)
 
     szo = (nt,)+sz
     return h.reshape(szo), u.reshape(szo), v.reshape(szo)
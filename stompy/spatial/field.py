@@ -393,7 +393,26 @@ class XYZField(Field):
     # If true, linear interpolation will revert to nearest when queried outside
     # the convex hull
     outside_hull_fallback=True
-    def interpolate(self,X,interpolation=None):
+    _kd_interper = None
+    def kd_interper(self):
+        """
+        cKDTree-backed interpolator for nearest, idw and kriging, cached
+        until points are added, moved or deleted.  Weights are cached
+        per query geometry, so updating self.F and interpolating to the
+        same points again is cheap.
+        """
+        if self._kd_interper is None or self._kd_interper.X_src is not self.X:
+            from .interpXYZ import KDTreeInterpolator
+            self._kd_interper=KDTreeInterpolator(self.X)
+            self._kd_interper.X_src=self.X
+        return self._kd_interper
+
+    def interpolate(self,X,interpolation=None,**kwargs):
+        """
+        interpolation: 'nearest','linear','naturalneighbor','idw','kriging'.
+        For 'idw' and 'kriging', additional keyword arguments (NNear, maxdist,
+        p, varmodel, nugget, sill, vrange) are passed to KDTreeInterpolator.
+        """
         if interpolation is None:
             interpolation=self.default_interpolation
         # X should be a (N,2) vectors - make it so
@@ -402,17 +421,9 @@ class XYZField(Field):
         newF = np.zeros( X.shape[0], np.float64 )
 
         if interpolation=='nearest':
-            for i in range(len(X)):
-                if i % 10000 == 1:
-                    print( " %.2f%%"%( (100.0*i)/len(X) ))
-
-                if not self.index:
-                    dsqr = ((self.X - X[i])**2).sum(axis=1)
-                    j = np.argmin( dsqr )
-                else:
-                    j = self.nearest(X[i])
-
-                newF[i] = self.F[j]
+            newF[:] = self.kd_interper()(X,self.F,method='nearest')
+        elif interpolation in ['idw','kriging']:
+            newF[:] = self.kd_interper()(X,self.F,method=interpolation,**kwargs)
         elif interpolation=='naturalneighbor':
             newF = self.nn_interper()(X[:,0],X[:,1])
             # print "why aren't you using linear?!"
@@ -893,6 +904,7 @@ class XYZField(Field):
     ## Editing API for use with GUI editor
     def move_point(self,i,pnt):
         self.X[i] = pnt
+        self._kd_interper = None
         
         if self.index:
             if self.index_type == 'stree':
@@ -917,6 +929,7 @@ class XYZField(Field):
         self._tri = None
         self._nn_interper = None
         self._lin_interper = None
+        self._kd_interper = None
         
         if self.index is not None:
             if self.index_type == 'stree':
@@ -940,6 +953,7 @@ class XYZField(Field):
             
         self.X[i,0] = np.nan
         self.F[i] = np.nan
+        self._kd_interper = None
         self.deleted_point(i)
 
     
@@ -1008,6 +1022,7 @@ class XYZField(Field):
             """
         d = self.__dict__.copy()
         d['_lin_interper']=None
+        d['_kd_interper']=None
         return d
 
 class PyApolloniusField(XYZField):
@@ -1908,6 +1923,125 @@ class CurvilinearGrid(QuadrilateralGrid):
 
         return CurvilinearGrid(X=self.X, F= Fb, projection=self.projection() )
 
+def fill_by_convolution_array(F,iterations=7,smoothing=0,kernel_size=3):
+    """
+    Array version of SimpleGrid.fill_by_convolution(), fills F in place.
+    """
+    kern = np.ones( (kernel_size,kernel_size) )
+
+    valid = np.isfinite(F)
+
+    bin_valid = valid.copy()
+    newF = F # just do it in place
+    newF[~valid] = 0.0
+
+    if iterations=='adaptive':
+        iterations=1
+        adaptive=True
+    else:
+        adaptive=False
+
+    i = 0
+    while i < iterations+smoothing:
+        weights = signal.convolve2d(bin_valid,kern,mode='same',boundary='symm')
+        values  = signal.convolve2d(newF,kern,mode='same',boundary='symm')
+
+        # update data_or_zero and bin_valid
+        # so anywhere that we now have a nonzero weight, we should get a usable value.
+
+        # for smoothing-only iterations, the valid mask isn't expanded
+        if i < iterations:
+            bin_valid |= (weights>0)
+
+        to_update = (bin_valid & (~valid)).astype(bool)
+        newF[to_update] = values[to_update] / weights[to_update]
+
+        i+=1
+        if adaptive and (np.sum(~bin_valid)>0):
+            iterations += 1 # keep trying
+        else:
+            adaptive = False # we're done 
+
+    # and turn the missing values back to nan's
+    newF[~bin_valid] = np.nan
+
+def _upsample2(C,shape):
+    """
+    Linear interpolation of the cell-centered array C onto a grid twice as
+    fine, cropped to shape.
+    """
+    for axis in [0,1]:
+        n=C.shape[axis]
+        lo=np.take(C,np.r_[0,np.arange(n-1)],axis=axis)
+        hi=np.take(C,np.r_[np.arange(1,n),n-1],axis=axis)
+        fine_shape=list(C.shape)
+        fine_shape[axis]=2*n
+        fine=np.empty(fine_shape,C.dtype)
+        even=[slice(None)]*2 ; even[axis]=slice(0,None,2)
+        odd=[slice(None)]*2 ; odd[axis]=slice(1,None,2)
+        fine[tuple(even)]=0.75*C+0.25*lo
+        fine[tuple(odd)]=0.75*C+0.25*hi
+        C=fine
+    return C[:shape[0],:shape[1]]
+
+def fill_pushpull_array(F,valid):
+    """
+    Push-pull hole filling. Returns a copy of F with invalid pixels filled
+    from a pyramid of successively coarser weighted averages.
+    """
+    # weighted sums and weights for each level
+    S=np.where(valid,F,0.0)
+    W=valid.astype(np.float64)
+    levels=[]
+    while True:
+        levels.append( (S,W) )
+        if np.all(W>0) or max(S.shape)<=1:
+            break
+        # pad to even, then sum 2x2 blocks
+        pad=((0,S.shape[0]%2),(0,S.shape[1]%2))
+        S=np.pad(S,pad)
+        W=np.pad(W,pad)
+        S=S[0::2,0::2]+S[1::2,0::2]+S[0::2,1::2]+S[1::2,1::2]
+        W=W[0::2,0::2]+W[1::2,0::2]+W[0::2,1::2]+W[1::2,1::2]
+
+    V=None
+    for S,W in levels[::-1]:
+        with np.errstate(invalid='ignore',divide='ignore'):
+            level_V=np.where(W>0,S/W,np.nan)
+        if V is None:
+            V=level_V
+        else:
+            w=np.minimum(W,1.0)
+            up=_upsample2(V,S.shape)
+            V=np.where(W>0, w*level_V + (1-w)*up, up)
+    result=F.copy()
+    result[~valid]=V[~valid]
+    return result
+
+def fill_nearest_array(F,valid):
+    """
+    Returns a copy of F with invalid pixels set to the nearest valid pixel.
+    """
+    idxs=ndimage.distance_transform_edt(~valid,return_distances=False,return_indices=True)
+    return F[idxs[0],idxs[1]]
+
+def smooth_filled_array(F,valid,iterations):
+    """
+    Apply 3x3 averaging to finite, not valid pixels of F, in place. Valid
+    pixels are held fixed, and nan pixels are ignored.
+    """
+    update=(~valid) & np.isfinite(F)
+    if not np.any(update):
+        return
+    kern=np.ones( (3,3) )
+    finite=np.isfinite(F)
+    F0=np.where(finite,F,0.0)
+    weights=signal.convolve2d(finite,kern,mode='same',boundary='symm')
+    for _ in range(iterations):
+        values=signal.convolve2d(F0,kern,mode='same',boundary='symm')
+        F0[update]=values[update]/weights[update]
+    F[update]=F0[update]
+
 class SimpleGrid(QuadrilateralGrid):
     """
     A spatial field stored as a regular cartesian grid.
@@ -2317,47 +2451,101 @@ class SimpleGrid(QuadrilateralGrid):
         grown, but the averaging process is reapplied.
 
         If iterations is 'adaptive', then iterate until there are no nans.
-        """
-        kern = np.ones( (kernel_size,kernel_size) )
-
-        valid = np.isfinite(self.F) 
 
-        bin_valid = valid.copy()
-        # newF = self.F.copy()
-        newF = self.F # just do it in place
-        newF[~valid] = 0.0
+        The convolutions are only carried out over windows around each group
+        of missing pixels, which gives the same result as convolving the
+        whole array, but with cost proportional to the size of the holes.
+        """
+        valid=np.isfinite(self.F)
+        if np.all(valid):
+            return
 
+        reach=kernel_size//2
         if iterations=='adaptive':
-            iterations=1
-            adaptive=True
-        else:
-            adaptive=False
-
-        i = 0
-        while i < iterations+smoothing:
-            #for i in range(iterations + smoothing):
-
-            weights = signal.convolve2d(bin_valid,kern,mode='same',boundary='symm')
-            values  = signal.convolve2d(newF,kern,mode='same',boundary='symm')
-
-            # update data_or_zero and bin_valid
-            # so anywhere that we now have a nonzero weight, we should get a usable value.
-
-            # for smoothing-only iterations, the valid mask isn't expanded
-            if i < iterations:
-                bin_valid |= (weights>0)
+            if not np.any(valid) or kernel_size%2==0:
+                # no way to figure the number of iterations ahead of time
+                fill_by_convolution_array(self.F,iterations,smoothing,kernel_size)
+                return
+            # number of iterations to reach the pixel farthest from valid data
+            dist=ndimage.distance_transform_cdt(~valid,metric='chessboard')
+            iterations=max(1,int(np.ceil(dist.max()/float(max(reach,1)))))
+
+        margin=(iterations+smoothing)*max(reach,1)+1
+        for slc,holes in self.hole_windows(valid,margin):
+            sub=self.F[slc].copy()
+            fill_by_convolution_array(sub,iterations,smoothing,kernel_size)
+            self.F[slc][holes]=sub[holes]
+
+    def hole_windows(self,valid,margin):
+        """
+        Group the invalid pixels of a [rows,cols] valid mask into clusters,
+        where holes within 2*margin pixels of each other are grouped together.
+        Yields (slices,holes) for each cluster, where slices index the
+        cluster's holes grown by margin (clipped to the array), and holes is a
+        bitmask over that window of the holes belonging to the cluster.
+        """
+        missing=~valid
+        grown=ndimage.maximum_filter(missing,size=2*margin+1,mode='constant',cval=0)
+        labels,n_labels=ndimage.label(grown,structure=np.ones((3,3)))
+        for lab,slc in enumerate(ndimage.find_objects(labels)):
+            if slc is None:
+                continue
+            holes=missing[slc] & (labels[slc]==lab+1)
+            yield slc,holes
 
-            to_update = (bin_valid & (~valid)).astype(bool)
-            newF[to_update] = values[to_update] / weights[to_update]
+    def fill_holes(self,method='convolution',**kwargs):
+        """
+        Fill missing (non-finite) values, with the engine selected by name:
+         'convolution': fill_by_convolution(iterations=7,smoothing=0,kernel_size=3)
+         'pushpull': fill_by_pushpull(max_dist=None,smoothing=2)
+         'nearest': fill_by_nearest(max_dist=None,smoothing=2)
+        kwargs are passed on to the respective method.
+        """
+        methods=dict(convolution=self.fill_by_convolution,
+                     pushpull=self.fill_by_pushpull,
+                     nearest=self.fill_by_nearest)
+        if method not in methods:
+            raise Exception("Unknown fill method %s, should be one of %s"%(method,
+                                                                          ", ".join(methods)))
+        return methods[method](**kwargs)
+
+    def fill_by_pushpull(self,max_dist=None,smoothing=2):
+        """
+        Fill holes with a coarse-to-fine (push-pull) pyramid.  Valid pixels
+        are averaged down to coarser levels until each hole is covered, and
+        the coarse values are interpolated back into the holes.  Cost
+        scales with the area of the holes, independent of their width.
+
+        max_dist: pixels farther than this (in pixels) from valid data are
+         left as nan.  None fills everything.
+        smoothing: number of 3x3 averaging passes applied to the filled pixels.
+        """
+        self._fill_windows(fill_pushpull_array,max_dist,smoothing)
 
-            i+=1
-            if adaptive and (np.sum(~bin_valid)>0):
-                iterations += 1 # keep trying
-            else:
-                adaptive = False # we're done 
+    def fill_by_nearest(self,max_dist=None,smoothing=2):
+        """
+        Fill holes by copying the nearest valid pixel (via a distance
+        transform), followed by smoothing passes over the filled pixels.
 
-        # and turn the missing values back to nan's
-        newF[~bin_valid] = np.nan
+        max_dist: pixels farther than this (in pixels) from valid data are
+         left as nan.  None fills everything.
+        smoothing: number of 3x3 averaging passes applied to the filled pixels.
+        """
+        self._fill_windows(fill_nearest_array,max_dist,smoothing)
+
+    def _fill_windows(self,filler,max_dist,smoothing):
+        valid=np.isfinite(self.F)
+        if np.all(valid) or not np.any(valid):
+            return
+        for slc,holes in self.hole_windows(valid,smoothing+2):
+            sub=self.F[slc].copy()
+            sub_valid=np.isfinite(sub)
+            filled=filler(sub,sub_valid)
+            if max_dist is not None:
+                dist=ndimage.distance_transform_edt(~sub_valid)
+                filled[dist>max_dist]=np.nan
+            smooth_filled_array(filled,sub_valid,smoothing)
+            self.F[slc][holes]=filled[holes]
 
     def smooth_by_convolution(self,kernel_size=3,iterations=1):
         """
@@ -3269,6 +3457,23 @@ if ogr:
                 print("MultiBlenderField: %d source polygons were totally obscured"%invalid_count)
             self.sources=sources[valid]
 
+class CompositeLayer(object):
+    """
+    One source of a CompositeField, rendered over a window of the output
+    tile.
+    """
+    def __init__(self,src_i,rows,cols,ops):
+        self.src_i=src_i
+        # slices of the output tile covered by this layer's window
+        self.rows=rows
+        self.cols=cols
+        # (name,args) data and alpha operations, and how many have been applied
+        self.ops=ops
+        self.n_applied=0
+        # SimpleGrid data and alpha over the window, once rendered
+        self.data=None
+        self.alpha=None
+
 class CompositeField(Field):
     """
     In the same vein as BlenderField, but following the model of raster
@@ -3339,7 +3544,8 @@ class CompositeField(Field):
      * `max()`: use the maximum value between this source and lower
        priority data.  This layer will only *raise* areas.
      * `fill(dist)`: fill in holes up to `dist` wide in this datasets
-       before proceeding.
+       before proceeding.  An optional second argument selects the fill
+       engine of SimpleGrid.fill_holes(), e.g. `fill(50.0,'pushpull')`.
 
     Multiple steps can be chained with commas, as in `fill(5.0),min()`, which
     would fill in holes smaller than 5 spatial units (e.g. m), and then take
@@ -3410,8 +3616,325 @@ class CompositeField(Field):
             self.delegate_list[i] = self.factory( self.sources[i] )
         return self.delegate_list[i]
 
+    # operations which read the composite of lower priority layers
+    composite_ops=('min','max')
+    # operations which can be used in data_mode and alpha_mode
+    layer_op_names=('min','max','fill','overlay','valid','blur_alpha',
+                    'feather_in','feather','buffer','feather_out')
+
+    def layer_ops(self,src_i):
+        """
+        Parse the data and alpha modes of a source into a list of
+        (name,args) operations, in the order they are applied.
+        """
+        ops=[]
+        def recorder(name):
+            def record(*args):
+                ops.append( (name,args) )
+            return record
+        namespace=dict(globals())
+        for name in self.layer_op_names:
+            namespace[name]=recorder(name)
+        namespace['feather']=recorder('feather_in')
+
+        # dangerous! executing code from a shapefile!
+        for mode in [self.data_mode[src_i],self.alpha_mode[src_i]]:
+            if mode is None or mode.strip() in ['',b'']: continue
+            eval(mode,namespace)
+        return ops
+
+    def layer_op_margin(self,name,args,dx):
+        """
+        Number of pixels beyond its input that an operation can spread data
+        or alpha, or None if unknown.
+        """
+        if name in ('min','max','overlay','valid'):
+            return 0
+        if name not in self.layer_op_names:
+            return None
+        pixels=int(round(float(args[0])/dx))
+        if name=='fill':
+            if len(args)>1 and args[1]!='convolution':
+                return None # fill engines which depend on the extent of the window
+            return np.maximum( pixels//3, 2 )+1 if pixels>0 else 0
+        elif name=='blur_alpha':
+            # gaussian_filter truncates at 4 sigma
+            return int(4*pixels+0.5)+1 if pixels>0 else 0
+        elif name=='feather_in':
+            return 1
+        else: # buffer, feather_out
+            return abs(pixels)+1
+
+    def apply_layer_op(self,layer,name,args,dx,result_data=None,result_alpha=None):
+        """
+        Apply one data or alpha operation to a rendered layer.
+        result_data,result_alpha: arrays of the composite so far over the
+        layer's window.  Only needed for composite_ops.
+        """
+        src_data=layer.data
+        src_alpha=layer.alpha
+
+        # Use to use ndimage.distance_transform_bf.
+        # This appears to give equivalent results (at least for binary-valued
+        # inputs), and runs about 80x faster on a small-ish input.
+        dist_xform=ndimage.distance_transform_edt
+
+        if name=='min':
+            # new data will only decrease values
+            valid=result_alpha>0
+            src_data.F[valid]=np.minimum( src_data.F[valid],result_data[valid] )
+        elif name=='max':
+            # new data will only increase values
+            valid=result_alpha>0
+            src_data.F[valid]=np.maximum( src_data.F[valid],result_data[valid] )
+        elif name=='fill':
+            # fill in small missing areas
+            pixels=int(round(float(args[0])/dx))
+            # for fill, it may be better to clip this to 1 pixel, rather than
+            # bail when pixels==0
+            method=args[1] if len(args)>1 else 'convolution'
+            if pixels>0:
+                if method=='convolution':
+                    niters=np.maximum( pixels//3, 2 )
+                    src_data.fill_by_convolution(iterations=niters)
+                else:
+                    src_data.fill_holes(method,max_dist=pixels)
+        elif name=='overlay':
+            pass
+        elif name=='valid':
+            # updates alpha channel to be zero where source data is missing.
+            data_missing=np.isnan(src_data.F)
+            src_alpha.F[data_missing]=0.0
+        elif name=='blur_alpha':
+            # smooth alpha channel with gaussian filter - this allows spreading
+            # beyond original poly!
+            pixels=int(round(float(args[0])/dx))
+            if pixels>0:
+                src_alpha.F=ndimage.gaussian_filter(src_alpha.F,pixels)
+        elif name=='feather_in':
+            # linear feathering within original poly
+            pixels=int(round(float(args[0])/dx))
+            if pixels>0:
+                Fsoft=dist_xform(src_alpha.F)
+                src_alpha.F = (Fsoft/pixels).clip(0,1)
+        elif name=='buffer':
+            # buffer poly outwards (by pixels)
+            # Could do this by erosion/dilation.  but using
+            # distance is a bit more compact (maybe slower, tho)
+            pixels=int(round(float(args[0])/dx))
+            if pixels>0:
+                # Like feather_out.
+                # Fsoft gets distance to a 1 pixel
+                Fsoft=dist_xform(1-src_alpha.F)
+                # is this right, or does it need a 1 in there?
+                src_alpha.F = (pixels-Fsoft).clip(0,1)
+            elif pixels<0:
+                pixels=-pixels
+                # Fsoft gets the distance to a zero pixel
+                Fsoft=dist_xform(src_alpha.F)
+                src_alpha.F = (Fsoft-pixels).clip(0,1)
+        elif name=='feather_out':
+            pixels=int(round(float(args[0])/dx))
+            if pixels>0:
+                Fsoft=dist_xform(1-src_alpha.F)
+                src_alpha.F = (1-Fsoft/pixels).clip(0,1)
+        else:
+            raise Exception("Unknown compositing operation %s"%name)
+
+    def render_layer(self,layer,xs,ys,dx=None,dy=None,op_dx=None,mask_poly=None):
+        """
+        Evaluate the source of layer over its window, and apply operations up
+        to the first one which needs the composite of lower layers.
+        xs,ys: pixel coordinates of the whole output tile.
+        dx,dy: resolution as passed to to_grid(), may be None.
+        op_dx: pixel size for converting distances in operations.
+        """
+        src_i=layer.src_i
+        log.info(self.sources['src_name'][src_i])
+        log.info("   data mode: %s  alpha mode: %s"%(self.data_mode[src_i],
+                                                     self.alpha_mode[src_i]))
+        window=[xs[layer.cols.start],xs[layer.cols.stop-1],
+                ys[layer.rows.start],ys[layer.rows.stop-1]]
+        shape=(layer.rows.stop-layer.rows.start,layer.cols.stop-layer.cols.start)
+
+        source=self.load_source(src_i)
+        if dx is not None:
+            layer.data=source.to_grid(bounds=window,dx=dx,dy=dy)
+        else:
+            layer.data=source.to_grid(bounds=window,nx=shape[1],ny=shape[0])
+        layer.alpha=SimpleGrid(extents=layer.data.extents,
+                               F=np.ones(layer.data.F.shape,'f8'))
+
+        assert np.allclose( window, layer.data.extents )
+        assert np.all( shape==layer.data.F.shape )
+
+        src_geom=self.sources['geom'][src_i]
+        if mask_poly is not None:
+            src_geom=src_geom.intersection(mask_poly)
+        mask=layer.alpha.polygon_mask(src_geom)
+        layer.alpha.F[~mask] = 0.0
+
+        # create an alpha tile. depending on alpha_mode, this may draw on the lower data,
+        # the polygon and/or the data tile.
+        # modify the data tile according to the data mode - so if the data mode is
+        # overlay, do nothing.  but if it's max, the resulting data tile is the max
+        # of itself and the lower data.
+        for name,args in layer.ops:
+            if name in self.composite_ops:
+                break
+            self.apply_layer_op(layer,name,args,op_dx)
+            layer.n_applied+=1
+        return layer
+
+    def composite_layer(self,layer,result_data,result_alpha,op_dx=None):
+        """
+        Apply the remaining operations of a rendered layer, and blend it into
+        result_data, result_alpha (arrays for the full tile, updated in place).
+        """
+        res_data=result_data[layer.rows,layer.cols]
+        res_alpha=result_alpha[layer.rows,layer.cols]
+
+        for name,args in layer.ops[layer.n_applied:]:
+            self.apply_layer_op(layer,name,args,op_dx,
+                                result_data=res_data,result_alpha=res_alpha)
+        layer.n_applied=len(layer.ops)
+
+        src_data=layer.data
+        src_alpha=layer.alpha
+
+        data_missing=np.isnan(src_data.F)
+        src_alpha.F[data_missing]=0.0
+        cleaned=src_data.F.copy()
+        cleaned[data_missing]=-999 # avoid nan contamination.
+
+        # composite the data tile, using its alpha to blend with lower data.
+
+        # 2018-12-06: this is how it used to work, but this is problematic
+        #  when result_alpha is < 1.
+        # result_data.F   = result_data.F *(1-src_alpha.F) + cleaned*src_alpha.F
+
+        # where result_alpha=1.0, then we want to blend with src_alpha and 1-src_alpha.
+        # if result_alpha=0.0, then we take src wholesale, and carry its alpha through.
+        #
+        total_alpha=res_alpha*(1-src_alpha.F) + src_alpha.F
+        new_data = res_data * res_alpha *(1-src_alpha.F) + cleaned*src_alpha.F
+        # to avoid contracting data towards zero, have to normalize data by the total alpha.
+        valid=total_alpha>1e-10 # avoid #DIVZERO
+        new_data[valid] /= total_alpha[valid]
+        res_data[...]=new_data
+        res_alpha[...]=total_alpha
+
+    def render_windowed(self,ordered_srcs,xs,ys,dx=None,dy=None,op_dx=None,
+                        mask_poly=None,workers=1):
+        """
+        Render the layers for to_grid(windowed=True), starting with the
+        highest priority.  Each layer is limited to the window its polygon
+        and operations can reach, and layers covered by opaque, higher
+        priority layers are skipped.
+
+        Returns a list parallel to ordered_srcs, with None for skipped sources.
+        """
+        from concurrent.futures import ThreadPoolExecutor, Future
+
+        nx,ny=len(xs),len(ys)
+        pix_dx=(xs[-1]-xs[0])/max(1,nx-1)
+        pix_dy=(ys[-1]-ys[0])/max(1,ny-1)
+
+        # pixels where some higher priority layer is opaque and does not
+        # depend on the layers below it.
+        covered=np.zeros( (ny,nx), np.bool8 )
+        # once a layer fills data after combining with lower layers, data from
+        # the lower layers can spread, and they can no longer be skipped.
+        can_skip=True
+
+        layers=[None]*len(ordered_srcs)
+        pending=[] # [ (idx,future) ], rendered or rendering, not yet in covered
+
+        def merge(idx,fut):
+            layer=fut.result()
+            if not any( [name in self.composite_ops for name,args in layer.ops] ):
+                opaque=(layer.alpha.F==1.0) & np.isfinite(layer.data.F)
+                covered[layer.rows,layer.cols] |= opaque
+
+        def overlaps(a,b):
+            return ( (a[0].start<b[0].stop) and (b[0].start<a[0].stop) and
+                     (a[1].start<b[1].stop) and (b[1].start<a[1].stop) )
+
+        def index_range(vmin,vmax,v0,dv,n,margin):
+            if dv>0:
+                lo=int(np.floor( (vmin-v0)/dv ))-margin
+                hi=int(np.ceil( (vmax-v0)/dv ))+margin
+            else:
+                lo,hi=0,n-1
+            return slice(max(lo,0),max(0,min(hi,n-1))+1)
+
+        if workers>1:
+            executor=ThreadPoolExecutor(max_workers=workers)
+        else:
+            executor=None
+
+        try:
+            for idx in range(len(ordered_srcs))[::-1]:
+                src_i=ordered_srcs[idx]
+                ops=self.layer_ops(src_i)
+                margins=[self.layer_op_margin(name,args,op_dx) for name,args in ops]
+
+                src_geom=self.sources['geom'][src_i]
+                if mask_poly is not None:
+                    src_geom=src_geom.intersection(mask_poly)
+
+                if (None in margins) or src_geom.is_empty:
+                    window=reach=(slice(0,ny),slice(0,nx))
+                else:
+                    gxmin,gymin,gxmax,gymax=src_geom.bounds
+                    # window has to include everything the operations can touch,
+                    # while the layer can only be visible as far as its alpha spreads.
+                    margin=1+int(np.sum(margins))
+                    alpha_margin=1+int(np.sum( [m for m,(name,args) in zip(margins,ops)
+                                                if name in ('blur_alpha','buffer','feather_out')] ))
+                    window=(index_range(gymin,gymax,ys[0],pix_dy,ny,margin),
+                            index_range(gxmin,gxmax,xs[0],pix_dx,nx,margin))
+                    reach=(index_range(gymin,gymax,ys[0],pix_dy,ny,alpha_margin),
+                           index_range(gxmin,gxmax,xs[0],pix_dx,nx,alpha_margin))
+
+                # wait on higher priority layers this one might be hidden by
+                still_pending=[]
+                for pidx,fut in pending:
+                    if overlaps( (layers[pidx].rows,layers[pidx].cols), reach):
+                        merge(pidx,fut)
+                    else:
+                        still_pending.append( (pidx,fut) )
+                pending=still_pending
+
+                if can_skip and np.all(covered[reach]):
+                    log.info("%s is covered by higher priority sources, skipping"%
+                             self.sources['src_name'][src_i])
+                    continue
+
+                names=[name for name,args in ops]
+                composite=[i for i,name in enumerate(names) if name in self.composite_ops]
+                if composite and ('fill' in names[composite[0]:]):
+                    can_skip=False
+
+                layer=CompositeLayer(src_i,rows=window[0],cols=window[1],ops=ops)
+                layers[idx]=layer
+                render_args=(layer,xs,ys,dx,dy,op_dx,mask_poly)
+                if executor is not None:
+                    fut=executor.submit(self.render_layer,*render_args)
+                else:
+                    fut=Future()
+                    fut.set_result(self.render_layer(*render_args))
+                pending.append( (idx,fut) )
+
+            for pidx,fut in pending:
+                fut.result()
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        return layers
+
     def to_grid(self,nx=None,ny=None,bounds=None,dx=None,dy=None,
-                mask_poly=None,stackup=False):
+                mask_poly=None,stackup=False,windowed=False,workers=1):
         """ render the layers to a SimpleGrid tile.
         nx,ny: number of pixels in respective dimensions
         bounds: xxyy bounding rectangle.
@@ -3423,6 +3946,15 @@ class CompositeField(Field):
         this tile. 
         'plot': make a figure showing the evolution of the layers as they're
         stacked up.
+
+        windowed: if True, each source is only evaluated over the part of the
+        tile that its polygon, grown by any fill/buffer/feather operations,
+        can reach, and sources hidden beneath opaque higher priority sources
+        are skipped.  Output is the same as the default, which evaluates every
+        source over the full tile.
+        workers: for windowed, render up to this many sources at once in
+        threads.  Sources only wait on higher priority sources with
+        overlapping windows.
         """
         # boil the arguments down to dimensions
         if bounds is None:
@@ -3450,6 +3982,13 @@ class CompositeField(Field):
         result_alpha=result_data.copy()
         result_alpha.F[:]=0.0
 
+        # pixel centers and size
+        xs,ys=result_data.xy()
+        if dx is not None:
+            op_dx=dx
+        else:
+            op_dx=result_data.delta()[0]
+
         # Which sources to use, and in what order?
         box=geometry.box(bounds[0],bounds[2],bounds[1],bounds[3])
         if mask_poly is not None:
@@ -3465,131 +4004,29 @@ class CompositeField(Field):
         order = np.argsort(self.src_priority[relevant_srcs])
         ordered_srcs=relevant_srcs[order]
 
-        # Use to use ndimage.distance_transform_bf.
-        # This appears to give equivalent results (at least for binary-valued
-        # inputs), and runs about 80x faster on a small-ish input.
-        dist_xform=ndimage.distance_transform_edt
-        
-        for src_i in ordered_srcs:
-            log.info(self.sources['src_name'][src_i])
-            log.info("   data mode: %s  alpha mode: %s"%(self.data_mode[src_i],
-                                                         self.alpha_mode[src_i]))
-
-            source=self.load_source(src_i)
-            src_data = source.to_grid(bounds=bounds,dx=dx,dy=dy)
-            src_alpha= SimpleGrid(extents=src_data.extents,
-                                  F=np.ones(src_data.F.shape,'f8'))
-
-            src_geom=self.sources['geom'][src_i]
-            if mask_poly is not None:
-                src_geom=src_geom.intersection(mask_poly)
-            mask=src_alpha.polygon_mask(src_geom)
-            src_alpha.F[~mask] = 0.0
-
-            # create an alpha tile. depending on alpha_mode, this may draw on the lower data,
-            # the polygon and/or the data tile.
-            # modify the data tile according to the data mode - so if the data mode is 
-            # overlay, do nothing.  but if it's max, the resulting data tile is the max
-            # of itself and the lower data.
-            # composite the data tile, using its alpha to blend with lower data.
-
-            # the various operations
-            def min():
-                """ new data will only decrease values
-                """
-                valid=result_alpha.F>0
-                src_data.F[valid]=np.minimum( src_data.F[valid],result_data.F[valid] )
-            def max():
-                """ new data will only increase values
-                """
-                valid=result_alpha.F>0
-                src_data.F[valid]=np.maximum( src_data.F[valid],result_data.F[valid] )
-            def fill(dist):
-                "fill in small missing areas"
-                pixels=int(round(float(dist)/dx))
-                # for fill, it may be better to clip this to 1 pixel, rather than
-                # bail when pixels==0
-                if pixels>0:
-                    niters=np.maximum( pixels//3, 2 )
-                    src_data.fill_by_convolution(iterations=niters)
-            #def blur(dist):
-            #    "smooth data channel with gaussian filter - this allows spreading beyond original poly!"
-            #    pixels=int(round(float(dist)/dx))
-            #    src_data.F=ndimage.gaussian_filter(src_data.F,pixels)
-
-            def overlay():
-                pass
-            # alpha channel operations:
-            def valid():
-                # updates alpha channel to be zero where source data is missing.
-                data_missing=np.isnan(src_data.F)
-                src_alpha.F[data_missing]=0.0
-            def blur_alpha(dist):
-                "smooth alpha channel with gaussian filter - this allows spreading beyond original poly!"
-                pixels=int(round(float(dist)/dx))
-                if pixels>0:
-                    src_alpha.F=ndimage.gaussian_filter(src_alpha.F,pixels)
-            def feather_in(dist):
-                "linear feathering within original poly"
-                pixels=int(round(float(dist)/dx))
-                if pixels>0:
-                    Fsoft=dist_xform(src_alpha.F)
-                    src_alpha.F = (Fsoft/pixels).clip(0,1)
-            def buffer(dist):
-                "buffer poly outwards (by pixels)"
-                # Could do this by erosion/dilation.  but using
-                # distance is a bit more compact (maybe slower, tho)
-                pixels=int(round(float(dist)/dx))
-                if pixels>0:
-                    # Like feather_out.
-                    # Fsoft gets distance to a 1 pixel
-                    Fsoft=dist_xform(1-src_alpha.F)
-                    # is this right, or does it need a 1 in there?
-                    src_alpha.F = (pixels-Fsoft).clip(0,1)
-                elif pixels<0:
-                    pixels=-pixels
-                    # Fsoft gets the distance to a zero pixel
-                    Fsoft=dist_xform(src_alpha.F)
-                    src_alpha.F = (Fsoft-pixels).clip(0,1)
-                
-            feather=feather_in
-            def feather_out(dist):
-                pixels=int(round(float(dist)/dx))
-                if pixels>0:
-                    Fsoft=dist_xform(1-src_alpha.F)
-                    src_alpha.F = (1-Fsoft/pixels).clip(0,1)
-
-            # dangerous! executing code from a shapefile!
-            for mode in [self.data_mode[src_i],self.alpha_mode[src_i]]:
-                if mode is None or mode.strip() in ['',b'']: continue
-                eval(mode)
+        if windowed:
+            layers=self.render_windowed(ordered_srcs,xs,ys,dx=dx,dy=dy,op_dx=op_dx,
+                                        mask_poly=mask_poly,workers=workers)
+        else:
+            layers=[None]*len(ordered_srcs)
+
+        for idx,src_i in enumerate(ordered_srcs):
+            if windowed:
+                layer=layers[idx]
+                if layer is None:
+                    continue
+                layers[idx]=None # release memory as we go
+            else:
+                layer=CompositeLayer(src_i,rows=slice(0,ny),cols=slice(0,nx),
+                                     ops=self.layer_ops(src_i))
+                self.render_layer(layer,xs,ys,dx=dx,dy=dy,op_dx=op_dx,mask_poly=mask_poly)
 
-            data_missing=np.isnan(src_data.F)
-            src_alpha.F[data_missing]=0.0
-            cleaned=src_data.F.copy()
-            cleaned[data_missing]=-999 # avoid nan contamination.
-
-            assert np.allclose( result_data.extents, src_data.extents )
-            assert np.all( result_data.F.shape==src_data.F.shape )
-
-            # 2018-12-06: this is how it used to work, but this is problematic
-            #  when result_alpha is < 1.
-            # result_data.F   = result_data.F *(1-src_alpha.F) + cleaned*src_alpha.F
-
-            # where result_alpha=1.0, then we want to blend with src_alpha and 1-src_alpha.
-            # if result_alpha=0.0, then we take src wholesale, and carry its alpha through.
-            # 
-            total_alpha=result_alpha.F*(1-src_alpha.F) + src_alpha.F
-            result_data.F   = result_data.F * result_alpha.F *(1-src_alpha.F) + cleaned*src_alpha.F
-            # to avoid contracting data towards zero, have to normalize data by the total alpha.
-            valid=total_alpha>1e-10 # avoid #DIVZERO
-            result_data.F[valid] /= total_alpha[valid]
-            result_alpha.F  = total_alpha
+            self.composite_layer(layer,result_data.F,result_alpha.F,op_dx=op_dx)
 
             if stackup:
                 stack.append( (self.sources['src_name'][src_i],
                                result_data.copy(),
-                               src_alpha.copy() ) )
+                               layer.alpha.copy() ) )
 
         # fudge it a bit, and allow semi-transparent data back out, but
         # at least nan out the totally transparent stuff.
@@ -62,7 +62,10 @@ def create_dataset(args):
     return comp_field
 
 
-def process_tile(args,mask_poly=None,overwrite=False):
+def process_tile(args,mask_poly=None,overwrite=False,**render_kw):
+    """
+    render_kw: additional arguments to CompositeField.to_grid, e.g. windowed
+    """
     fn,xxyy,res = args
 
     bleed=150 # pad out the tile by this much to avoid edge effects
@@ -73,7 +76,8 @@ def process_tile(args,mask_poly=None,overwrite=False):
                    xxyy[1]+bleed,
                    xxyy[2]-bleed,
                    xxyy[3]+bleed ]
-        dem=dataset.to_grid(dx=res,dy=res,bounds=xxyy_pad,mask_poly=mask_poly)
+        dem=dataset.to_grid(dx=res,dy=res,bounds=xxyy_pad,mask_poly=mask_poly,
+                            **render_kw)
 
         if bleed!=0:
             dem=dem.crop(xxyy)
@@ -119,6 +123,9 @@ if __name__=='__main__':
     parser.add_argument("-d", "--date",help="Target date",default=None,type=np.datetime64)
     parser.add_argument("-g", "--grid",help="Mask region by grid outline",default=None)
     parser.add_argument("--buffer",help="Buffer distance beyond grid",default=100.0)
+    parser.add_argument("-w", "--windowed",help="Render each source only over the part of the tile it can reach",
+                        action='store_true')
+    parser.add_argument("--workers",help="With --windowed, render this many sources in parallel",default=1,type=int)
 
     args=parser.parse_args()
 
@@ -180,7 +187,8 @@ if __name__=='__main__':
     else:
         for i,call in enumerate(calls):
             log.info("Call %d/%d %s"%(i,len(calls),call[0]))
-            process_tile(call,mask_poly=poly_buff,overwrite=args.force)
+            process_tile(call,mask_poly=poly_buff,overwrite=args.force,
+                         windowed=args.windowed,workers=args.workers)
 
     if args.merge:
         # and then merge them with something like:
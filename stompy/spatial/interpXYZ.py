@@ -11,6 +11,9 @@ Original comment:
 """
 
 import gzip
+import os
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from scipy import spatial
 import numpy as np
 # from maptools import ll2utm, readShpBathy, readraster
@@ -109,7 +112,9 @@ class interpXYZ(object):
 
     def _krig(self):
         """ Kriging interpolation"""
-        self.Finterp = kriging(self.XY,self.XYout,maxdist=self.maxdist,NNear=self.NNear)
+        self.Finterp = kriging(self.XY,self.XYout,maxdist=self.maxdist,NNear=self.NNear,
+                               varmodel=self.varmodel,nugget=self.nugget,
+                               sill=self.sill,vrange=self.vrange)
 
     def _linear(self):
         self.Finterp =\
@@ -463,6 +468,205 @@ class nn(object):
         Z[self.mask]=np.nan
         
         return Z            
+
+class KDTreeInterpolator(object):
+    """
+    Batched nearest / inverse-distance / local kriging interpolation from
+    scattered points XYin, using a single cKDTree.
+
+    Every method reduces to a sparse set of weights W and neighbor indices
+    ind for each output point, computed in chunks of output points and in
+    parallel threads.  The weights are cached per output geometry, so
+    repeated calls with the same XYout but different Zin only pay for the
+    weighted sum.
+
+    Non-finite input points are dropped from the tree, and output points
+    with no neighbor within maxdist get nan.
+    """
+    method='idw' # 'nearest','idw' or 'kriging'
+    NNear=8 # number of neighbors for idw and kriging
+    maxdist=np.inf # neighbors further than this are ignored
+    p=1.0 # power for inverse distance weighting
+
+    # kriging options, same meaning as interpXYZ
+    varmodel='spherical'
+    nugget=0.1
+    sill=0.8
+    vrange=250.0
+
+    chunk_size=20000 # output points per chunk
+    workers=-1 # threads for queries and chunks, -1 for all cpus
+    cache_size=4 # number of output geometries to keep weights for
+
+    def __init__(self,XYin,**kwargs):
+        self.__dict__.update(kwargs)
+        XYin=np.asarray(XYin,np.float64)
+        valid=np.all(np.isfinite(XYin),axis=1)
+        # index into the original XYin for each point in the tree
+        self.src_idx=np.nonzero(valid)[0]
+        # recenter for precision
+        self.ctr=XYin[valid].mean(axis=0) if valid.any() else np.zeros(2)
+        self.XY=XYin[valid]-self.ctr
+        self.kd=spatial.cKDTree(self.XY)
+        self.cache=memoize.LRUDict(size_limit=self.cache_size)
+
+    def n_workers(self):
+        if self.workers is None or self.workers<1:
+            return os.cpu_count() or 1
+        return self.workers
+
+    def weights(self,XYout,method=None,**kwargs):
+        """
+        Return ind,W, each [N,k], such that the interpolated value at XYout[i]
+        is sum(Zin[ind[i]]*W[i]).  Missing neighbors have W==0.  Rows with
+        no neighbors at all are all zero.
+        Extra keyword arguments override the instance's parameters.
+        """
+        XYout=np.asarray(XYout,np.float64).reshape([-1,2])
+        params=dict(method=method or self.method,NNear=self.NNear,maxdist=self.maxdist,
+                    p=self.p,varmodel=self.varmodel,nugget=self.nugget,
+                    sill=self.sill,vrange=self.vrange)
+        params.update(kwargs)
+        if params['method']=='nearest':
+            params['NNear']=1
+
+        key=(hashlib.md5(XYout.tobytes()).hexdigest(),XYout.shape,
+             tuple(sorted(params.items())))
+        if key in self.cache:
+            return self.cache[key]
+
+        N=len(XYout)
+        k=min(params['NNear'],len(self.XY))
+        ind=np.zeros((N,k),np.int64)
+        W=np.zeros((N,k),np.float64)
+
+        def do_chunk(start):
+            stop=min(N,start+self.chunk_size)
+            ind[start:stop],W[start:stop]=self.chunk_weights(XYout[start:stop]-self.ctr,
+                                                            k,params)
+        starts=range(0,N,self.chunk_size)
+        if k>0:
+            if self.n_workers()>1 and len(starts)>1:
+                with ThreadPoolExecutor(max_workers=self.n_workers()) as pool:
+                    list(pool.map(do_chunk,starts))
+            else:
+                for start in starts:
+                    do_chunk(start)
+
+        self.cache[key]=(ind,W)
+        return ind,W
+
+    def chunk_weights(self,XY,k,params):
+        dist,ind=self.kd.query(XY,k=k,distance_upper_bound=params['maxdist'])
+        dist=dist.reshape([len(XY),k])
+        ind=ind.reshape([len(XY),k])
+        missing=~np.isfinite(dist)
+        ind[missing]=0
+        dist[missing]=0.0
+
+        method=params['method']
+        if method=='nearest':
+            W=np.where(missing,0.0,1.0)
+        elif method=='idw':
+            eps=1e-10
+            W=1./(dist+eps)**params['p']
+            W[missing]=0.0
+            Wsum=W.sum(axis=1)
+            Wsum[Wsum==0]=1.0
+            W/=Wsum[:,None]
+        elif method=='kriging':
+            W=self.kriging_weights(XY,ind,missing,params)
+        else:
+            raise Exception("Unknown interpolation method %s"%method)
+        # map back to the caller's indices
+        return self.src_idx[ind],W
+
+    def variogram(self,h,params):
+        nugget,sill,vrange=params['nugget'],params['sill'],params['vrange']
+        if params['varmodel']=='spherical':
+            hr=np.minimum(h/vrange,1.0)
+            g=nugget+(sill-nugget)*(1.5*hr-0.5*hr**3)
+        elif params['varmodel']=='exponential':
+            g=nugget+(sill-nugget)*(1-np.exp(-3*h/vrange))
+        elif params['varmodel']=='gaussian':
+            g=nugget+(sill-nugget)*(1-np.exp(-3*(h/vrange)**2))
+        elif params['varmodel']=='linear':
+            g=nugget+(sill-nugget)*h/vrange
+        else:
+            raise Exception("Unknown variogram model %s"%params['varmodel'])
+        return np.where(h>0,g,0.0)
+
+    def kriging_weights(self,XY,ind,missing,params):
+        """
+        Ordinary kriging over the k nearest neighbors of each output point,
+        solved as a batch of (k+1)x(k+1) systems.
+        """
+        n,k=ind.shape
+        nbrs=self.XY[ind] # [n,k,2]
+        h=np.sqrt(((nbrs[:,:,None,:]-nbrs[:,None,:,:])**2).sum(axis=-1))
+        A=np.zeros((n,k+1,k+1),np.float64)
+        A[:,:k,:k]=self.variogram(h,params)
+        A[:,:k,k]=1.0
+        A[:,k,:k]=1.0
+        b=np.zeros((n,k+1),np.float64)
+        b[:,:k]=self.variogram(np.sqrt(((nbrs-XY[:,None,:])**2).sum(axis=-1)),params)
+        b[:,k]=1.0
+
+        # missing neighbors get a decoupled row with zero weight
+        rows,cols=np.nonzero(missing)
+        A[rows,cols,:]=0.0
+        A[rows,:,cols]=0.0
+        A[rows,cols,cols]=1.0
+        b[rows,cols]=0.0
+        # and output points with no neighbors at all are left with zero weights
+        empty=missing.all(axis=1)
+        A[empty,k,k]=1.0
+        b[empty,k]=0.0
+
+        try:
+            sol=np.linalg.solve(A,b[...,None])[...,0]
+        except np.linalg.LinAlgError:
+            # coincident input points make some systems singular
+            sol=np.einsum('nij,nj->ni',np.linalg.pinv(A),b)
+        W=sol[:,:k]
+        W[missing]=0.0
+        return W
+
+    def __call__(self,XYout,Zin,method=None,**kwargs):
+        """
+        Interpolate Zin, values at XYin, to the points XYout.  Zin may have
+        trailing dimensions, in which case each is interpolated.
+        """
+        ind,W=self.weights(XYout,method=method,**kwargs)
+        Zin=np.asarray(Zin)
+        Zsel=Zin[ind] # [N,k,...]
+        Wx=W.reshape(W.shape+(1,)*(Zin.ndim-1))
+        # missing neighbors point at an arbitrary input with zero weight,
+        # which must not pass through a nan value there
+        Z=np.where(Wx!=0,Zsel*Wx,0).sum(axis=1)
+        empty=(W==0).all(axis=1)
+        if empty.any():
+            Z=Z.astype(np.float64)
+            Z[empty]=np.nan
+        return Z
+
+class kriging(object):
+    """
+    Local ordinary kriging interpolation function, same calling convention
+    as idw.
+    """
+    maxdist=np.inf
+    NNear=8
+
+    def __init__(self,XYin,XYout,**kwargs):
+        self.__dict__.update(kwargs)
+        self.interp=KDTreeInterpolator(XYin,method='kriging',**kwargs)
+        self.XYout=XYout
+        self.interp.weights(XYout)
+
+    def __call__(self,Zin):
+        return self.interp(self.XYout,np.squeeze(Zin))
+
 ## Other functions that don't need to be in a class ##
 
     
@@ -12,9 +12,11 @@ except ImportError:
     import ogr
 import sys
 import os.path
+import warnings
 import six
 
 from numpy.linalg import norm
+from numpy import cross
 
 from . import wkb2shp
 from .. import utils
@@ -55,6 +57,215 @@ progress_message = progress_printer
 # faster...
 trust_prepared = True
 
+def segments_to_flat(segments):
+    """
+    segments: list of numpy arrays [N,2] giving points along a path, or
+    a single array [Nsegs,N,2].
+    Returns points, ptr: all points concatenated, and offsets such that
+    segment i is points[ptr[i]:ptr[i+1]].
+    """
+    if isinstance(segments,np.ndarray) and segments.ndim==3:
+        n_segs,n_points,n_dim=segments.shape
+        ptr=n_points*np.arange(n_segs+1)
+        return segments.reshape(-1,n_dim),ptr
+    segments=[np.asarray(seg) for seg in segments]
+    ptr=np.zeros(len(segments)+1,np.int64)
+    ptr[1:]=np.cumsum([len(seg) for seg in segments])
+    if len(segments):
+        points=np.concatenate(segments)
+    else:
+        points=np.zeros((0,2),np.float64)
+    return points,ptr
+
+def layer_to_flat(layer):
+    """
+    Read all geometries from an ogr LineString layer, returning points,ptr
+    as in segments_to_flat.  MultiLineStrings are split into their parts.
+    Geometry is exported per feature as WKB, but parsed and unpacked in bulk.
+    """
+    layer.ResetReading()
+    wkbs=[]
+    fids=[]
+    while 1:
+        feat = layer.GetNextFeature()
+        if not feat:
+            break
+        geo = feat.GetGeometryRef() # should be a linestring
+        if geo is None:
+            log.warning("Missing geometry - will skip")
+            continue
+        wkbs.append(bytes(geo.ExportToWkb()))
+        fids.append(feat.GetFID())
+
+    try:
+        from shapely import from_wkb,get_parts,get_type_id,get_coordinates,has_z
+    except ImportError:
+        # shapely 1.x: no vectorized interface
+        segments=[]
+        for fid,wkb in zip(fids,wkbs):
+            geom=shapely.wkb.loads(wkb)
+            if geom.type == 'MultiLineString':
+                geolist=geom.geoms
+            else:
+                geolist=[geom]
+            for one_geom in geolist:
+                if one_geom.type != 'LineString':
+                    raise Exception("All (sub)features must be linestrings (fid=%s, %s)"%(fid,one_geom.type))
+                segments.append(np.array(one_geom.coords))
+        return segments_to_flat(segments)
+
+    geoms=from_wkb(wkbs)
+    parts,part_feature=get_parts(geoms,return_index=True)
+    # 1: LineString, 2: LinearRing
+    bad=~np.isin(get_type_id(parts),[1,2])
+    if np.any(bad):
+        i=np.nonzero(bad)[0][0]
+        raise Exception("All (sub)features must be linestrings (fid=%s, %s)"%(fids[part_feature[i]],
+                                                                            parts[i].geom_type))
+    points,part_idx=get_coordinates(parts,include_z=bool(np.any(has_z(parts))),
+                                    return_index=True)
+    ptr=np.zeros(len(parts)+1,np.int64)
+    ptr[1:]=np.cumsum(np.bincount(part_idx,minlength=len(parts)))
+    return points,ptr
+
+def chain_segments(points,ptr,tolerance=0.0):
+    """
+    Merge segments by matching endpoints, returning a list of arrays of points.
+
+    points,ptr: segments in the flat format of segments_to_flat.
+    tolerance: 0.0 joins exactly coincident endpoints, and only where exactly two
+      segments meet.  Otherwise endpoints are snapped together with a KD-tree when
+      within tolerance of each other, and where more than two segments meet they are
+      paired up in order of segment index.
+
+    Segments which are already closed are passed through.  Where segments meet, the
+    shared point is taken from the earlier segment of the chain.  Chains which close
+    on themselves end with their starting point, exactly so when tolerance is 0.
+    Chains are returned in order of their lowest segment index, and follow the
+    orientation of that segment when it is at a loose end or in a loop.
+    """
+    from scipy import sparse
+    from scipy.sparse import csgraph
+
+    ptr=np.asarray(ptr)
+    n_segs=len(ptr)-1
+    lengths=np.diff(ptr)
+    if n_segs==0:
+        return []
+
+    firsts=points[ptr[:-1]]
+    lasts=points[ptr[1:]-1]
+    closed=np.all(firsts==lasts,axis=1)
+    open_segs=np.nonzero(~closed)[0]
+    n_open=len(open_segs)
+
+    # slots: 0..n_open-1 are the starts of open_segs, n_open.. the ends.
+    ends=np.concatenate([firsts[open_segs],lasts[open_segs]])
+    n_slots=len(ends)
+    slot_seg=np.r_[np.arange(n_open),np.arange(n_open)]
+
+    # cluster endpoints into vertices
+    if tolerance>0:
+        from scipy.spatial import cKDTree
+        near=cKDTree(ends).query_pairs(tolerance,output_type='ndarray')
+        adj=sparse.coo_matrix( (np.ones(len(near)),(near[:,0],near[:,1])),
+                               shape=(n_slots,n_slots) )
+        _,vertex=csgraph.connected_components(adj,directed=False)
+    else:
+        # lexsort + comparison, rather than np.unique(axis=0), so that
+        # 0.0 and -0.0 are the same point
+        order=np.lexsort(ends.T[::-1])
+        sorted_ends=ends[order]
+        new_vertex=np.r_[True,np.any(sorted_ends[1:]!=sorted_ends[:-1],axis=1)]
+        vertex=np.zeros(n_slots,np.int64)
+        vertex[order]=np.cumsum(new_vertex)-1
+
+    progress_message("%i possible matched features"%(vertex.max()+1 if n_slots else 0))
+
+    # pair up slots which share a vertex
+    order=np.lexsort( (slot_seg,vertex) )
+    v_sorted=vertex[order]
+    starts=np.r_[0,1+np.nonzero(v_sorted[1:]!=v_sorted[:-1])[0]]
+    counts=np.diff(np.r_[starts,n_slots])
+    rank=np.arange(n_slots) - np.repeat(starts,counts)
+    if tolerance>0:
+        pair_first=(rank%2==0) & (rank+1<np.repeat(counts,counts))
+    else:
+        pair_first=(np.repeat(counts,counts)==2) & (rank==0)
+    a=order[pair_first]
+    b=order[np.nonzero(pair_first)[0]+1]
+    link=np.full(n_slots,-1,np.int64)
+    link[a]=b
+    link[b]=a
+
+    def opposite(slot):
+        return np.where(slot<n_open,slot+n_open,slot-n_open)
+
+    # chains are paths, or cycles.  cycles are cut at the start of their
+    # lowest segment, which then leads the chain.
+    seg_graph=sparse.coo_matrix( (np.ones(len(a)),(slot_seg[a],slot_seg[b])),
+                                 shape=(n_open,n_open) )
+    n_chains,chain_label=csgraph.connected_components(seg_graph,directed=False)
+    free=link<0
+    chain_has_free=np.zeros(n_chains,np.bool8)
+    chain_has_free[chain_label[slot_seg[free]]]=True
+    chain_min_seg=np.full(n_chains,n_open,np.int64)
+    np.minimum.at(chain_min_seg,chain_label,np.arange(n_open))
+    cut=chain_min_seg[~chain_has_free] # start slots of cycle leaders
+    link[link[cut]]=-1
+    link[cut]=-1
+    is_cycle=~chain_has_free
+
+    # leaving a segment via exit slot e, the next exit is the far end of
+    # the linked segment.
+    succ=np.where(link>=0,opposite(np.maximum(link,0)),-1)
+    # list ranking by pointer jumping: dist to the end of the chain,
+    # and the last exit slot
+    dist=(succ>=0).astype(np.int64)
+    last=np.where(succ>=0,succ,np.arange(n_slots))
+    nxt=succ.copy()
+    while np.any(nxt>=0):
+        valid=np.nonzero(nxt>=0)[0]
+        nv=nxt[valid]
+        dist_v=dist[valid]+dist[nv]
+        last_v=last[nv]
+        nxt_v=nxt[nv]
+        dist[valid]=dist_v
+        last[valid]=last_v
+        nxt[valid]=nxt_v
+
+    # each chain starts at its lower free slot (start slots are numbered
+    # before end slots), and is traversed by exit slots sharing a last slot
+    free_slots=np.nonzero(link<0)[0]
+    chain_start=np.full(n_chains,n_slots,np.int64)
+    np.minimum.at(chain_start,chain_label[slot_seg[free_slots]],free_slots)
+    start_exit=opposite(chain_start)
+    chain_of_last=np.full(n_slots,-1,np.int64)
+    chain_of_last[last[start_exit]]=np.arange(n_chains)
+    member_chain=chain_of_last[last]
+    members=np.nonzero(member_chain>=0)[0]
+    member_chain=member_chain[members]
+    member_pos=dist[start_exit][member_chain] - dist[members]
+    order=np.lexsort( (member_pos,member_chain) )
+    members=members[order]
+    member_chain=member_chain[order]
+    member_first=(member_pos[order]==0)
+
+    # assemble coordinates in bulk
+    segs=open_segs[slot_seg[members]]
+    forward=members>=n_open
+    take=lengths[segs] - (~member_first)
+    rep=np.repeat(np.arange(len(segs)),take)
+    k=np.arange(rep.size) - np.repeat(np.cumsum(take)-take,take) + (~member_first)[rep]
+    idx=np.where(forward[rep], ptr[segs][rep]+k, ptr[segs+1][rep]-1-k)
+    chain_points=np.split(points[idx],np.cumsum(np.bincount(member_chain,weights=take,
+                                                            minlength=n_chains)).astype(np.int64)[:-1])
+
+    # output ordered by lowest segment index, interleaved with closed segments
+    keys=np.r_[open_segs[chain_min_seg],np.nonzero(closed)[0]]
+    results=chain_points + [points[ptr[i]:ptr[i+1]] for i in np.nonzero(closed)[0]]
+    return [results[i] for i in np.argsort(keys,kind='stable')]
+
 def merge_lines(layer=None,segments=None):
     """ Given an ogr LineString layer, merge linestrings by matching
     endpoints, and return a list of arrays of points.
@@ -63,215 +274,112 @@ def merge_lines(layer=None,segments=None):
     if segments is given, it should be a list of numpy arrays, where
     each array is [N,2] giving points along a path.
 
-    this version only handles *exact* matches between endpoints
+    this version only handles *exact* matches between endpoints.
+    See chain_segments() for details on the ordering of the output.
     """
-
-    # a hash that maps x,y values to feature ids
-    endpoints = {}
-    features = {} # map feature id to a list of points
-    # map old feature ids to new ones:
-    remapper = {}
-
     progress_message("Reading features")
 
+    if layer:
+        points,ptr=layer_to_flat(layer)
+    else:
+        points,ptr=segments_to_flat(segments)
 
-    def seg_iter():
-        if not layer:
-            for fid,seg in enumerate(segments):
-                yield fid,seg
-        else:
-            layer.ResetReading()
-            while 1:
-                feat = layer.GetNextFeature()
-                if not feat:
-                    return
-                fid = feat.GetFID()
-                geo = feat.GetGeometryRef() # should be a linestring
-                if geo is None:
-                    log.warning("Missing geometry - will skip")
-                    continue
-
-                geom=shapely.wkb.loads(geo.ExportToWkb())
-                
-                if geom.type == 'MultiLineString':
-                    geolist=geom.geoms
-                else:
-                    geolist=[geom]
-
-                for sub_idx,one_geom in enumerate(geolist):
-                    if one_geom.type != 'LineString':
-                        raise Exception("All (sub)features must be linestrings (fid=%s, %s)"%(fid,one_geom.type))
-
-                    # read the points into a numpy array:
-                    points = np.array(one_geom.coords)
-                    # use tuples to keep sub-features distinct
-                    yield (fid,sub_idx),points
-        
-    for fid,points in seg_iter():
-        features[fid] = points
-
-        start_point = tuple(points[0])
-        end_point   = tuple(points[-1])
-
-        if start_point == end_point:
-            continue
-
-        if start_point not in endpoints:
-            endpoints[start_point] = []
-        endpoints[start_point].append(fid)
-        if end_point not in endpoints:
-            endpoints[end_point] = []
-        endpoints[end_point].append(fid)
-
-        remapper[fid] = fid
-
-    # check on how many things match up:
-    # almost every point has exactly two features - perfect!
-
-    progress_message("%i possible matched features"%len(endpoints))
-
-    # toss out endpoints that don't have exactly two matches:
-    endpoint_list = []
-    for k in endpoints:
-        if len(endpoints[k]) == 2:
-            endpoint_list.append(endpoints[k])
-
-    total_pairs = len(endpoint_list)
-    pairs_processed = 0
-    
-    # iterate over the end points, merging all exact matches:
-    for matched_pair in endpoint_list:
-        fidA,fidB = [remapper[fid] for fid in matched_pair]
-
-        if fidA==fidB:
-            continue
-
-        pairs_processed += 1
-        if pairs_processed%1000==0:
-            progress_message("Merge lines exact",pairs_processed,total_pairs)
-
-        # 
-        coordsA = features[fidA]
-        coordsB = features[fidB]
-
-        # figure out how they go together, and figure out what point needs
-        # to be redirected from featB:
-        # also be sure to skip the repeated poin
-        if all(coordsA[0]==coordsB[0]):
-            coordsC = np.concatenate((coordsA[::-1],coordsB[1:]))
-            redirect = coordsB[-1]
-        elif all(coordsA[-1]==coordsB[0]):
-            coordsC = np.concatenate((coordsA,coordsB[1:]))
-            redirect = coordsB[-1]
-        elif all(coordsA[0]==coordsB[-1]):
-            coordsC = np.concatenate((coordsB,coordsA[1:]))
-            redirect = coordsB[0]
-        elif all(coordsA[-1]==coordsB[-1]):
-            coordsC = np.concatenate((coordsA[:-1],coordsB[::-1]))
-            redirect = coordsB[0]
-        else:
-            log.error( "No match:" )
-            log.error( "%s %s"%( fidA,fidB) )
-            log.error( "%s"%( coordsA[0])   )
-            log.error( "%s"%( coordsA[-1])  )
-            log.error( "%s"%( coordsB[0] )  )
-            log.error( "%s"%( coordsB[-1] ) )
-            raise Exception("hash says we have a match, but no good match found")
-
-        # replace the geometry of featA
-        features[fidA] = coordsC
-        for k in remapper.keys():
-            if remapper[k] == fidB:
-                remapper[k] = fidA
-
-        # and delete featB
-        del features[fidB]
+    features=chain_segments(points,ptr)
     progress_message("merge completed")
-    # cast to list for python 3
-    return list(features.values())
+    return features
 
-def tolerant_merge_lines(features,tolerance):
+def tolerant_merge_lines(features,tolerance,clustered=False):
     """ expects features to be formatted like the output of merge_lines,
     i.e. a list of numpy arrays
-    """
 
-    NO_MATCH   =0
-    FIRST_FIRST=1
-    FIRST_LAST =2
-    LAST_FIRST =3
-    LAST_LAST  =4
-    INIT_MATCH =5 # dummy value to kick-start the loop
-
-    closed_already = [ all(feat[0]==feat[-1]) for feat in features]
-
-    def check_match(pntsA,pntsB):
-        if norm(pntsA[0]-pntsB[0]) <= tolerance:
-            return FIRST_FIRST
-        elif norm(pntsA[0]-pntsB[-1]) <= tolerance:
-            return FIRST_LAST
-        elif norm(pntsA[-1]-pntsB[0]) <= tolerance:
-            return LAST_FIRST
-        elif norm(pntsA[-1]-pntsB[-1]) <= tolerance:
-            return LAST_LAST
-        else:
-            return NO_MATCH
-
-    # how to do the matching:
-    #  nested loops?  match the i-th feature against each jth other feature
-    #    if they match, merge j onto i, set j-th to None, and start scanning
-    #    again to match more features against i-th
-    for i in range(len(features)):
-        if features[i] is None:
-            continue
-        if closed_already[i]:
-            continue
+    clustered: if True, match all endpoints at once with chain_segments(),
+    which is much faster for many features.  Where more than two ends are
+    within tolerance of each other, it pairs them in order of feature index
+    rather than in the order of the default greedy scan, so results can
+    differ at such junctions.
+    """
+    if clustered:
+        points,ptr=segments_to_flat(features)
+        features=chain_segments(points,ptr,tolerance=tolerance)
+    else:
+        features=list(features)
+        NO_MATCH   =0
+        FIRST_FIRST=1
+        FIRST_LAST =2
+        LAST_FIRST =3
+        LAST_LAST  =4
+        INIT_MATCH =5 # dummy value to kick-start the loop
+
+        closed_already = [ all(feat[0]==feat[-1]) for feat in features]
+
+        def check_match(pntsA,pntsB):
+            if norm(pntsA[0]-pntsB[0]) <= tolerance:
+                return FIRST_FIRST
+            elif norm(pntsA[0]-pntsB[-1]) <= tolerance:
+                return FIRST_LAST
+            elif norm(pntsA[-1]-pntsB[0]) <= tolerance:
+                return LAST_FIRST
+            elif norm(pntsA[-1]-pntsB[-1]) <= tolerance:
+                return LAST_LAST
+            else:
+                return NO_MATCH
+
+        # how to do the matching:
+        #  nested loops?  match the i-th feature against each jth other feature
+        #    if they match, merge j onto i, set j-th to None, and start scanning
+        #    again to match more features against i-th
+        for i in range(len(features)):
+            if features[i] is None:
+                continue
+            if closed_already[i]:
+                continue
 
-        progress_message("Merge lines tolerant",i,len(features))
-
-        # once we've tried to match the i-th feature against everybody
-        # after i, there's no reason to look at it again, so the inner
-        # loop starts at i+1
-
-        match = INIT_MATCH
-        while match:
-            match = NO_MATCH
-            # check each subsequent feature
-            for j in range(i+1,len(features)):
-                if features[j] is None:
-                    continue # check next j-th
-                if closed_already[j]:
-                    continue
-
-                match = check_match(features[i],
-                                    features[j])
-
-                # When merging, drop one point from the merge location
-                # otherwise if they are very close we'll end up with numerical issues
-                # related to repeated points.
-                if match==FIRST_FIRST:
-                    features[i] = np.concatenate((features[i][::-1],features[j][1:]))
-                elif match==FIRST_LAST:
-                    features[i] = np.concatenate((features[j],features[i][1:]))
-                elif match==LAST_FIRST:
-                    features[i] = np.concatenate((features[i],features[j][1:]))
-                elif match==LAST_LAST:
-                    features[i] = np.concatenate((features[i][:-1],features[j][::-1]))
-
-                # if we get a match, we just merged the features and can
-                # remove the j-th feature.
-                if match != NO_MATCH:
-                    features[j] = None
-                    # at this point, though, our i-th feature has changed and
-                    # requires that we re-process matches against it, so
-                    # with match set non-zero, escape out of the j-loop
-                    # and the while loop will restart the j-loop.
-                    break
-            # if we fall out of this loop and didn't have a match, we're done
-            # with the i-th feature, so let the next iteration of the i-loop
-            # run
-
-    # this just eliminates None elements
-    features = [f for f in features if f is not None]
+            progress_message("Merge lines tolerant",i,len(features))
+
+            # once we've tried to match the i-th feature against everybody
+            # after i, there's no reason to look at it again, so the inner
+            # loop starts at i+1
+
+            match = INIT_MATCH
+            while match:
+                match = NO_MATCH
+                # check each subsequent feature
+                for j in range(i+1,len(features)):
+                    if features[j] is None:
+                        continue # check next j-th
+                    if closed_already[j]:
+                        continue
+
+                    match = check_match(features[i],
+                                        features[j])
+
+                    # When merging, drop one point from the merge location
+                    # otherwise if they are very close we'll end up with numerical issues
+                    # related to repeated points.
+                    if match==FIRST_FIRST:
+                        features[i] = np.concatenate((features[i][::-1],features[j][1:]))
+                    elif match==FIRST_LAST:
+                        features[i] = np.concatenate((features[j],features[i][1:]))
+                    elif match==LAST_FIRST:
+                        features[i] = np.concatenate((features[i],features[j][1:]))
+                    elif match==LAST_LAST:
+                        features[i] = np.concatenate((features[i][:-1],features[j][::-1]))
+
+                    # if we get a match, we just merged the features and can
+                    # remove the j-th feature.
+                    if match != NO_MATCH:
+                        features[j] = None
+                        # at this point, though, our i-th feature has changed and
+                        # requires that we re-process matches against it, so
+                        # with match set non-zero, escape out of the j-loop
+                        # and the while loop will restart the j-loop.
+                        break
+                # if we fall out of this loop and didn't have a match, we're done
+                # with the i-th feature, so let the next iteration of the i-loop
+                # run
+
+        # this just eliminates None elements
+        features = [f for f in features if f is not None]
 
     # Make an additional loop to see if there are rings that we need to close:
     for feat in features:
@@ -299,7 +407,7 @@ def clean_degenerate_rings(point_lists,degen_shpname='degenerate_rings.shp'):
     valid_lists = []
     for i in range(len(point_lists)):
         point_list = point_lists[i]
-        if all(point_list[0]!=point_list[-1]):
+        if any(point_list[0]!=point_list[-1]):
             valid_lists.append(point_list)
         else: # closed - check it's area
             poly = shapely.geometry.Polygon(point_list)
@@ -324,7 +432,7 @@ def find_exterior_ring(point_lists):
 
     for i in range(len(point_lists)):
         point_list = point_lists[i]
-        if all(point_list[0]!=point_list[-1]):
+        if any(point_list[0]!=point_list[-1]):
             open_strings.append(i)
         else: # closed - check it's area
             poly = shapely.geometry.Polygon(point_list)
@@ -341,7 +449,7 @@ def find_exterior_ring(point_lists):
 
     if len(open_strings) == 1:
         log.error("Choosing exterior ring based on it being the only open ring")
-        log.error( "Endpoints: %s"%( point_lists[open_strings[0]][0],point_lists[open_strings[0]][-1] ) )
+        log.error( "Endpoints: %s %s"%( point_lists[open_strings[0]][0],point_lists[open_strings[0]][-1] ) )
         return open_strings[0],False
     else:
         log.info( "No open linestrings, resorting to choosing exterior ring by area" )
@@ -355,7 +463,7 @@ def arc_to_close_line(points,n_arc_points=40):
 
     # Find the centroid of the original points.
     geo = shapely.geometry.Polygon(points)
-    centroid = np.array(geo.centroid)
+    centroid = np.array(geo.centroid.coords[0])
 
     # for now, assume a 180 degree arc:
     arc_center = (points[0]+points[-1])/2.0
@@ -396,71 +504,26 @@ def arc_to_close_line(points,n_arc_points=40):
 
 def lines_to_polygons_slow(new_features,close_arc=False,single_feature=True,force_orientation=True):
     """
-    single_feature: False is not yet implemented!
-    returns a list of Polygons and a list of features which were not part of a polygon
-    force_orientation: ensure that interior rings have negative signed area
+    Deprecated - use lines_to_polygons().
+    With close_arc, a single open exterior ring is first closed with an arc,
+    then the rings are passed on to lines_to_polygons() for a single polygon.
+    returns a list of Polygons and a list of Polygons which were not part of
+    the polygon.
     """
+    warnings.warn("lines_to_polygons_slow is deprecated, use lines_to_polygons",
+                  DeprecationWarning,stacklevel=2)
     assert single_feature
 
-    ### Remove non-polygons - still not smart enough to handle duplicate points
     new_features = [f for f in new_features if len(f) > 2]
-
-    ### Find exterior ring
-    log.info("Finding exterior ring from %d linestrings"%len(new_features))
-
-    new_features = clean_degenerate_rings(new_features)
-
-    exterior_id,closed_p = find_exterior_ring(new_features)
-
-    if close_arc and not closed_p:
-        ### Add an arc to close the exterior ring:
-        # really this out to test whether or not it's necessary
-        # to add the arc.
-        closing_arc = arc_to_close_line(new_features[exterior_id])
-
-        new_features[exterior_id] = np.concatenate((new_features[exterior_id],closing_arc))
-
-    exterior = new_features[exterior_id]
-    interiors = [new_features[i] for i in range(len(new_features)) if i!=exterior_id]
-
-    ### Remove features that are not contained by the exterior ring:
-    ext_poly = shapely.geometry.Polygon(exterior)
-
-    if prepared is not None:
-        prep_ext_poly = prepared.prep(ext_poly)
-    else:
-        prep_ext_poly = None
-
-    new_interiors = []
-    extras = [] # features which were not inside exterior, but otherwise valid
-    for i in range(len(interiors)):
-        interior = interiors[i]
-        if i%300==0:
-            progress_message("Checking for orphan interior features",i,len(interiors))
-        if force_orientation and (utils.signed_area(interior) > 0):
-            interior=interior[::-1]
-        int_poly = shapely.geometry.Polygon(interior)
-
-        # spaghetti logic
-        if prep_ext_poly is None or prep_ext_poly.contains(int_poly):
-            if prep_ext_poly and trust_prepared:
-                new_interiors.append(interior)
-            else:                    
-                if ext_poly.contains(int_poly):
-                    new_interiors.append(interior)
-                else:
-                    if prep_ext_poly is not None:
-                        log.warning( "A feature got through the prepared query, but the real query says it's outside the exterior")
-                    else:
-                        log.debug("Removing a feature that was outside the exterior ring" )
-                    extras.append(interior)
-        else:
-            log.debug("Removing a feature that the fast query said was outside the exterior ring")
-            extras.append(interior)
-
-    # create a single polygon feature from all of the rings:
-    poly_geom = shapely.geometry.Polygon(exterior,new_interiors)
-    return [poly_geom],extras
+    if close_arc:
+        new_features = clean_degenerate_rings(new_features)
+        exterior_id,closed_p = find_exterior_ring(new_features)
+        if not closed_p:
+            exterior=new_features[exterior_id]
+            exterior=np.concatenate((exterior,arc_to_close_line(exterior),exterior[:1]))
+            new_features[exterior_id]=exterior
+    return lines_to_polygons(new_features,single_feature=True,
+                             force_orientation=force_orientation)
 
 # updated version, hopefully faster in the usual case of no open loops, but
 # multiple polygons
@@ -510,8 +573,12 @@ def lines_to_polygons(new_features,close_arc=False,single_feature=True,force_ori
 
     log.info("Building index")
     # Because the index only hands back the poly, not an index.
+    # shapely 2 returns indices instead, and doesn't allow the attribute.
     for i,p in enumerate(simple_polys):
-        p.join_id=i
+        try:
+            p.join_id=i
+        except AttributeError:
+            pass
 
     index=STRtree(simple_polys)
     log.info("done building index")
@@ -535,7 +602,8 @@ def lines_to_polygons(new_features,close_arc=False,single_feature=True,force_ori
         prep_ext_poly = prepare_geometry(ext_poly)
 
         hits=index.query(ext_poly)
-        hit_indexes=[p.join_id for p in hits]
+        hit_indexes=[h if isinstance(h,(int,np.integer)) else h.join_id
+                     for h in hits]
         # this keeps us comparing large->small, needed to avoid
         # confusing islands in lake with lakes
         hit_indexes.sort()
@@ -17,43 +17,44 @@ def as_density(d):
     return d
 
 def upsample_linearring(points,density,closed_ring=1,return_sources=False):
-    new_segments = []
-
-    sources = []
-
+    """
+    Subdivide each segment of points so that it is broken into
+    round(length/scale) pieces, where scale is the density evaluated at
+    the middle of the segment.  Original points are retained.
+    return_sources: also return the fractional index into points of each
+     output point.
+    """
     density = as_density(density)
     points=np.asarray(points)
 
-    for i in range(len(points)):
-        A = points[i]
-
-        if i+1 == len(points) and not closed_ring:
-            new_segments.append( [A] )
-            sources.append( [i] )
-            break
-
-        B = points[(i+1)%len(points)]
-
-        l = norm(B-A)
-        # print "Edge length is ",l
-
-        scale = density( 0.5*(A+B) )
-        # print "Scale is ",scale
+    if closed_ring:
+        A=points
+        B=np.roll(points,-1,axis=0)
+    else:
+        A=points[:-1]
+        B=points[1:]
 
-        npoints = max(1,round( l/scale ))
-        # print "N points ",npoints
+    if len(A):
+        lengths=np.sqrt( ((B-A)**2).sum(axis=1) )
+        scales=np.asarray( density(0.5*(A+B)) ) * np.ones(len(A))
+        npoints=np.maximum(1,np.round(lengths/scales)).astype(np.int64)
+    else:
+        npoints=np.zeros(0,np.int64)
 
-        alphas = arange(npoints) / float(npoints)
+    # segment and step within the segment for each new point
+    seg=np.repeat(np.arange(len(npoints)),npoints)
+    starts=np.cumsum(npoints)-npoints
+    step=np.arange(len(seg)) - starts[seg]
+    alphas=step/npoints[seg].astype(np.float64)
 
-        new_segment = (1.0-alphas[:,newaxis])*A + alphas[:,newaxis]*B
-        new_segments.append(new_segment)
-        sources.append(i + alphas)
+    new_points=(1.0-alphas[:,None])*A[seg] + alphas[:,None]*B[seg]
+    sources=seg+alphas
 
-    new_points = concatenate( new_segments )
+    if not closed_ring:
+        new_points=np.concatenate( [new_points,points[-1:]] )
+        sources=np.concatenate( [sources,[len(points)-1.0]] )
 
     if return_sources:
-        sources = concatenate(sources)
-        # print "upsample: %d points, %d alpha values"%( len(new_points), len(sources))
         return new_points,sources
     else:
         return new_points
@@ -87,89 +88,103 @@ def downsample_linearring(points,density,factor=None,closed_ring=1):
 
     return points[valid]
 
+def density_along(points,density,dist=None,resolution=0.25,max_rounds=8):
+    """
+    Sample density along the polyline points, refining the samples until
+    each sample interval is no longer than resolution times the local
+    scale.  density is called once per round with all new sample points.
+
+    Returns (s,scale) with s the sample locations as distance along points,
+    and scale the density at each.
+    """
+    if dist is None:
+        dist=distance_along(points)
+
+    def locate(s):
+        # map distance along the line to coordinates
+        seg=np.searchsorted(dist,s,side='right')-1
+        seg=np.clip(seg,0,len(points)-2)
+        seg_len=dist[seg+1]-dist[seg]
+        alpha=np.where(seg_len>0, (s-dist[seg])/np.where(seg_len>0,seg_len,1), 0.0)
+        return (1-alpha[:,None])*points[seg] + alpha[:,None]*points[seg+1]
+
+    # start from the input vertices, dropping repeated points
+    samp_s=np.unique(dist)
+    samp_scale=np.asarray(density(locate(samp_s)),np.float64)*np.ones(len(samp_s))
+
+    for _ in range(max_rounds):
+        ds=np.diff(samp_s)
+        local=np.minimum(samp_scale[:-1],samp_scale[1:])
+        n_sub=np.ceil( ds/(resolution*local) ).astype(np.int64)
+        n_sub=np.maximum(n_sub,1)
+        split=np.nonzero(n_sub>1)[0]
+        if len(split)==0:
+            break
+        # interior points for each interval which needs splitting
+        counts=n_sub[split]-1
+        interval=np.repeat(split,counts)
+        k=1+np.arange(counts.sum()) - np.repeat(np.cumsum(counts)-counts,counts)
+        new_s=samp_s[interval] + ds[interval]*k/n_sub[interval]
+        new_scale=np.asarray(density(locate(new_s)),np.float64)*np.ones(len(new_s))
+
+        samp_s=np.concatenate([samp_s,new_s])
+        samp_scale=np.concatenate([samp_scale,new_scale])
+        order=np.argsort(samp_s,kind='stable')
+        samp_s=samp_s[order]
+        samp_scale=samp_scale[order]
+    return samp_s,samp_scale
+
 def resample_linearring(points,density,closed_ring=1,return_sources=False):
     """  similar to upsample, but does not try to include
     the original points, and can handle a density that changes
     even within one segment of the input
+
+    The density is sampled along the line in batched calls (see density_along),
+    integrated to give the number of points as a function of distance, and
+    that function is inverted to place the new points.
     """
     density = as_density(density)
+    points = np.asarray(points,np.float64)
 
     if closed_ring:
         points = concatenate( (points, [points[0]]) )
 
-    # distance_left[i] is the distance from points[i] to the end of
-    # the line, along the input path.
-    lengths = sqrt( ((points[1:] - points[:-1])**2).sum(axis=1) )
-    distance_left = cumsum( lengths[::-1] )[::-1]
-
-    new_points = []
-    new_points.append( points[0] )
+    dist=distance_along(points)
+    total=dist[-1]
 
     # x=sources[i] means that the ith point is between points[floor(x)]
     # and points[floor(x)+1], with the fractional step between them
     #  given by x%1.0
-    sources = [0.0]
-
-    # indexes the ending point of the segment we're currently sampling
-    # the starting point is just new_points[-1]
-    i=1
-
-    # print "points.shape ",points.shape
-    while 1:
-        # print "Top of loop, i=",i
-        last_point = new_points[-1]
-        last_source = sources[-1]
-
-        if i < len(distance_left):
-            total_distance_left = norm(points[i] - last_point) + distance_left[i]
+    if total<=0:
+        new_s=np.zeros(1 if closed_ring else 2)
+    else:
+        samp_s,samp_scale=density_along(points,density,dist=dist)
+        # cumulative count of points, trapezoidal in 1/scale
+        inv=1./samp_scale
+        count=np.concatenate( ([0],np.cumsum(0.5*(inv[1:]+inv[:-1])*np.diff(samp_s))) )
+        n=max(1,int(np.round(count[-1])))
+
+        if closed_ring:
+            targets=count[-1]*np.arange(n)/n
         else:
-            total_distance_left = norm(points[i] - last_point)
-
-        scale = density( last_point )
-        npoints_at_scale = round( total_distance_left/scale )
-
-        if (npoints_at_scale <= 1):
-            if not closed_ring:
-                new_points.append( points[-1] )
-                sources.append(len(points)-1)
-            break
-
-        this_step_length = total_distance_left / npoints_at_scale
-        # print "scale = %g   this_step_length = %g "%(scale,this_step_length)
-
-        # at this point this_step_length refers to how far we must go
-        # from new_points[i], along the boundary.
-
-        while norm( points[i] - last_point ) < this_step_length:
-            # print "i=",i
-            this_step_length -= norm( points[i] - last_point )
-            last_point = points[i]
-            last_source = float(i)
-            i += 1
-
-
-        seg_length = norm(points[i] - points[i-1])
-        # along this whole segment, we might be starting in the middle
-        # from a last_point that was on this same segment, in which
-        # case add our alpha to the last alpha
-        # print "[%d,%d] length=%g   step_length=%g "%(i-1,i,seg_length,this_step_length)
-
-        alpha = this_step_length / seg_length
-        # print "My alpha", alpha
-        last_alpha = (last_source  - floor(last_source))
-        # print "Alpha from last step:",last_alpha
-        alpha = alpha + last_alpha
+            targets=count[-1]*np.arange(n+1)/n
+        new_s=np.interp(targets,count,samp_s)
 
-        new_points.append( (1-alpha)*points[i-1] + alpha * points[i] )
-        frac = norm(new_points[-1] - points[i-1])/ norm(points[i] - points[i-1])
+    seg=np.searchsorted(dist,new_s,side='right')-1
+    seg=np.clip(seg,0,len(points)-2)
+    seg_len=dist[seg+1]-dist[seg]
+    frac=np.where(seg_len>0, (new_s-dist[seg])/np.where(seg_len>0,seg_len,1),0.0)
+    frac=np.clip(frac,0,1)
 
-        # print "frac=%g   alpha = %g"%(frac,alpha)
-        sources.append( (i-1) + frac )
+    new_points=(1-frac[:,None])*points[seg] + frac[:,None]*points[seg+1]
+    sources=seg+frac
 
-    new_points = array( new_points )
+    if not closed_ring:
+        # exactly retain the end point
+        new_points[-1]=points[-1]
+        sources[-1]=len(points)-1
 
     if return_sources:
-        sources = array( sources )
         return new_points,sources
     else:
         return new_points
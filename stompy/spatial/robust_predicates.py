@@ -1,4 +1,5 @@
 from __future__ import print_function
+import numpy as np
 
 # Pure python implementation of J.R. Shewchuk's robust geometric predicates.
 # This is a straightforward translation of the predicates in triangle.c into
@@ -833,6 +834,137 @@ def orientation(a,b,c):
     # hack for missing cmp in python3
     return (ccw>0)-(ccw<0)
 
+## Batched predicates
+# These evaluate the floating point determinant and the first error bound
+# over whole arrays with numpy, and only fall back to the adaptive scalar
+# code above for entries where the filter cannot certify the sign.  Results
+# are identical to calling the scalar predicates one entry at a time.
+
+def counterclockwise_many(pa, pb, pc):
+    """
+    pa,pb,pc: [...,2] arrays of points, broadcast against each other.
+    returns array of counterclockwise(pa,pb,pc) for each entry.
+    """
+    pa,pb,pc=np.broadcast_arrays(np.asarray(pa,np.float64),
+                                 np.asarray(pb,np.float64),
+                                 np.asarray(pc,np.float64))
+    detleft = (pa[...,0] - pc[...,0]) * (pb[...,1] - pc[...,1])
+    detright = (pa[...,1] - pc[...,1]) * (pb[...,0] - pc[...,0])
+    det = detleft - detright
+
+    pos=detleft>0.0
+    neg=detleft<0.0
+    with np.errstate(invalid='ignore'):
+        detsum=np.where(pos,detleft+detright,-detleft-detright)
+        errbound = ccwerrboundA * detsum
+        exact= ( (pos & (detright<=0.0))
+                 | (neg & (detright>=0.0))
+                 | ~(pos|neg)
+                 | (det>=errbound) | (-det>=errbound) )
+    for idx in zip(*np.nonzero(~exact)):
+        # python floats are much faster than numpy scalars in the expansion code
+        det[idx]=counterclockwiseadapt(pa[idx].tolist(),pb[idx].tolist(),pc[idx].tolist(),
+                                       float(detsum[idx]))
+    return det
+
+def orientation_many(a,b,c):
+    """
+    Vectorized orientation(): a,b,c are [...,2] arrays of points.
+    returns int array, 1 for counter-clockwise, -1 for clockwise, 0 for
+    collinear.
+    """
+    ccw=counterclockwise_many(a,b,c)
+    return (ccw>0).astype(np.int32) - (ccw<0)
+
+def incircle_many(pa, pb, pc, pd):
+    """
+    Vectorized incircle(): pa,pb,pc,pd are [...,2] arrays of points,
+    broadcast against each other.  returns array of determinants, positive
+    when pd is inside the circle through pa,pb,pc (taken counter-clockwise).
+    """
+    pa,pb,pc,pd=np.broadcast_arrays(np.asarray(pa,np.float64),
+                                    np.asarray(pb,np.float64),
+                                    np.asarray(pc,np.float64),
+                                    np.asarray(pd,np.float64))
+    adx = pa[...,0] - pd[...,0]
+    bdx = pb[...,0] - pd[...,0]
+    cdx = pc[...,0] - pd[...,0]
+    ady = pa[...,1] - pd[...,1]
+    bdy = pb[...,1] - pd[...,1]
+    cdy = pc[...,1] - pd[...,1]
+
+    bdxcdy = bdx * cdy
+    cdxbdy = cdx * bdy
+    alift = adx * adx + ady * ady
+
+    cdxady = cdx * ady
+    adxcdy = adx * cdy
+    blift = bdx * bdx + bdy * bdy
+
+    adxbdy = adx * bdy
+    bdxady = bdx * ady
+    clift = cdx * cdx + cdy * cdy
+
+    det = alift * (bdxcdy - cdxbdy) \
+        + blift * (cdxady - adxcdy) \
+        + clift * (adxbdy - bdxady)
+
+    permanent = (np.abs(bdxcdy) + np.abs(cdxbdy)) * alift \
+              + (np.abs(cdxady) + np.abs(adxcdy)) * blift \
+              + (np.abs(adxbdy) + np.abs(bdxady)) * clift
+
+    errbound = iccerrboundA * permanent
+    with np.errstate(invalid='ignore'):
+        exact=(det > errbound) | (-det > errbound)
+    for idx in zip(*np.nonzero(~exact)):
+        det[idx]=incircleadapt(pa[idx].tolist(),pb[idx].tolist(),pc[idx].tolist(),pd[idx].tolist(),
+                               float(permanent[idx]))
+    return det
+
+def benchmark(n=100000,degenerate_fraction=0.01,seed=1):
+    """
+    Compare scalar and batched predicates on random points, with a fraction
+    of nearly collinear/cocircular entries which require the exact path.
+    Prints timings and returns a dict of them.  Also checks that the results
+    agree exactly.
+    """
+    import time
+    rng=np.random.RandomState(seed)
+    pa,pb,pc,pd=[rng.uniform(-1,1,(n,2)) for _ in range(4)]
+
+    n_degen=int(degenerate_fraction*n)
+    if n_degen:
+        # nearly collinear: pc on the line pa-pb, with tiny perturbation
+        alpha=rng.uniform(-2,2,n_degen)
+        pc[:n_degen]=pa[:n_degen] + alpha[:,None]*(pb[:n_degen]-pa[:n_degen])
+        pc[:n_degen]+=rng.uniform(-1,1,(n_degen,2))*1e-17
+        # nearly cocircular: pd on the unit circle with pa,pb,pc
+        theta=rng.uniform(0,2*np.pi,(n_degen,4))
+        theta.sort(axis=1)
+        circ=np.stack( [np.cos(theta),np.sin(theta)],axis=-1 )
+        pa[-n_degen:],pb[-n_degen:],pc[-n_degen:],pd[-n_degen:]=[circ[:,i] for i in range(4)]
+
+    timings={}
+    def timed(label,f):
+        t=time.time()
+        result=f()
+        timings[label]=time.time()-t
+        return result
+
+    ori=timed('orientation',lambda: np.array([orientation(a,b,c)
+                                               for a,b,c in zip(pa.tolist(),pb.tolist(),pc.tolist())]))
+    ori_many=timed('orientation_many',lambda: orientation_many(pa,pb,pc))
+    inc=timed('incircle',lambda: np.array([incircle(a,b,c,d)
+                                            for a,b,c,d in zip(pa.tolist(),pb.tolist(),
+                                                               pc.tolist(),pd.tolist())]))
+    inc_many=timed('incircle_many',lambda: incircle_many(pa,pb,pc,pd))
+
+    assert np.all(ori==ori_many)
+    assert np.all(inc==inc_many)
+
+    for k in ['orientation','orientation_many','incircle','incircle_many']:
+        print("%-20s %8.3fs  %10.2f us/call"%(k,timings[k],1e6*timings[k]/n))
+    return timings
 
 if __name__ == '__main__':
     ## Some testing:
@@ -25,6 +25,154 @@ import uuid
 
 import numpy as np
 
+# map file extensions to OGR driver names, for when driver is not given
+ext_to_driver={'.shp':'ESRI Shapefile',
+               '.gpkg':'GPKG',
+               '.fgb':'FlatGeobuf',
+               '.geojson':'GeoJSON'}
+
+def infer_driver(fn,driver=None):
+    if driver is not None:
+        return driver
+    if fn.lower()=='memory':
+        return 'Memory'
+    ext=os.path.splitext(fn)[1].lower()
+    return ext_to_driver.get(ext,'ESRI Shapefile')
+
+# shapely type ids (shapely.get_type_id) to names
+type_id_to_text={0:'Point',1:'LineString',2:'LinearRing',3:'Polygon',
+                 4:'MultiPoint',5:'MultiLineString',6:'MultiPolygon',
+                 7:'GeometryCollection'}
+
+def geoms_from_coords(geom_type,coords,ptr=None):
+    """
+    Build shapely geometries in bulk from coordinate arrays.
+
+    geom_type: 'Point', 'LineString' or 'Polygon'
+    coords: for points, [N,2].  For lines and polygons, either [N,k,2] with
+      k points per feature, or flat [M,2] with ptr.
+    ptr: [N+1] offsets such that feature i is coords[ptr[i]:ptr[i+1]].
+      Polygons are closed automatically, and those with fewer than 3 points
+      are returned as None.
+
+    Returns an object array of geometries.
+    """
+    coords=np.asarray(coords,np.float64)
+    if geom_type!='Point':
+        if ptr is None:
+            n,k=coords.shape[:2]
+            ptr=k*np.arange(n+1)
+            coords=coords.reshape([n*k]+list(coords.shape[2:]))
+        ptr=np.asarray(ptr)
+    try:
+        import shapely
+        vectorized=hasattr(shapely,'linearrings')
+    except ImportError:
+        vectorized=False
+
+    if geom_type=='Point':
+        if vectorized:
+            return shapely.points(coords)
+        result=np.empty(len(coords),object)
+        result[:]=[Point(xy) for xy in coords]
+        return result
+
+    counts=np.diff(ptr)
+    result=np.empty(len(counts),object)
+    if geom_type=='LineString':
+        valid=counts>=2
+    elif geom_type=='Polygon':
+        valid=counts>=3
+    else:
+        raise Exception("geom_type %s not supported"%geom_type)
+    sel=np.nonzero(valid)[0]
+    # gather the valid features' coordinates
+    counts=counts[sel]
+    flat_idx=np.repeat(np.arange(len(sel)),counts)
+    k=np.arange(len(flat_idx)) - np.repeat(np.cumsum(counts)-counts,counts)
+    flat=coords[np.repeat(ptr[sel],counts)+k]
+
+    if vectorized:
+        if geom_type=='LineString':
+            result[sel]=shapely.linestrings(flat,indices=flat_idx)
+        else:
+            result[sel]=shapely.polygons(shapely.linearrings(flat,indices=flat_idx))
+    else:
+        cls=LineString if geom_type=='LineString' else Polygon
+        for i,pnts in zip(sel,np.split(flat,np.cumsum(counts)[:-1])):
+            result[i]=cls(pnts)
+    return result
+
+def geoms_to_wkb(geoms):
+    """
+    Convert a sequence of shapely geometries to WKB, splitting multi-part
+    geometries into one item per part.  None is passed through.
+
+    Returns list of WKB (bytes or None), and an array giving the index
+    into geoms for each.
+    """
+    geoms=np.asarray(list(geoms) if not isinstance(geoms,np.ndarray) else geoms,
+                     dtype=object)
+    try:
+        from shapely import get_parts,to_wkb
+    except ImportError:
+        wkbs=[] ; src=[]
+        for i,geom in enumerate(geoms):
+            if geom is None:
+                parts=[None]
+            elif type(geom) in (MultiPolygon,MultiLineString,MultiPoint):
+                parts=[g.wkb for g in geom.geoms]
+            else:
+                parts=[geom.wkb]
+            wkbs+=parts
+            src+=[i]*len(parts)
+        return wkbs,np.array(src,np.int64)
+
+    missing=np.array([g is None for g in geoms],np.bool8)
+    present=np.nonzero(~missing)[0]
+    parts,part_src=get_parts(geoms[present],return_index=True)
+    wkbs=list(to_wkb(parts))
+    src=present[part_src]
+    if np.any(missing):
+        # keep a feature, without geometry, for each missing geometry
+        src=np.concatenate([src,np.nonzero(missing)[0]])
+        wkbs=wkbs+[None]*missing.sum()
+        order=np.argsort(src,kind='stable')
+        src=src[order]
+        wkbs=[wkbs[i] for i in order]
+    return wkbs,src
+
+def field_columns(geoms,fields=None,field_gen=lambda f:{}):
+    """
+    Normalize the ways wkb2shp accepts fields into a list of names and
+    a parallel list of columns (sequences of length len(geoms)).
+    """
+    if fields is not None and type(fields) == list: # sub case - fields is a list of dicts
+        field_gen_list=fields
+        field_names=list(field_gen_list[0].keys()) if len(field_gen_list) else []
+        columns=[ [d[k] for d in field_gen_list] for k in field_names]
+    elif fields is not None and isinstance(fields,dict):
+        field_names=list(fields.keys())
+        columns=[fields[k] for k in field_names]
+    elif fields is not None and isinstance(fields,np.ndarray):
+        dt = fields.dtype
+        # Note that each field may itself have some shape - so we need to enumerate those
+        # dimensions, too.
+        field_names = []
+        columns = []
+        for name in dt.names:
+            # ndindex iterates over tuples which index successive elements of the field
+            for index in np.ndindex( dt[name].shape ):
+                field_names.append( name + "_".join([str(i) for i in index]) )
+                columns.append( fields[name][(slice(None),)+index] )
+    else:
+        # geometries and a field generator are specified
+        field_dicts = [field_gen(g) for g in geoms]
+        # py3k: .keys() is a dict_keys object, not 100% compatible with a list.
+        field_names = list(field_dicts[0].keys()) if len(field_dicts) else []
+        columns = [ [d[k] for d in field_dicts] for k in field_names]
+    return field_names,columns
+
 def wkb2shp(shp_name,
             input_wkbs,
             srs_text='EPSG:26910',
@@ -33,15 +181,17 @@ def wkb2shp(shp_name,
             overwrite=False,
             geom_type=None,
             driver=None,
-            layer_name=None):
+            layer_name=None,
+            transaction_size=None):
     """
-    Save data to a shapefile.
+    Save data to a shapefile, or other OGR vector format.
 
     shp_name: filename.shp for writing the result
     or 'MEMORY' to return an in-memory ogr layer.
 
       input_wkbs: list of shapely geometry objects for each feature.  They must all
                   be the same geometry type (no mixing lines and polygons, etc.)
+                  See geoms_from_coords() for building these from arrays.
 
     There are three ways of specifying fields:
        field_gen: a function which will be called once for each feature, with
@@ -53,34 +203,40 @@ def wkb2shp(shp_name,
     srs_text: sets the projection information when writing the shapefile.  Expects
     a string, for example 'EPSG:3095'  or 'WGS84'.
 
-    driver: Directly specify an alternative driver, such as GPKG. if None, assumed
-      shapefile, unless shp_name is 'memory' in which case create an in-Memory
+    driver: Directly specify an alternative driver, such as GPKG or FlatGeobuf. if
+      None, inferred from the extension of shp_name (.gpkg, .fgb, .geojson), falling
+      back to shapefile, unless shp_name is 'memory' in which case create an in-Memory
       layer.
-      for GPKG, the optional layer_name argument can be used to name the layer
-      which would default to the basename of the shp_name otherwise
+      the optional layer_name argument can be used to name the layer
+      which would default to the shp_name otherwise
+
+    transaction_size: features are written in layer transactions of this many
+      features.  Defaults to the module-level transaction_size.
     """
+    driver=infer_driver(shp_name,driver)
     if layer_name is None:
-        layer_name=shp_name
-        
-    if driver=='GPKG':
-        drv = ogr.GetDriverByName('GPKG')
-        new_ds = drv.CreateDataSource(shp_name)
-    if shp_name.lower()=='memory':
-        drv = ogr.GetDriverByName('Memory')
+        if driver=='ESRI Shapefile':
+            layer_name=shp_name
+        else:
+            layer_name=os.path.splitext(os.path.basename(shp_name))[0]
+    if transaction_size is None:
+        transaction_size=globals()['transaction_size']
+
+    drv = ogr.GetDriverByName(driver)
+    if driver=='Memory':
         new_ds = drv.CreateDataSource("mem_" + uuid.uuid1().hex)
     else:
         if os.path.exists(shp_name):
-            if shp_name[-4:] == '.shp':
-                if overwrite:
-                    # remove any matching files:
-                    print("Removing the old to make way for the new")
+            if overwrite:
+                # remove any matching files, including shapefile sidecars
+                print("Removing the old to make way for the new")
+                if drv.DeleteDataSource(shp_name)!=0 and os.path.exists(shp_name):
                     os.unlink(shp_name)
-                else:
-                    raise Exception("Shapefile exists, but overwrite is False")
-
-        # open the output shapefile:
-        drv = ogr.GetDriverByName('ESRI Shapefile')
+            else:
+                raise Exception("%s exists, but overwrite is False"%shp_name)
         new_ds = drv.CreateDataSource(shp_name)
+    if new_ds is None:
+        raise Exception("Failed to create %s with driver %s"%(shp_name,driver))
 
     if isinstance(srs_text,osr.SpatialReference):
         srs = srs_text
@@ -88,166 +244,87 @@ def wkb2shp(shp_name,
         srs = osr.SpatialReference()
         srs.SetFromUserInput(srs_text)
 
-    ## Depending on the inputs, populate
-    #  geoms - a list or array of shapely geometries
-    #  field_names - ordered list of field names
-    #  field_values - list of lists of field values
-
-    # Case 1: all the data is packed into a numpy struct array
     geoms = input_wkbs
+    field_names,columns=field_columns(geoms,fields=fields,field_gen=field_gen)
 
-    if fields is not None and type(fields) == list: # sub case - fields is a list of dicts
-        field_iter = iter(fields)
-        field_gen = lambda x: six.next(field_iter)
-        fields = None
-
-    if fields is not None and isinstance(fields,dict):
-        field_names=list(fields.keys())
-        N=len(fields[field_names[0]])
-
-        field_values=[None]*N
-
-        for n in range(N):
-            row=[fields[fname][n] for fname in field_names] 
-            field_values[n]=row
-
-    elif fields is not None and isinstance(fields,np.ndarray):
-        dt = fields.dtype
-
-        # Note that each field may itself have some shape - so we need to enumerate those
-        # dimensions, too.
-        field_names = []
-        for name in dt.names:
-            # ndindex iterates over tuples which index successive elements of the field
-            for index in np.ndindex( dt[name].shape ):
-                name_idx = name + "_".join([str(i) for i in index])
-                field_names.append(name_idx)
-
-        field_values = []
-        for i in range(len(fields)):
-            fields_onerow = []
-            for name in dt.names:
-                for index in np.ndindex( dt[name].shape ):
-                    if index != ():
-                        fields_onerow.append( fields[i][name][index] )
-                    else:
-                        fields_onerow.append( fields[i][name] )
-            field_values.append( fields_onerow )
-    else:
-        # Case 2: geometries and a field generator are specified
-        field_dicts = []
-        for g in geoms:
-            field_dicts.append( field_gen(g) )
-        # py3k: .keys() is a dict_keys object, not 100% compatible with a list.
-        field_names = list(field_dicts[0].keys())
-        field_values = []
-        for i in range(len(input_wkbs)):
-            field_values.append( [field_dicts[i][k] for k in field_names] )
-
-    for n in field_names:
-        if len(n)>10:
-            raise Exception("Cannot have field names longer than 10 characters")
+    if driver=='ESRI Shapefile':
+        for n in field_names:
+            if len(n)>10:
+                raise Exception("Cannot have field names longer than 10 characters")
 
     if geom_type is None:
         # find it by querying the features - minor bug - this only 
         # works when shapely geometries were passed in.
-        types = np.array( [text2ogr[g.type] for g in geoms] )
-        geom_type = int(types.max())
-        # print "Chose geometry type to be %s"%ogr2text[geom_type]
+        names=set( g.geom_type for g in geoms if g is not None )
+        geom_type = int(max( [text2ogr[name] for name in names] ))
 
     new_layer = new_ds.CreateLayer(layer_name,
                                    srs=srs,
                                    geom_type=geom_type)
 
-    # setup the feature definition:
-
-    # create fields based on the field key/value pairs
-    # return for the first wkb file
-    casters = []
-    for field_i,key in enumerate(field_names):
-        val = field_values[0][field_i]
+    # create fields based on the type of the first value, and convert each
+    # column to python values in bulk
+    values=[]
+    for key,column in zip(field_names,columns):
+        val = column[0]
         if type(val) == int or isinstance(val,np.integer):
             field_def = ogr.FieldDefn(key,ogr.OFTInteger)
-            casters.append( int )
+            values.append( np.asarray(column).astype(np.int64).tolist() )
         elif isinstance(val,np.floating):
-            # above: use np.float, as it seems to be more compatible with
-            # 32-bit and 64-bit floats.
-
-            # This is an old bug - seems to work without this in the modern
-            # era, and in turn, asscalar does *not* work with list of lists
-            # # a numpy array of float32 ends up with
-            # # a type here of <type 'numpy.float32'>,
-            # # which doesn't match isinstance(...,float)
-            # # asscalar helps out with that
-            # 2018-07: np.floating is maybe the proper solution.
-            print( "float valued key is %s"%key)
             field_def = ogr.FieldDefn(key,ogr.OFTReal)
             field_def.SetWidth(64)
             field_def.SetPrecision(10)
-            casters.append( float )
+            values.append( np.asarray(column,np.float64).tolist() )
         else:
             field_def = ogr.FieldDefn(key,ogr.OFTString)
-            casters.append( str )
-        # print "Field name is %s"%key
+            values.append( [str(v) for v in column] )
         new_layer.CreateField( field_def )
-    
-    for i,geom in enumerate(geoms):
-        feature_fields = field_values[i]        
-
-        # print "Processing: ",feature_fields
-
-        if type(geom) == str:
-            fp = open(wkb_file,'rb')
-            geom_wkbs = [fp.read()]
-            fp.close()
-        elif type(geom) in (Polygon,LineString,Point):
-            geom_wkbs = [geom.wkb]
-        elif type(geom) in (MultiPolygon,MultiLineString,MultiPoint):
-            geom_wkbs = [g.wkb for g in geom.geoms]
-
-        for geom_wkb in geom_wkbs:
-            feat_geom = ogr.CreateGeometryFromWkb(geom_wkb)
-            feat = ogr.Feature( new_layer.GetLayerDefn() )
-            feat.SetGeometryDirectly(feat_geom)
-            for i,val in enumerate(feature_fields):
-                feat.SetField(str(field_names[i]),casters[i](feature_fields[i]))
-
-            new_layer.CreateFeature(feat)
-            feat.Destroy()
-
-    if shp_name.lower()!="memory":
+
+    geom_wkbs,geom_src=geoms_to_wkb(geoms)
+
+    layer_defn=new_layer.GetLayerDefn()
+    n_fields=len(field_names)
+
+    def start():
+        try:
+            return new_layer.StartTransaction()==0
+        except Exception:
+            return False
+    in_transaction=start()
+
+    for count,(geom_wkb,src) in enumerate(zip(geom_wkbs,geom_src.tolist())):
+        feat = ogr.Feature(layer_defn)
+        if geom_wkb is not None:
+            feat.SetGeometryDirectly(ogr.CreateGeometryFromWkb(geom_wkb))
+        for fi in range(n_fields):
+            feat.SetField(fi,values[fi][src])
+        new_layer.CreateFeature(feat)
+        feat = None
+
+        if in_transaction and (count+1)%transaction_size==0:
+            new_layer.CommitTransaction()
+            in_transaction=start()
+    if in_transaction:
+        new_layer.CommitTransaction()
+
+    if driver!='Memory':
         new_layer.SyncToDisk()
     else:
         return new_ds
 
+# Features per layer transaction in wkb2shp.
+transaction_size=50000
 
-# kind of the reverse of the above
-def shp2geom(shp_fn,use_wkt=False,target_srs=None,
-             source_srs=None,return_srs=False,
-             query=None,layer_patt=None,
-             fold_to_lower=False):
+def open_layer(shp_fn,layer_patt=None,query=None):
     """
-    Read a shapefile into memory as a numpy array.
-    Data is returned as a record array, with geometry as a shapely
-    geometry object in the 'geom' field.
-
-    target_srs: input suitable for osgeo.osr.SetFromUserInput(), or an
-    existing osr.SpatialReference, to specify
-    a projection to which the data should be projected.  If this is specified
-    but the shapefile does not specify a projection, and source_srs is not given,
-    then an exception is raised.  source_srs will override the projection in 
-    the shapefile if specified.
-
-    fold_to_lower: fold field names to lower case.
-
-    return_srs: return a tuple, second item being the text representation of the project, or
-     None if no projection information was found.
+    Open a vector data source, returning the datasource and a layer,
+    optionally choosing the first layer with a name matching layer_patt,
+    and applying an attribute filter query.
     """
     ods = ogr.Open(shp_fn)
     if ods is None:
         raise ValueError("File '%s' corrupt or not found"%shp_fn)
     if layer_patt is not None:
-        import re
         names=[]
         for layer_idx in range(ods.GetLayerCount()):
             layer=ods.GetLayerByIndex(layer_idx)
@@ -264,17 +341,167 @@ def shp2geom(shp_fn,use_wkt=False,target_srs=None,
 
     if query is not None:
         layer.SetAttributeFilter(query)
+    return ods,layer
+
+def ogr_field_type(ogr_type):
+    """ numpy type used by shp2geom for an OGR field type name """
+    if ogr_type == 'String':
+        return object
+    elif ogr_type =='Integer':
+        return np.int32
+    elif ogr_type == 'Date':
+        return '<M8[s]' # np.datetime64
+    else:
+        return np.float64
 
-    if target_srs is not None: # potentially transform on the fly
-        if source_srs is None:
-            source_srs=layer.GetSpatialRef()
-        if source_srs is None:
-            raise Exception("Reprojection requested, but no source reference available")
+def layer_fields(layer,fold_to_lower=False):
+    """
+    list of (index,ogr name,output name,numpy type) for the fields of layer.
+    """
+    defn = layer.GetLayerDefn()
+    fields=[]
+    for i in range(defn.GetFieldCount()):
+        fdef = defn.GetFieldDefn(i)
+        name = fdef.name
+        out_name = name.lower() if fold_to_lower else name
+        fields.append( (i,name,out_name,ogr_field_type(fdef.GetTypeName())) )
+    return fields
 
-        mapper=proj_utils.mapper(source_srs,target_srs)
+def read_columns_arrow(layer,fields,batch_size=None):
+    """
+    Read all features as columns via the GDAL>=3.6 Arrow stream interface.
+    Returns dict of field name to array, and an object array of WKB.
+    Raises AttributeError if the interface is not available.
+    """
+    options=['INCLUDE_FID=NO','GEOMETRY_ENCODING=WKB']
+    if batch_size is not None:
+        options.append('MAX_FEATURES_IN_BATCH=%d'%batch_size)
+    layer.ResetReading()
+    stream=layer.GetArrowStreamAsNumPy(options=options)
+    geom_col=layer.GetGeometryColumn() or 'wkb_geometry'
+
+    batches=list(stream)
+    columns={}
+    for i,name,out_name,np_type in fields:
+        parts=[]
+        for batch in batches:
+            col=batch[name]
+            if np_type is object:
+                # nulls read back as empty strings, like GetFieldAsString
+                col=np.ma.filled(col,None) if np.ma.isMaskedArray(col) else col
+                col=np.array([ '' if v is None else
+                               (v.decode() if isinstance(v,bytes) else v)
+                               for v in col],dtype=object)
+            elif np_type == '<M8[s]':
+                col=np.ma.filled(np.ma.asarray(col).astype('<M8[s]'),np.datetime64('NaT'))
+            else:
+                # nulls read back as 0, like GetFieldAsInteger/Double
+                col=np.ma.filled(np.ma.asarray(col).astype(np_type),0)
+            parts.append(np.asarray(col))
+        if parts:
+            columns[name]=np.concatenate(parts)
+        else:
+            columns[name]=np.zeros(0,np_type)
+
+    wkbs=[]
+    for batch in batches:
+        if geom_col in batch:
+            col=batch[geom_col]
+            if np.ma.isMaskedArray(col):
+                col=np.ma.filled(col,None)
+            wkbs.append(np.asarray(col,dtype=object))
+        else:
+            wkbs.append(np.full(len(next(iter(batch.values()))),None,dtype=object))
+    if wkbs:
+        wkbs=np.concatenate(wkbs)
+    else:
+        wkbs=np.zeros(0,object)
+    return columns,wkbs
+
+def read_columns_features(layer,fields,use_wkt=False):
+    """
+    Read all features as columns, one feature at a time.
+    Returns dict of field name to array, and an object array of WKB (or WKT).
+    """
+    getters=[]
+    for i,name,out_name,np_type in fields:
+        if np_type is object:
+            getter = lambda f,i=i: f.GetFieldAsString(i)
+        elif np_type is np.int32:
+            getter = lambda f,i=i: f.GetFieldAsInteger(i)
+        elif np_type == '<M8[s]':
+            # this handles null and real dates, whereas GetFieldAsDateTime
+            # would take more finagling to deal with nulls.
+            getter = lambda f,i=i: np.datetime64(f.GetFieldAsString(i).replace('/','-'))
+        else:
+            getter = lambda f,i=i: f.GetFieldAsDouble(i)
+        getters.append(getter)
+
+    values=[ [] for f in fields]
+    geoms=[]
+    layer.ResetReading()
+    while 1:
+        feat = layer.GetNextFeature()
+        if feat is None:
+            break
+        for vals,getter in zip(values,getters):
+            vals.append(getter(feat))
+        geo_ref=feat.GetGeometryRef()
+        if geo_ref is None:
+            # this is possible, for example, in QGIS delete all nodes of a
+            # line, but don't delete the actual feature.
+            geoms.append(None)
+        elif use_wkt:
+            geoms.append(geo_ref.ExportToWkt())
+        else:
+            geoms.append(bytes(geo_ref.ExportToWkb()))
+
+    columns={}
+    for (i,name,out_name,np_type),vals in zip(fields,values):
+        columns[name]=np.array(vals,dtype=np_type)
+    geom_data=np.empty(len(geoms),object)
+    geom_data[:]=geoms
+    return columns,geom_data
+
+def parse_geometries(data,use_wkt=False):
+    """
+    Parse an object array of WKB (or WKT) into shapely geometries.
+    Returns geometries and a boolean array, True where parsing failed.
+    Missing (None) geometries are passed through, and are not failures.
+    """
+    missing=np.array([d is None for d in data],np.bool8)
+    try:
+        from shapely import from_wkb,from_wkt
+    except ImportError:
+        geoms=np.empty(len(data),object)
+        failed=np.zeros(len(data),np.bool8)
+        for i,d in enumerate(data):
+            if d is None:
+                continue
+            try:
+                geoms[i]=wkt.loads(d) if use_wkt else wkb.loads(d)
+            except shapely.geos.WKBReadingError as exc:
+                # Used to just be shapely.geos.ReadingError
+                print("Failed to load geometry for feature")
+                print(exc)
+                failed[i]=True
+        return geoms,failed
+
+    parser=from_wkt if use_wkt else from_wkb
+    geoms=parser(data,on_invalid='ignore')
+    failed=(~missing) & np.array([g is None for g in geoms],np.bool8)
+    if np.any(failed):
+        print("Failed to load geometry for %d features"%failed.sum())
+    return np.asarray(geoms,dtype=object),failed
+
+def transform_geometries(geoms,mapper):
+    """ Apply a coordinate mapper (see proj_utils.mapper) to an array of geometries """
+    try:
+        import shapely
+        xform_many=shapely.transform
+    except (ImportError,AttributeError):
         # have to massage it a bit to suit shapely's calling convention
         def xform(x,y,z=None): # x,y,z may be scalar or array
-            # ugly code... annoying code...
             if z is None:
                 xy=np.moveaxis( np.array([x,y]), 0, -1 )
                 xyp=mapper(xy)
@@ -283,90 +510,117 @@ def shp2geom(shp_fn,use_wkt=False,target_srs=None,
                 xyz=np.moveaxis( np.array([x,y,z]), 0, -1 )
                 xyzp=mapper(xyz)
                 return xyzp[...,0],xyzp[...,1],xyzp[...,2]
-        def geom_xform(g):
-            return ops.transform(xform,g)
+        result=np.empty(len(geoms),object)
+        result[:]=[None if g is None else ops.transform(xform,g) for g in geoms]
+        return result
+
+    result=np.array(geoms,dtype=object)
+    valid=np.array([g is not None for g in geoms],np.bool8)
+    has_z=np.zeros(len(geoms),np.bool8)
+    has_z[valid]=shapely.has_z(result[valid])
+    for z in [False,True]:
+        sel=valid & (has_z==z)
+        if np.any(sel):
+            # mapper transforms the leading two columns
+            result[sel]=xform_many(result[sel],mapper,include_z=z)
+    return result
+
+def shp2columns(shp_fn,use_wkt=False,target_srs=None,
+                source_srs=None,return_srs=False,
+                query=None,layer_patt=None,
+                fold_to_lower=False,use_arrow=None,batch_size=None):
+    """
+    Columnar reader: read a vector layer into a dict of numpy arrays, one per field,
+    and 'geom', an object array of shapely geometries.  Features whose geometry
+    fails to parse are dropped.
+
+    use_arrow: None to read batches via GDAL's Arrow stream interface
+      (GetArrowStreamAsNumPy, GDAL>=3.6) when available, falling back to reading
+      one feature at a time.  True to require the Arrow interface, False to
+      skip it.
+    batch_size: optional number of features per Arrow batch.
+
+    Other arguments as for shp2geom.
+    """
+    ods,layer=open_layer(shp_fn,layer_patt=layer_patt,query=query)
+
+    if target_srs is not None: # potentially transform on the fly
+        if source_srs is None:
+            source_srs=layer.GetSpatialRef()
+        if source_srs is None:
+            raise Exception("Reprojection requested, but no source reference available")
+        mapper=proj_utils.mapper(source_srs,target_srs)
+        if not isinstance(target_srs,osr.SpatialReference):
+            srs=osr.SpatialReference()
+            srs.SetFromUserInput(target_srs)
+            target_srs=srs
     else:
         target_srs=layer.GetSpatialRef()
-        def geom_xform(g):
-            return g
+        mapper=None
 
-    feat = layer.GetNextFeature()
+    fields=layer_fields(layer,fold_to_lower=fold_to_lower)
 
-    defn = feat.GetDefnRef()
-    fld_count = defn.GetFieldCount()
+    data=None
+    if use_arrow is not False and not use_wkt:
+        try:
+            data=read_columns_arrow(layer,fields,batch_size=batch_size)
+        except AttributeError:
+            if use_arrow:
+                raise
+    if data is None:
+        data=read_columns_features(layer,fields,use_wkt=use_wkt)
+    columns,geom_data=data
+
+    geoms,failed=parse_geometries(geom_data,use_wkt=use_wkt)
+    if mapper is not None:
+        geoms=transform_geometries(geoms,mapper)
+
+    result={}
+    for i,name,out_name,np_type in fields:
+        result[out_name]=columns[name][~failed]
+    result['geom']=geoms[~failed]
 
-    fields = []
-    
-    for i in range(fld_count):
-        fdef =defn.GetFieldDefn(i)
-        name = fdef.name
-        if fold_to_lower:
-            name=name.lower()
-        ogr_type = fdef.GetTypeName()
-        if ogr_type == 'String':
-            np_type = object
-            getter = lambda f,i=i: f.GetFieldAsString(i)
-        elif ogr_type =='Integer':
-            np_type = np.int32
-            getter = lambda f,i=i: f.GetFieldAsInteger(i)
-        elif ogr_type == 'Date':
-            np_type = '<M8[s]' # np.datetime64
-            # this handles null and real dates, whereas GetFieldAsDateTime
-            # would take more finagling to deal with nulls.
-            getter = lambda f,i=i: np.datetime64(f.GetFieldAsString(i).replace('/','-'))
-        else:
-            np_type = np.float64
-            getter = lambda f,i=i: f.GetFieldAsDouble(i)
-        fields.append( (i,name,np_type,getter) )
+    if return_srs:
+        return result, (target_srs.ExportToWkt() if target_srs is not None else None)
+    else:
+        return result
 
-    # And one for the geometry
-    def rdr(f):
-        # The try..except block is from olden days when OGR was not stable
-        # to weird geometries.
+# kind of the reverse of the above
+def shp2geom(shp_fn,use_wkt=False,target_srs=None,
+             source_srs=None,return_srs=False,
+             query=None,layer_patt=None,
+             fold_to_lower=False,use_arrow=None):
+    """
+    Read a shapefile into memory as a numpy array.
+    Data is returned as a record array, with geometry as a shapely
+    geometry object in the 'geom' field.
 
-        geo_ref=f.GetGeometryRef()
-        if geo_ref is None:
-            # this is possible, for example, in QGIS delete all nodes of a
-            # line, but don't delete the actual feature.
-            return None
-        #try:
-        if use_wkt:
-            geo=wkt.loads( f.GetGeometryRef().ExportToWkt() )
-        else:
-            geo=wkb.loads( f.GetGeometryRef().ExportToWkb() )
-        geo=geom_xform(geo)
-        #except:
-        #    geo=None
-        return geo
-    fields.append( (None,'geom',object,rdr) )
-    
-    layer_dtype = [ (name,np_type) for i,name,np_type,getter in fields]
+    target_srs: input suitable for osgeo.osr.SetFromUserInput(), or an
+    existing osr.SpatialReference, to specify
+    a projection to which the data should be projected.  If this is specified
+    but the shapefile does not specify a projection, and source_srs is not given,
+    then an exception is raised.  source_srs will override the projection in 
+    the shapefile if specified.
 
-    recs = []
+    fold_to_lower: fold field names to lower case.
 
-    layer.ResetReading()
+    return_srs: return a tuple, second item being the text representation of the project, or
+     None if no projection information was found.
 
-    while 1:
-        feat = layer.GetNextFeature()
-        if feat is None:
-            break
-        try:
-            field_vals = [getter(feat) for i,name,np_type,getter in fields]
-        except shapely.geos.WKBReadingError as exc:
-            # Used to just be shapely.geos.ReadingError
-            print("Failed to load geometry for feature")
-            print(exc)
-            continue
-        field_array = tuple(field_vals)
-        recs.append(field_array)
+    use_arrow: see shp2columns, which does the reading.
+    """
+    columns,srs_wkt=shp2columns(shp_fn,use_wkt=use_wkt,target_srs=target_srs,
+                                source_srs=source_srs,return_srs=True,
+                                query=query,layer_patt=layer_patt,
+                                fold_to_lower=fold_to_lower,use_arrow=use_arrow)
 
-    recs = np.array( recs, dtype=layer_dtype)
+    layer_dtype = [ (name,columns[name].dtype) for name in columns ]
+    recs = np.zeros( len(columns['geom']), dtype=layer_dtype)
+    for name in columns:
+        recs[name]=columns[name]
 
     if return_srs:
-        return recs, target_srs.ExportToWkt()
+        return recs, srs_wkt
     else:
         return recs
 
-    
-
-    
@@ -79,3 +79,110 @@ def find_tidal_datum(timeseries,stat,daily=False):
             daily_agg = h_agg_by_day.max(axis=1)
 
         return daily_agg.mean()
+
+def find_tidal_datums(t,h,datums=('mllw','mlw','mhw','mhhw')):
+    """
+    Compute several tidal datums for many series at once.
+
+    t: [N] datenums, shared by all series
+    h: [N] or [N,nseries] water levels.  NaN samples are ignored, and M2
+      periods without any valid samples are skipped.
+    datums: names of datums to compute, from 'mllw','mlw','mhw','mhhw'.
+
+    Returns a dict mapping datum name to an [nseries] array (or a float
+    when h is 1-D).  For series without gaps, results match find_tidal_datum.
+    """
+    t=np.asarray(t,np.float64)
+    h=np.asarray(h,np.float64)
+    squeeze=(h.ndim==1)
+    if squeeze:
+        h=h[:,None]
+    nt,nseries=h.shape
+    for datum in datums:
+        if datum not in ('mllw','mlw','mhw','mhhw'):
+            raise Exception("Datum %s not understood"%datum)
+
+    # median seems safer than mode with floating point data
+    dt=np.median(np.diff(t)*24*60) # time step of the record in minutes
+    nm2=TM2/dt      # fractional samples per TM2
+
+    valid=np.isfinite(h)
+    hmean=np.where(valid,h,0.0).sum(axis=0)/np.maximum(1,valid.sum(axis=0))
+    h1=h-hmean # height anomaly, NaN in gaps
+
+    # first zero crossing per series
+    crossing=h1[:-1]*h1[1:] < 0
+    i0=np.argmax(crossing,axis=0)
+    has_crossing=crossing[i0,np.arange(nseries)]
+
+    Nmonths=np.where(has_crossing,
+                     ((t[-1] - t[i0])*24*60 / T57M2).astype(np.int64),
+                     0)
+    Nm2=57*Nmonths # number of M2 periods for each series
+    Kmax=Nm2.max() if nseries else 0
+
+    result={datum:np.nan*np.ones(nseries) for datum in datums}
+    if Kmax==0:
+        if squeeze:
+            result={k:float(v[0]) for k,v in result.items()}
+        return result
+
+    # M2 period boundaries, relative to i0. The kth period is
+    # [offsets[k],offsets[k+1])
+    offsets=np.round(np.arange(Kmax+1)*nm2).astype(np.int64)
+
+    # Lay the series end to end and reduce each M2 period with reduceat.
+    # Each series contributes the starts of its periods, and one more index
+    # ending its last period. The trailing sentinel keeps that end index
+    # in bounds.
+    k=np.arange(Kmax+1)
+    in_series=k[None,:] <= Nm2[:,None] # [S,K+1]
+    bounds=np.minimum(i0[:,None]+offsets[None,:],nt) + nt*np.arange(nseries)[:,None]
+    bounds=bounds[in_series]
+    is_period=(k[None,:] < Nm2[:,None])[in_series]
+    period_series,period_k=np.nonzero( k[None,:] < Nm2[:,None] )
+
+    flat=h.T.ravel()
+    gaps=np.isnan(flat)
+
+    period_valid=np.zeros( (Kmax,nseries), np.bool8)
+    period_valid[period_k,period_series]=True
+
+    for stat in ['min','max']:
+        stat_datums=[d for d in datums if (d in ('mllw','mlw'))==(stat=='min')]
+        if not stat_datums:
+            continue
+        if stat=='min':
+            fill=np.inf
+            reducer=np.minimum
+        else:
+            fill=-np.inf
+            reducer=np.maximum
+        filled=np.concatenate( [np.where(gaps,fill,flat),[fill]] )
+        extrema=reducer.reduceat(filled,bounds)[is_period]
+
+        # h extrema aggregated per M2 period, [K,S]
+        h_agg=np.full( (Kmax,nseries), np.nan)
+        h_agg[period_k,period_series]=extrema
+        h_agg[~np.isfinite(h_agg)]=np.nan
+        agg_valid_m2=period_valid & np.isfinite(h_agg)
+
+        for datum in stat_datums:
+            if datum in ('mlw','mhw'):
+                agg=h_agg
+                agg_valid=agg_valid_m2
+            else:
+                # pairs of M2 periods, trimming to an even number
+                # of M2 periods per series.
+                npair=Kmax//2
+                by_day=h_agg[:2*npair].reshape( (npair,2,-1) )
+                agg=reducer.reduce(np.where(np.isnan(by_day),fill,by_day),axis=1)
+                agg_valid=( np.isfinite(agg)
+                            & (np.arange(npair)[:,None] < (Nm2//2)[None,:]) )
+            count=agg_valid.sum(axis=0)
+            total=np.where(agg_valid,agg,0.0).sum(axis=0)
+            result[datum]=np.where(count>0,total/np.maximum(count,1),np.nan)
+
+    if squeeze:
+        result={k:float(v[0]) for k,v in result.items()}
+    return result
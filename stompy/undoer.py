@@ -9,7 +9,41 @@ Could be better to maintain a linked list of checkpoints, each
 checkpoint references one before it.  Then commiting a checkpoint
 means deleting its reference to commits before it.
 
+Bounded history: with op_history_bounded=True, ops older than the oldest
+checkpoint still referenced somewhere are discarded, since nothing can
+revert to them.  op_history_max_bytes additionally caps the (estimated)
+size of the history, discarding the oldest ops even if that invalidates
+old checkpoints.  Trimming happens every op_history_trim_interval pushes.
 """
+import sys
+import weakref
+import logging
+from contextlib import contextmanager
+
+import numpy as np
+
+log=logging.getLogger('undoer')
+
+def op_nbytes(op):
+    """
+    Rough estimate of the memory held by a recorded op, counting numpy
+    arrays by their data size.
+    """
+    meth,data,kwdata=op
+    total=sys.getsizeof(data)+sys.getsizeof(kwdata)
+    for v in list(data)+list(kwdata.values()):
+        if isinstance(v,np.ndarray):
+            total+=v.nbytes
+        elif isinstance(v,dict):
+            total+=sys.getsizeof(v)
+            for vv in v.values():
+                if isinstance(vv,np.ndarray):
+                    total+=vv.nbytes
+                else:
+                    total+=sys.getsizeof(vv)
+        else:
+            total+=sys.getsizeof(v)
+    return total
 
 class OpHistory(object):
     state='inactive' # 'recording','reverting'
@@ -23,14 +57,34 @@ class OpHistory(object):
     op_stack_serial = 17
     op_stack = None
     abs_serial=0
+
+    # Bounded history settings.  See module docstring.
+    op_history_bounded=False
+    op_history_max_bytes=None
+    op_history_trim_interval=1000
+
+    # number of ops discarded from the bottom of op_stack, so that
+    # checkpoint frames keep counting from the start of the stack.
+    op_stack_base=0
+    op_stack_nbytes=None # parallel to op_stack when tracking bytes
+    _live_checkpoints=None
+    _pushes_since_trim=0
+
     def checkpoint(self):
         assert self.state != 'reverting'
 
         if self.op_stack is None:
             self.op_stack_serial += 1
             self.op_stack = []
+            self.op_stack_base = 0
+            self.op_stack_nbytes = None
         self.state='recording'
-        return self.Checkpoint(self.op_stack_serial,len(self.op_stack))
+        cp=self.Checkpoint(self.op_stack_serial,self.op_stack_base+len(self.op_stack))
+        if self.op_history_bounded:
+            if self._live_checkpoints is None:
+                self._live_checkpoints=weakref.WeakSet()
+            self._live_checkpoints.add(cp)
+        return cp
 
     def revert(self,cp):
         if cp.serial != self.op_stack_serial:
@@ -39,9 +93,12 @@ class OpHistory(object):
                                                              cp.serial) )
         if self.state!='recording':
             raise Exception("Tried to revert, but not recording")
+        if cp.frame < self.op_stack_base:
+            raise ValueError( ("Checkpoint at op %d is older than the bounded history, "
+                               "which starts at op %d")%(cp.frame,self.op_stack_base) )
         try:
             self.state='reverting'
-            while len(self.op_stack) > cp.frame:
+            while self.op_stack_base+len(self.op_stack) > cp.frame:
                 self.pop_op()
         finally:
             self.state='recording'
@@ -58,8 +115,27 @@ class OpHistory(object):
     def commit(self):
         assert self.state != 'reverting'
         self.op_stack = None
+        self.op_stack_nbytes = None
         self.op_stack_serial += 1
         self.state='inactive'
+
+    @contextmanager
+    def suspend_history(self):
+        """
+        Context manager for bulk operations which should not be recorded.
+        Since ops inside the block cannot be undone, any existing history is
+        committed, and checkpoints taken before the block can no longer be
+        reverted.  If recording was active, it resumes with a fresh history
+        after the block.
+        """
+        assert self.state != 'reverting'
+        was_recording=(self.state=='recording')
+        self.commit()
+        try:
+            yield
+        finally:
+            if was_recording:
+                self.checkpoint()
     
     def push_op(self,meth,*data,**kwdata):
         self.abs_serial=self.abs_serial+1
@@ -67,7 +143,53 @@ class OpHistory(object):
             return
 
         if self.op_stack is not None:
-            self.op_stack.append( (meth,data,kwdata) )
+            op=(meth,data,kwdata)
+            self.op_stack.append( op )
+            if self.op_history_max_bytes is not None:
+                if self.op_stack_nbytes is None:
+                    self.op_stack_nbytes=[op_nbytes(o) for o in self.op_stack]
+                else:
+                    self.op_stack_nbytes.append(op_nbytes(op))
+            if self.op_history_bounded or (self.op_history_max_bytes is not None):
+                self._pushes_since_trim+=1
+                if self._pushes_since_trim>=self.op_history_trim_interval:
+                    self.trim_history()
+
+    def trim_history(self):
+        """
+        Discard ops which can no longer be reverted (op_history_bounded), or
+        which exceed op_history_max_bytes.  Called periodically by push_op.
+        Returns the number of ops discarded.
+        """
+        self._pushes_since_trim=0
+        if not self.op_stack:
+            return 0
+        top=self.op_stack_base+len(self.op_stack)
+        keep_from=self.op_stack_base # absolute index of first op to keep
+
+        if self.op_history_bounded:
+            live=[cp.frame for cp in (self._live_checkpoints or [])
+                  if cp.serial==self.op_stack_serial]
+            keep_from=max(keep_from,min(live,default=top))
+
+        if self.op_history_max_bytes is not None and self.op_stack_nbytes is not None:
+            sizes=np.array(self.op_stack_nbytes[keep_from-self.op_stack_base:],np.int64)
+            # bytes held by each op and all those above it
+            from_top=np.cumsum(sizes[::-1])[::-1]
+            over=np.nonzero(from_top>self.op_history_max_bytes)[0]
+            if len(over):
+                new_keep=keep_from+over[-1]+1
+                log.warning("Undo history over %d bytes, discarding %d ops"%(self.op_history_max_bytes,
+                                                                             new_keep-keep_from))
+                keep_from=new_keep
+
+        n_drop=keep_from-self.op_stack_base
+        if n_drop>0:
+            del self.op_stack[:n_drop]
+            if self.op_stack_nbytes is not None:
+                del self.op_stack_nbytes[:n_drop]
+            self.op_stack_base=keep_from
+        return n_drop
 
     def pop_op(self):
         assert self.state=='reverting'
@@ -75,6 +197,8 @@ class OpHistory(object):
         self.abs_serial=self.abs_serial+1
 
         f = self.op_stack.pop()
+        if self.op_stack_nbytes:
+            self.op_stack_nbytes.pop()
         self.log.debug("popping: %s"%( str(f) ) )
         meth = f[0]
         args = f[1]
@@ -89,6 +213,8 @@ class OpHistory(object):
             d = dict(self.__dict__)
 
         d['op_stack']=None
+        d['op_stack_nbytes']=None
         d['state']='inactive'
+        d.pop('_live_checkpoints',None)
 
         return d
@@ -1807,7 +1807,9 @@ def array_append( A, b=sentinel ):
     # the layout is different and it would just get confusing, or
     # A is a slice on other dimensions, too, which gets too confusing.
 
-    if (A.base is None) or type(A.base) in (str,bytes) \
+    # memory mapped arrays (base is an mmap) are promoted to
+    # regular arrays here, too.
+    if (A.base is None) or not isinstance(A.base,np.ndarray) \
            or A.base.size == A.size or A.base.strides != A.strides \
            or A.shape[1:] != A.base.shape[1:]:
         new_shape = list(A.shape)
@@ -452,6 +452,63 @@ def section_hydro_to_transect(filename,name=None,index=None):
 
     return section_hydro_parsed_to_transect(section,filename)
 
+# rows of profiles per chunk in the resampling kernels, to bound the size of
+# temporary [profile,new,old] arrays
+resample_chunk_elements=2**22
+
+def resample_z_columns(values,src_z,src_dz,new_z,sgn=1,z_flip=1):
+    """
+    Kernel for resample_z, operating on all water columns at once.
+
+    values, src_z, src_dz: [...,Nz] arrays, with the vertical dimension last.
+     Columns can be ragged, marked by nan in values or src_z.
+    new_z: [N] target z, in the same reference as src_z after z_flip.
+    sgn: +1 if src_z increases with the vertical index, -1 if it decreases.
+    z_flip: -1 to flip the sign of new_z relative to src_z.
+
+    returns [...,N] array, the value of the source bin containing each
+    new_z, nan where new_z falls outside the valid part of the column.
+    """
+    values=np.asarray(values)
+    new_z=np.asarray(new_z)
+    Nz=values.shape[-1]
+    out_shape=values.shape[:-1]+new_z.shape
+
+    vals=values.reshape(-1,Nz)
+    z=np.broadcast_to(src_z,values.shape).reshape(-1,Nz)
+    dz=np.broadcast_to(src_dz,values.shape).reshape(-1,Nz)
+    Ncol=len(vals)
+    rows=np.arange(Ncol)
+
+    valid=np.isfinite(z+vals)
+    n_valid=valid.sum(axis=1)
+
+    # pack valid entries of each column to the front, keeping their order
+    order=np.argsort(~valid,axis=1,kind='stable')
+    vals=vals[rows[:,None],order]
+    z=z[rows[:,None],order]
+    dz=dz[rows[:,None],order]
+
+    # interfaces in sgn*z, increasing within a column and padded with inf
+    ints=np.full( (Ncol,Nz+1), np.inf)
+    packed=np.arange(Nz)[None,:]<n_valid[:,None]
+    ints[:,:Nz]=np.where(packed,sgn*(z-0.5*dz),np.inf)
+    last=np.maximum(n_valid-1,0)
+    ints[rows,n_valid]=np.where(n_valid>0,sgn*(z[rows,last]+0.5*dz[rows,last]),np.inf)
+
+    # searchsorted(ints,q) is the number of interfaces less than q
+    q=z_flip*sgn*new_z
+    bins=np.zeros( (Ncol,len(q)), np.int64)
+    step=max(1,resample_chunk_elements//max(1,len(q)*(Nz+1)))
+    for start in range(0,Ncol,step):
+        chunk=slice(start,start+step)
+        bins[chunk]=(ints[chunk,None,:]<q[None,:,None]).sum(axis=2)
+
+    bad=(bins<1)|(bins>n_valid[:,None])
+    bins=np.clip(bins,1,np.maximum(n_valid,1)[:,None])-1
+    result=np.where(bad,np.nan,vals[rows[:,None],bins])
+    return result.reshape(out_shape)
+
 def resample_z(tran,new_z,save_original=None,new_z_positive='same'):
     """
     Resample z coordinate to the given vector new_z [N].
@@ -464,11 +521,16 @@ def resample_z(tran,new_z,save_original=None,new_z_positive='same'):
     the current handling for order of z is not good.
 
     new_z is taken to be in the target sign convention.
+
+    All water columns of a variable are resampled at once by
+    resample_z_columns().  Dask-backed variables stay lazy.
     """
     # had been a comment about resampling to positive up, but the code
     # doesn't actually do that.  instead, assumes that new_z is the
     # same reference and sign as tran.z_ctr
-    ds=xr.Dataset()
+    # collect variables and create the dataset once at the end, which
+    # avoids aligning on every assignment.
+    ds={}
 
     z_dim='layer'
 
@@ -484,11 +546,26 @@ def resample_z(tran,new_z,save_original=None,new_z_positive='same'):
     # print("Existing z_ctr_pos %s  new z pos %s z_flip %s"%(z_ctr_pos,new_z_positive,z_flip))
 
     ds['sample']=tran['sample']
-    ds['z_ctr']=(z_dim,),new_z
+    z_ctr_attrs=dict(tran.z_ctr.attrs)
+    z_ctr_attrs['positive']=new_z_positive
+    ds['z_ctr']=(z_dim,),new_z,z_ctr_attrs
     ds['z_dz']=(z_dim,),utils.center_to_interval(new_z)
 
-    ds['z_ctr'].attrs.update(tran.z_ctr.attrs)
-    ds['z_ctr'].attrs['positive']=new_z_positive
+    z_dz=get_z_dz(tran)
+
+    # sgn is used to get the src data into increasing z coordinate
+    # so if the order is top-to-bottom, sgn*src_z is positive-down
+    #    if order is bottom-to-top, sgn*src_z is positive-up
+    all_sgns=np.sign(z_dz.values).ravel()
+    # some of these may be nan - just look past those
+    all_sgns=all_sgns[ np.isfinite(all_sgns) ]
+    if all_sgns.max()>0:
+        sgn=1
+    elif all_sgns.min()<0:
+        sgn=-1
+    else:
+        raise Exception("All signs are 0?")
+    assert np.all( sgn*all_sgns>=0 )
 
     for v in tran.data_vars:
         var=tran[v]
@@ -510,77 +587,24 @@ def resample_z(tran,new_z,save_original=None,new_z_positive='same'):
                 # unclear how to deal with things like wdim.  For now
                 # it will get copied, but then it will not be valid.
                 ds[d]=tran[d]
-        shape=[ len(ds[d]) for d in dims]
-
-        # For the moment, can assume that there are two dimensions,
-        # and the first is sample.
-        new_val=np.nan*np.ones( shape, np.float64 )
-
-        # iter_shape=[ len(tran[d]) for d in dims
-        iter_shape=var.shape
-
-        z_num=list(dims).index(z_dim)
 
         if len(dims)==1:
             # print("Not sure how to resample %s"%v)
             continue
         # Not quite there -- this isn't smart enough to get the interfaces
-        _,src_z,src_dz = xr.broadcast(var,tran['z_ctr'],get_z_dz(tran))
-
-        # sgn is used to get the src data into increasing z coordinate
-        # so if the order is top-to-bottom, sgn*src_z is positive-down
-        #    if order is bottom-to-top, sgn*src_z is positive-up
-        all_sgns=np.sign(src_dz).values.ravel()
-        # some of these may be nan - just look past those
-        all_sgns=all_sgns[ np.isfinite(all_sgns) ]
-        if all_sgns.max()>0:
-            sgn=1
-        elif all_sgns.min()<0:
-            sgn=-1
-        else:
-            raise Exception("All signs are 0?")
-        assert np.all( sgn*all_sgns>=0 )
-
-        for index in np.ndindex( *iter_shape ):
-            if index[z_num]>0:
-                continue
-            index=list(index)
-            index[z_num]=slice(None)
-            index=tuple(index)
-            my_src_z=src_z.values[index]
-            my_src_dz=src_dz.values[index] # this has a nan
-            my_src=var.values[index]
-            my_src_bottom=my_src_z-0.5*my_src_dz # for each layer
-            my_src_top=my_src_z+0.5*my_src_dz
-
-            # all-nan columns are not valid below because 'bad' bins are still
-            # accessed.  Could rewrite to avoid the partial indexing by src_valid
-            # early on.  in theory we should always have valid z if we have valid
-            # var, but in the case of sontek files, we can have valid SNR, but for
-            # bins below the bed or otherwise invalid, and z will b reported as nan.
-            if np.all(np.isnan(my_src + my_src_z)):
-                new_val[index]=np.nan
-                continue
-            src_valid=np.isfinite(my_src_z+my_src)
-            Nsrc_valid=src_valid.sum()
-
-            # interfaces in src z coordinate
-            my_src_ints=np.concatenate( (my_src_bottom[src_valid],
-                                         my_src_top[src_valid][-1:]) )
-
-            # use sgn to make sure this is increasing
-            # and new_z is flipped maybe to match flipping of src, and
-            # maybe again to get the desired output sign.
-            bins=np.searchsorted(sgn*my_src_ints,z_flip*sgn*new_z)
-            bad=(bins<1)|(bins>Nsrc_valid) # not sure about that top clip
-            # Make these safe, and 0-referenced
-            bins=bins.clip(1,Nsrc_valid)-1
-            # But record which ones are not valid
-            new_val[index]=np.where( bad,np.nan,var.values[index][src_valid][bins] )
-
-        ds[v]=dims,new_val
-        ds[v].attrs.update(var.attrs)
-
+        _,src_z,src_dz = xr.broadcast(var,tran['z_ctr'],z_dz)
+
+        new_var=xr.apply_ufunc(resample_z_columns,var,src_z,src_dz,
+                               kwargs=dict(new_z=np.asarray(new_z),sgn=sgn,z_flip=z_flip),
+                               input_core_dims=[[z_dim]]*3,
+                               output_core_dims=[[z_dim]],
+                               exclude_dims=set([z_dim]),
+                               dask='parallelized',
+                               output_dtypes=[np.float64],
+                               dask_gufunc_kwargs=dict(output_sizes={z_dim:len(new_z)}))
+        ds[v]=dims,new_var.transpose(*dims).data,var.attrs
+
+    ds=xr.Dataset(ds)
     ds.attrs.update(tran.attrs)
     return ds
 
@@ -593,10 +617,9 @@ def resample_d(tran,new_xy,save_original=None):
     # need a function which takes per-sample data from ds_in,
     # returns per-sample data at new_xy
     old_xy=np.c_[tran.x_sample, tran.y_sample]
+    new_xy=np.asarray(new_xy)
 
-    # per point in new_xy, an array of averaging weights to apply across samples
-    weights=np.zeros( (len(new_xy),len(old_xy)), np.float64)
-    # for categorical data, just have to choose one input element
+    # for each new point, the input sample it takes its values from
     # -1 => no match
     selectors=np.zeros(len(new_xy), np.int32)-1
 
@@ -610,15 +633,17 @@ def resample_d(tran,new_xy,save_original=None):
         # print("Resampling: flip transect to match order of new points")
         new_start,new_stop = new_stop,new_start
 
-    for row in range(new_start,new_stop+1):
-        pnt=new_xy[row]
-        # start with simple -- choose nearest point in input
-        dists=utils.dist(pnt,old_xy)
-        best=np.argmin(dists)
-        weights[row,best]=1.0
-        selectors[row]=best
-
-    ds=xr.Dataset()
+    # start with simple -- choose nearest point in input
+    step=max(1,resample_chunk_elements//max(1,len(old_xy)))
+    for start in range(new_start,new_stop+1,step):
+        stop=min(start+step,new_stop+1)
+        dists=utils.dist(new_xy[start:stop,None,:],old_xy[None,:,:])
+        selectors[start:stop]=np.argmin(dists,axis=1)
+    matched=selectors>=0
+    safe_selectors=selectors.clip(0)
+
+    # as in resample_z, create the dataset once at the end
+    ds={}
     ds['sample']=('sample',),np.arange(len(new_xy))
     sample_dim='sample'
 
@@ -646,48 +671,24 @@ def resample_d(tran,new_xy,save_original=None):
                 # unclear how to deal with things like wdim.  For now
                 # it will get copied, but then it will not be valid.
                 ds[d]=tran[d]
-        shape=[ len(ds[d]) for d in dims]
-
-        new_val=np.zeros( shape, var.dtype )
-        if np.issubdtype(var.dtype,np.floating):
-            new_val[...]=np.nan
         sample_num=list(dims).index(sample_dim)
 
-        # handling below is simplified by casting dates to floats.
-        if np.issubdtype(var.dtype,np.datetime64):
-            cast=utils.to_dnum
-            uncast=utils.to_dt64
+        # all of the non-sample dimensions at once
+        new_val=var.isel({sample_dim:safe_selectors}).data
+        unmatched=(slice(None),)*sample_num + (~matched,)
+        if np.issubdtype(var.dtype,np.floating) or np.issubdtype(var.dtype,np.datetime64):
+            if not np.all(matched):
+                new_val=new_val.copy()
+                new_val[unmatched]=np.nan if np.issubdtype(var.dtype,np.floating) else np.datetime64('NaT')
         else:
-            def cast(x): return x
-            def uncast(x): return x
-
-        for index in np.ndindex( *var.shape ):
-            if index[sample_num]>0:
-                continue # really only iterating over the non-sample dimensions
-            # replace sample index with slice(None)
-            index=list(index)
-            index[sample_num]=slice(None)
-
-            my_src=cast(var.values[tuple(index)])
-            if not np.issubdtype(my_src.dtype,np.floating):
-                print("Variable %s will be treated as a category"%var.name)
-                my_dst=my_src[selectors]
-                my_dst[selectors<0]=None
-            else:
-                valid=np.isfinite(my_src)
-
-                my_dst=(my_src[valid]*weights[:,valid]).sum(axis=1)
-                weight_sum=weights[:,valid].sum(axis=1)
+            print("Variable %s will be treated as a category"%var.name)
+            if not np.all(matched):
+                new_val=np.array(new_val)
+                new_val[unmatched]=None
 
-                bad=(weight_sum==0)
-                my_dst[bad]=np.nan
-                my_dst[~bad]=my_dst[~bad]/weight_sum[~bad]
+        ds[v_dest]=dims,new_val
 
-            new_val[tuple(index)]=my_dst
-
-        ds[v_dest]=dims,uncast(new_val)
-
-    return ds
+    return xr.Dataset(ds)
 
 
 def extrapolate_vertical(tran,var_methods,eta=0,z_bed='z_bed',save_original=False):
@@ -0,0 +1,82 @@
+import os
+import datetime
+import numpy as np
+
+from stompy.grid import unstructured_grid
+from stompy.model.delft import io as dio
+
+def write_his(fn,nframes=5,n_regions=4,n_fields=3):
+    with open(fn,'wb') as fp:
+        descs=np.array([b'desc1',b'desc2',b'desc3',
+                        b'T0: 2012/08/07-00:00:00  (scu=       1s)'],'S40')
+        descs.tofile(fp)
+        np.array([n_fields,n_regions],'i4').tofile(fp)
+        fields=np.zeros(n_fields,[('sub','S10'),('proc','S10')])
+        fields['sub']=[b'sub%d'%i for i in range(n_fields)]
+        fields.tofile(fp)
+        regions=np.zeros(n_regions,[('num','i4'),('name','S20')])
+        regions['num']=1+np.arange(n_regions)
+        regions['name']=[b'region%d'%i for i in range(n_regions)]
+        regions.tofile(fp)
+        frames=np.zeros(nframes,[('tsec','i4'),('data','f4',(n_regions,n_fields))])
+        frames['tsec']=3600*np.arange(nframes)
+        frames['data']=np.random.random(frames['data'].shape)
+        frames.tofile(fp)
+
+def test_his_lazy():
+    fn='test-lazy.his'
+    write_his(fn)
+    ds_eager=dio.his_file_xarray(fn,region_exclude='region1')
+    ds_lazy=dio.his_file_xarray(fn,region_exclude='region1',lazy=True)
+
+    assert np.all(ds_eager.tsec.values==ds_lazy.tsec.values)
+    assert np.all(ds_eager.bal.values==ds_lazy.bal.values)
+    sel=dict(time=[1,3],region=slice(1,None),field=2)
+    assert np.all(ds_eager.bal.isel(**sel).values==ds_lazy.bal.isel(**sel).values)
+    ds_lazy.close()
+    os.unlink(fn)
+
+class FakeHydro(object):
+    def __init__(self,g,n_layers):
+        self.g=g
+        self.n_2d_elements=g.Ncells()
+        self.seg_k=np.repeat(np.arange(n_layers),g.Ncells())
+        self.time0=datetime.datetime(2012,8,7)
+    def infer_2d_elements(self):
+        pass
+    def grid(self):
+        return self.g
+
+def test_map_lazy():
+    g=unstructured_grid.UnstructuredGrid(max_sides=4)
+    g.add_rectilinear([0,0],[10,10],4,5)
+    n_layers=3
+    hyd=FakeHydro(g,n_layers)
+    n_segs=n_layers*g.Ncells()
+    subs=['salinity','temp']
+    nframes=6
+
+    fn='test-lazy.map'
+    with open(fn,'wb') as fp:
+        fp.write(b' '*160)
+        np.array([len(subs),n_segs],'i4').tofile(fp)
+        np.array(subs,'S20').tofile(fp)
+        frames=np.zeros(nframes,[('tsecs','i4'),('data','f4',(n_segs,len(subs)))])
+        frames['tsecs']=1800*np.arange(nframes)
+        frames['data']=np.random.random(frames['data'].shape)
+        frames.tofile(fp)
+
+    ds_eager=dio.read_map(fn,hyd=hyd,include_grid=False,lazy=False)
+    ds_lazy=dio.read_map(fn,hyd=hyd,include_grid=False)
+
+    for sub in subs:
+        assert np.all(ds_eager[sub].values==ds_lazy[sub].values)
+    sel=dict(time=[0,4],layer=1,face=slice(2,7))
+    assert np.all(ds_eager['temp'].isel(**sel).values==ds_lazy['temp'].isel(**sel).values)
+    # segment ordering is layer-major
+    expected=frames['data'][2,g.Ncells()*2+3,1]
+    assert ds_lazy['temp'].isel(time=2,layer=2,face=3).values==expected
+    ds_lazy.close()
+    ds_eager.close()
+    del ds_eager
+    os.unlink(fn)
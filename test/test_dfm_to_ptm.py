@@ -0,0 +1,202 @@
+import os
+import datetime
+import numpy as np
+import xarray as xr
+
+from stompy.grid import unstructured_grid
+from stompy.model.delft import dfm_to_ptm
+from stompy.model.delft import waq_scenario as waq
+
+# Synthetic DFM map output and DWAQ hydro, enough to drive the converter
+# without running dflowfm.
+time0=datetime.datetime(2018,1,1)
+dt_sec=1800
+
+def make_grid():
+    g=unstructured_grid.UnstructuredGrid(max_sides=4)
+    g.add_rectilinear([0,0],[400,300],5,4)
+    g.make_edges_from_cells()
+    return g
+
+class FakeModel(object):
+    num_procs=1
+    def __init__(self,map_fns):
+        self.map_fns=map_fns
+        self.mdu={('geometry','BedLevType'):'3'}
+    def map_outputs(self):
+        return self.map_fns
+
+class FakeHydro(waq.Hydro):
+    """
+    DWAQ-like hydro on g, nkmax layers, top layer first.  West edges are
+    flow boundaries.  Volumes are integrated from the flows, so the output
+    should satisfy continuity.
+    """
+    def __init__(self,g,nkmax,nt,seed=1):
+        super(FakeHydro,self).__init__()
+        self.time0=time0
+        self.t_secs=(dt_sec*np.arange(nt)).astype('i4')
+        self.n_seg=nkmax*g.Ncells()
+        seg=lambda c,k: k*g.Ncells()+c
+
+        e2c=g.edge_to_cells()
+        west=g.edges_center()[:,0]==0
+        hor=[]
+        for k in range(nkmax):
+            for j in range(g.Nedges()):
+                c1,c2=e2c[j]
+                if c1>=0 and c2>=0:
+                    hor.append( [seg(c1,k)+1,seg(c2,k)+1,0,0] )
+                elif west[j]:
+                    c=max(c1,c2)
+                    hor.append( [-(c+1),seg(c,k)+1,0,0] )
+        vert=[ [seg(c,k)+1,seg(c,k+1)+1,0,0]
+               for k in range(nkmax-1) for c in range(g.Ncells())]
+        self.pointers=np.array(hor+vert,np.int32).reshape([-1,4])
+        self.n_exch_x=len(hor)
+        self.n_exch_y=0
+        self.n_exch_z=len(vert)
+
+        rng=np.random.RandomState(seed)
+        self._flows=rng.uniform(-1,1,(nt,self.n_exch)).astype('f4')
+        self._flows[:,::7]=0.0 # some dry exchanges
+        self._areas=rng.uniform(1,10,(nt,self.n_exch)).astype('f4')
+        vols=np.zeros((nt,self.n_seg),np.float64)
+        vols[0]=1000.0
+        poi0=self.pointers-1
+        for ti in range(nt-1):
+            vols[ti+1]=vols[ti]
+            inside=poi0[:,0]>=0
+            np.add.at(vols[ti+1],poi0[inside,0],-dt_sec*self._flows[ti,inside])
+            np.add.at(vols[ti+1],poi0[:,1],dt_sec*self._flows[ti])
+        self._volumes=vols.astype('f4')
+
+    def seg_active(self):
+        return np.ones(self.n_seg,np.bool_)
+    def flows(self,t):
+        return self._flows[self.t_sec_to_index(t)]
+    def areas(self,t):
+        return self._areas[self.t_sec_to_index(t)]
+    def volumes(self,t):
+        return self._volumes[self.t_sec_to_index(t)]
+
+def write_map(g,nkmax,nt,fns,seed=2):
+    ds=g.write_to_xarray(mesh_name='mesh2d',
+                         node_coordinates='mesh2d_node_x mesh2d_node_y',
+                         face_node_connectivity='mesh2d_face_nodes',
+                         edge_node_connectivity='mesh2d_edge_nodes',
+                         face_dimension='nmesh2d_face',
+                         edge_dimension='nmesh2d_edge',
+                         node_dimension='nmesh2d_node')
+    ds=ds.rename({'maxnode_per_face':'max_nmesh2d_face_nodes',
+                  'node_per_edge':'Two'})
+    ds.mesh2d.attrs['node_dimension']='nmesh2d_node'
+    ds.mesh2d.attrs['max_face_nodes_dimension']='max_nmesh2d_face_nodes'
+    cc=g.cells_center()
+    ec=g.edges_center()
+    ds['mesh2d_face_x']=('nmesh2d_face',),cc[:,0]
+    ds['mesh2d_face_y']=('nmesh2d_face',),cc[:,1]
+    ds['mesh2d_edge_x']=('nmesh2d_edge',),ec[:,0]
+    ds['mesh2d_edge_y']=('nmesh2d_edge',),ec[:,1]
+    ds['mesh2d_flowelem_bl']=('nmesh2d_face',),-5.0+0*cc[:,0]
+    ds['mesh2d_node_z']=('nmesh2d_node',),-5.0+0*g.nodes['x'][:,0]
+    # 1: internal, 2: flow bc, 3: closed
+    e2c=g.edge_to_cells()
+    edge_type=np.where(e2c.min(axis=1)>=0,1,3)
+    edge_type[(e2c.min(axis=1)<0) & (ec[:,0]==0)]=2
+    ds['mesh2d_edge_type']=('nmesh2d_edge',),edge_type.astype(np.float64)
+
+    rng=np.random.RandomState(seed)
+    times=np.datetime64(time0)+dt_sec*np.arange(nt)*np.timedelta64(1,'s')
+    ds['time']=('time',),times
+    s1=rng.uniform(-5.5,1,(nt,g.Ncells()))
+    ds['mesh2d_s1']=('time','nmesh2d_face'),s1
+    ds['mesh2d_waterdepth']=('time','nmesh2d_face'),np.maximum(s1+5,0.0)
+    if nkmax==1:
+        ds['mesh2d_ucx']=('time','nmesh2d_face'),rng.uniform(size=(nt,g.Ncells()))
+    else:
+        dims=('time','nmesh2d_face','nmesh2d_layer')
+        shape=(nt,g.Ncells(),nkmax)
+        ds['mesh2d_ucx']=dims,rng.uniform(size=shape)
+        ds['mesh2d_sa1']=dims,rng.uniform(0,35,size=shape)
+        ds['mesh2d_viw']=dims,rng.uniform(size=shape)
+
+    # multiple files overlap by one step, as with a restarted run
+    breaks=np.linspace(0,nt-1,len(fns)+1).astype(np.int32)
+    for fn,t_start,t_stop in zip(fns,breaks[:-1],breaks[1:]):
+        ds.isel(time=slice(t_start,t_stop+1)).to_netcdf(fn)
+
+class PTMHydro(dfm_to_ptm.DFlowToPTMHydro):
+    remap_waq_elements=False
+    fake_hyd=None
+    def open_waq_output(self):
+        self.hyd=self.fake_hyd
+        self.hyd.infer_2d_links()
+        self.poi0=self.hyd.pointers-1
+        self.init_waq_mappings()
+
+def convert(tmpdir,monkeypatch,label,nkmax=1,nt=9,n_map_files=1,**kw):
+    g=make_grid()
+    map_fns=[os.path.join(str(tmpdir),"%s_%d_map.nc"%(label,i))
+             for i in range(n_map_files)]
+    write_map(g,nkmax,nt,map_fns)
+    monkeypatch.setattr(dfm_to_ptm.dfm.DFlowModel,'load',
+                        staticmethod(lambda mdu_path: FakeModel(map_fns)))
+    out_fn=os.path.join(str(tmpdir),"%s_hydro.nc"%label)
+    PTMHydro('unused.mdu',out_fn,fake_hyd=FakeHydro(g,nkmax,nt),**kw)
+    return xr.open_dataset(out_fn)
+
+time_vars=['Mesh2_salinity_3d','Mesh2_vertical_diffusivity_3d',
+           'Mesh2_edge_bottom_layer','Mesh2_edge_top_layer',
+           'Mesh2_face_bottom_layer','Mesh2_face_top_layer',
+           'h_flow_avg','v_flow_avg','Mesh2_face_water_volume',
+           'Mesh2_edge_wet_area','Mesh2_face_wet_area',
+           'Mesh2_sea_surface_elevation']
+
+def test_continuity(tmpdir,monkeypatch):
+    ds=convert(tmpdir,monkeypatch,'cont')
+    vol=ds.Mesh2_face_water_volume.values[:,0,:]
+    Q=ds.h_flow_avg.values[:,0,:]
+    assert np.all(np.isnan(Q[:,0]))
+    assert np.all(ds.Mesh2_edge_top_layer.values[:,0]==0)
+
+    # net inflow for each cell, with flux positive from first to second cell
+    e2c=ds.Mesh2_edge_faces.values
+    net_in=np.zeros_like(vol)
+    for c in range(vol.shape[0]):
+        for j in ds.Mesh2_face_edges.values[c]:
+            if j<0: continue
+            sgn=1 if e2c[j,1]==c else -1
+            net_in[c,1:]+=sgn*Q[j,1:]
+    err=vol[:,1:]-vol[:,:-1]-dt_sec*net_in[:,1:]
+    assert np.all(np.abs(err)<1e-5*vol.max())
+    ds.close()
+
+def test_blocks(tmpdir,monkeypatch):
+    # block size, threads and time-divided map files do not change the output
+    ref=convert(tmpdir,monkeypatch,'ref',time_block=1)
+    for label,kw in [('blk',dict(time_block=4)),
+                     ('thr',dict(time_block=2,workers=3)),
+                     ('files',dict(n_map_files=3))]:
+        ds=convert(tmpdir,monkeypatch,label,**kw)
+        for v in time_vars+['Mesh2_data_time']:
+            assert np.array_equal(ds[v].values,ref[v].values,equal_nan=True),v
+        ds.close()
+    ref.close()
+
+def test_3d(tmpdir,monkeypatch):
+    nkmax=3
+    ds=convert(tmpdir,monkeypatch,'3d',nkmax=nkmax,time_block=4)
+    hyd=FakeHydro(make_grid(),nkmax,9)
+    ncells=ds.dims['nMesh2_face']
+    # PTM layers run bed to surface, DWAQ surface to bed
+    vols=hyd._volumes.reshape([9,nkmax,ncells])
+    for k in range(nkmax):
+        assert np.all(ds.Mesh2_face_water_volume.values[:,k,:]==vols[:,nkmax-1-k,:].T)
+
+    # vertical flux out of the bed layer
+    v_flow=ds.v_flow_avg.values
+    n_hor=hyd.n_exch_x
+    bed_exch=n_hor+(nkmax-2)*ncells+np.arange(ncells)
+    assert np.all(v_flow[:,0,1:]==-hyd._flows[:-1,bed_exch].T)
+    ds.close()
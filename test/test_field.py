@@ -1,7 +1,7 @@
 import os
 import numpy as np
 
-from stompy.spatial import field
+from stompy.spatial import field, interpXYZ
 
 
 datadir=os.path.join( os.path.dirname(__file__), 'data')
@@ -36,3 +36,107 @@ def test_lin_interp():
     assert np.allclose(out,F)
 
 
+
+def test_kd_interp():
+    X=np.random.random((500,2))*100
+    F=X[:,0]+2*X[:,1]
+    f = field.XYZField(X=X,F=F)
+
+    Q=np.random.random((100,2))*100
+
+    near=f.interpolate(Q,'nearest')
+    js=[np.argmin( ((X-q)**2).sum(axis=1) ) for q in Q]
+    assert np.all(near==F[js])
+
+    # exact at the data points
+    assert np.allclose(f.interpolate(X,'idw',NNear=4),F)
+    assert np.allclose(f.interpolate(X,'kriging',NNear=6,nugget=0.0),F)
+
+    # same geometry, new values reuses weights
+    idw1=f.interpolate(Q,'idw',NNear=4)
+    f.F=2*F
+    idw2=f.interpolate(Q,'idw',NNear=4)
+    assert np.allclose(idw2,2*idw1)
+
+    assert np.all(np.isnan(f.interpolate(Q,'idw',maxdist=1e-6)))
+
+    # missing neighbors do not pick up a nan from another input point
+    interp=interpXYZ.KDTreeInterpolator(np.array([[0,0],[10,0],[0.5,0]]))
+    Z=interp(np.array([[10.1,0]]),np.array([np.nan,1,2]),method='idw',NNear=2,maxdist=1)
+    assert np.allclose(Z,[1.0])
+
+class WavyField(field.Field):
+    def __init__(self,offset,hole=None):
+        super(WavyField,self).__init__()
+        self.offset=offset
+        self.hole=hole
+    def value(self,X):
+        X=np.asarray(X)
+        v=self.offset + np.sin(X[...,0]/37.) + np.cos(X[...,1]/23.)
+        if self.hole is not None:
+            x,y,r=self.hole
+            in_hole=(np.abs(X[...,0]-x)<r) & (np.abs(X[...,1]-y)<r)
+            v=np.where(in_hole,np.nan,v)
+        return v
+
+def test_composite_windowed():
+    from shapely import geometry
+    layers=[ (geometry.box(0,0,1000,1000),0,'overlay()','valid()'),
+             (geometry.box(100,100,400,300),1,'fill(12),overlay()','valid()'),
+             (geometry.Point(500,500).buffer(150),2,'min()','feather(15)'),
+             (geometry.box(600,100,900,400),3,'overlay()','buffer(8)'),
+             (geometry.box(650,150,850,350),1,'max()','valid()'), # hidden by the previous
+             (geometry.box(200,600,700,900),2,'overlay()','blur_alpha(5)') ]
+    recs=np.zeros(len(layers),[('geom',object),('priority',np.float64),('data_mode',object),
+                               ('alpha_mode',object),('src_name',object)])
+    for i,(geom,priority,data_mode,alpha_mode) in enumerate(layers):
+        recs[i]=(geom,priority,data_mode,alpha_mode,'src%d'%i)
+
+    def factory(rec):
+        i=int(rec['src_name'][3:])
+        hole=None
+        if i==1:
+            hole=(250,200,6.0) # filled by fill(12)
+        return WavyField(offset=i,hole=hole)
+
+    kw=dict(bounds=[0,1000,0,1000],dx=4.0,dy=4.0)
+    full=field.CompositeField(shp_data=recs,factory=factory).to_grid(**kw)
+    for workers in [1,3]:
+        comp=field.CompositeField(shp_data=recs,factory=factory)
+        windowed=comp.to_grid(windowed=True,workers=workers,**kw)
+        assert np.array_equal(full.F,windowed.F,equal_nan=True)
+        # source 4 is entirely under an opaque source, and is never loaded
+        assert comp.delegate_list[4] is None
+        assert comp.delegate_list[0] is not None
+
+def test_fill_holes():
+    n=200
+    y,x=np.mgrid[:n,:n].astype(np.float64)
+    truth=0.01*x + 0.02*y
+    F=truth.copy()
+    F[(x-60)**2+(y-60)**2<20**2]=np.nan
+    F[120:125,:30]=np.nan
+    F[190:,190:]=np.nan # corner
+    holes=np.isnan(F)
+
+    # windowed convolution matches convolving the whole array
+    for kw in [dict(iterations=4),dict(iterations='adaptive',smoothing=2)]:
+        g=field.SimpleGrid(extents=[0,n-1,0,n-1],F=F.copy())
+        g.fill_by_convolution(**kw)
+        expected=F.copy()
+        field.fill_by_convolution_array(expected,**kw)
+        assert np.array_equal(g.F,expected,equal_nan=True)
+
+    for method in ['pushpull','nearest','convolution']:
+        g=field.SimpleGrid(extents=[0,n-1,0,n-1],F=F.copy())
+        kw=dict(iterations='adaptive') if method=='convolution' else {}
+        g.fill_holes(method,**kw)
+        assert np.all(np.isfinite(g.F))
+        assert np.all(g.F[~holes]==F[~holes])
+        assert np.abs(g.F-truth)[holes].max()<0.5
+
+    g=field.SimpleGrid(extents=[0,n-1,0,n-1],F=F.copy())
+    g.fill_holes('pushpull',max_dist=5)
+    # center of the big hole is too far from data
+    assert np.isnan(g.F[60,60])
+    assert np.isfinite(g.F[122,10])
@@ -527,6 +527,45 @@ def test_pave_quad():
 
     return trifront_wrapper(rings,scale,label='quad')
     
+def test_one_point_cost_many():
+    rng=np.random.RandomState(2)
+    counts=[1,3,5,2]
+    owner=np.repeat(np.arange(len(counts)),counts)
+    pnts=rng.uniform(-1,1,(len(counts),2))
+    edges=rng.uniform(-1,1,(len(owner),2,2))
+    target=rng.uniform(0.5,2,len(counts))
+
+    costs=front.one_point_cost_many(pnts,edges,owner,target)
+    for i in range(len(counts)):
+        expected=front.one_point_cost(pnts[i],edges[owner==i],target_length=target[i])
+        assert np.allclose(costs[i],expected)
+
+def test_relax_nodes():
+    rings=[ np.array([[0,0],[500,0],[500,500],[0,500]]) ]
+    af=trifront_wrapper(rings,field.ConstantField(50))
+    g=af.grid
+
+    # jostle the free nodes, then relax them all together
+    rng=np.random.RandomState(0)
+    for n in np.nonzero( (g.nodes['fixed']==af.FREE) & ~g.nodes['deleted'])[0]:
+        try:
+            g.modify_node(n,x=g.nodes['x'][n]+rng.uniform(-4,4,2))
+        except af.cdt.IntersectingConstraints:
+            pass
+    nodes=[n for n in g.valid_node_iter()
+           if g.nodes['fixed'][n] in (af.FREE,af.SLIDE)]
+    for node_set in af.independent_node_sets(nodes):
+        for n in node_set:
+            for c in g.node_to_cells(n):
+                assert len(set(g.cell_to_nodes(c)) & set(node_set))==1
+
+    before=np.array([af.eval_cost(n) for n in nodes])
+    costs=af.relax_nodes(nodes)
+    assert set(costs.keys())==set(nodes)
+    # relaxing one node can make its neighbors worse, so only check overall
+    after=np.array([af.eval_cost(n) for n in nodes])
+    assert after.mean() < 0.5*before.mean()
+
 def test_pave_basic():
     # big square with right triangle inside
     # Define a polygon
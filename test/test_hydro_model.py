@@ -0,0 +1,122 @@
+import numpy as np
+from shapely import geometry
+
+from stompy.grid import unstructured_grid
+from stompy.model import hydro_model as hm
+from stompy.model.otps import read_otps
+
+def fake_extract_HC(modfile,lon,lat,z=None,conlist=None):
+    # deterministic constants as a function of location
+    lon=np.asarray(lon,np.float64).ravel()
+    lat=np.asarray(lat,np.float64).ravel()
+    conlist=['M2','S2','K1','O1']
+    omega=np.array([read_otps.otis_constits[c]['omega'] for c in conlist])
+    k=np.arange(1,len(conlist)+1)[:,None]
+    consts=[np.cos(k*lon+i)*np.sin(k*lat-i) for i in range(6)]
+    return tuple(consts)+(omega,conlist)
+
+def test_tide_pred(monkeypatch):
+    monkeypatch.setattr(read_otps,'extract_HC',fake_extract_HC)
+    lon=np.linspace(235,236,7)
+    lat=np.linspace(37,38,7)
+    times=np.arange(np.datetime64('2012-01-01'),np.datetime64('2012-01-03'),
+                    np.timedelta64(15,'m'))
+    h,u,v=read_otps.tide_pred('unused',lon,lat,times)
+
+    # reference per-point evaluation
+    u_re,u_im,v_re,v_im,h_re,h_im,omega,conlist=fake_extract_HC(None,lon,lat)
+    base_time=np.datetime64("1992-01-01 00:00")
+    pu,pf,v0u=read_otps.nodal((times[0]-base_time)/np.timedelta64(1,'D')+48622.0,conlist)
+    tsec=(times-base_time)/np.timedelta64(1,'s')
+    for ii in range(len(lon)):
+        h_ref=0.0
+        for nn,om in enumerate(omega):
+            arg=om*tsec + v0u[nn] + pu[nn]
+            h_ref=h_ref + pf[nn]*(h_re[nn,ii]*np.cos(arg) - h_im[nn,ii]*np.sin(arg))
+        assert np.allclose(h[:,ii],h_ref,rtol=1e-9,atol=1e-9)
+    assert h.shape==u.shape==v.shape==(len(times),len(lon))
+
+class FakeModel(hm.HydroModel):
+    def initial_water_level(self):
+        return 0.0
+
+def patch_otps(monkeypatch,calls):
+    monkeypatch.setattr(read_otps,'model_path',lambda name: name)
+    monkeypatch.setattr(read_otps,'extract_HC',fake_extract_HC)
+    tide_pred=read_otps.tide_pred
+    def counting_tide_pred(modfile,lon,lat,time,**kw):
+        calls.append(len(lon))
+        return tide_pred(modfile,lon,lat,time,**kw)
+    monkeypatch.setattr(read_otps,'tide_pred',counting_tide_pred)
+
+def otps_model():
+    g=unstructured_grid.UnstructuredGrid(max_sides=4)
+    g.add_rectilinear([0,0],[10,10],11,11)
+    g.add_node_field('node_z_bed',-10+0*g.nodes['x'][:,0])
+    model=FakeModel(grid=g,
+                    run_start=np.datetime64('2012-01-01'),
+                    run_stop=np.datetime64('2012-01-02'))
+    # south boundary is split into per-edge BCs, west has a stage BC
+    south=hm.MultiBC(hm.OTPSVelocityBC,name='south',otps_model='fake')
+    south.geom=geometry.LineString([[0,0],[10,0]])
+    model.add_bcs([south,
+                   hm.OTPSStageBC(name='west',otps_model='fake',
+                                  geom=geometry.LineString([[0,0],[0,10]]))])
+    return model
+
+def test_bc_compiler(monkeypatch):
+    calls=[]
+    patch_otps(monkeypatch,calls)
+    model=otps_model()
+    model.bc_compiler.compile()
+    # all BCs served by a single prediction over the unique points
+    assert calls==[12]
+
+    sub_bcs=model.bcs[0].sub_bcs
+    assert len(sub_bcs)==10
+    compiled=[bc.dataset() for bc in sub_bcs+model.bcs[1:]]
+    assert len(calls)==1
+
+    # same answer as per-BC predictions
+    direct_model=otps_model()
+    direct_model.compile_bcs=False
+    direct_model.bcs[0].enumerate_sub_bcs()
+    direct_bcs=direct_model.bcs[0].sub_bcs+direct_model.bcs[1:]
+    for bc,ds in zip(direct_bcs,compiled):
+        ds_direct=bc.dataset()
+        for v in ['water_level','Q','unorm']:
+            assert np.allclose(ds[v].values,ds_direct[v].values,rtol=1e-12,atol=1e-12)
+    assert len(calls)==1+len(direct_bcs)
+
+def test_bc_compiler_cache(monkeypatch,tmpdir):
+    calls=[]
+    patch_otps(monkeypatch,calls)
+    model=otps_model()
+    model.cache_dir=str(tmpdir)
+    model.bc_compiler.compile()
+    ds1=model.bcs[1].dataset()
+    assert len(model.bc_compiler.cache)==1
+
+    # a fresh model reuses the extraction saved in cache_dir
+    model=otps_model()
+    model.cache_dir=str(tmpdir)
+    assert len(model.bc_compiler.cache)==0
+    model.bc_compiler.compile()
+    ds2=model.bcs[1].dataset()
+    assert len(calls)==1
+    assert np.all(ds1.water_level.values==ds2.water_level.values)
+
+    # the in-memory cache is bounded, and can be cleared
+    compiler=model.bc_compiler
+    compiler.cache_size=2
+    compiler.clear_cache()
+    for i in range(5):
+        compiler.cached(('test',i),lambda: i,persist=False)
+    assert len(compiler.cache)==2 and ('test',4) in compiler.cache
+
+    # compile_bcs=False bypasses the cache
+    model.compile_bcs=False
+    fetches=[]
+    for i in range(2):
+        compiler.cached(('test',0),lambda: fetches.append(1),persist=False)
+    assert len(fetches)==2
@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from stompy.spatial import join_features
+
+def random_network(rng,n_lines=50):
+    """ polylines and rings, chopped into shuffled, randomly reversed segments """
+    lines=[]
+    segs=[]
+    for i in range(n_lines):
+        pts=np.cumsum(rng.randn(rng.randint(3,20),2),axis=0)+rng.uniform(0,1000,2)
+        if i%2:
+            pts=np.concatenate([pts,pts[:1]])
+        lines.append(pts)
+        cuts=np.sort(rng.choice(np.arange(1,len(pts)-1),size=min(3,len(pts)-2),replace=False))
+        bounds=np.r_[0,cuts,len(pts)-1]
+        for a,b in zip(bounds[:-1],bounds[1:]):
+            seg=pts[a:b+1]
+            segs.append(seg[::-1] if rng.rand()<0.5 else seg)
+    return lines,[segs[i] for i in rng.permutation(len(segs))]
+
+def same_path(a,b,atol=1e-8):
+    if len(a)!=len(b):
+        return False
+    if np.all(a[0]==a[-1]):
+        # rings may start anywhere, in either direction
+        for ring in [a[:-1],a[:-1][::-1]]:
+            for k in range(len(ring)):
+                if np.allclose(np.roll(ring,-k,axis=0),b[:-1],atol=atol):
+                    return True
+        return False
+    return np.allclose(a,b,atol=atol) or np.allclose(a[::-1],b,atol=atol)
+
+def test_merge_lines():
+    rng=np.random.RandomState(2)
+    lines,segs=random_network(rng)
+    merged=join_features.merge_lines(segments=segs)
+    assert len(merged)==len(lines)
+    for line in lines:
+        assert sum(same_path(line,m) for m in merged)==1
+
+    # three segments meeting at a point are not joined there
+    star=[np.array([[0,0],[1,0]]),np.array([[0,0],[0,1]]),np.array([[-1,-1],[0,0]]),
+          np.array([[1,0],[2,0]])]
+    merged=join_features.merge_lines(segments=np.array(star))
+    assert len(merged)==3
+    assert any(same_path(m,np.array([[0,0],[1,0],[2,0]])) for m in merged)
+
+def test_tolerant_merge_lines():
+    rng=np.random.RandomState(3)
+    lines,segs=random_network(rng)
+    noisy=[]
+    for seg in segs:
+        seg=seg.copy()
+        seg[[0,-1]]+=rng.uniform(-1e-4,1e-4,(2,2))
+        noisy.append(seg)
+    merged=join_features.tolerant_merge_lines(noisy,1e-3)
+    assert len(merged)==len(lines)
+    assert sorted(len(m) for m in merged)==sorted(len(line) for line in lines)
+    n_closed=sum(np.all(m[0]==m[-1]) for m in merged)
+    assert n_closed==len(lines)//2
+
+    # without junctions, the clustered matching gives the same lines, up to
+    # which of the points at a joint is kept
+    clustered=join_features.tolerant_merge_lines(noisy,1e-3,clustered=True)
+    assert len(clustered)==len(merged)
+    for m in merged:
+        assert sum(same_path(m,c,atol=1e-3) for c in clustered)==1
+
+def test_lines_to_polygons():
+    square=np.array([[0,0],[10,0],[10,10],[0,10],[0,0]],np.float64)
+    hole=np.array([[2,2],[2,4],[4,4],[4,2],[2,2]],np.float64)
+    island=square+20
+    polys,extras=join_features.lines_to_polygons([square,hole,island],single_feature=False)
+    assert len(polys)==2
+    assert np.allclose(sorted(p.area for p in polys),[96,100])
+
+    # old interface
+    with pytest.warns(DeprecationWarning):
+        polys,extras=join_features.lines_to_polygons_slow([square,hole,island])
+    assert len(polys)==1 and np.isclose(polys[0].area,96)
+    assert len(extras)==1
+
+    # an open exterior is closed with an arc
+    ext=np.array([[0,0],[0,-10],[10,-10],[10,0]],np.float64)
+    with pytest.warns(DeprecationWarning):
+        polys,extras=join_features.lines_to_polygons_slow([ext,hole-[0,6]],close_arc=True)
+    assert len(polys[0].interiors)==1
+    assert np.isclose(polys[0].area,100+np.pi*25/2-4,rtol=1e-2)
@@ -0,0 +1,59 @@
+import numpy as np
+from stompy.spatial import linestring_utils
+
+def ring_and_line():
+    th=np.linspace(0,2*np.pi,200,endpoint=False)
+    r=100+20*np.sin(5*th)
+    ring=np.c_[r*np.cos(th),r*np.sin(th)]
+    line=np.c_[np.linspace(0,300,50),10*np.sin(np.linspace(0,10,50))]
+    return ring,line
+
+def test_resample_constant():
+    ring,line=ring_and_line()
+    for closed,pts in [(1,ring),(0,line)]:
+        new,src=linestring_utils.resample_linearring(pts,5.0,closed_ring=closed,
+                                                     return_sources=True)
+        assert len(new)==len(src)
+        assert np.all(np.diff(src)>=0)
+        # sources map back onto the input line
+        i=np.floor(src).astype(np.int32)
+        i=np.minimum(i,len(pts)-1)
+        alpha=src-i
+        ext=np.concatenate([pts,pts[:1]]) if closed else np.concatenate([pts,pts[-1:]])
+        expected=(1-alpha[:,None])*ext[i] + alpha[:,None]*ext[i+1]
+        assert np.allclose(expected,new)
+        assert np.allclose(new[0],pts[0])
+        if not closed:
+            assert np.allclose(new[-1],pts[-1])
+        # distance along the line is uniform for a constant density
+        seg_len=np.sqrt((np.diff(ext,axis=0)**2).sum(axis=1))
+        dist=np.concatenate([[0],np.cumsum(seg_len)])
+        s=np.interp(src,np.arange(len(dist)),dist)
+        if closed:
+            s=np.concatenate([s,[dist[-1]]])
+        steps=np.diff(s)
+        assert np.allclose(steps,steps.mean())
+        assert abs(steps.mean()-5.0)<0.1
+
+def test_resample_variable():
+    ring,line=ring_and_line()
+    density=lambda X: 1+0.05*np.abs(np.asarray(X)[...,0])
+    new=linestring_utils.resample_linearring(line,density,closed_ring=0)
+    mid=0.5*(new[1:]+new[:-1])
+    spacing=np.sqrt((np.diff(new,axis=0)**2).sum(axis=1))
+    ratio=spacing/density(mid)
+    assert np.all(ratio<1.1)
+    assert np.median(ratio)>0.9
+
+def test_upsample():
+    ring,line=ring_and_line()
+    new,src=linestring_utils.upsample_linearring(line,2.0,closed_ring=0,return_sources=True)
+    # original points are retained
+    assert np.all(np.isin(np.arange(len(line)),src))
+    assert np.allclose(new[src==np.round(src)],line)
+    spacing=np.sqrt((np.diff(new,axis=0)**2).sum(axis=1))
+    assert spacing.max()<3.0
+
+    new=linestring_utils.upsample_linearring(ring,2.0,closed_ring=1)
+    spacing=np.sqrt((np.diff(np.concatenate([new,new[:1]]),axis=0)**2).sum(axis=1))
+    assert spacing.max()<3.0
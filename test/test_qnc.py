@@ -0,0 +1,44 @@
+import numpy as np
+from stompy.io import qnc
+from stompy import filters
+
+def make_ds(t0,nt,seed):
+    rng=np.random.RandomState(seed)
+    ds=qnc.empty()
+    ds['time']['time']=t0+np.arange(nt,dtype=np.float64)
+    ds['eta']['time','cell']=rng.randn(nt,7)
+    ds['count']['time']=np.arange(nt,dtype=np.int32)
+    ds['x']['cell']=np.arange(7.0)
+    ds['time'].units='days since 2000-01-01'
+    return ds
+
+def test_concatenate():
+    dss=[make_ds(0,10,0),None,make_ds(10,13,1),make_ds(23,5,2)]
+    result=qnc.concatenate(dss,'time',chunk_size=9)
+    parts=[ds for ds in dss if ds is not None]
+    for v in ['time','eta','count']:
+        expected=np.concatenate([ds.variables[v][:] for ds in parts])
+        assert np.all(result.variables[v][:]==expected)
+    assert result.variables['eta'].dimensions==('time','cell')
+    assert np.all(result.variables['x'][:]==np.arange(7.0))
+    assert result.variables['time'].units=='days since 2000-01-01'
+
+    # differing non-concatenated variables go into a new dimension
+    parts[1].variables['x'][:]=10+np.arange(7.0)
+    result=qnc.concatenate(parts,'time',new_dim='src',chunk_size=9)
+    assert result.variables['x'].dimensions==('src','cell')
+    assert np.all(result.variables['x'][1]==10+np.arange(7.0))
+
+def test_downsample():
+    ds=make_ds(0,101,3)
+    ds.variables['eta'][17:20,2]=np.nan
+    full=filters.lowpass_fir(ds.variables['eta'][:],8,axis=0,nan_weight_threshold=0.5)[::4]
+    for chunk_size in [None,7*5,7*16]:
+        new=qnc.downsample(ds,'time',4,lowpass=2,chunk_size=chunk_size)
+        assert new.variables['eta'].shape==full.shape
+        assert np.allclose(new.variables['eta'][:],full,equal_nan=True)
+        assert np.all(new.variables['x'][:]==np.arange(7.0))
+
+    new=qnc.downsample(ds,'time',4,lowpass=False,chunk_size=5)
+    assert np.all(new.variables['count'][:]==np.arange(0,101,4))
+    assert new.variables['count'].dtype==np.int32
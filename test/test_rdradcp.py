@@ -0,0 +1,74 @@
+import io
+import os
+import struct
+import numpy as np
+
+from stompy.io import rdradcp
+
+def write_pd0(fn,nens=20,n_cells=10,junk=b''):
+    """
+    Write a minimal synthetic Workhorse (firmware 16.30) raw file with
+    fixed leader, variable leader, velocity, correlation, intensity,
+    percent good and bottom track blocks.
+    """
+    rng=np.random.RandomState(0)
+    out=bytearray(junk)
+    for e in range(nens):
+        fixed=( struct.pack('<H',0x0000) + bytes([16,30,0xCA,0x41,0,0,4,n_cells])
+                + struct.pack('<HHH',1,50,100) + bytes([1,64,5,0]) + struct.pack('<H',2000)
+                + bytes([0,1,0,0x1F]) + struct.pack('<hh',0,0) + bytes([0,0])
+                + struct.pack('<HH',150,50) + bytes([1,5,0,0]) + struct.pack('<H',0)
+                + bytes(17) )
+        var=( struct.pack('<HH',0x0080,e+1) + bytes([19,5,6,1,2,e%60,e%100,0])
+              + struct.pack('<HHHHhhhh',0,1500,rng.randint(1000),rng.randint(36000),
+                            rng.randint(-500,500),rng.randint(-500,500),33,rng.randint(2000))
+              + bytes([0,0,1,3,4,5]) + bytes(range(8))
+              + struct.pack('<I',0) + bytes(2) + struct.pack('<II',rng.randint(100000),7)
+              + bytes([0,20,19,5,6,1,2,e%60,e%100]) )
+        vel=rng.randint(-2000,2000,size=(n_cells,4)).astype('<i2')
+        vel[0,0]=-32768
+        blocks=[fixed,var,struct.pack('<H',0x0100)+vel.tobytes()]
+        for block_id in [0x0200,0x0300,0x0400]:
+            blocks.append(struct.pack('<H',block_id)
+                          + rng.randint(255,size=(n_cells,4)).astype('u1').tobytes())
+        bt=bytearray(85)
+        bt[0:2]=struct.pack('<H',0x0600)
+        bt[9]=7
+        bt[16:24]=rng.randint(60000,size=4).astype('<u2').tobytes()
+        bt[24:32]=rng.randint(-1000,1000,size=4).astype('<i2').tobytes()
+        bt[32:44]=rng.randint(255,size=12).astype('u1').tobytes()
+        bt[77:81]=bytes([1,0,2,0])
+        blocks.append(bytes(bt))
+
+        offsets=[] ; o=6+2*len(blocks)
+        for b in blocks:
+            offsets.append(o)
+            o+=len(b)
+        ens=bytearray( b'\x7f\x7f'+struct.pack('<HBB',o+2,0,len(blocks))
+                       + struct.pack('<%dH'%len(blocks),*offsets) )
+        for b in blocks:
+            ens+=b
+        ens+=bytes(2)
+        ens+=struct.pack('<H',sum(ens)%65536)
+        out+=ens
+    with open(fn,'wb') as fp:
+        fp.write(out)
+
+def test_rdradcp_fast():
+    fn='test-rdradcp.pd0'
+    write_pd0(fn,nens=21,junk=b'\x01\x7f\x7f\x03')
+    log=io.StringIO()
+    for num_av in [1,3]:
+        slow=rdradcp.rdradcp(fn,num_av=num_av,log_fp=log)
+        fast=rdradcp.rdradcp_fast(fn,num_av=num_av,log_fp=log)
+        # rdradcp skips the last ensemble
+        n=len(slow.ensemble_data)
+        assert len(fast.ensemble_data)==21//num_av
+        for A,B in [ (slow.ensemble_data,fast.ensemble_data),
+                     (slow.bin_data,fast.bin_data) ]:
+            for fld in A.dtype.names:
+                assert np.allclose(A[fld],B[fld][:n],equal_nan=True),fld
+
+    sub=rdradcp.rdradcp_fast(fn,num_av=1,nens=[5,8],log_fp=log)
+    assert np.all(sub.number==[5,6,7,8])
+    os.unlink(fn)
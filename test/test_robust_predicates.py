@@ -0,0 +1,41 @@
+import numpy as np
+
+from stompy.spatial import robust_predicates
+
+def test_orientation_many():
+    rng=np.random.RandomState(3)
+    pa,pb=rng.uniform(-1,1,(2,500,2))
+    # mix of general position, exactly collinear and nearly collinear
+    alpha=rng.uniform(-2,2,500)
+    pc=pa + alpha[:,None]*(pb-pa)
+    pc[:200]+=rng.uniform(-1,1,(200,2))
+    pc[200:400]+=rng.uniform(-1,1,(200,2))*1e-17
+
+    ori=robust_predicates.orientation_many(pa,pb,pc)
+    expected=[robust_predicates.orientation(a,b,c)
+              for a,b,c in zip(pa.tolist(),pb.tolist(),pc.tolist())]
+    assert np.all(ori==expected)
+    assert np.all(robust_predicates.counterclockwise_many(pa,pb,pc)
+                  ==[robust_predicates.counterclockwise(a,b,c)
+                     for a,b,c in zip(pa.tolist(),pb.tolist(),pc.tolist())])
+
+def test_incircle_many():
+    rng=np.random.RandomState(4)
+    theta=np.sort(rng.uniform(0,2*np.pi,(300,4)),axis=1)
+    pts=np.stack([np.cos(theta),np.sin(theta)],axis=-1)
+    pts[:100]=rng.uniform(-1,1,(100,4,2))
+    # integer, exactly cocircular points
+    pts[100:110]=[[0,0],[1,0],[1,1],[0,1]]
+
+    det=robust_predicates.incircle_many(pts[:,0],pts[:,1],pts[:,2],pts[:,3])
+    expected=[robust_predicates.incircle(*p) for p in pts.tolist()]
+    assert np.all(det==expected)
+    assert np.all(det[100:110]==0)
+
+    # broadcasting one triangle against many points
+    det=robust_predicates.incircle_many([0,0],[1,0],[0,1],pts[:100,0])
+    expected=[robust_predicates.incircle([0,0],[1,0],[0,1],p) for p in pts[:100,0].tolist()]
+    assert np.all(det==expected)
+
+def test_benchmark():
+    robust_predicates.benchmark(n=2000)
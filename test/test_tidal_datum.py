@@ -0,0 +1,41 @@
+import numpy as np
+from stompy import tidal_datum
+
+def synthetic_tides(nseries=5,days=70,dt_minutes=6.0,seed=0):
+    rng=np.random.RandomState(seed)
+    t=730000 + np.arange(0,days*24*60,dt_minutes)/(24*60.)
+    hours=(t-t[0])*24
+    h=np.zeros((len(t),nseries))
+    for s in range(nseries):
+        h[:,s]=( rng.uniform(0.5,1.5)*np.cos(2*np.pi*hours/12.42 + rng.uniform(0,6))
+                 + rng.uniform(0.2,0.6)*np.cos(2*np.pi*hours/23.93 + rng.uniform(0,6))
+                 + rng.uniform(0.1,0.3)*np.cos(2*np.pi*hours/12.0 + rng.uniform(0,6))
+                 + rng.uniform(-1,1) + 0.02*rng.randn(len(t)) )
+    return t,h
+
+def test_datums_match_scalar():
+    t,h=synthetic_tides()
+    datums=tidal_datum.find_tidal_datums(t,h)
+    funcs=dict(mllw=tidal_datum.find_mllw,mlw=tidal_datum.find_mlw,
+               mhw=tidal_datum.find_mhw,mhhw=tidal_datum.find_mhhw)
+    for s in range(h.shape[1]):
+        ts=np.c_[t,h[:,s]]
+        for name,func in funcs.items():
+            assert np.allclose(datums[name][s],func(ts))
+    # 1-D input gives the same answer
+    single=tidal_datum.find_tidal_datums(t,h[:,2])
+    for name in funcs:
+        assert np.allclose(single[name],datums[name][2])
+
+def test_datums_gaps():
+    t,h=synthetic_tides(nseries=3)
+    h_gap=h.copy()
+    h_gap[1000:1100,0]=np.nan # gap of 10 hours
+    h_gap[:,2]=np.nan # no data
+    datums=tidal_datum.find_tidal_datums(t,h_gap)
+    full=tidal_datum.find_tidal_datums(t,h)
+    for name in ['mllw','mlw','mhw','mhhw']:
+        assert abs(datums[name][0]-full[name][0])<0.05
+        assert datums[name][1]==full[name][1]
+        assert np.isnan(datums[name][2])
+    assert datums['mllw'][0]<datums['mlw'][0]<datums['mhw'][0]<datums['mhhw'][0]
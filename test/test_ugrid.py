@@ -0,0 +1,79 @@
+import numpy as np
+import xarray as xr
+
+from stompy.grid import ugrid
+
+def zlayer_dataset(n_face=50,n_time=4,seed=1):
+    rng=np.random.RandomState(seed)
+    n_layer=10
+    interfaces=-np.arange(n_layer+1,dtype=np.float64) # 0,-1,...,-10
+    ds=xr.Dataset()
+    ds['mesh']=(),0
+    ds.mesh.attrs.update(cf_role='mesh_topology',face_dimension='face',
+                         edge_dimension='edge')
+    ds['layer']=('layer',),0.5*(interfaces[:-1]+interfaces[1:])
+    ds.layer.attrs.update(standard_name='ocean_zlevel_coordinate',bounds='layer_bnds',
+                          positive='up')
+    ds['layer_bnds']=('layer','two'),np.c_[interfaces[:-1],interfaces[1:]]
+    ds['depth']=('face',),rng.uniform(1.5,9.5,n_face)
+    ds.depth.attrs.update(standard_name='sea_floor_depth_below_geoid',positive='down',
+                          mesh='mesh',location='face')
+    eta=rng.uniform(-1.2,0.9,(n_time,n_face))
+    eta[:,0]=-1.0+0.0005 # within surface_dzmin of an interface
+    ds['eta']=('time','face'),eta
+    ds.eta.attrs.update(standard_name='sea_surface_height_above_geoid',
+                        mesh='mesh',location='face')
+    ds['salt']=('time','face','layer'),rng.uniform(20,30,(n_time,n_face,n_layer))
+    return ds
+
+def test_averaging_matrix_matches_dense():
+    ds=zlayer_dataset()
+    ug=ugrid.UgridXr(ds,face_dim='face',edge_dim='edge',layer_dim='layer')
+    for kw in [dict(),dict(ztop=0,dz=2.0),dict(zbottom=0,dz=1.5),dict(ztop=1.0,dz=3.0)]:
+        for t in range(ds.dims['time']):
+            dense=ug.vertical_averaging_weights(time_slice=t,**kw)
+            W=ug.vertical_averaging_matrix(t,**kw)
+            assert W.shape==(ds.dims['face'],ds.dims['face']*ds.dims['layer'])
+            sparse_dense=W.toarray().reshape(ds.dims['face'],ds.dims['face'],-1)
+            sparse_dense=sparse_dense[np.arange(ds.dims['face']),np.arange(ds.dims['face'])]
+            avg=ug.vertical_average('salt',t,**kw)
+            expected=(ds.salt.isel(time=t).values*dense).sum(axis=1)
+
+            # the dense weights let a window reach above eta, sparse weights
+            # only cover the wet column.  compare where that doesn't matter.
+            eta=ds.eta.values[t] ; bed=-ds.depth.values
+            sel=np.isfinite(dense[:,0])
+            if 'zbottom' in kw:
+                sel&=(bed+kw['zbottom']+kw['dz']<=eta)
+            assert np.allclose(sparse_dense[sel],dense[sel],atol=1e-3)
+            assert np.allclose(avg[sel],expected[sel],atol=1e-2)
+            assert np.all(np.isnan(avg[~np.isfinite(dense[:,0])]))
+    # cached
+    assert ug.vertical_averaging_matrix(1) is ug.vertical_averaging_matrix(1)
+
+def test_sigma_and_z_sigma():
+    eta=np.array([0.5,-0.2,1.0])
+    bed=np.array([-4.0,-10.0,-2.5])
+    sigma=np.linspace(0,-1,5)
+    bot,top=ugrid.layer_bounds(eta,bed,sigma_interfaces=sigma)
+    assert np.allclose(top-bot,((eta-bed)/4)[:,None])
+
+    zlow,zhigh=ugrid.averaging_window(eta,bed)
+    W=ugrid.averaging_weight_matrix(bot,top,zlow,zhigh)
+    data=np.arange(12.0).reshape(3,4)
+    assert np.allclose(W.dot(data.ravel()),data.mean(axis=1))
+
+    # 3 sigma layers above -3, z-layers of 2m below
+    z_int=np.array([-3.,-5,-7,-9,-11])
+    bot,top=ugrid.layer_bounds(eta,bed,z_interfaces=z_int,
+                               sigma_interfaces=np.linspace(0,-1,4),z_sigma=-3.0)
+    assert bot.shape==(3,7)
+    # layers tile each water column without gaps
+    assert np.allclose((top-bot).sum(axis=1),eta-bed)
+    assert np.allclose(top[:,:3]-bot[:,:3],((eta-np.maximum(bed,-3))/3)[:,None])
+    assert np.allclose(top[1,3:]-bot[1,3:],[2,2,2,1])
+
+    # empty window gives nan
+    zlow,zhigh=ugrid.averaging_window(eta,bed,zbottom=20,dz=1)
+    W=ugrid.averaging_weight_matrix(bot,top,zlow,zhigh)
+    assert np.all(np.isnan(W.dot(np.ones(21))))
@@ -33,6 +33,47 @@ def test_undo_00():
     assert ug.Nedges()==2
     assert ug.Nnodes()==3
 
+def test_undo_bounded():
+    ug=unstructured_grid.UnstructuredGrid()
+    ug.op_history_bounded=True
+    ug.op_history_trim_interval=10
+
+    cp_old=ug.checkpoint()
+    for i in range(20):
+        ug.add_node(x=[i,0])
+    cp=ug.checkpoint()
+    for i in range(20):
+        ug.add_node(x=[i,1])
+    # cp_old still alive, so nothing can be discarded
+    assert len(ug.op_stack)==40
+    del cp_old
+    ug.trim_history()
+    assert len(ug.op_stack)==20
+    ug.revert(cp)
+    assert ug.Nnodes()==20
+
+    # byte budget invalidates checkpoints which are too old
+    ug.op_history_max_bytes=2000
+    cp=ug.checkpoint()
+    for i in range(50):
+        ug.add_node(x=[i,2])
+    assert len(ug.op_stack)<50
+    with assert_raises(ValueError):
+        ug.revert(cp)
+
+    # ops while suspended are not recorded
+    cp=ug.checkpoint()
+    with ug.suspend_history():
+        for i in range(5):
+            ug.add_node(x=[i,3])
+    assert len(ug.op_stack)==0
+    with assert_raises(ValueError):
+        ug.revert(cp)
+    cp=ug.checkpoint()
+    ug.add_node(x=[0,4])
+    ug.revert(cp)
+    assert ug.Nnodes()==75
+
 ## 
 
 sample_data=os.path.join(os.path.dirname(__file__),'data')
@@ -201,8 +242,77 @@ def test_pickle():
     ug2=unstructured_grid.UnstructuredGrid.from_pickle(pkl_fn)
     os.unlink(pkl_fn)
 
+def test_native():
+    ug=unstructured_grid.SuntansGrid(os.path.join(sample_data,'sfbay'))
+    ug.add_cell_field('depth',np.arange(ug.Ncells(),dtype=np.float64))
+    ug.delete_cell(5)
+
+    for fn in ['test-native','test-native.zip']:
+        ug.write_native(fn,overwrite=True)
+        ug2=unstructured_grid.UnstructuredGrid.read_native(fn)
+
+        for elts in ['nodes','edges','cells']:
+            A=getattr(ug,elts)
+            B=getattr(ug2,elts)
+            assert A.dtype==B.dtype
+            for name in A.dtype.names:
+                assert np.array_equal(A[name],B[name],
+                                      equal_nan=(A[name].dtype.kind=='f'))
+        n=10
+        assert list(ug2.node_to_edges(n))==list(ug.node_to_edges(n))
+        assert list(ug2.node_to_cells(n))==list(ug.node_to_cells(n))
+
+        # edits on the loaded grid must not touch the file
+        n_new=ug2.add_node(x=[0,0])
+        ug2.add_edge(nodes=[n_new,3])
+        ug2.modify_node(4,x=[1,2])
+        ug3=unstructured_grid.UnstructuredGrid.read_native(fn)
+        assert ug3.Nnodes()==ug.Nnodes()
+        assert np.all(ug3.nodes['x'][4]==ug.nodes['x'][4])
+
+    shutil.rmtree('test-native')
+    os.unlink('test-native.zip')
+
+def test_op_profiler():
+    prof=unstructured_grid.op_profiler
+    ug=unstructured_grid.UnstructuredGrid(max_sides=4)
+    calls=[]
+    def cb(*a,**k):
+        calls.append(a)
+    ug.subscribe_after('add_node',cb)
 
-## 
+    with prof.profiling():
+        chk=ug.checkpoint()
+        n1=ug.add_node(x=[0,0])
+        n2=ug.add_node(x=[1,0])
+        n3=ug.add_node(x=[1,1])
+        ug.add_cell_and_edges(nodes=[n1,n2,n3])
+    assert not prof.enabled
+    ug.add_node(x=[5,5]) # not counted
+
+    rep=prof.report()
+    assert rep['methods']['add_node']['calls']==3
+    assert rep['methods']['add_edge']['calls']==3
+    assert rep['methods']['add_node']['undo_ops']==3
+    assert rep['methods']['add_cell']['undo_ops']==1
+    assert rep['max_undo_depth']==7
+    assert sum(v['calls'] for v in rep['listeners'].values())==3
+    assert len(calls)==4
+    assert 'add_cell' in prof.table()
+
+    # calls which raise are still recorded
+    def fail(*a,**k):
+        raise ValueError("listener failed")
+    ug.subscribe_after('add_node',fail)
+    with prof.profiling():
+        with assert_raises(ValueError):
+            ug.add_node(x=[2,2])
+    rep=prof.report()
+    assert rep['methods']['add_node']['calls']==1
+    assert sum(v['calls'] for (name,listener),v in rep['listeners'].items()
+               if listener.endswith('.fail'))==1
+
+##
 
 def test_modify_max_sides():
     ug=unstructured_grid.SuntansGrid(os.path.join(sample_data,'sfbay') )
@@ -247,6 +357,120 @@ def test_nearest_cell():
 
     assert hit1==hit2
 
+def test_dual_refine():
+    g=unstructured_grid.UnstructuredGrid(max_sides=4)
+    g.add_rectilinear([0,0],[100,70],11,8)
+
+    gm=unstructured_grid.UnstructuredGrid(max_sides=4)
+    gm.from_simple_data(points=g.nodes['x'],cells=g.cells['nodes'])
+    gm.make_edges_from_cells()
+    assert gm.Nedges()==g.Nedges()
+    assert np.all(gm.nodes_to_edge_many(gm.edges['nodes'][:,1],gm.edges['nodes'][:,0])
+                  ==np.arange(gm.Nedges()))
+    assert gm.nodes_to_edge_many([0],[gm.Nnodes()-1])[0]==-1
+
+    gd=g.create_dual(center='circumcenter',create_cells=True)
+    # one dual cell per interior node, one dual node per cell
+    assert gd.Nnodes()==g.Ncells()
+    assert gd.Ncells()==9*6
+    assert np.all(gd.cells_area()>0)
+    assert np.all(gd.edges['cells'][:,0]>=0)
+    for c in [0,10,gd.Ncells()-1]:
+        n=gd.cells['source_node'][c]
+        assert np.allclose(gd.cells_centroid([c])[0],g.nodes['x'][n])
+
+    gr=g.global_refine()
+    assert gr.Ncells()==4*g.Ncells()
+    assert np.allclose(gr.cells_area().sum(),g.cells_area().sum())
+
+def test_shortest_path():
+    g=unstructured_grid.UnstructuredGrid(max_sides=4)
+    g.add_rectilinear([0,0],[10,10],11,11)
+
+    n1=g.select_nodes_nearest([0,0])
+    n2=g.select_nodes_nearest([3,4])
+    path=g.shortest_path(n1,n2)
+    assert path[0]==n1 and path[-1]==n2 and len(path)==8
+    assert np.allclose(g.shortest_path(n1,n2,return_type='cost'),7.0)
+    js=g.shortest_path(n1,n2,return_type='edges')
+    assert np.all(np.sort(g.edges['nodes'][js].ravel())
+                  ==np.sort(np.r_[path[:-1],path[1:]]))
+
+    # callable and array weights agree, non-finite weights drop edges
+    weights=np.ones(g.Nedges())
+    ec=g.edges_center()
+    weights[ (ec[:,0]==0.5) & (ec[:,1]<3) ]=np.inf
+    cost_a=g.shortest_path(n1,n2,return_type='cost',edge_weight=weights)
+    cost_f=g.shortest_path(n1,n2,return_type='cost',edge_weight=lambda j,d: weights[j])
+    assert cost_a==cost_f==7.0
+    assert g.nodes['x'][g.shortest_path(n1,n2,edge_weight=weights)[3],0]==0.0
+
+    # multiple targets come back sorted by cost
+    targets=[g.select_nodes_nearest(xy) for xy in [[5,5],[1,0],[0,3]]]
+    res=g.shortest_path(n1,targets,return_type='cost',max_return=2)
+    assert [n for n,c in res]==targets[1:]
+
+    # multi-source distances
+    boundary=np.nonzero( (g.nodes['x'][:,0]==0) | (g.nodes['x'][:,0]==10) )[0]
+    dist=g.graph_distances(boundary,edge_weight='unit')
+    assert np.allclose(dist,np.minimum(g.nodes['x'][:,0],10-g.nodes['x'][:,0]))
+
+    c1=g.select_cells_nearest([0.5,0.5])
+    c2=g.select_cells_nearest([9.5,0.5])
+    assert len(g.shortest_path(c1,c2,traverse='cells'))==10
+
+    mask=g.edges_center()[:,0]!=5.0
+    labels=g.cells_connected_components(mask,randomize=False)
+    assert labels.max()==1
+    n_comp,_=g.graph_connected_components('cells',edge_selector=mask)
+    assert n_comp==2
+
+    # cached graph follows edits
+    g.delete_cell(c1)
+    assert g.graph_connected_components('cells')[0]==2
+
+def test_shortest_path_cache():
+    g=unstructured_grid.UnstructuredGrid(max_sides=4)
+    g.add_rectilinear([0,0],[100,100],101,101)
+    n1=g.select_nodes_nearest([50,50])
+    n2=g.select_nodes_nearest([52,51])
+
+    # callables are only evaluated near the search
+    calls=[]
+    def weight(j,direc):
+        calls.append(j)
+        return 1.0
+    assert g.shortest_path(n1,n2,return_type='cost',edge_weight=weight)==3.0
+    assert len(calls)<200
+    path=g.shortest_path(n1,n2,edge_weight=weight)
+    js=g.shortest_path(n1,n2,return_type='edges',edge_weight=weight)
+    assert len(js)==3
+    assert np.all(np.sort(g.edges['nodes'][js].ravel())
+                  ==np.sort(np.r_[path[:-1],path[1:]]))
+
+    # weighted graphs are reused until invalidated
+    weights=np.ones(g.Nedges())
+    assert g.shortest_path(n1,n2,return_type='cost',edge_weight=weights)==3.0
+    graph=g.graph_adjacency(edge_weight=weights)
+    assert g.graph_adjacency(edge_weight=weights) is graph
+    weights[g.shortest_path(n1,n2,return_type='edges',edge_weight=weights)]=10
+    assert g.graph_adjacency(edge_weight=weights) is graph
+    g.invalidate_graph_cache()
+    assert g.graph_adjacency(edge_weight=weights) is not graph
+    assert g.shortest_path(n1,n2,return_type='cost',edge_weight=weights)==3.0
+    assert 10 not in weights[g.shortest_path(n1,n2,return_type='edges',edge_weight=weights)]
+
+    # and grid modifications
+    graph=g.graph_adjacency()
+    g.modify_node(n2,x=g.nodes['x'][n2]+[0.5,0])
+    assert g.graph_adjacency() is not graph
+    assert np.allclose(g.shortest_path(n1,n2,return_type='cost'),2+np.sqrt(1.25))
+
+    # far targets and multiple targets with a limited search
+    far=[g.select_nodes_nearest(xy) for xy in [[0,0],[100,100],[60,50]]]
+    res=g.shortest_path(n1,far,return_type='cost',edge_weight='unit')
+    assert [c for n,c in res]==[10.0,100.0,100.0]
+
 ## 
     
 if __name__=='__main__':
@@ -1,5 +1,9 @@
+import numpy as np
+import pytest
 from stompy.model.delft import waq_scenario
 import datetime
+import logging
+import os
 
 def test_waq_timestep_timedelta():
     inputs=[100,"100","0010","5000000",5100]
@@ -9,3 +13,304 @@ def test_waq_timestep_timedelta():
         ts=waq_scenario.timedelta_to_waq_timestep(td)
         td2=waq_scenario.waq_timestep_to_timedelta(ts)
         assert td == td2
+
+class FilterStubHydro(object):
+    def __init__(self,t_secs,pointers):
+        self.t_secs=t_secs
+        self.pointers=pointers
+
+def test_filter_exchange_blocks():
+    rng=np.random.RandomState(1)
+    nt=600
+    n_seg=30
+    t_secs=1800*np.arange(nt)
+    pointers=np.zeros((80,4),np.int32)
+    pointers[:,0]=rng.randint(-3,n_seg+1,80)
+    pointers[pointers[:,0]==0,0]=-1
+    pointers[:,1]=rng.randint(1,n_seg+1,80)
+    flows=rng.normal(size=(nt,80)) + 10*np.sin(2*np.pi*t_secs/44712.)[:,None]
+    volumes=1e6+np.zeros((nt,n_seg))
+
+    def filtered(block_size,workers=1):
+        hyd=waq_scenario.FilterHydroBC.__new__(waq_scenario.FilterHydroBC)
+        hyd.orig=FilterStubHydro(t_secs,pointers)
+        hyd.selection='all'
+        hyd.exchange_block_size=block_size
+        hyd.filter_workers=workers
+        hyd.filt_flows=flows.copy()
+        hyd.filt_volumes=volumes.copy()
+        if block_size:
+            hyd.filter_exchange_blocks()
+        else:
+            hyd.filter_exchanges()
+        return hyd.filt_flows,hyd.filt_volumes
+
+    flo0,vol0=filtered(None)
+    for block_size,workers in [(7,1),(16,3),(100,2)]:
+        flo,vol=filtered(block_size,workers)
+        assert np.allclose(flo,flo0)
+        assert np.allclose(vol,vol0)
+
+def filter_stub_data(nt=400):
+    """
+    4 water columns of 3 layers, with horizontal exchanges between
+    neighboring columns, a boundary exchange into each layer of the first
+    column, and vertical exchanges.  Segments are numbered layer by layer.
+    """
+    rng=np.random.RandomState(3)
+    ncol,nk=4,3
+    seg=lambda k,c: 1+k*ncol+c
+    hor=[[seg(k,c),seg(k,c+1)] for k in range(nk) for c in range(ncol-1)]
+    bnd=[[-1-k,seg(k,0)] for k in range(nk)]
+    vert=[[seg(k,c),seg(k+1,c)] for k in range(nk-1) for c in range(ncol)]
+    pointers=np.zeros((len(hor)+len(bnd)+len(vert),4),np.int32)
+    pointers[:,:2]=hor+bnd+vert
+    t_secs=1800*np.arange(nt)
+    tide=np.sin(2*np.pi*t_secs/44712.)[:,None]
+    flows=rng.normal(size=(nt,len(pointers)))+10*tide
+    volumes=1e7+1e5*rng.normal(size=(nt,ncol*nk))
+    areas=rng.uniform(0,100,size=(nt,len(pointers)))
+    return dict(t_secs=t_secs,pointers=pointers,n_exch_x=len(hor)+len(bnd),
+                n_seg=ncol*nk,seg_to_2d_element=np.tile(np.arange(ncol),nk),
+                flows=flows.astype('f4'),volumes=volumes.astype('f4'),
+                areas=areas.astype('f4'))
+
+class FilterOrigHydro(waq_scenario.Hydro):
+    n_exch_y=0
+    scenario=None
+    def __init__(self,data,**kw):
+        super(FilterOrigHydro,self).__init__(**kw)
+        self.data=data
+        self.t_secs=data['t_secs']
+        self.pointers=data['pointers']
+        self.n_seg=data['n_seg']
+        self.n_exch_x=data['n_exch_x']
+        self.n_exch_z=len(self.pointers)-self.n_exch_x
+        self.time0=datetime.datetime(2020,1,1)
+    def infer_2d_elements(self):
+        self.seg_to_2d_element=self.data['seg_to_2d_element']
+    def flows(self,t):
+        return self.data['flows'][self.t_sec_to_index(t)]
+    def volumes(self,t):
+        return self.data['volumes'][self.t_sec_to_index(t)]
+    def areas(self,t):
+        return self.data['areas'][self.t_sec_to_index(t)]
+
+class FilterOrigHydroFiles(waq_scenario.HydroFiles):
+    # the same data, on disk
+    n_exch_y=0
+    scenario=None
+    t_secs=None
+    pointers=None
+    n_seg=None
+    n_exch_x=None
+    n_exch_z=None
+    time0=datetime.datetime(2020,1,1)
+    def __init__(self,data,path):
+        self.log=logging.getLogger('stub')
+        self.data=data
+        self.t_secs=data['t_secs']
+        self.pointers=data['pointers']
+        self.n_seg=data['n_seg']
+        self.n_exch_x=data['n_exch_x']
+        self.n_exch_z=len(self.pointers)-self.n_exch_x
+        self.paths={}
+        for label,dtype,field in [('flows-file',self.flo_dtype(),'flows'),
+                                  ('volumes-file',self.vol_dtype(),'volumes'),
+                                  ('areas-file',self.are_dtype(),'areas')]:
+            recs=np.zeros(len(self.t_secs),dtype)
+            recs['tstamp']=self.t_secs
+            recs[dtype.names[1]]=data[field]
+            self.paths[label]=os.path.join(path,'orig-'+field)
+            recs.tofile(self.paths[label])
+    def get_path(self,label,check=False):
+        return self.paths[label]
+    def infer_2d_elements(self):
+        self.seg_to_2d_element=self.data['seg_to_2d_element']
+
+def test_filter_hydro_bc(tmpdir):
+    data=filter_stub_data()
+    dt=np.diff(data['t_secs'])
+
+    # reference: per exchange filter of in-memory copies
+    ref=FilterOrigHydro(data)
+    hyd=waq_scenario.FilterHydroBC.__new__(waq_scenario.FilterHydroBC)
+    hyd.orig=ref
+    hyd.filt_flows=data['flows'].astype(np.float64)
+    hyd.filt_volumes=data['volumes'].astype(np.float64)
+    hyd.exchange_block_size=None
+    hyd.filter_exchanges()
+    Vratio=np.array([np.bincount(data['seg_to_2d_element'],hyd.filt_volumes[ti])
+                     /np.bincount(data['seg_to_2d_element'],data['volumes'][ti])
+                     for ti in range(len(dt)+1)])
+
+    results=[]
+    for use_memmap in [False,True]:
+        out_dir=tmpdir.mkdir('memmap%s'%use_memmap)
+        if use_memmap:
+            orig=FilterOrigHydroFiles(data,str(out_dir))
+        else:
+            orig=FilterOrigHydro(data)
+        filt=waq_scenario.FilterHydroBC(orig,use_memmap=use_memmap,tmp_dir=str(out_dir),
+                                        exchange_block_size=4,time_block_size=64)
+        assert os.path.exists(os.path.join(str(out_dir),'tmp.flo'))
+        assert np.all(filt.new_vol_mmap['tstamp']==data['t_secs'])
+        assert np.allclose(filt.filt_flows,hyd.filt_flows,atol=1e-4)
+        assert np.allclose(filt.filt_volumes,hyd.filt_volumes,rtol=1e-6)
+
+        areas=data['areas'].copy()
+        exch_z=np.arange(data['n_exch_x'],len(data['pointers']))
+        col=data['seg_to_2d_element'][data['pointers'][exch_z,0]-1]
+        areas[:,exch_z]*=Vratio[:,col]
+        areas[areas<filt.min_area]=filt.min_area
+        assert np.allclose(filt.filt_areas,areas,rtol=1e-5)
+        results.append(filt)
+    for fld in ['filt_flows','filt_volumes','filt_areas']:
+        assert np.all(getattr(results[0],fld)==getattr(results[1],fld))
+
+    # with the output directory in place, the memmaps are the output files
+    filt.scenario=WriteStubScenario(str(tmpdir))
+    filt.apply_filter()
+    assert filt.tmp_flo_fn==filt.flo_filename
+    filt.write_flo()
+    flo=np.fromfile(filt.flo_filename,filt.flo_dtype())
+    assert np.allclose(flo['flow'],hyd.filt_flows,atol=1e-4)
+
+class WriteStubHydro(object):
+    n_seg=12
+    n_2d_elements=4
+    seg_to_2d_element=np.tile(np.arange(4),3)
+    enable_write_symlink=False
+
+class WriteStubScenario(object):
+    def __init__(self,base_path):
+        self.base_path=base_path
+        self.name='stub'
+        self.scu=np.timedelta64(1,'s')
+        self.time0=np.datetime64('2020-01-01')
+        self.start_time=self.time0+np.timedelta64(3600,'s')
+        self.stop_time=self.time0+np.timedelta64(86400,'s')
+        self.overwrite=True
+        self.log=logging.getLogger('stub')
+
+def test_spatiotemporal_write_blocks(tmpdir):
+    times=1800*np.arange(100)
+    rng=np.random.RandomState(5)
+    scen=WriteStubScenario(str(tmpdir))
+    params=[ waq_scenario.ParameterSpatioTemporal(times=times,values=rng.random((100,12)),
+                                                  name='full',hydro=WriteStubHydro()),
+             waq_scenario.ParameterSpatioTemporal(times=times,values=rng.random((100,4)),
+                                                  name='two_d',hydro=WriteStubHydro()),
+             waq_scenario.ParameterSpatioTemporal(times=times,func_t=lambda t: t*np.ones(12),
+                                                  name='func',hydro=WriteStubHydro()) ]
+    for p in params:
+        p.scenario=scen
+        p.write_block_size=None
+        p.write_supporting()
+    expected=[open(p.supporting_path,'rb').read() for p in params]
+    for p in params:
+        os.unlink(p.supporting_path)
+        p.write_block_size=7
+
+    written=waq_scenario.write_supporting_concurrently(params+[waq_scenario.ParameterConstant(1.0)],
+                                                       workers=3)
+    assert len(written)==3
+    for p,exp in zip(params,expected):
+        assert open(p.supporting_path,'rb').read()==exp
+
+class ConservationStubHydro(waq_scenario.Hydro):
+    n_exch_x=50
+    n_exch_y=0
+    n_exch_z=0
+    n_seg=20
+    def __init__(self,t_secs,pointers,flow_data,vol_data,**kw):
+        super(ConservationStubHydro,self).__init__(**kw)
+        self.t_secs=t_secs
+        self.pointers=pointers
+        self.flow_data=flow_data
+        self.vol_data=vol_data
+    def flows(self,t):
+        return self.flow_data[self.t_sec_to_index(t)]
+    def volumes(self,t):
+        return self.vol_data[self.t_sec_to_index(t)]
+    def planform_areas(self):
+        return waq_scenario.ParameterSpatial(np.ones(self.n_seg))
+
+def conservation_stub(nt=300):
+    rng=np.random.RandomState(2)
+    t_secs=600*np.arange(nt)
+    pointers=np.zeros((50,4),np.int32)
+    pointers[:,0]=rng.randint(-2,21,50)
+    pointers[pointers[:,0]==0,0]=-1
+    pointers[:,1]=rng.randint(1,21,50)
+    flows=rng.normal(size=(nt,50))
+    volumes=np.zeros((nt,20))
+    volumes[0]=1e5
+    for ti in range(1,nt):
+        dV=np.zeros(20)
+        for j,(a,b) in enumerate(pointers[:,:2]):
+            if a>0: dV[a-1]-=flows[ti-1,j]*600
+            if b>0: dV[b-1]+=flows[ti-1,j]*600
+        volumes[ti]=volumes[ti-1]+dV
+    volumes[171,7]+=500.0 # a conservation bug
+    return ConservationStubHydro(t_secs,pointers,flows,volumes)
+
+def test_volume_conservation_blocks():
+    hyd=conservation_stub()
+    seg_rel=np.zeros(hyd.n_seg)
+    def cb(ti,summary):
+        seg_rel[:]=np.maximum(seg_rel,summary['rel_err'])
+    hyd.check_volume_conservation_incr(err_callback=cb,verbose=False)
+
+    for block_size,workers in [(1000,1),(17,1),(32,4)]:
+        ds=hyd.check_volume_conservation_blocks(block_size=block_size,workers=workers)
+        assert np.allclose(ds.seg_rel_err_max.values,seg_rel)
+        assert ds.sizes['time']==len(hyd.t_secs)-1
+        # error shows up stepping in and stepping out of tidx 171
+        assert ds.seg_worst_tidx.values[7] in (171,172)
+        assert np.all(ds.worst_seg.values[170:172]==7)
+        assert np.isclose(ds.vol_err.values[170],500.0)
+
+    ds=hyd.check_volume_conservation_blocks(seg_select=np.arange(10,20),tidx_select=slice(0,150))
+    assert ds.attrs['rel_err_max']<1e-8
+
+def test_written_volume_conservation(tmpdir):
+    hyd=conservation_stub()
+    hyd.scenario=WriteStubScenario(str(tmpdir))
+    vol=np.zeros(len(hyd.t_secs),hyd.vol_dtype())
+    vol['tstamp']=hyd.t_secs
+    vol['volume']=hyd.vol_data
+    vol.tofile(hyd.vol_filename)
+    # flows lack the last step
+    flo=np.zeros(len(hyd.t_secs)-1,hyd.flo_dtype())
+    flo['tstamp']=hyd.t_secs[:-1]
+    flo['flow']=hyd.flow_data[:-1]
+    flo.tofile(hyd.flo_filename)
+
+    ds=hyd.check_written_volume_conservation(block_size=50)
+    assert hyd.check_conservation_after_write().sizes['time']==len(hyd.t_secs)-1
+    assert ds.sizes['time']==len(hyd.t_secs)-1
+    # with f4 data the error is split between stepping in and out
+    assert ds.seg_worst_tidx.values[7] in (171,172)
+    assert np.all(ds.worst_seg.values[170:172]==7)
+    assert np.all(ds.n_bad.values[:170]==0)
+
+def test_check_conservation_after_write(tmpdir,monkeypatch):
+    hyd=conservation_stub()
+    hyd.scenario=WriteStubScenario(str(tmpdir))
+    # missing output is only reported
+    assert hyd.check_conservation_after_write() is None
+    # and a partial file too
+    with open(hyd.vol_filename,'wb') as fp:
+        fp.write(b'123')
+    assert hyd.check_conservation_after_write() is None
+
+    # but errors in the check itself propagate
+    vol=np.zeros(len(hyd.t_secs),hyd.vol_dtype())
+    vol.tofile(hyd.vol_filename)
+    np.zeros(len(hyd.t_secs),hyd.flo_dtype()).tofile(hyd.flo_filename)
+    def broken(*a,**k):
+        raise IndexError("bug in the check")
+    monkeypatch.setattr(hyd,'check_volume_conservation_blocks',broken)
+    with pytest.raises(IndexError):
+        hyd.check_conservation_after_write()
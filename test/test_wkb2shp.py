@@ -22,17 +22,38 @@ def test_load_shp_query():
                                   query=query)
         assert len(feats)>len(feat_sel)
 
-if 0:
-    # Doesn't work.
-    def test_write_gpkg():
-        from shapely import geometry
+def test_write_gpkg():
+    xy=np.array([[-120.0,37.0],[-121.0,37.5],[-121.5,38.0]])
+    geoms=wkb2shp.geoms_from_coords('Point',xy)
+    fields=np.zeros(len(geoms),[('name','U10'),('value',np.float64),('count',np.int32)])
+    fields['name']=['a','b','c']
+    fields['value']=[1.5,2.5,3.5]
+    fields['count']=[1,2,3]
 
-        geoms=[ geometry.Point( -120.0, 37.0 ),
-                geometry.Point( -121.0, 37.5 ) ]
-        if os.path.exists('test.gpkg'):
-            import shutil
-            shutil.rmtree('test.gpkg')
-        wkb2shp.wkb2shp("test.gpkg",geoms,driver='GPKG',srs_text='WGS84',
-                        layer_name='points')
+    fn='test.gpkg'
+    wkb2shp.wkb2shp(fn,geoms,fields=fields,srs_text='WGS84',
+                    layer_name='points',overwrite=True,transaction_size=2)
 
+    cols=wkb2shp.shp2columns(fn)
+    assert np.all(cols['name']==fields['name'])
+    assert np.allclose(cols['value'],fields['value'])
+    assert np.all(cols['count']==fields['count'])
+    assert np.allclose([g.coords[0] for g in cols['geom']],xy)
 
+    feats=wkb2shp.shp2geom(fn,query="count > 1")
+    assert len(feats)==2
+    os.unlink(fn)
+
+def test_write_multipart_lines():
+    # multi-part geometries are split into one feature per part
+    lines=wkb2shp.geoms_from_coords('LineString',
+                                    np.array([[[0,0],[1,1]],
+                                              [[1,1],[2,0]]],np.float64))
+    from shapely import geometry
+    geoms=[geometry.MultiLineString(list(lines))]
+    fn='test-lines.gpkg'
+    wkb2shp.wkb2shp(fn,geoms,fields=dict(id=np.array([7])),overwrite=True)
+    cols=wkb2shp.shp2columns(fn)
+    assert len(cols['geom'])==2
+    assert np.all(cols['id']==7)
+    os.unlink(fn)
@@ -1,4 +1,5 @@
 import numpy as np
+import xarray as xr
 import matplotlib.pyplot as plt
 from stompy import xr_transect
 
@@ -26,3 +27,52 @@ def test_transect():
 
 
 
+
+def test_resample_columns():
+    """
+    Vectorized resampling against a column-by-column reference, with
+    ragged columns.
+    """
+    rng=np.random.RandomState(7)
+    n_sample,n_layer=40,12
+    z_ctr=-0.5-np.arange(n_layer)[None,:] + 0.1*rng.uniform(size=(n_sample,1))
+    values=rng.uniform(size=(n_sample,n_layer))
+    n_wet=rng.randint(0,n_layer+1,n_sample)
+    for i,n in enumerate(n_wet):
+        z_ctr[i,n:]=np.nan
+    values[3,2]=np.nan # a hole inside a column
+    dz=-np.ones_like(z_ctr)
+    new_z=np.linspace(-12,0.5,30)
+
+    result=xr_transect.resample_z_columns(values,z_ctr,dz,new_z,sgn=-1)
+    for i in range(n_sample):
+        valid=np.isfinite(values[i]+z_ctr[i])
+        if not valid.any():
+            assert np.all(np.isnan(result[i]))
+            continue
+        ints=np.r_[z_ctr[i][valid]+0.5, z_ctr[i][valid][-1]-0.5]
+        bins=np.searchsorted(-ints,-new_z)
+        bad=(bins<1)|(bins>valid.sum())
+        expected=np.where(bad,np.nan,values[i][valid][bins.clip(1,valid.sum())-1])
+        assert np.array_equal(result[i],expected,equal_nan=True)
+
+    tran=xr.Dataset()
+    tran['sample']=('sample',),np.arange(n_sample)
+    tran['x_sample']=('sample',),2.0*np.arange(n_sample)
+    tran['y_sample']=('sample',),np.zeros(n_sample)
+    tran['z_ctr']=('sample','layer'),z_ctr
+    tran['z_dz']=('sample','layer'),dz
+    tran['Ve']=('sample','layer'),values
+    tran.Ve.attrs['units']='m s-1'
+    tran['kind']=('sample',),np.arange(n_sample)%3
+
+    tran_z=xr_transect.resample_z(tran,new_z)
+    assert np.array_equal(tran_z.Ve.values,result,equal_nan=True)
+    assert tran_z.Ve.attrs['units']=='m s-1'
+
+    new_xy=np.c_[np.linspace(0,78,60),np.zeros(60)]
+    tran_d=xr_transect.resample_d(tran_z,new_xy)
+    assert tran_d.Ve.dims==('sample','layer')
+    nearest=np.argmin(np.abs(new_xy[:,0,None]-tran.x_sample.values[None,:]),axis=1)
+    assert np.array_equal(tran_d.Ve.values,tran_z.Ve.values[nearest],equal_nan=True)
+    assert np.all(tran_d.kind.values==tran.kind.values[nearest])
@@ -0,0 +1,200 @@
+import numpy as np
+import xarray as xr
+from collections import defaultdict
+from scipy import sparse
+
+from stompy.grid import unstructured_grid
+from stompy.model.delft import waq_scenario as waq
+from stompy.model.delft import z_layer_aggregator as zla
+
+nkmax=4
+nt=5
+
+class FakeHydro(waq.Hydro):
+    """
+    Single processor z-layer hydro, with a varying number of layers per
+    water column.  Segments are numbered layer by layer, surface first.
+    """
+    def __init__(self,seed=1):
+        super(FakeHydro,self).__init__()
+        g=unstructured_grid.UnstructuredGrid(max_sides=4)
+        g.add_rectilinear([0,0],[600,500],7,6)
+        g.make_edges_from_cells()
+        self.g=g
+        rng=np.random.RandomState(seed)
+        self.t_secs=1800*np.arange(nt)
+        self.nk=rng.randint(1,nkmax+1,g.Ncells())
+        self.nk[0]=nkmax
+
+        seg_of=-np.ones( (nkmax,g.Ncells()),np.int32)
+        for k in range(nkmax):
+            cells=np.nonzero(self.nk>k)[0]
+            seg_of[k,cells]=seg_of.max()+1+np.arange(len(cells))
+        self.n_seg=seg_of.max()+1
+
+        hor=[ [seg_of[k,c1]+1,seg_of[k,c2]+1,0,0]
+              for k in range(nkmax) for c1,c2 in g.edge_to_cells()
+              if min(c1,c2)>=0 and seg_of[k,c1]>=0 and seg_of[k,c2]>=0]
+        vert=[ [seg_of[k,c]+1,seg_of[k+1,c]+1,0,0]
+               for k in range(nkmax-1) for c in range(g.Ncells()) if seg_of[k+1,c]>=0]
+        self.pointers=np.array(hor+vert,np.int32)
+        self.n_exch_x=len(hor)
+        self.n_exch_y=0
+        self.n_exch_z=len(vert)
+
+        self.bac=g.cells_area()*rng.uniform(0.8,1.2,g.Ncells())
+        self._volumes=rng.uniform(1e3,1e5,(nt,self.n_seg)).astype('f4')
+        self._areas=rng.uniform(1,100,(nt,self.n_exch)).astype('f4')
+
+    def seg_active(self):
+        return np.ones(self.n_seg,np.bool_)
+    def volumes(self,t):
+        return self._volumes[self.t_sec_to_index(t)]
+    def areas(self,t):
+        return self._areas[self.t_sec_to_index(t)]
+    def flows(self,t):
+        return self._areas[self.t_sec_to_index(t)]-50
+
+class Aggregator(zla.ZLayerAggregator):
+    def __init__(self,hyd,mode,**kw):
+        self.hyd=hyd
+        self.mode=mode
+        super(Aggregator,self).__init__(nprocs=1,skip_load_basic=True,**kw)
+        ncells=hyd.g.Ncells()
+        # lump cells in pairs, leave the last few out
+        self.elt_global_to_agg_2d=np.arange(ncells)//2
+        self.elt_global_to_agg_2d[-3:]=-1
+        self.elements=np.zeros(self.elt_global_to_agg_2d.max()+1,self.agg_elt_2d_dtype)
+        self.max_segs_per_proc=hyd.n_seg
+        self.n_agg_layers=nkmax
+    def open_hyd(self,p,force=False):
+        return self.hyd
+    def open_flowgeom_ds(self,p):
+        ncells=self.hyd.g.Ncells()
+        return xr.Dataset(dict(FlowElemGlobalNr=('nFlowElem',1+np.arange(ncells)),
+                               FlowElemDomain=('nFlowElem',np.zeros(ncells,np.int32)),
+                               FlowElem_bac=('nFlowElem',self.hyd.bac)))
+
+def reference_mapping(agg):
+    """ per-element loop version of the mapping, [(k,elt)] per segment """
+    hyd=agg.hyd
+    hyd.infer_2d_elements()
+    vols=hyd.volumes(hyd.t_secs[0])
+    mapping={}
+    for elt_i in range(len(agg.elements)):
+        cols=np.nonzero(agg.elt_global_to_agg_2d==elt_i)[0]
+        if agg.mode=='original':
+            for c in cols:
+                for seg in np.nonzero(hyd.seg_to_2d_element==c)[0]:
+                    mapping[seg]=(hyd.seg_k[seg],elt_i)
+        elif agg.mode=='sort':
+            elt_segs=[]
+            for c in cols:
+                segs=np.nonzero(hyd.seg_to_2d_element==c)[0]
+                D=vols[segs].sum()/hyd.bac[c]
+                d=0
+                for seg in segs:
+                    d+=vols[seg]/hyd.bac[c]
+                    elt_segs.append( (d,D,seg,vols[seg]) )
+            elt_segs=np.array(elt_segs)
+            order=np.lexsort(elt_segs[:,1::-1].T)
+            cumul_vol=np.cumsum(elt_segs[order,3])
+            breaks=np.linspace(0,elt_segs[:,3].sum(),1+agg.n_agg_layers)
+            break_idxs=np.searchsorted(cumul_vol,breaks)
+            break_idxs[-1]=len(elt_segs)
+            for k_agg in range(agg.n_agg_layers):
+                for seg in elt_segs[order[break_idxs[k_agg]:break_idxs[k_agg+1]],2]:
+                    mapping[int(seg)]=(k_agg,elt_i)
+        elif agg.mode=='combine_bed':
+            layer_vols=defaultdict(lambda: 0.0)
+            segs=np.nonzero(np.in1d(hyd.seg_to_2d_element,cols))[0]
+            for seg in segs:
+                layer_vols[hyd.seg_k[seg]]+=vols[seg]
+            Nk=1+max(layer_vols.keys())
+            all_dz=[layer_vols[k]/hyd.bac[cols].sum() for k in range(Nk)]
+            dz_combined=0.0
+            groups=[]
+            this_group=[]
+            dzmin=agg.dzmin_m
+            for k in range(Nk)[::-1]:
+                this_group.append(k)
+                dz_combined+=all_dz[k]
+                if dz_combined < dzmin:
+                    continue
+                else:
+                    groups.append(this_group)
+                    this_group=[]
+                    dz_combined=0.0
+                if all_dz[k]>=dzmin:
+                    dzmin=0.0
+            if this_group:
+                groups.append(this_group)
+            k_map={}
+            for agg_k,seg_ks in enumerate(groups[::-1]):
+                for seg_k in seg_ks:
+                    k_map[seg_k]=agg_k
+            for seg in segs:
+                mapping[seg]=(k_map[hyd.seg_k[seg]],elt_i)
+    return mapping
+
+def test_seg_mapping():
+    hyd=FakeHydro()
+    for mode,dzmin in [('original',0.0),('sort',0.0),
+                       ('combine_bed',0.0),('combine_bed',50.0)]:
+        agg=Aggregator(hyd,mode)
+        agg.dzmin_m=dzmin
+        agg.init_seg_mapping()
+        expected=reference_mapping(agg)
+
+        seg_agg=agg.seg_local['agg'][0]
+        assert np.all( (seg_agg>=0)==np.in1d(np.arange(hyd.n_seg),list(expected.keys())) )
+        agg_seg=np.asarray(agg.agg_seg,dtype=agg.agg_seg_dtype)
+        for seg,(k,elt) in expected.items():
+            assert (agg_seg['k'][seg_agg[seg]],agg_seg['elt'][seg_agg[seg]])==(k,elt),mode
+        assert np.all(agg.seg_local['ghost'][0]==0)
+        # allocated segments which no local segment maps to are inactive
+        empty=np.setdiff1d(np.arange(len(agg_seg)),seg_agg)
+        assert np.all(agg.inactive_segs==empty),mode
+        assert np.all(agg_seg['active']==~np.in1d(np.arange(len(agg_seg)),empty))
+        if mode=='sort':
+            assert len(empty)>0
+    # with dzmin, thin bed layers were lumped
+    assert agg_seg['k'].max()<nkmax-1
+
+def identity_aggregator(hyd):
+    # no aggregation, to compare per-step and block evaluation
+    agg=Aggregator(hyd,'original')
+    agg.n_agg_segments=hyd.n_seg
+    agg.agg_seg=np.ones(hyd.n_seg,agg.agg_seg_dtype)
+    agg._pointers=hyd.pointers
+    agg.n_exch_x,agg.n_exch_y,agg.n_exch_z=hyd.n_exch_x,hyd.n_exch_y,hyd.n_exch_z
+    agg.seg_local=np.zeros( (1,hyd.n_seg),agg.seg_local_dtype)
+    agg.seg_local['agg'][0]=np.arange(hyd.n_seg)
+    agg.seg_matrix={0:sparse.identity(hyd.n_seg,'f4',format='csr')}
+    agg.area_matrix={0:sparse.identity(hyd.n_exch,'f4',format='csr')}
+    agg.flow_matrix={0:-agg.area_matrix[0]}
+    return agg
+
+def test_areas_volumes_block():
+    hyd=FakeHydro()
+    agg=identity_aggregator(hyd)
+    tidxs=np.arange(nt)
+    areas=agg.areas_block(tidxs)
+    vols=agg.volumes_block(tidxs)
+    flows=agg.flows_block(tidxs)
+    for ti in tidxs:
+        t=hyd.t_secs[ti]
+        assert np.all(agg.flows(t)==flows[ti])
+        assert np.all(agg.areas(t)==areas[ti])
+        assert np.all(agg.volumes(t)==vols[ti])
+
+        # column max of vertical exchange areas, one element at a time
+        ref=waq.DwaqAggregator.areas(agg,t)
+        elt_for_exch_z=agg.seg_to_2d_element[agg.pointers[:,1]-1]
+        elt_for_exch_z[:-agg.n_exch_z]=-1
+        for elt in range(agg.n_2d_elements):
+            exch_sel=(elt_for_exch_z==elt)
+            if np.any(exch_sel):
+                ref[exch_sel]=ref[exch_sel].max()
+        assert np.all(areas[ti]==ref)
+    assert np.all(areas[:,:hyd.n_exch_x]==hyd._areas[:,:hyd.n_exch_x])